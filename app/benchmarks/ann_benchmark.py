@@ -0,0 +1,77 @@
+"""Benchmark the IVF index of `LocalCollection` against its exhaustive search.
+
+Measures the build time of the index, and the recall@8 and the latency of both searches, on synthetic
+clustered embeddings, at several collection sizes and `nprobe` values.
+
+Usage:
+```bash
+python -m app.benchmarks.ann_benchmark
+python -m app.benchmarks.ann_benchmark --sizes 100000 1000000 --dim 768 --nprobe 8 16 32 64
+```
+"""
+
+import argparse
+import numpy as np
+import tempfile
+import time
+
+from pathlib import Path
+
+from app.databases.vector.local import LocalCollection
+from app.databases.vector.rebuild_index import evaluate_index
+
+
+def make_embeddings(count: int, dim: int, topics: int = 1_000, seed: int = 0) -> np.ndarray:
+    """Generate normalized embeddings, scattered around `topics` random directions, like chunks of documents."""
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dim)).astype(np.float32)
+    embeddings = np.empty((count, dim), dtype=np.float32)
+    for i in range(0, count, 100_000):
+        batch_size = min(100_000, count - i)
+        embeddings[i:i + batch_size] = centers[rng.integers(topics, size=batch_size)]
+        embeddings[i:i + batch_size] += rng.normal(scale=0.8, size=(batch_size, dim))
+
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def fill_collection(collection: LocalCollection, embeddings: np.ndarray, batch_size: int = 50_000) -> None:
+    """Add the embeddings to the collection, in batches."""
+
+    for i in range(0, len(embeddings), batch_size):
+        batch = embeddings[i:i + batch_size]
+        ids = [str(i + j) for j in range(len(batch))]
+        collection.add(ids, ids, [{'source_id': chunk_id} for chunk_id in ids], batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 500_000], help='Collection sizes.')
+    parser.add_argument('--dim', type=int, default=384, help='The dimensions of the embeddings.')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--queries', type=int, default=100, help='The number of queries per size.')
+    args = parser.parse_args()
+
+    print(f'{"rows":>10}{"nlist":>8}{"build s":>10}{"nprobe":>8}{"recall@8":>10}{"exact ms":>10}{"index ms":>10}')
+    for size in args.sizes:
+        embeddings = make_embeddings(size + args.queries, args.dim)
+        queries = embeddings[size:]
+
+        with tempfile.TemporaryDirectory() as directory:
+            collection = LocalCollection(Path(directory) / 'benchmark', quantization='')
+            fill_collection(collection, embeddings[:size])
+
+            start_time = time.perf_counter()
+            collection.build_index()
+            build_time = time.perf_counter() - start_time
+
+            for nprobe in args.nprobe:
+                results = evaluate_index(collection, queries, nprobe=nprobe)
+                print(
+                    f'{size:>10}{collection._index.nlist:>8}{build_time:>10.1f}{nprobe:>8}{results["recall"]:>10.3f}'
+                    f'{results["exact_ms"]:>10.2f}{results["index_ms"]:>10.2f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
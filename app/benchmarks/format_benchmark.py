@@ -0,0 +1,138 @@
+"""Benchmark `JSONDocumentFormatter` against the jinja2 prompt template that formatted the retrieved documents.
+
+Measures the time to build each formatter, and to format batches of retrieved documents of realistic size
+(chunks of ~1,000 characters, with quotes, newlines and non-ASCII characters), and checks whether each
+formatted document is valid JSON.
+
+Usage:
+```bash
+python -m app.benchmarks.format_benchmark
+python -m app.benchmarks.format_benchmark --documents 8 64 --chunk-size 500
+```
+"""
+
+import argparse
+import json
+import random
+import time
+
+from functools import partial
+from langchain.schema import Document
+from langchain_core.prompts import format_document
+from langchain_core.prompts.prompt import PromptTemplate
+from typing import Callable
+
+from app.indexing.metadata import DocumentMetadata
+from app.server.llm import DOCUMENT_FORMATTER
+from app.server.retriever_tool import JSONDocumentFormatter
+
+
+def make_template_prompt() -> PromptTemplate:
+    """Build the jinja2 prompt template, as the agents used to."""
+    return PromptTemplate(
+        template_format='jinja2',
+        input_variables=['source_id', 'source_name', 'modified_at', 'page_content'],
+        template='{'
+            '"source_name": "{{source_name}}", '
+            '"source_id": "{{source_id}}", '
+            '"modified": "{{modified_at}}", '
+            '"content": "{{page_content|replace(\'"\', \'""\')}}"'
+        '}',
+    )
+
+
+def format_with_template(doc: Document, prompt: PromptTemplate) -> str:
+    """Format the document with the template, as the retriever tool used to."""
+    return format_document(
+        Document(page_content=doc.page_content, metadata=DocumentMetadata.format_dict(doc.metadata)),
+        prompt,
+    )
+
+
+def make_documents(count: int, chunk_size: int, seed: int = 0) -> list[Document]:
+    """Generate retrieved chunks of about `chunk_size` characters, with their stored metadata."""
+
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choices('abcdefghijklmnopqrstuvwxyz', k=rnd.randint(1, 12))) for _ in range(2_000)]
+    words += ['"quoted"', 'naïve', 'café', 'C:\\path\\file', '<tag>', '50%', '{braces}', 'tab\tseparated']
+
+    docs = []
+    for i in range(count):
+        lines = []
+        length = 0
+        while length < chunk_size:
+            line = ' '.join(rnd.choices(words, k=rnd.randint(5, 20)))
+            lines.append(line)
+            length += len(line) + 1
+        docs.append(Document(
+            page_content='\n'.join(lines)[:chunk_size],
+            metadata={
+                'source_id': f'https://wiki.example.com/pages/{rnd.randint(1, 10_000)}',
+                'source_name': f'Handbook "{words[i]}" - chapter {i}',
+                'modified_at': 1_700_000_000 + rnd.randint(0, 10_000_000),
+                'payload': {'team': 'data'},
+            },
+        ))
+
+    return docs
+
+
+def measure(function: Callable[[], object], min_duration: float = 0.5) -> tuple[float, object]:
+    """Call the function repeatedly for at least `min_duration` seconds.
+
+    :return: The average duration of a call in microseconds, and the result of the last call.
+    """
+
+    runs = 0
+    start_time = time.perf_counter()
+    while (duration := time.perf_counter() - start_time) < min_duration or runs == 0:
+        result = function()
+        runs += 1
+
+    return duration / runs * 1_000_000, result
+
+
+def count_valid_json(lines: list[str]) -> int:
+    """Count the formatted documents that are valid JSON objects."""
+
+    valid = 0
+    for line in lines:
+        try:
+            valid += isinstance(json.loads(line), dict)
+        except json.JSONDecodeError:
+            pass
+
+    return valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--documents', type=int, nargs='+', default=[8, 16, 32, 64], help='Documents per batch.')
+    parser.add_argument('--chunk-size', type=int, default=1_000, help='The characters of each document.')
+    args = parser.parse_args()
+
+    template_build_us, prompt = measure(make_template_prompt)
+    formatter_build_us, _ = measure(lambda: JSONDocumentFormatter(DOCUMENT_FORMATTER.fields))
+    print(f'Build: template {template_build_us:.1f} us, formatter {formatter_build_us:.1f} us\n')
+
+    formatters = {
+        'template': partial(format_with_template, prompt=prompt),
+        'formatter': DOCUMENT_FORMATTER,
+    }
+
+    print(
+        f'{"documents":>10}{"template us":>13}{"formatter us":>14}{"speedup":>10}'
+        f'{"valid JSON (template/formatter)":>34}'
+    )
+    for count in args.documents:
+        docs = make_documents(count, args.chunk_size)
+        (template_us, template_lines), (formatter_us, formatter_lines) = (
+            measure(lambda: [format_doc(doc) for doc in docs]) for format_doc in formatters.values()
+        )
+
+        valid = f'{count_valid_json(template_lines)}/{count_valid_json(formatter_lines)} of {count}'
+        print(f'{count:>10}{template_us:>13.1f}{formatter_us:>14.1f}{template_us / formatter_us:>9.1f}x{valid:>34}')
+
+
+if __name__ == '__main__':
+    main()
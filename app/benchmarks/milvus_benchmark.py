@@ -0,0 +1,145 @@
+"""Benchmark the index types and the search params of Milvus.
+
+Measures the build time of each index, and the recall@8 and the p50/p99 latencies of its searches
+against exhaustive (numpy) searches, on synthetic clustered embeddings, for each of the search params
+and consistency levels. Runs against the Milvus of `MILVUS_SERVER_URI`, in temporary collections.
+Index types that the server doesn't support (e.g. Milvus Lite supports only some of them) are skipped.
+
+Usage:
+```bash
+MILVUS_SERVER_URI=/tmp/milvus-benchmark.db python -m app.benchmarks.milvus_benchmark
+python -m app.benchmarks.milvus_benchmark --size 1000000 --dim 768 --consistency-levels Strong Bounded
+python -m app.benchmarks.milvus_benchmark --index '{"index_type": "HNSW", "params": {"M": 32, "efConstruction": 200}}' \
+    --search '{"ef": 32}' '{"ef": 128}'
+```
+"""
+
+import argparse
+import json
+import numpy as np
+import time
+import uuid
+
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, MilvusException, connections, utility
+
+from app.benchmarks.ann_benchmark import make_embeddings
+from app.databases.vector.milvus import Milvus
+
+
+# The default index specs, and the search params to sweep for each of them.
+DEFAULT_SWEEPS = [
+    ({'index_type': 'FLAT', 'params': {}}, [{}]),
+    ({'index_type': 'HNSW', 'params': {'M': 16, 'efConstruction': 128}}, [{'ef': 16}, {'ef': 64}, {'ef': 256}]),
+    ({'index_type': 'IVF_FLAT', 'params': {'nlist': 256}}, [{'nprobe': 4}, {'nprobe': 16}, {'nprobe': 64}]),
+    ({'index_type': 'IVF_PQ', 'params': {'nlist': 256, 'm': 16, 'nbits': 8}}, [{'nprobe': 16}, {'nprobe': 64}]),
+    ({'index_type': 'DISKANN', 'params': {}}, [{'search_list': 32}, {'search_list': 100}]),
+]
+
+
+def create_collection(alias: str, embeddings: np.ndarray, index_params: dict, batch_size: int = 10_000) -> Collection:
+    """Create a temporary collection of the embeddings, with the index, and load it."""
+
+    schema = CollectionSchema(fields=[
+        FieldSchema('pk', DataType.INT64, is_primary=True),
+        FieldSchema('vector', DataType.FLOAT_VECTOR, dim=embeddings.shape[1]),
+    ])
+    col = Collection(f'benchmark_{uuid.uuid4().hex}', schema=schema, using=alias)
+    for i in range(0, len(embeddings), batch_size):
+        batch = embeddings[i:i + batch_size]
+        col.insert([list(range(i, i + len(batch))), batch])
+    col.flush()
+
+    try:
+        col.create_index('vector', index_params)
+        utility.wait_for_index_building_complete(col.name, using=alias)
+        col.load()
+    except MilvusException:
+        col.drop()
+        raise
+
+    return col
+
+
+def evaluate_search(
+        col: Collection,
+        queries: np.ndarray,
+        expected: np.ndarray,
+        param: dict,
+        consistency_level: str,
+        k: int = 8,
+    ) -> dict:
+    """Search the collection for each of the queries.
+
+    :param expected: The IDs of the `k` nearest neighbors of each query.
+    :return: The mean recall@k, and the p50/p99 latencies of the searches, in milliseconds.
+    """
+
+    recalls, latencies = [], []
+    for query, query_expected in zip(queries, expected):
+        start_time = time.perf_counter()
+        res = col.search(
+            data=[query.tolist()],
+            anns_field='vector',
+            param=param,
+            limit=k,
+            consistency_level=consistency_level,
+        )
+        latencies.append(time.perf_counter() - start_time)
+        recalls.append(len(set(res[0].ids) & set(query_expected.tolist())) / k)
+
+    return {
+        'recall': float(np.mean(recalls)),
+        'p50_ms': float(np.percentile(latencies, 50)) * 1_000,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1_000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100_000, help='The collection size.')
+    parser.add_argument('--dim', type=int, default=384, help='The dimensions of the embeddings.')
+    parser.add_argument('--queries', type=int, default=200, help='The number of queries.')
+    parser.add_argument('--metric', default='L2', help='The metric of the indexes.')
+    parser.add_argument('--index', type=json.loads, help='An index spec (JSON) to benchmark, instead of the defaults.')
+    parser.add_argument('--search', type=json.loads, nargs='+', default=[{}], help='The search params of `--index`.')
+    parser.add_argument('--consistency-levels', nargs='+', default=['Strong'], help='The consistency levels.')
+    args = parser.parse_args()
+
+    sweeps = [(args.index, args.search)] if args.index else DEFAULT_SWEEPS
+
+    embeddings = make_embeddings(args.size + args.queries, args.dim)
+    corpus, queries = embeddings[:args.size], embeddings[args.size:]
+    # The embeddings are normalized, so the nearest neighbors are the same for all metrics.
+    expected = np.argsort(-(queries @ corpus.T), axis=1)[:, :8]
+
+    alias = f'benchmark_{uuid.uuid4().hex}'
+    connections.connect(alias, **Milvus.get_local_connection_args())
+
+    print(f'{"index":>10}{"build s":>10}{"search params":>24}{"consistency":>13}{"recall@8":>10}{"p50 ms":>9}{"p99 ms":>9}')
+    for index_params, search_params in sweeps:
+        index_params = {'metric_type': args.metric} | index_params
+        start_time = time.perf_counter()
+        try:
+            col = create_collection(alias, corpus, index_params)
+        except MilvusException as e:
+            print(f'{index_params["index_type"]:>10}  Skipped: {e.message}')
+            continue
+        build_time = time.perf_counter() - start_time
+
+        try:
+            for params in search_params:
+                param = Milvus.get_search_params(index_params)
+                param['params'] = param['params'] | params
+                for consistency_level in args.consistency_levels:
+                    results = evaluate_search(col, queries, expected, param, consistency_level)
+                    print(
+                        f'{index_params["index_type"]:>10}{build_time:>10.1f}{json.dumps(param["params"]):>24}'
+                        f'{consistency_level:>13}{results["recall"]:>10.3f}'
+                        f'{results["p50_ms"]:>9.2f}{results["p99_ms"]:>9.2f}'
+                    )
+        finally:
+            col.drop()
+
+
+if __name__ == '__main__':
+    main()
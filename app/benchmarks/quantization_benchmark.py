@@ -0,0 +1,56 @@
+"""Benchmark the quantized searches of `LocalCollection` against its full-precision searches.
+
+Measures the size of the searched data per chunk, and the recall@8 and the latency of the quantized
+searches (re-ranked by the full-precision vectors), on synthetic clustered embeddings, for each
+quantization and `oversample` value.
+
+Usage:
+```bash
+python -m app.benchmarks.quantization_benchmark
+python -m app.benchmarks.quantization_benchmark --size 1000000 --dim 1024 --oversample 2 4 10 20
+```
+"""
+
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.benchmarks.ann_benchmark import fill_collection, make_embeddings
+from app.databases.vector.local import LocalCollection
+from app.databases.vector.quantization import QUANTIZERS
+from app.databases.vector.rebuild_index import evaluate_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=200_000, help='The number of chunks.')
+    parser.add_argument('--dim', type=int, default=1024, help='The dimensions of the embeddings.')
+    parser.add_argument('--quantization', nargs='+', default=list(QUANTIZERS), choices=list(QUANTIZERS))
+    parser.add_argument('--oversample', type=int, nargs='+', default=[2, 4, 10, 20])
+    parser.add_argument('--queries', type=int, default=100, help='The number of queries.')
+    args = parser.parse_args()
+
+    embeddings = make_embeddings(args.size + args.queries, args.dim)
+    queries = embeddings[args.size:]
+
+    print(f'{"quantization":<14}{"bytes/chunk":>12}{"smaller":>9}{"oversample":>12}{"recall@8":>10}'
+          f'{"exact ms":>10}{"quantized ms":>14}')
+    with tempfile.TemporaryDirectory() as directory:
+        fill_collection(LocalCollection(Path(directory) / 'benchmark', quantization=''), embeddings[:args.size])
+
+        for quantization in args.quantization:
+            # Reopening the collection with another quantization computes the codes of its rows.
+            collection = LocalCollection(Path(directory) / 'benchmark', quantization=quantization)
+            size = collection.quantizer.get_bytes_per_row(args.dim)
+
+            for oversample in args.oversample:
+                results = evaluate_index(collection, queries, oversample=oversample)
+                print(
+                    f'{quantization:<14}{size:>12}{args.dim * 4 / size:>8.1f}x{oversample:>12}'
+                    f'{results["recall"]:>10.3f}{results["exact_ms"]:>10.2f}{results["index_ms"]:>14.2f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
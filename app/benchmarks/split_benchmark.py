@@ -0,0 +1,118 @@
+"""Benchmark `FastRecursiveTextSplitter` against `RecursiveCharacterTextSplitter`.
+
+Measures the throughput (MB/s) of both splitters, and checks that they return the same chunks, on
+synthetic text and on real-world text (a file, repeated up to the size), at several sizes.
+
+Usage:
+```bash
+python -m app.benchmarks.split_benchmark
+python -m app.benchmarks.split_benchmark --file data/export.txt --sizes 1 10 --chunk-size 500
+python -m app.benchmarks.split_benchmark --tokens  # Token-based lengths, requires `tiktoken`.
+```
+"""
+
+import argparse
+import random
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+from pathlib import Path
+from typing import Callable
+
+from app.indexing.text.fast import FastRecursiveTextSplitter
+
+
+def make_synthetic_text(size: int, seed: int = 0) -> str:
+    """Generate `size` characters of paragraphs, lines and words of varying lengths."""
+
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choices('abcdefghijklmnopqrstuvwxyz', k=rnd.randint(1, 12))) for _ in range(5_000)]
+
+    parts = []
+    length = 0
+    while length < size:
+        paragraph = '\n'.join(
+            ' '.join(rnd.choices(words, k=rnd.randint(5, 30)))
+            for _ in range(rnd.randint(1, 8))
+        )
+        parts.append(paragraph)
+        length += len(paragraph) + 2
+
+    return '\n\n'.join(parts)[:size]
+
+
+def make_real_world_text(path: Path, size: int) -> str:
+    """Repeat the content of the file up to `size` characters."""
+
+    content = path.read_text(encoding='utf-8')
+    return (content * (size // len(content) + 1))[:size]
+
+
+def measure(splitter: TextSplitter, text: str, min_duration: float = 1) -> tuple[float, list[str]]:
+    """Split the text repeatedly for at least `min_duration` seconds.
+
+    :return: The throughput in MB/s, and the chunks.
+    """
+
+    runs = 0
+    start_time = time.perf_counter()
+    while (duration := time.perf_counter() - start_time) < min_duration or runs == 0:
+        chunks = splitter.split_text(text)
+        runs += 1
+
+    return len(text.encode('utf-8')) * runs / duration / 1_000_000, chunks
+
+
+def get_token_counter() -> Callable[[str], int]:
+    """Count the tokens of texts with `tiktoken`."""
+
+    import tiktoken  # Optional - only needed for token-based lengths.
+
+    encoding = tiktoken.get_encoding('cl100k_base')
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.1, 1, 10], help='Text sizes, in MB.')
+    parser.add_argument('--file', type=Path, default=Path('README.md'), help='Real-world text to repeat.')
+    parser.add_argument('--chunk-size', type=int, default=1_000)
+    parser.add_argument('--chunk-overlap', type=int, default=200)
+    parser.add_argument('--tokens', action='store_true', help='Measure the lengths in tokens, instead of characters.')
+    args = parser.parse_args()
+
+    length_function = get_token_counter() if args.tokens else len
+    splitters = {
+        'recursive': RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            length_function=length_function,
+        ),
+        'fast': FastRecursiveTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            length_function=length_function,
+        ),
+    }
+
+    print(f'{"text":<12}{"MB":>8}{"recursive MB/s":>16}{"fast MB/s":>12}{"speedup":>10}{"chunks":>10}  parity')
+    for size in args.sizes:
+        texts = {
+            'synthetic': make_synthetic_text(int(size * 1_000_000)),
+            'real-world': make_real_world_text(args.file, int(size * 1_000_000)),
+        }
+        for name, text in texts.items():
+            (recursive_throughput, recursive_chunks), (fast_throughput, fast_chunks) = (
+                measure(splitter, text) for splitter in splitters.values()
+            )
+
+            parity = 'identical' if fast_chunks == recursive_chunks \
+                else f'DIFFERENT ({len(recursive_chunks)} recursive chunks)'
+            print(
+                f'{name:<12}{size:>8}{recursive_throughput:>16.2f}{fast_throughput:>12.2f}'
+                f'{fast_throughput / recursive_throughput:>9.1f}x{len(fast_chunks):>10}  {parity}'
+            )
+
+
+if __name__ == '__main__':
+    main()
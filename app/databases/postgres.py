@@ -1,16 +1,36 @@
 import os
 
+from contextlib import asynccontextmanager
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from typing import AsyncGenerator
 
+from app.utils.logger import Logger
 from app.utils.singleton import Singleton
 
 
 class Database(metaclass=Singleton):
     """Represents the main database.
-    
-    Currently, provides only the connection string to the database.
+
+    Provides the connection string to the database, and a connection pool that is shared
+    by the checkpointers and any other access to the database.
+
+    The pool is opened and closed by the server's `lifespan`. When the pool isn't open
+    (e.g. in scripts and tests), a dedicated connection is used instead.
     """
 
+    # Class-level, so the pool outlives the refreshes of the singleton instance.
+    _pool: AsyncConnectionPool = None
+
+    # The checkpointers require these connection settings.
+    CONNECTION_KWARGS = {
+        'autocommit': True,
+        'prepare_threshold': 0,
+        'row_factory': dict_row,
+    }
+
     def __init__(self):
         """Initialize the database connection."""
 
@@ -24,12 +44,112 @@ class Database(metaclass=Singleton):
 
         self.uri = f'postgres://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}'
 
+        # Connection pool configuration. Times are in seconds.
+        self.pool_min_size = int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2))
+        self.pool_max_size = int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10))
+        self.pool_max_idle = float(os.environ.get('POSTGRES_POOL_MAX_IDLE', 10 * 60))
+        self.pool_max_lifetime = float(os.environ.get('POSTGRES_POOL_MAX_LIFETIME', 60 * 60))
+        self.pool_timeout = float(os.environ.get('POSTGRES_POOL_TIMEOUT', 30))
+
     def get_connection_string(self) -> str:
         """Get a URI representation of the database connection params."""
         return self.uri
-    
+
+    @classmethod
+    async def open_pool(cls) -> AsyncConnectionPool:
+        """Open the shared connection pool, if it's not open already."""
+
+        if cls._pool is not None:
+            return cls._pool
+
+        database = cls()
+        pool = AsyncConnectionPool(
+            conninfo=database.get_connection_string(),
+            kwargs=cls.CONNECTION_KWARGS,
+            min_size=database.pool_min_size,
+            max_size=database.pool_max_size,
+            max_idle=database.pool_max_idle,
+            max_lifetime=database.pool_max_lifetime,
+            timeout=database.pool_timeout,
+            check=AsyncConnectionPool.check_connection,
+            name='rag-app',
+            open=False,
+        )
+        await pool.open(wait=True)
+
+        cls._pool = pool
+        Logger().get_logger().info(
+            f'Database connection pool is open (min_size={pool.min_size}, max_size={pool.max_size})'
+        )
+        return pool
+
+    @classmethod
+    async def close_pool(cls) -> None:
+        """Close the shared connection pool, if it's open."""
+
+        if cls._pool is None:
+            return
+
+        pool, cls._pool = cls._pool, None
+        await pool.close()
+
+    @classmethod
+    def get_pool(cls) -> AsyncConnectionPool | None:
+        """Get the shared connection pool, or `None` if it isn't open."""
+        return cls._pool
+
+    @classmethod
+    def get_pool_stats(cls) -> dict:
+        """Get statistics about the shared connection pool, for monitoring."""
+
+        if cls._pool is None:
+            return {'open': False}
+
+        stats = cls._pool.get_stats()
+        return {
+            'open': True,
+            'min_size': stats['pool_min'],
+            'max_size': stats['pool_max'],
+            'size': stats['pool_size'],
+            'in_use': stats['pool_size'] - stats['pool_available'],
+            'available': stats['pool_available'],
+            'waiting': stats['requests_waiting'],
+            'requests': stats.get('requests_num', 0),
+            'requests_queued': stats.get('requests_queued', 0),
+            'requests_wait_ms': stats.get('requests_wait_ms', 0),
+            'requests_errors': stats.get('requests_errors', 0),
+            'connections_lost': stats.get('connections_lost', 0),
+        }
+
+    @classmethod
+    @asynccontextmanager
+    async def connection(cls) -> AsyncGenerator[AsyncConnection, None]:
+        """Borrow a connection from the shared pool, or open a dedicated one if the pool isn't open."""
+
+        if cls._pool is not None:
+            async with cls._pool.connection() as conn:
+                yield conn
+        else:
+            async with await AsyncConnection.connect(cls().get_connection_string(), **cls.CONNECTION_KWARGS) as conn:
+                yield conn
+
+    @classmethod
+    @asynccontextmanager
+    async def checkpointer(cls) -> AsyncGenerator[AsyncPostgresSaver, None]:
+        """Get a checkpointer that borrows connections from the shared pool.
+
+        The checkpointer serializes its own queries, so each concurrent user (e.g. agent) should
+        get its own checkpointer. That's cheap, as connections are shared by the pool.
+        """
+
+        if cls._pool is not None:
+            yield AsyncPostgresSaver(cls._pool)
+        else:
+            async with AsyncPostgresSaver.from_conn_string(cls().get_connection_string()) as saver:
+                yield saver
+
     @staticmethod
     async def setup():
         """Setup the database."""
-        async with AsyncPostgresSaver.from_conn_string(Database().get_connection_string()) as saver:
+        async with Database.checkpointer() as saver:
             await saver.setup()
@@ -1,4 +1,5 @@
 # from app.databases.vector.chroma import Chroma
+# from app.databases.vector.local import LocalVectorDB
 from app.databases.vector.milvus import Milvus
 
 VectorDB = Milvus
@@ -1,17 +1,95 @@
 import abc
+import asyncio
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import json
 import os
+import threading
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from langchain_core.embeddings import Embeddings
 from langchain.schema import Document
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Iterator
 
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.retriever import CollectionGenerations, RetrieverCache, VectorDBRetriever
+from app.databases.vector.sparse import BaseSparseIndex, InMemoryBM25Index
+from app.indexing.dedup import ChunkDeduplicator
+from app.indexing.manifest import SourceManifest, SourceManifestEntry, to_naive_utc
 from app.indexing.text.base import BaseTextIndexing
 from app.indexing.metadata import DocumentMetadata
 from app.models import EmbeddingsModel
+from app.models.embeddings.cached_embeddings import CachedEmbeddings, EmbeddingsCache
+from app.utils.logger import Logger
+from app.utils.tenants import get_current_tenant, use_tenant, validate_tenant_id
+
+
+@dataclass
+class _PendingDocument:
+    """A document whose chunks are being stored by `BaseVectorDatabase.split_and_store_many`."""
+
+    metadata: DocumentMetadata
+    ids: list = field(default_factory=list)
+    chunks_left: int = 0
+    error: str = None
+
+    def to_result(self) -> dict:
+        # Near-duplicate chunks that were dropped have no ID (see `BaseVectorDatabase.aadd_documents`).
+        ids = [id_ for id_ in self.ids if id_ is not None]
+        if self.error is None:
+            return {'source_id': self.metadata.source_id, 'ids': ids}
+
+        result = {'source_id': self.metadata.source_id, 'error': self.error}
+        if ids:
+            # The stored chunks of the document that couldn't be deleted after the error.
+            result['ids'] = ids
+        return result
 
 
 class BaseVectorDatabase(abc.ABC):
     """Base class for vector databases."""
 
+    # Runs the blocking calls of the ingestion (splitting, embedding, inserts and deletes), so they don't block
+    # the event loop. Shared by all the vector databases of the process. See `get_ingestion_executor`.
+    _ingestion_executor: ThreadPoolExecutor = None
+    _ingestion_executor_lock = threading.Lock()
+
+    # Serialize the upserts of each source in the process. See `upsert_text`.
+    _source_locks: weakref.WeakValueDictionary[tuple[str, str], asyncio.Lock] = weakref.WeakValueDictionary()
+
+    @classmethod
+    def get_ingestion_executor(cls) -> ThreadPoolExecutor:
+        """Get the process-wide ingestion executor.
+
+        Its size (`INGESTION_MAX_WORKERS`) bounds the number of concurrent ingestion calls, so a burst of
+        ingestion can't take over the event loop's default executor, which other requests rely on.
+        """
+
+        with BaseVectorDatabase._ingestion_executor_lock:
+            if BaseVectorDatabase._ingestion_executor is None:
+                BaseVectorDatabase._ingestion_executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('INGESTION_MAX_WORKERS', 4)),
+                    thread_name_prefix='ingestion',
+                )
+
+        return BaseVectorDatabase._ingestion_executor
+
+    async def run_in_executor(self, func: Callable, *args, **kwargs) -> Any:
+        """Run the blocking call `func(*args, **kwargs)` in the ingestion executor, and wait for its result.
+
+        The call runs in a copy of the current context, so context variables are preserved.
+        """
+
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.get_ingestion_executor(),
+            functools.partial(context.run, func, *args, **kwargs),
+        )
+
     def get_default_collection_name(self) -> str:
         """Get the default collection name for the vector database."""
 
@@ -21,27 +99,414 @@ class BaseVectorDatabase(abc.ABC):
         """Get the embedding function for the vector database."""
 
         # TODO: Add more options such as `Voyage`, `Gemini`.
-        return EmbeddingsModel()
+        embeddings = EmbeddingsModel()
+
+        # Put the persistent embeddings cache in front of the model, if it's enabled.
+        cache = EmbeddingsCache.get_shared()
+        if cache is not None:
+            embeddings = CachedEmbeddings(embeddings, cache)
+
+        return embeddings
     
     async def split_and_store_text(self, text: str | list[Document], metadata: DocumentMetadata) -> list[int]:
         """Store the embeddings for the given text in the vector database."""
 
         # Split the text into chunks.
-        splits = self.split_strategy.split(text=text, metadata=metadata)
+        splits = await self.asplit(text, metadata)
 
         # Store the embeddings for each chunk.
-        return self.add_documents(documents=splits)
-    
+        ids = await self.aadd_documents(splits)
+        self.on_collection_changed()
+
+        return [id_ for id_ in ids if id_ is not None]
+
+    async def split_and_store_text_stream(
+            self,
+            text: AsyncIterable[str],
+            metadata: DocumentMetadata,
+            batch_size: int = None,
+        ) -> list[int]:
+        """Store the embeddings for a text that is read incrementally, e.g. a very large document.
+
+        The chunks are embedded and inserted as soon as a batch is full, so the memory usage
+        depends on `batch_size` and not on the size of the text. See `BaseTextIndexing.split_stream`.
+
+        :param text: The parts of the text.
+        :param batch_size: The number of chunks to embed and insert at once.
+            Defaults to the `EMBEDDINGS_BATCH_SIZE` environment variable.
+        """
+
+        batch_size = batch_size or int(os.environ.get('EMBEDDINGS_BATCH_SIZE', 256))
+        splitter = self.split_strategy.get_stream_splitter(metadata)
+
+        ids = []
+        batch: list[Document] = []
+
+        async def store_batches(is_last: bool = False):
+            while len(batch) >= batch_size or (is_last and batch):
+                ids.extend(await self.aadd_documents(batch[:batch_size]))
+                self.on_collection_changed()
+                del batch[:batch_size]
+
+        async for part in text:
+            batch.extend(await self.run_in_executor(splitter.feed, part))
+            await store_batches()
+
+        batch.extend(await self.run_in_executor(splitter.flush))
+        await store_batches(is_last=True)
+
+        return [id_ for id_ in ids if id_ is not None]
+
+    def get_source_manifest(self) -> SourceManifest:
+        """Get the manifest of the sources stored in the vector database. See `upsert_text`."""
+        return SourceManifest()
+
+    def get_chunk_deduplicator(self) -> ChunkDeduplicator | None:
+        """Get the deduplicator of the chunks, or `None` if deduplication is disabled. See `aadd_documents`."""
+        return ChunkDeduplicator.get_shared()
+
+    def get_content_hash(self, text: str | list[Document], metadata: DocumentMetadata) -> str:
+        """Hash everything that determines the stored chunks of a source, except for its `modified_at`."""
+
+        content = {
+            'text': text if isinstance(text, str) else [[doc.page_content, doc.metadata] for doc in text],
+            'source_name': metadata.source_name,
+            'payload': metadata.payload,
+            'split_strategy': self.split_strategy.get_fingerprint(),
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def upsert_text(self, text: str | list[Document], metadata: DocumentMetadata) -> dict:
+        """Store the text as the only content of its source, unless it's already stored.
+
+        Uses the source manifest (see `get_source_manifest`) to skip the splitting and embedding when the
+        content didn't change, or when `metadata.modified_at` is older than the stored content.
+
+        Otherwise, the text is split and the chunks are compared with the stored chunks of the source (by their
+        hashes, see `get_chunk_hash`). Only new chunks are embedded and inserted, and only vanished chunks are
+        deleted, after the insert, so searches never miss the source.
+
+        :return: A dictionary with the `status` of the upsert (`created`, `updated`, `unchanged` or `stale`),
+            and the `ids` of the chunks of the source. Created and updated sources also have the number of
+            chunks that were `added` and `deleted`.
+        """
+
+        lock_key = (self.cache_scope, metadata.source_id)
+        lock = self._source_locks.setdefault(lock_key, asyncio.Lock())
+
+        async with lock:
+            manifest = self.get_source_manifest()
+            entry = await manifest.get(self.cache_scope, metadata.source_id)
+            content_hash = self.get_content_hash(text, metadata)
+            modified_at = to_naive_utc(metadata.modified_at)
+
+            if entry is not None and modified_at < entry.modified_at:
+                return {'status': 'stale', 'ids': [id_ for id_ in entry.chunk_ids if id_ is not None]}
+
+            if entry is not None and entry.content_hash == content_hash:
+                if modified_at != entry.modified_at:
+                    await manifest.set(dataclasses.replace(entry, modified_at=modified_at))
+                return {'status': 'unchanged', 'ids': [id_ for id_ in entry.chunk_ids if id_ is not None]}
+
+            # Only chunks that aren't stored already are embedded and inserted.
+            splits = await self.asplit(text, metadata)
+            chunk_hashes = [self.get_chunk_hash(split) for split in splits]
+
+            stored_ids: dict[str, list] = {}
+            if entry is not None:
+                for chunk_hash, chunk_id in zip(entry.chunk_hashes, entry.chunk_ids):
+                    stored_ids.setdefault(chunk_hash, []).append(chunk_id)
+
+            # Near-duplicate chunks that were dropped (see `aadd_documents`) have no ID, and are checked again.
+            ids = [stored_ids[chunk_hash].pop() if stored_ids.get(chunk_hash) else None for chunk_hash in chunk_hashes]
+            new_splits = [split for split, id_ in zip(splits, ids) if id_ is None]
+            # The stored chunks of the source may be deleted below, so they can't keep near-duplicates out.
+            new_ids = []
+            if new_splits:
+                new_ids = await self.aadd_documents(new_splits, replaced_source_ids=[metadata.source_id])
+            new_ids_iter = iter(new_ids)
+            ids = [id_ if id_ is not None else next(new_ids_iter) for id_ in ids]
+            vanished = [
+                (chunk_hash, chunk_id)
+                for chunk_hash, chunk_ids in stored_ids.items() for chunk_id in chunk_ids if chunk_id is not None
+            ]
+            vanished_ids = [chunk_id for _, chunk_id in vanished]
+            self.on_collection_changed()
+
+            new_entry = SourceManifestEntry(
+                scope=self.cache_scope,
+                source_id=metadata.source_id,
+                content_hash=content_hash,
+                modified_at=modified_at,
+                chunk_ids=ids,
+                chunk_hashes=chunk_hashes,
+            )
+
+            # The manifest is written after the deletes, so a failed delete is retried by the next upsert.
+            stored_chunk_ids = [id_ for id_ in ids if id_ is not None]
+            if entry is None or not entry.chunk_hashes:
+                # Also deletes chunks of the source that were stored without the manifest (e.g. by `split_and_store_text`).
+                await self.delete_embeddings(metadata.source_id, except_ids=stored_chunk_ids)
+            elif vanished_ids:
+                # Until the vanished chunks are deleted, the manifest keeps them along with the new chunks, and no
+                # content hash, so if the delete fails, the next upsert reuses the new chunks and deletes the others.
+                await manifest.set(dataclasses.replace(
+                    new_entry,
+                    content_hash='',
+                    chunk_ids=ids + vanished_ids,
+                    chunk_hashes=chunk_hashes + [chunk_hash for chunk_hash, _ in vanished],
+                ))
+                await self.delete_chunks(vanished_ids)
+            await manifest.set(new_entry)
+
+            return {
+                'status': 'created' if entry is None else 'updated',
+                'ids': stored_chunk_ids,
+                'added': sum(id_ is not None for id_ in new_ids),
+                'deleted': len(vanished_ids),
+                'duplicates': sum(id_ is None for id_ in new_ids),
+            }
+
+    def get_chunk_hash(self, chunk: Document) -> str:
+        """Hash the content and metadata of the chunk, except for its `modified_at`.
+
+        Chunks with the same hash are interchangeable, so edited sources keep their unchanged chunks
+        (along with the `modified_at` of the version they were stored with).
+        """
+
+        metadata = {k: v for k, v in chunk.metadata.items() if k != 'modified_at'}
+        content = json.dumps([chunk.page_content, metadata], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    async def delete_chunks(self, ids: list) -> None:
+        """Delete the chunks with the given IDs from the vector database."""
+
+        await self.run_in_executor(self.delete, ids)
+        self.on_collection_changed()
+        await self.forget_chunks(ids)
+
+    async def forget_chunks(self, ids: list) -> None:
+        """Remove deleted chunks from the sparse index and the chunk deduplication index. Called by `delete_chunks`."""
+
+        await self.run_in_executor(self.get_sparse_index().delete_chunks, ids)
+        if (deduplicator := self.get_chunk_deduplicator()) is not None:
+            await self.invalidate_sources(await deduplicator.forget_chunks(self.cache_scope, ids))
+
+    async def forget_sources(self, source_ids: list[str], except_ids: list = None) -> None:
+        """Remove deleted sources from the source manifest, the sparse index and the chunk deduplication index.
+
+        Called by `delete_embeddings` and `delete_embeddings_many`.
+
+        :param except_ids: The IDs of the chunks that were kept. See `delete_embeddings`.
+        """
+
+        if except_ids is None:
+            await self.get_source_manifest().delete_many(self.cache_scope, source_ids)
+        await self.run_in_executor(self.get_sparse_index().delete_sources, source_ids, except_ids=except_ids)
+        if (deduplicator := self.get_chunk_deduplicator()) is not None:
+            await self.invalidate_sources(
+                await deduplicator.forget_sources(self.cache_scope, source_ids, except_ids=except_ids)
+            )
+
+    async def invalidate_sources(self, source_ids: list[str]) -> None:
+        """Clear the content hash of the sources in the source manifest, so their next upsert stores them again.
+
+        Called for the sources whose near-duplicate chunks were dropped (see `aadd_documents`) when the kept
+        chunks are deleted. Their dropped chunks have no ID in the manifest, so they're stored by the next upsert.
+        """
+
+        manifest = self.get_source_manifest()
+        for source_id in source_ids:
+            entry = await manifest.get(self.cache_scope, source_id)
+            if entry is not None and entry.content_hash:
+                await manifest.set(dataclasses.replace(entry, content_hash=''))
+
+    async def forget_collection(self) -> None:
+        """Remove the dropped collection from the source manifest, the sparse index and the chunk deduplication index.
+
+        Called by `drop_collection`.
+        """
+
+        await self.get_source_manifest().delete(self.cache_scope)
+        await self.run_in_executor(self.get_sparse_index().clear)
+        if (deduplicator := self.get_chunk_deduplicator()) is not None:
+            await deduplicator.forget_collection(self.cache_scope)
+
+    async def asplit(self, text: str | list[Document], metadata: DocumentMetadata) -> list[Document]:
+        """Split the text into chunks with `split_strategy`, without blocking the event loop."""
+
+        splits, = await self.split_strategy.asplit_many([(text, metadata)], run_in_executor=self.run_in_executor)
+        if isinstance(splits, Exception):
+            raise splits
+        return splits
+
+    async def aadd_documents(
+            self,
+            documents: list[Document],
+            replaced_source_ids: list[str] = None,
+            **kwargs,
+        ) -> list[str | None]:
+        """Embed and insert the documents, without blocking the event loop.
+
+        The vector stores embed the documents as part of their (synchronous) inserts,
+        so both run in the ingestion executor.
+
+        If deduplication is enabled (see `get_chunk_deduplicator`), near-duplicates of stored documents
+        (or of earlier documents in `documents`) are neither embedded nor inserted, and their IDs are `None`.
+
+        The inserted documents are also added to the sparse index (see `get_sparse_index`).
+
+        :param replaced_source_ids: The sources whose stored chunks are being replaced by the documents,
+            so they aren't compared with the documents.
+        """
+
+        deduplicator = self.get_chunk_deduplicator()
+        if deduplicator is None or not documents:
+            ids = await self.run_in_executor(self.add_documents, documents, **kwargs)
+            await self.run_in_executor(self.get_sparse_index().add, ids, documents)
+            return ids
+
+        plan = await deduplicator.deduplicate(
+            self.cache_scope,
+            documents,
+            self.run_in_executor,
+            exclude_source_ids=replaced_source_ids,
+        )
+        kept_documents = [document for idx, document in enumerate(documents) if not plan.is_duplicate(idx)]
+        kept_ids = await self.run_in_executor(self.add_documents, kept_documents, **kwargs) if kept_documents else []
+        await self.run_in_executor(self.get_sparse_index().add, kept_ids, kept_documents)
+        await deduplicator.register(self.cache_scope, documents, plan, kept_ids)
+
+        kept_ids_iter = iter(kept_ids)
+        return [None if plan.is_duplicate(idx) else next(kept_ids_iter) for idx in range(len(documents))]
+
+    async def split_and_store_many(
+            self,
+            documents: AsyncIterable[tuple[str | list[Document], DocumentMetadata]],
+            batch_size: int = None,
+        ) -> AsyncGenerator[dict, None]:
+        """Store the embeddings for many documents, packing the chunks of consecutive documents into full batches.
+
+        Documents are consumed lazily, so only the documents of the current batch, and of the group that is being
+        split (see `BaseTextIndexing.max_concurrency`), are kept in memory.
+
+        :param documents: The `(text, metadata)` pairs of the documents to store.
+        :param batch_size: The number of chunks to embed and insert at once.
+            Defaults to the `EMBEDDINGS_BATCH_SIZE` environment variable.
+
+        :return: An async generator of the results, one per document, in the order of `documents`.
+            Each result is either `{'source_id': ..., 'ids': [...]}` or `{'source_id': ..., 'error': '...'}`.
+            The chunks of a document that failed are deleted, or if that fails too, their `ids` are
+            part of its error result.
+        """
+
+        batch_size = batch_size or int(os.environ.get('EMBEDDINGS_BATCH_SIZE', 256))
+
+        # The documents whose results weren't yielded yet, in order, and the chunks of the current batch.
+        pending: list[_PendingDocument] = []
+        batch: list[tuple[_PendingDocument, int, Document]] = []
+
+        async def discard_document(document: _PendingDocument):
+            """Delete the chunks of the failed document that earlier batches stored, so none of it is searchable.
+
+            If the delete fails, the IDs of the chunks are kept, and reported along with the error.
+            """
+
+            ids = [id_ for id_ in document.ids if id_ is not None]
+            if not ids:
+                return
+
+            try:
+                await self.delete_chunks(ids)
+            except Exception:
+                Logger().get_logger().exception(f'Failed to delete the stored chunks of {document.metadata.source_id}')
+            else:
+                document.ids = [None] * len(document.ids)
+
+        async def store_batch():
+            # The remaining chunks of documents that failed already aren't stored.
+            chunks = [(document, idx, chunk) for document, idx, chunk in batch if document.error is None]
+            try:
+                ids = await self.aadd_documents([chunk for _, _, chunk in chunks]) if chunks else []
+            except Exception as e:
+                for document in {id(document): document for document, _, _ in chunks}.values():
+                    document.error = str(e)
+                    await discard_document(document)
+            else:
+                for (document, idx, _), id_ in zip(chunks, ids):
+                    document.ids[idx] = id_
+                if chunks:
+                    self.on_collection_changed()
+
+            for document, _, _ in batch:
+                document.chunks_left -= 1
+            batch.clear()
+
+        def pop_done():
+            while pending and pending[0].chunks_left == 0:
+                yield pending.pop(0).to_result()
+
+        # Documents are split in groups, so strategies can process them concurrently (e.g. summarize them).
+        group: list[tuple[str | list[Document], DocumentMetadata]] = []
+
+        async def store_group():
+            results = await self.split_strategy.asplit_many(group, run_in_executor=self.run_in_executor)
+            for (_, metadata), splits in zip(group, results):
+                document = _PendingDocument(metadata=metadata)
+                pending.append(document)
+
+                if isinstance(splits, Exception):
+                    document.error = str(splits)
+                    splits = []
+
+                document.ids = [None] * len(splits)
+                document.chunks_left = len(splits)
+
+                for idx, split in enumerate(splits):
+                    batch.append((document, idx, split))
+                    if len(batch) >= batch_size:
+                        await store_batch()
+
+            group.clear()
+
+        async for text, metadata in documents:
+            group.append((text, metadata))
+            if len(group) >= self.split_strategy.max_concurrency:
+                await store_group()
+
+                for result in pop_done():
+                    yield result
+
+        if group:
+            await store_group()
+
+        if batch:
+            await store_batch()
+
+        for result in pop_done():
+            yield result
+
     def __init__(
             self,
             split_strategy: BaseTextIndexing = None,
             collection_name: str = None,
+            tenant_id: str = None,
             **kwargs,
         ):
-        """Initialize the vector database."""
+        """Initialize the vector database.
+
+        :param tenant_id: The tenant whose vectors are stored and searched (see `get_tenant_collection_name`).
+            Defaults to the tenant of the current request or job (see `use_tenant`).
+        """
 
         self.split_strategy = split_strategy or BaseTextIndexing()
-        self.collection_name = collection_name or self.get_default_collection_name()
+        self.tenant_id = validate_tenant_id(tenant_id) if tenant_id is not None else get_current_tenant()
+        self.base_collection_name = collection_name or self.get_default_collection_name()
+        self.collection_name = self.get_tenant_collection_name(self.base_collection_name)
+
+        # The vector databases of the other tenants, by tenant. See `with_tenant`.
+        self._init_kwargs = kwargs
+        self._tenant_views: dict[str | None, BaseVectorDatabase] = {}
 
         default_kwargs = {
             'embedding_function': self.get_embedding_function(),
@@ -52,18 +517,170 @@ class BaseVectorDatabase(abc.ABC):
             **(default_kwargs | kwargs),
         )
 
+    def get_tenant_collection_name(self, collection_name: str) -> str:
+        """Get the name of the collection that stores the vectors of the tenant.
+
+        By default, each tenant has a collection of its own, so its searches never scan the vectors of other
+        tenants. Databases that partition a shared collection by tenant (e.g. Milvus) override this.
+        """
+        return collection_name if self.tenant_id is None else f'{collection_name}_{self.tenant_id}'
+
+    def with_tenant(self, tenant_id: str | None) -> 'BaseVectorDatabase':
+        """Get the vector database of the same collection, for another tenant.
+
+        The vector databases of the tenants are created once, so e.g. the retrievers of long-lived agents
+        can switch to the tenant of each request cheaply (see `VectorDBRetriever.for_tenant`).
+        """
+
+        tenant_id = validate_tenant_id(tenant_id)
+        if tenant_id == self.tenant_id:
+            return self
+
+        if tenant_id not in self._tenant_views:
+            with use_tenant(tenant_id):
+                self._tenant_views[tenant_id] = type(self)(
+                    split_strategy=self.split_strategy,
+                    collection_name=self.base_collection_name,
+                    **self._init_kwargs,
+                )
+
+        return self._tenant_views[tenant_id]
+
+    @property
+    def collection_scope(self) -> str:
+        """Identifies the (physical) collection, e.g. for its maintenance."""
+        return f'{type(self).__name__}:{self.collection_name}'
+
+    @property
+    def cache_scope(self) -> str:
+        """Identifies the collection, and the tenant whose vectors are searched, in the caches."""
+
+        if self.tenant_id is None:
+            return self.collection_scope
+        return f'{type(self).__name__}:{self.base_collection_name}/{self.tenant_id}'
+
+    def on_collection_changed(self) -> None:
+        """Should be called after every change to the collection, to invalidate the cached search results."""
+        CollectionGenerations.bump(self.cache_scope)
+
+    def get_sparse_index(self) -> BaseSparseIndex:
+        """Get the sparse (keyword) index of the collection, for the `hybrid` search. See `sparse_search`."""
+        return InMemoryBM25Index.get_shared(self.cache_scope)
+
+    def load_sparse_index(self) -> BaseSparseIndex:
+        """Get the sparse index of the collection, and load the chunks of the collection into it, if needed."""
+
+        sparse_index = self.get_sparse_index()
+        sparse_index.load(self.iter_documents)
+        return sparse_index
+
+    def sparse_search(self, query: str, k: int = 4, metadata_filter: MetadataFilter = None) -> list[Document]:
+        """Get the `k` chunks that best match the keywords of the query (e.g. identifiers, error codes), with BM25.
+
+        :param metadata_filter: If set, only the chunks that match it are searched.
+        """
+
+        results = self.load_sparse_index().search_with_ids(query, k=k, metadata_filter=metadata_filter)
+        if not results:
+            return []
+
+        # The sparse index may miss the deletes of other processes (see `BaseSparseIndex`), so the deleted
+        # chunks are dropped here, rather than merged with the results of the dense search.
+        existing_ids = self.get_existing_ids([chunk_id for chunk_id, _ in results])
+        return [document for chunk_id, document in results if chunk_id in existing_ids]
+
+    async def asparse_search(self, query: str, k: int = 4, metadata_filter: MetadataFilter = None) -> list[Document]:
+        """Same as `sparse_search`, without blocking the event loop."""
+        return await self.run_in_executor(self.sparse_search, query, k=k, metadata_filter=metadata_filter)
+
+    @abc.abstractmethod
+    def similarity_search_with_vectors(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            **kwargs,
+        ) -> list[tuple[Document, list[float]]]:
+        """Get the `k` chunks that are the most similar to the embedding, the most similar first, with their vectors.
+
+        Used by the diversity stage of the retrievers (see `VectorDBRetriever`), which compares the candidates
+        with each other. The vectors are fetched by the search itself, rather than by another round trip.
+
+        :param kwargs: Same as `similarity_search_by_vector`, e.g. the filters of `get_filter_kwargs`.
+        """
+        pass
+
+    async def asimilarity_search_with_vectors(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            **kwargs,
+        ) -> list[tuple[Document, list[float]]]:
+        """Same as `similarity_search_with_vectors`, without blocking the event loop."""
+        return await self.run_in_executor(self.similarity_search_with_vectors, embedding, k=k, **kwargs)
+
     @abc.abstractmethod
-    async def delete_embeddings(self, source_id: str) -> dict:
+    def get_filter_kwargs(self, metadata_filter: MetadataFilter) -> dict:
+        """Get the keyword arguments of the similarity searches, that push the filters down into the searches.
+
+        Usage:
+        ```python
+        >>> metadata_filter = MetadataFilter(source_names=['Handbook'], modified_after=datetime(2024, 1, 1))
+        >>> vector_db.similarity_search(query, k=8, **vector_db.get_filter_kwargs(metadata_filter))
+        ```
+        """
+        pass
+
+    def as_retriever(self, **kwargs) -> VectorDBRetriever:
+        """Return a retriever for the vector database, with a per-process cache of queries and results.
+
+        Accepts the same arguments as `VectorStore.as_retriever`, plus `cache`, to override the shared cache,
+        and `metadata_filter`, to pre-filter the searches (see `VectorDBRetriever.with_filter`).
+        The `hybrid` search type merges the dense and the sparse searches (see `VectorDBRetriever`).
+        """
+
+        tags = kwargs.pop('tags', None) or []
+        metadata_filter = kwargs.pop('metadata_filter', None)
+        kwargs.setdefault('cache', RetrieverCache.get_shared())
+
+        retriever = VectorDBRetriever(vectorstore=self, tags=tags + self._get_retriever_tags(), **kwargs)
+        return retriever.with_filter(metadata_filter)
+
+    @abc.abstractmethod
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        """Get the IDs, out of `ids`, of the chunks that are in the collection. The IDs are strings."""
+        pass
+
+    @abc.abstractmethod
+    def iter_documents(self, batch_size: int = 1_000) -> Iterator[tuple[Any, Document]]:
+        """Iterate over the `(id, chunk)` pairs of the collection, fetching `batch_size` chunks at a time."""
+        pass
+
+    @abc.abstractmethod
+    async def delete_embeddings(self, source_id: str, except_ids: list = None) -> dict:
         """Delete the embeddings for the given text from the vector database.
         
         :param source_id: The `source_id` metadata parameter to delete.
             This is not the same as the ID in the vector database, but rather the ID
             we use to identify the source, that the chunk of text came from.
+        :param except_ids: If set, these chunks of the source are kept, and the source is kept in the
+            source manifest. Otherwise, the source is also removed from the manifest.
 
         :return: A dictionary with the results of the deletion.
         """
         pass
 
+    @abc.abstractmethod
+    async def delete_embeddings_many(self, source_ids: list[str], batch_size: int = None) -> dict:
+        """Delete the embeddings of many sources from the vector database, and remove them from the source manifest.
+
+        :param source_ids: The `source_id` metadata parameters to delete. See `delete_embeddings`.
+        :param batch_size: The number of sources to delete at once.
+            Defaults to the `EMBEDDINGS_DELETE_BATCH_SIZE` environment variable.
+
+        :return: A dictionary with the results of the deletion, including the `error_count`.
+        """
+        pass
+
     @abc.abstractmethod
     async def drop_collection(self, collection_name: str, ignore_non_exist: bool = False) -> None:
         """Drop the collection from the vector database.
@@ -1,12 +1,15 @@
 import chromadb
+import itertools
+import json
 import os
 
 from langchain.schema import Document
 from langchain_chroma import Chroma as LangChroma
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, Optional
 from urllib.parse import urlparse
 
 from app.databases.vector.base import BaseVectorDatabase
+from app.databases.vector.filters import MetadataFilter
 from app.utils.logger import Logger
 
 
@@ -16,6 +19,13 @@ class Chroma(BaseVectorDatabase, LangChroma):
     SERVER_SCHEMA = 'http://'
     SERVER_SECURE_SCHEMA = 'https://'
 
+    # The HNSW parameters of new collections, by their environment variables.
+    HNSW_PARAMS = {
+        'CHROMA_HNSW_M': 'hnsw:M',
+        'CHROMA_HNSW_CONSTRUCTION_EF': 'hnsw:construction_ef',
+        'CHROMA_HNSW_SEARCH_EF': 'hnsw:search_ef',
+    }
+
     def get_chroma_http_client(self, uri: str) -> chromadb.HttpClient:
         """Parse `uri` and return an HTTP client object for the Chroma database."""
         
@@ -37,6 +47,15 @@ class Chroma(BaseVectorDatabase, LangChroma):
             ),
         )
     
+    def get_hnsw_metadata(self) -> dict | None:
+        """Get the HNSW parameters of new collections, from the `CHROMA_HNSW_*` environment variables.
+
+        Chroma can't change the parameters of existing collections, so they must be re-created to apply changes.
+        """
+
+        metadata = {param: int(os.environ[env]) for env, param in self.HNSW_PARAMS.items() if env in os.environ}
+        return metadata or None
+
     def __init__(self, drop_old: Optional[bool] = False, **kwargs):
         """Initialize a Chroma database client.
         
@@ -65,6 +84,7 @@ class Chroma(BaseVectorDatabase, LangChroma):
             raise ValueError(f'Invalid CHROMA_DB_URI Schema: {chroma_db_uri}')
 
         kwargs['client'] = self.client
+        kwargs.setdefault('collection_metadata', self.get_hnsw_metadata())
 
         # Drop the existing collection, if requested and exists.
         if drop_old:
@@ -73,12 +93,36 @@ class Chroma(BaseVectorDatabase, LangChroma):
 
         super().__init__(**kwargs)
 
-    async def delete_embeddings(self, source_id: str) -> dict:
+    def iter_documents(self, batch_size: int = 1_000) -> Iterator[tuple[str, Document]]:
+        """Iterate over the `(id, chunk)` pairs of the collection, fetching `batch_size` chunks at a time."""
+
+        collection = self.client.get_collection(self.collection_name)
+        for offset in itertools.count(0, batch_size):
+            res = collection.get(include=['documents', 'metadatas'], limit=batch_size, offset=offset)
+            for chunk_id, text, metadata in zip(res['ids'], res['documents'], res['metadatas']):
+                yield chunk_id, Document(page_content=text, metadata=metadata)
+
+            if len(res['ids']) < batch_size:
+                break
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        return set(self._collection.get(ids=ids, include=[])['ids'])
+
+    async def delete_embeddings(self, source_id: str, except_ids: list = None) -> dict:
         """Delete the embeddings for the given text from the Chroma database."""
         
         # Must use the "low-level" API to delete using a condition (and not by ID).
         collection = self.client.get_collection(self.collection_name)
-        collection.delete(where={'source_id': source_id})
+        if except_ids:
+            # Chroma can't exclude IDs in a condition, so find the IDs to delete first.
+            res = await self.run_in_executor(collection.get, where={'source_id': source_id}, include=[])
+            ids = list(set(res['ids']) - set(except_ids))
+            if ids:
+                await self.run_in_executor(collection.delete, ids=ids)
+        else:
+            await self.run_in_executor(collection.delete, where={'source_id': source_id})
+        self.on_collection_changed()
+        await self.forget_sources([source_id], except_ids=except_ids)
 
         # Chroma DB doesn't provide statistics on deletion.
         return {
@@ -86,6 +130,30 @@ class Chroma(BaseVectorDatabase, LangChroma):
             'error_count': 0,
         }
 
+    async def delete_embeddings_many(self, source_ids: list[str], batch_size: int = None) -> dict:
+        """Delete the embeddings of many sources from the Chroma database, with one delete per batch of sources.
+
+        See `BaseVectorDatabase.delete_embeddings_many`.
+        """
+
+        batch_size = batch_size or int(os.environ.get('EMBEDDINGS_DELETE_BATCH_SIZE', 1_000))
+        collection = self.client.get_collection(self.collection_name)
+
+        batches = 0
+        for i in range(0, len(source_ids), batch_size):
+            batch = source_ids[i:i + batch_size]
+            await self.run_in_executor(collection.delete, where={'source_id': {'$in': batch}})
+            self.on_collection_changed()
+            await self.forget_sources(batch)
+            batches += 1
+
+        # Chroma DB doesn't provide statistics on deletion.
+        return {
+            'success': True,
+            'error_count': 0,
+            'batches': batches,
+        }
+
     def _drop_collection(self, collection_name: str, ignore_non_exist: bool = False) -> None:
         """Drop the collection from the Chroma database."""
         try:
@@ -99,20 +167,61 @@ class Chroma(BaseVectorDatabase, LangChroma):
 
     async def drop_collection(self, collection_name: str, ignore_non_exist: bool = False) -> None:
         """Drop the collection from the Chroma database."""
-        self._drop_collection(collection_name, ignore_non_exist)
+        await self.run_in_executor(self._drop_collection, collection_name, ignore_non_exist)
+        self.on_collection_changed()
+        if collection_name == self.collection_name:
+            await self.forget_collection()
+
+    def similarity_search_with_vectors(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            filter: dict = None,
+            **kwargs,
+        ) -> list[tuple[Document, list[float]]]:
+        """See `BaseVectorDatabase.similarity_search_with_vectors`. The vectors are included in the query results."""
+
+        res = self._collection.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where=filter,
+            include=['documents', 'metadatas', 'embeddings'],
+            **kwargs,
+        )
+        return [
+            (Document(page_content=text, metadata=metadata or {}), list(vector))
+            for text, metadata, vector in zip(res['documents'][0], res['metadatas'][0], res['embeddings'][0])
+        ]
+
+    def get_filter_kwargs(self, metadata_filter: MetadataFilter) -> dict:
+        """See `BaseVectorDatabase.get_filter_kwargs`.
+
+        Chroma indexes all the metadata fields of the chunks, so the filters don't need indexes of their own.
+        """
+
+        conditions = [{key: {'$in': values}} for key, values in metadata_filter.get_values().items()]
+        modified_after, modified_before = metadata_filter.get_modified_range()
+        if modified_after is not None:
+            conditions.append({'modified_at': {'$gte': modified_after}})
+        if modified_before is not None:
+            conditions.append({'modified_at': {'$lte': modified_before}})
+
+        if not conditions:
+            return {}
+        return {'filter': conditions[0] if len(conditions) == 1 else {'$and': conditions}}
 
     def add_documents(self, documents: Iterable[Document]) -> list[str]:
-        """Override the general `add_documents` in order to convert `metadata.payload` to string.
+        """Override the general `add_documents` in order to convert `metadata.payload` to JSON.
         
         The problem is that `Chroma` doesn't accept dictionary metadata values.
         """
 
         def payload_to_str(doc: Document) -> Document:
-            """Convert the `payload` field in the metadata to a string."""
-            doc.metadata['payload'] = str(doc.metadata.get('payload', {}))
+            """Convert the `payload` field in the metadata to a JSON string."""
+            doc.metadata['payload'] = json.dumps(doc.metadata.get('payload', {}), default=str)
             return doc
 
-        # Convert the `payload` field in the metadata to a string.
+        # Convert the `payload` field in the metadata to a JSON string.
         documents = (payload_to_str(doc) for doc in documents)
 
         # Call the parent method.
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+import time
+
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from app.utils.logger import Logger
+
+
+class CompactionScheduler:
+    """Defers the compaction of a collection, until enough rows were deleted and the deletes quiet down.
+
+    Compacting reclaims the space of deleted rows and speeds up searches, but it's expensive, so it
+    shouldn't run on every delete. Instead, deletes are recorded with `record_deletes`, and a compaction
+    is scheduled once either threshold is met:
+    - `min_deleted_count` rows were deleted since the last compaction.
+    - The deleted rows are at least `min_deleted_ratio` of the rows of the collection.
+
+    The compaction runs after `quiet_period` seconds without deletes, so bulk deletes are compacted once.
+
+    Usage:
+    ```python
+    >>> scheduler = CompactionScheduler(min_deleted_ratio=0.1, min_deleted_count=10_000, quiet_period=60)
+    >>> scheduler.record_deletes(20_000, rows_count=1_000_000, compact=compact_collection)
+    >>> scheduler.get_stats()
+        {'state': 'scheduled', 'deleted_since_compaction': 20000, ...}
+    ```
+    """
+
+    # The shared, process-wide schedulers, by the collection's scope. See `get_shared`.
+    _shared: dict[str, 'CompactionScheduler'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, min_deleted_ratio: float = 0.1, min_deleted_count: int = 10_000, quiet_period: float = 60):
+        """Initialize the scheduler.
+
+        :param min_deleted_ratio: Compact when the deleted rows are at least this ratio of the rows.
+        :param min_deleted_count: Compact when at least this number of rows were deleted.
+        :param quiet_period: The number of seconds without deletes to wait before compacting.
+        """
+
+        self.min_deleted_ratio = min_deleted_ratio
+        self.min_deleted_count = min_deleted_count
+        self.quiet_period = quiet_period
+
+        self.state = 'idle'
+        self.deleted_count = 0
+        self.rows_count = 0
+        self.forced = False
+
+        self.compactions = 0
+        self.failures = 0
+        self.last_compaction_at: datetime = None
+        self.last_duration_ms: float = None
+        self.last_error: str = None
+
+        self._compact: Callable[[], Awaitable[None]] = None
+        self._task: asyncio.Task = None
+
+    @classmethod
+    def get_shared(cls, scope: str, env_prefix: str = 'MILVUS_COMPACTION') -> 'CompactionScheduler':
+        """Get the process-wide scheduler of the collection identified by `scope`, configured by env variables.
+
+        :param env_prefix: The prefix of the environment variables, e.g. `MILVUS_COMPACTION`.
+        """
+
+        with cls._shared_lock:
+            if scope not in cls._shared:
+                cls._shared[scope] = cls(
+                    min_deleted_ratio=float(os.environ.get(f'{env_prefix}_MIN_DELETED_RATIO', 0.1)),
+                    min_deleted_count=int(os.environ.get(f'{env_prefix}_MIN_DELETED_COUNT', 10_000)),
+                    quiet_period=float(os.environ.get(f'{env_prefix}_QUIET_PERIOD', 60)),
+                )
+
+            return cls._shared[scope]
+
+    @classmethod
+    def get_all_stats(cls) -> dict:
+        """Get the statistics of all the shared schedulers, by scope."""
+        return {scope: scheduler.get_stats() for scope, scheduler in cls._shared.items()}
+
+    def record_deletes(
+            self,
+            deleted_count: int,
+            rows_count: int,
+            compact: Callable[[], Awaitable[None]],
+            force: bool = False,
+        ) -> None:
+        """Record deleted rows, and (re)schedule a compaction if needed.
+
+        Must be called from the event loop.
+
+        :param deleted_count: The number of deleted rows.
+        :param rows_count: The number of rows that are left in the collection.
+        :param compact: Compacts the collection and waits for the compaction to complete.
+        :param force: Compact after the quiet period, even if the thresholds aren't met.
+        """
+
+        self.deleted_count += deleted_count
+        self.rows_count = rows_count
+        self.forced = self.forced or force
+        self._compact = compact
+
+        # Deletes during a compaction are handled when it completes.
+        if self.state != 'compacting' and self.should_compact():
+            self._schedule()
+
+    def should_compact(self) -> bool:
+        """Whether the deleted rows reached a threshold."""
+
+        if self.forced:
+            return True
+        if self.deleted_count == 0:
+            return False
+
+        deleted_ratio = self.deleted_count / (self.deleted_count + self.rows_count)
+        return self.deleted_count >= self.min_deleted_count or deleted_ratio >= self.min_deleted_ratio
+
+    def reset(self) -> None:
+        """Cancel the scheduled compaction and forget the deleted rows, e.g. when the collection is dropped."""
+
+        if self.state == 'scheduled':
+            self._cancel()
+            self.state = 'idle'
+
+        self.deleted_count = 0
+        self.forced = False
+
+    def get_stats(self) -> dict:
+        """Get the state of the compactions, for monitoring."""
+        return {
+            'state': self.state,
+            'deleted_since_compaction': self.deleted_count,
+            'rows': self.rows_count,
+            'compactions': self.compactions,
+            'failures': self.failures,
+            'last_compaction_at': self.last_compaction_at.isoformat() if self.last_compaction_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'last_error': self.last_error,
+        }
+
+    def _schedule(self) -> None:
+        """Schedule a compaction after the quiet period, restarting the period if it's already scheduled."""
+
+        if self.state == 'scheduled':
+            self._cancel()
+
+        self.state = 'scheduled'
+        self._task = asyncio.create_task(self._compact_after_quiet_period())
+
+    def _cancel(self) -> None:
+        """Cancel the scheduled compaction, unless its event loop was closed (and the compaction with it)."""
+
+        if self._task is not None and not self._task.get_loop().is_closed():
+            self._task.cancel()
+
+    async def _compact_after_quiet_period(self) -> None:
+        """Wait for the quiet period, and compact."""
+
+        await asyncio.sleep(self.quiet_period)
+
+        self.state = 'compacting'
+        deleted_count, self.deleted_count = self.deleted_count, 0
+        self.forced = False
+
+        start_time = time.perf_counter()
+        try:
+            await self._compact()
+        except Exception as e:
+            # Retry with the next deletes.
+            Logger().get_logger().exception('Compaction failed')
+            self.deleted_count += deleted_count
+            self.failures += 1
+            self.last_error = str(e)
+        else:
+            self.compactions += 1
+            self.last_error = None
+            self.last_compaction_at = datetime.now(timezone.utc)
+            Logger().get_logger().info(f'Compacted the collection after {deleted_count} deletes')
+        finally:
+            self.last_duration_ms = (time.perf_counter() - start_time) * 1_000
+            self.state = 'idle'
+
+        # Rows that were deleted during the compaction.
+        if self.last_error is None and self.should_compact():
+            self._schedule()
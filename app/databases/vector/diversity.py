@@ -0,0 +1,65 @@
+import numpy as np
+
+from typing import Hashable
+
+
+def maximal_marginal_relevance(
+        relevance: np.ndarray,
+        vectors: np.ndarray,
+        k: int,
+        lambda_mult: float = 0.5,
+        sources: list[Hashable] = None,
+        max_per_source: int = None,
+    ) -> list[int]:
+    """Select up to `k` of the candidates, trading their relevance for their novelty (MMR), greedily.
+
+    Each step selects the candidate with the best `lambda_mult * relevance - (1 - lambda_mult) * redundancy`,
+    where the redundancy of a candidate is its highest cosine similarity to the selected candidates. The
+    similarities of all the candidates are computed at once, as a single matrix, and each step is a few
+    vectorized operations on its rows, so the cost is one `n x n` product and `k` passes over `n` scores.
+
+    :param relevance: The relevance of each candidate, e.g. its similarity to the query. Higher is better.
+    :param vectors: The vectors of the candidates, one per row. Zero vectors (e.g. unknown vectors) aren't
+        similar to any candidate.
+    :param lambda_mult: 1 selects by relevance only (e.g. for the source caps only), 0 by novelty only.
+    :param sources: The source of each candidate, for `max_per_source`.
+    :param max_per_source: If set, at most this number of candidates of each source are selected.
+    :return: The indexes of the selected candidates, in the order of their selection.
+    """
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    count = min(k, len(relevance))
+    if count <= 0:
+        return []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarities = vectors @ vectors.T
+
+    # The redundancy of each candidate. Starts at the lowest similarity, so the first step is by relevance only.
+    redundancy = np.full(len(relevance), -1.0, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+
+    source_codes, source_counts = None, None
+    if max_per_source is not None and sources is not None:
+        _, source_codes = np.unique(np.asarray([str(source) for source in sources]), return_inverse=True)
+        source_counts = np.zeros(source_codes.max() + 1, dtype=np.int64)
+
+    selected = []
+    for _ in range(count):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        idx = int(np.argmax(scores))
+        if not available[idx]:
+            break
+
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(redundancy, similarities[idx], out=redundancy)
+
+        if source_codes is not None:
+            source_counts[source_codes[idx]] += 1
+            if source_counts[source_codes[idx]] >= max_per_source:
+                available[source_codes == source_codes[idx]] = False
+
+    return selected
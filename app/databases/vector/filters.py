@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from app.indexing.metadata import get_promoted_keys, to_epoch
+
+
+@dataclass
+class MetadataFilter:
+    """Pre-filters of a search, by the metadata of the chunks (see `DocumentMetadata.to_dict`).
+
+    The vector databases push the filters down into their searches (see
+    `BaseVectorDatabase.get_filter_kwargs`), so the `k` results are the most similar chunks that match
+    them, rather than the matching chunks among the `k` most similar ones. All the set filters must match.
+    """
+
+    source_ids: list[str] = None
+    source_names: list[str] = None
+    # Inclusive bounds of `modified_at`.
+    modified_after: datetime = None
+    modified_before: datetime = None
+    # The allowed values of promoted payload keys (see `get_promoted_keys`), by key.
+    payload: dict[str, list[str]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        promoted_keys = get_promoted_keys()
+        unknown_keys = [key for key in self.payload if key not in promoted_keys]
+        if unknown_keys:
+            raise ValueError(
+                f'Only promoted payload keys can be filtered by (see `METADATA_PROMOTED_KEYS`), got: '
+                f'{", ".join(unknown_keys)}'
+            )
+
+    def is_empty(self) -> bool:
+        return not self.get_values() and self.modified_after is None and self.modified_before is None
+
+    def get_values(self) -> dict[str, list[str]]:
+        """Get the allowed values of the filtered string fields, by field."""
+
+        values = {'source_id': self.source_ids, 'source_name': self.source_names} | self.payload
+        return {
+            key: [str(value) for value in key_values]
+            for key, key_values in values.items() if key_values is not None
+        }
+
+    def get_modified_range(self) -> tuple[int | None, int | None]:
+        """Get the inclusive bounds of `modified_at`, in seconds since the epoch, or `None` if unbounded."""
+        return (
+            to_epoch(self.modified_after) if self.modified_after is not None else None,
+            to_epoch(self.modified_before) if self.modified_before is not None else None,
+        )
+
+    def matches(self, metadata: dict) -> bool:
+        """Check whether the stored metadata of a chunk matches the filters."""
+
+        for key, values in self.get_values().items():
+            if str(metadata.get(key, '')) not in values:
+                return False
+
+        modified_after, modified_before = self.get_modified_range()
+        if modified_after is not None or modified_before is not None:
+            modified_at = metadata.get('modified_at')
+            if not isinstance(modified_at, (int, float)):
+                return False
+            if modified_after is not None and modified_at < modified_after:
+                return False
+            if modified_before is not None and modified_at > modified_before:
+                return False
+
+        return True
+
+    def to_key(self) -> str:
+        """Get a string that identifies the filters, e.g. for cache keys."""
+        return repr((sorted(self.get_values().items()), self.get_modified_range()))
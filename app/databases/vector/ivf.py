@@ -0,0 +1,141 @@
+import numpy as np
+import os
+
+from pathlib import Path
+
+
+class IVFIndex:
+    """An inverted-file (IVF) index of normalized vectors, for approximate nearest-neighbor searches.
+
+    The vectors are clustered around `nlist` centroids (see `train`), and each row is assigned to its
+    nearest centroid. A search only scores the rows of the `nprobe` centroids that are the nearest to
+    the query, so its cost grows with `nprobe / nlist` of the rows, rather than with all the rows.
+    Higher `nprobe` values trade speed for recall.
+
+    The index is stored next to the vectors (see `LocalCollection`):
+    - `ivf-<generation>.centroids.npy`: The centroids.
+    - `ivf-<generation>.assignments.i32`: The centroid of each row, appended row after row.
+
+    New rows are assigned to the existing centroids, so the index must be rebuilt (see
+    `app.databases.vector.rebuild_index`) once the data drifts away from them.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, nprobe: int = None):
+        """Initialize the index.
+
+        :param centroids: The normalized centroids, of shape `(nlist, dim)`.
+        :param assignments: The centroid of each row.
+        :param nprobe: The default number of centroids to search. Defaults to the `LOCAL_VECTOR_DB_IVF_NPROBE`
+            environment variable.
+        """
+
+        self.centroids = centroids
+        self.nprobe = nprobe or int(os.environ.get('LOCAL_VECTOR_DB_IVF_NPROBE', 16))
+        self.count = 0
+        self._lists: list[np.ndarray] = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self.add(assignments)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def get_default_nlist(count: int) -> int:
+        """Get the default number of centroids for `count` rows, `4 * sqrt(count)`."""
+        return max(1, int(4 * np.sqrt(count)))
+
+    @staticmethod
+    def get_sample(positions: np.ndarray, nlist: int, max_sample_size: int = 64, seed: int = 0) -> np.ndarray:
+        """Get a random sample of the positions to train the centroids on, in order.
+
+        :param max_sample_size: The maximum number of vectors per centroid to train on. The others
+            are only assigned to the centroids.
+        """
+
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(positions, min(len(positions), nlist * max_sample_size), replace=False))
+
+    @staticmethod
+    def train(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+        """Cluster the (normalized) vectors with spherical k-means.
+
+        :param nlist: The number of centroids.
+        :return: The normalized centroids, of shape `(nlist, dim)`.
+        """
+
+        rng = np.random.default_rng(seed)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = min(nlist, len(vectors))
+
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = IVFIndex.assign_to(centroids, vectors)
+            order = np.argsort(assignments, kind='stable')
+            clusters, starts = np.unique(assignments[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[clusters] = np.add.reduceat(vectors[order], starts)
+
+            # Re-seed the empty clusters with random vectors.
+            empty = np.setdiff1d(np.arange(nlist), clusters)
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def assign_to(centroids: np.ndarray, vectors: np.ndarray, batch_size: int = 10_000) -> np.ndarray:
+        """Get the nearest centroid of each of the vectors."""
+
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), batch_size):
+            assignments[i:i + batch_size] = np.argmax(vectors[i:i + batch_size] @ centroids.T, axis=1)
+        return assignments
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Get the nearest centroid of each of the vectors."""
+        return self.assign_to(self.centroids, vectors)
+
+    def add(self, assignments: np.ndarray) -> None:
+        """Add rows to the index, after its current rows.
+
+        The lists are replaced rather than changed, since searches may be using them (see `probe`).
+        """
+
+        if not len(assignments):
+            return
+
+        positions = np.arange(self.count, self.count + len(assignments))
+        order = np.argsort(assignments, kind='stable')
+        centroids, starts = np.unique(assignments[order], return_index=True)
+
+        lists = list(self._lists)
+        for centroid, rows in zip(centroids, np.split(positions[order], starts[1:])):
+            lists[centroid] = np.concatenate([lists[centroid], rows])
+
+        self._lists = lists
+        self.count += len(assignments)
+
+    def probe(self, query: np.ndarray, nprobe: int = None) -> np.ndarray:
+        """Get the positions of the rows of the `nprobe` centroids that are the nearest to the query, in order."""
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = self._lists
+        nearest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([lists[centroid] for centroid in nearest]))
+
+    @classmethod
+    def get_paths(cls, directory: Path, generation: int) -> tuple[Path, Path]:
+        """Get the paths of the centroids and the assignments files of the generation."""
+        return directory / f'ivf-{generation}.centroids.npy', directory / f'ivf-{generation}.assignments.i32'
+
+    def get_stats(self) -> dict:
+        """Get statistics about the index."""
+
+        sizes = [len(rows) for rows in self._lists]
+        return {
+            'type': 'ivf',
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'max_list_size': max(sizes, default=0),
+        }
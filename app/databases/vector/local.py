@@ -0,0 +1,904 @@
+import fcntl
+import json
+import numpy as np
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TextIO
+
+from app.databases.vector.base import BaseVectorDatabase
+from app.databases.vector.compaction import CompactionScheduler
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.ivf import IVFIndex
+from app.databases.vector.quantization import BaseQuantizer, get_quantizer
+from app.indexing.metadata import get_promoted_keys
+from app.utils.logger import Logger
+
+
+class LocalCollection:
+    """The chunks of a collection of the local vector store, in a directory:
+
+    - `vectors-<generation>.f32`: The (normalized) float32 embeddings, appended row after row. Searches
+      memory-map the file, so loading the collection doesn't read nor copy the vectors.
+    - `chunks.sqlite`: The ID, source, text and metadata of each row, and whether it was deleted.
+    - `ivf-<generation>.*`: The optional approximate nearest-neighbor index. See `IVFIndex` and `build_index`.
+    - `quantized-<generation>.*`: The optional quantized codes of the vectors, which are searched instead of
+      the vectors, before re-ranking the best candidates by their vectors. See `BaseQuantizer`.
+
+    Deleted rows are tombstoned, and reclaimed by `compact`, which writes the rows that are left to
+    the vectors file of the next generation. A collection must be used by a single process at a time, which
+    holds an exclusive lock of `collection.lock` while it's open. See `_lock_directory`.
+    """
+
+    # The shared, process-wide collections, by their directory. See `get_shared`.
+    _shared: dict[Path, 'LocalCollection'] = {}
+    _shared_lock = threading.Lock()
+
+    # The lock files of the collections that this process opened, by their directory. See `_lock_directory`.
+    _directory_locks: dict[Path, TextIO] = {}
+    _directory_locks_lock = threading.Lock()
+
+    def __init__(self, path: str | Path, quantization: str = None):
+        """Open the collection, or create it if it doesn't exist.
+
+        :param path: The directory of the collection.
+        :param quantization: `int8`, `binary`, or an empty string to search the full-precision vectors only.
+            Defaults to the `LOCAL_VECTOR_DB_QUANTIZATION` environment variable. The codes of the existing
+            rows are computed when it changes.
+        """
+
+        self.path = Path(path)
+        self.quantizer: BaseQuantizer | None = get_quantizer(
+            quantization if quantization is not None else os.environ.get('LOCAL_VECTOR_DB_QUANTIZATION'),
+        )
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock_directory()
+
+        self._lock = threading.RLock()
+        # Compactions run one at a time, mostly without `self._lock`. See `compact`.
+        self._compact_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path / 'chunks.sqlite', check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                position INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS chunks_source_id ON chunks (source_id)')
+        for key in ('source_name', 'modified_at', *get_promoted_keys()):
+            # The searches are filtered by these fields (see `_get_filtered_mask`).
+            self._conn.execute(
+                f'CREATE INDEX IF NOT EXISTS chunks_{key} ON chunks ({self._get_metadata_field(key)})',
+            )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+        # Bumped by `compact`, which renumbers the rows. See `search`.
+        self.generation = 0
+        self._load()
+
+    def _lock_directory(self) -> None:
+        """Lock the directory of the collection for this process, or fail if another process holds the lock.
+
+        The lock is held until the collection is dropped, or the process exits, and is shared by the
+        instances of the collection in this process.
+
+        :raise RuntimeError: If another process uses the collection.
+        """
+
+        path = self.path.resolve()
+        with LocalCollection._directory_locks_lock:
+            if path in LocalCollection._directory_locks:
+                return
+
+            lock_file = open(path / 'collection.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise RuntimeError(f'The local collection {path} is used by another process.')
+
+            LocalCollection._directory_locks[path] = lock_file
+
+    @classmethod
+    def get_shared(cls, path: str | Path) -> 'LocalCollection':
+        """Get the process-wide collection in the directory."""
+
+        path = Path(path).resolve()
+        with cls._shared_lock:
+            if path not in cls._shared:
+                cls._shared[path] = cls(path)
+
+            return cls._shared[path]
+
+    @classmethod
+    def get_all_stats(cls) -> dict:
+        """Get the statistics of all the shared collections, by directory."""
+        return {str(path): collection.get_stats() for path, collection in cls._shared.items()}
+
+    @staticmethod
+    def _get_metadata_field(key: str) -> str:
+        """Get the SQL expression of a metadata field of the chunks. The keys are checked by `get_promoted_keys`."""
+        return 'source_id' if key == 'source_id' else f"json_extract(metadata, '$.{key}')"
+
+    def _get_filtered_mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        """Get whether each row matches the filters. Must be called with `self._lock` held."""
+
+        conditions, params = [], []
+        for key, values in metadata_filter.get_values().items():
+            conditions.append(f'{self._get_metadata_field(key)} IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+
+        # Chunks stored by older versions have an ISO 8601 `modified_at`, and don't match date ranges.
+        modified_at = self._get_metadata_field('modified_at')
+        for bound, operator in zip(metadata_filter.get_modified_range(), ('>=', '<=')):
+            if bound is not None:
+                conditions.append(f"{modified_at} {operator} ? AND typeof({modified_at}) = 'integer'")
+                params.append(bound)
+
+        mask = np.zeros(self.count, dtype=bool)
+        rows = self._conn.execute(
+            f'SELECT position FROM chunks WHERE deleted = 0 AND {" AND ".join(conditions) or "1"}',
+            params,
+        ).fetchall()
+        mask[[position for position, in rows]] = True
+        return mask
+
+    def _get_setting(self, key: str) -> str | None:
+        row = self._conn.execute('SELECT value FROM settings WHERE key = ?', [key]).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value: Any) -> None:
+        self._conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', [key, str(value)])
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.path / f'vectors-{self.generation}.f32'
+
+    @property
+    def index_paths(self) -> tuple[Path, Path]:
+        return IVFIndex.get_paths(self.path, self.generation)
+
+    def get_quantized_paths(self, generation: int) -> dict[str, Path]:
+        """Get the paths of the files of the quantized codes of the generation, by their suffix."""
+
+        if self.quantizer is None or self.dim is None:
+            return {}
+        return {suffix: self.path / f'quantized-{generation}.{suffix}' for suffix in self.quantizer.get_files(self.dim)}
+
+    def _load(self) -> None:
+        """Load the collection, and recover from inserts and compactions that were interrupted."""
+
+        self.generation = int(self._get_setting('generation') or 0)
+        self.dim = int(dim) if (dim := self._get_setting('dim')) else None
+
+        # Files of other generations are leftovers of interrupted compactions, index files without centroids
+        # are leftovers of interrupted index builds, and quantized codes of other quantizers are outdated.
+        centroids_path, assignments_path = self.index_paths
+        quantization = self.quantizer.name if self.quantizer else ''
+        current_paths = {self.vectors_path}
+        if centroids_path.exists():
+            current_paths |= {centroids_path, assignments_path}
+        if self._get_setting('quantization') == quantization:
+            current_paths |= set(self.get_quantized_paths(self.generation).values())
+        for path in [*self.path.glob('vectors-*'), *self.path.glob('ivf-*'), *self.path.glob('quantized-*')]:
+            if path not in current_paths:
+                path.unlink()
+
+        rows = self._conn.execute('SELECT position, deleted, source_id FROM chunks ORDER BY position').fetchall()
+        self.count = len(rows)
+
+        # Vectors are appended before their rows are committed, so vectors without rows are of interrupted inserts.
+        self._truncate(self.count)
+
+        self._alive = np.array([not deleted for _, deleted, _ in rows], dtype=bool)
+        self._source_ids = np.array([source_id for _, _, source_id in rows], dtype=object)
+        self._map_vectors()
+
+        if self._get_setting('quantization') != quantization:
+            self._write_codes(self.generation, np.arange(self.count))
+            self._set_setting('quantization', quantization)
+        self._map_codes()
+
+        self._index: IVFIndex | None = None
+        if centroids_path.exists():
+            assignments = np.fromfile(assignments_path, dtype=np.int32)
+            self._index = IVFIndex(np.load(centroids_path), assignments)
+
+    def _truncate(self, count: int) -> None:
+        """Truncate the vectors and the index assignments to the first `count` rows."""
+
+        if self.dim and self.vectors_path.exists():
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(count * self.dim * 4)
+
+        _, assignments_path = self.index_paths
+        if assignments_path.exists():
+            with open(assignments_path, 'r+b') as f:
+                f.truncate(count * 4)
+
+        files = self.quantizer.get_files(self.dim) if self.quantizer and self.dim else {}
+        for suffix, path in self.get_quantized_paths(self.generation).items():
+            if path.exists():
+                dtype, shape = files[suffix]
+                with open(path, 'r+b') as f:
+                    f.truncate(count * np.dtype(dtype).itemsize * int(np.prod(shape)))
+
+    def _map_vectors(self) -> None:
+        if self.count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        else:
+            self._vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+
+    def _map_codes(self) -> None:
+        self._codes: dict[str, np.ndarray] = {}
+        for suffix, path in self.get_quantized_paths(self.generation).items():
+            dtype, shape = self.quantizer.get_files(self.dim)[suffix]
+            self._codes[suffix] = np.memmap(path, dtype=dtype, mode='r', shape=(self.count, *shape)) if self.count \
+                else np.empty((0, *shape), dtype=dtype)
+
+    def _write_codes(
+            self,
+            generation: int,
+            positions: np.ndarray,
+            vectors: np.ndarray = None,
+            append: bool = False,
+            batch_size: int = 10_000,
+        ) -> None:
+        """Write the quantized codes of the rows at `positions` to the files of the generation.
+
+        :param vectors: The vectors of the rows. Defaults to the current vectors.
+        :param append: Append the codes to the files, instead of replacing them.
+        """
+
+        paths = self.get_quantized_paths(generation)
+        if not paths:
+            return
+
+        vectors = self._vectors if vectors is None else vectors
+        files = {suffix: open(path, 'ab' if append else 'wb') for suffix, path in paths.items()}
+        try:
+            for i in range(0, len(positions), batch_size):
+                codes = self.quantizer.encode(np.asarray(vectors[positions[i:i + batch_size]]))
+                for suffix, f in files.items():
+                    f.write(codes[suffix].tobytes())
+        finally:
+            for f in files.values():
+                f.close()
+
+    @property
+    def deleted_count(self) -> int:
+        return self.count - int(self._alive.sum())
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict], vectors: list[list[float]]) -> None:
+        """Append the chunks and their embeddings to the collection."""
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_setting('dim', self.dim)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f'Expected embeddings of {self.dim} dimensions, got {vectors.shape[1]}')
+
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+
+            # New rows are assigned to the centroids of the index, if any.
+            assignments = self._index.assign(vectors) if self._index else None
+            if assignments is not None:
+                with open(self.index_paths[1], 'ab') as f:
+                    f.write(assignments.tobytes())
+
+            if self.quantizer is not None:
+                codes = self.quantizer.encode(vectors)
+                for suffix, path in self.get_quantized_paths(self.generation).items():
+                    with open(path, 'ab') as f:
+                        f.write(codes[suffix].tobytes())
+
+            source_ids = [str(metadata.get('source_id')) for metadata in metadatas]
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO chunks (position, id, source_id, text, metadata) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (self.count + i, chunk_id, source_id, text, json.dumps(metadata, default=str))
+                        for i, (chunk_id, source_id, text, metadata)
+                        in enumerate(zip(ids, source_ids, texts, metadatas))
+                    ],
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                self._truncate(self.count)
+                raise
+
+            if assignments is not None:
+                self._index.add(assignments)
+            self.count += len(vectors)
+            self._alive = np.concatenate([self._alive, np.ones(len(vectors), dtype=bool)])
+            self._source_ids = np.concatenate([self._source_ids, np.array(source_ids, dtype=object)])
+            self._map_vectors()
+            self._map_codes()
+
+    def _tombstone(self, positions: list[int]) -> int:
+        """Mark the rows as deleted. Must be called with `self._lock` held.
+
+        :return: The number of deleted rows.
+        """
+
+        if not positions:
+            return 0
+
+        self._conn.executemany('UPDATE chunks SET deleted = 1 WHERE position = ?', [(p,) for p in positions])
+
+        # Replace the mask rather than changing it, since searches may be using it (see `search`).
+        alive = self._alive.copy()
+        alive[positions] = False
+        self._alive = alive
+
+        return len(positions)
+
+    def delete(self, ids: list[str]) -> int:
+        """Delete the chunks with the IDs.
+
+        :return: The number of deleted chunks.
+        """
+
+        placeholders = ', '.join('?' * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT position FROM chunks WHERE deleted = 0 AND id IN ({placeholders})',
+                [str(chunk_id) for chunk_id in ids],
+            ).fetchall()
+            return self._tombstone([position for position, in rows])
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        """Get the IDs, out of `ids`, of the chunks that weren't deleted."""
+
+        placeholders = ', '.join('?' * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id FROM chunks WHERE deleted = 0 AND id IN ({placeholders})',
+                [str(chunk_id) for chunk_id in ids],
+            ).fetchall()
+            return {chunk_id for chunk_id, in rows}
+
+    def delete_sources(self, source_ids: list[str], except_ids: list[str] = None) -> int:
+        """Delete the chunks of the sources, except for `except_ids`.
+
+        :return: The number of deleted chunks.
+        """
+
+        except_ids = {str(chunk_id) for chunk_id in except_ids or []}
+        placeholders = ', '.join('?' * len(source_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT position, id FROM chunks WHERE deleted = 0 AND source_id IN ({placeholders})',
+                [str(source_id) for source_id in source_ids],
+            ).fetchall()
+            return self._tombstone([position for position, chunk_id in rows if chunk_id not in except_ids])
+
+    def search(
+            self,
+            vector: list[float],
+            k: int = 4,
+            source_ids: list[str] = None,
+            nprobe: int = None,
+            oversample: int = None,
+            exact: bool = False,
+            metadata_filter: MetadataFilter = None,
+            with_vectors: bool = False,
+        ) -> list[tuple]:
+        """Find the `k` chunks that are the most similar to the vector, by cosine similarity.
+
+        If the collection has an index (see `build_index`), only the rows of the `nprobe` centroids that
+        are the nearest to the vector are searched, unless fewer than `k` of them match the filters.
+        If the collection has quantized codes (see `BaseQuantizer`), the `k * oversample` rows whose codes
+        are the most similar are found first, and only they are compared by their full-precision vectors.
+
+        :param source_ids: If set, only the chunks of these sources are searched.
+        :param nprobe: The number of centroids of the index to search. See `IVFIndex`.
+        :param oversample: The number of candidates per result, to re-rank by the full-precision vectors.
+            Defaults to the `LOCAL_VECTOR_DB_QUANTIZATION_OVERSAMPLE` environment variable, or to the
+            quantizer's default.
+        :param exact: Compare the vector with all the rows, by their full-precision vectors.
+        :param metadata_filter: If set, only the chunks that match it are searched.
+        :param with_vectors: Add the (normalized) vector of each chunk to its result.
+        :return: The `(id, chunk, similarity)`, or `(id, chunk, similarity, vector)`, of the most similar chunks,
+            the most similar first.
+        """
+
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        if source_ids is not None:
+            source_ids = [str(source_id) for source_id in source_ids]
+
+        while True:
+            # The search itself runs without the lock, on the current arrays, which are replaced (not changed)
+            # by the writes. If the rows were renumbered by a compaction in the meantime, search again.
+            with self._lock:
+                generation, vectors, codes, alive, all_source_ids, index = (
+                    self.generation, self._vectors, self._codes, self._alive, self._source_ids, self._index,
+                )
+                if metadata_filter is not None:
+                    alive = alive & self._get_filtered_mask(metadata_filter)
+
+            candidates = None
+            if index is not None and not exact:
+                # The index may have rows that were added after the arrays were taken.
+                candidates = index.probe(query, nprobe)
+                candidates = candidates[candidates < len(alive)]
+                candidates = candidates[alive[candidates]]
+                if source_ids is not None:
+                    candidates = candidates[np.isin(all_source_ids[candidates], source_ids)]
+                if len(candidates) < k:
+                    candidates = None
+
+            if candidates is None:
+                mask = alive if source_ids is None else alive & np.isin(all_source_ids, source_ids)
+                candidates = np.flatnonzero(mask)
+            if not len(candidates) or k <= 0:
+                return []
+
+            # Keep the candidates whose codes are the most similar, in order, to re-rank by their vectors.
+            all_rows = len(candidates) == len(vectors)
+            oversample = oversample or int(os.environ.get(
+                'LOCAL_VECTOR_DB_QUANTIZATION_OVERSAMPLE', self.quantizer.default_oversample if self.quantizer else 1,
+            ))
+            if codes and not exact and k * oversample < len(candidates):
+                approximate_scores = self.quantizer.score(
+                    codes if all_rows else {suffix: rows[candidates] for suffix, rows in codes.items()},
+                    query,
+                )
+                shortlist = np.argpartition(-approximate_scores, k * oversample - 1)[:k * oversample]
+                candidates = candidates[np.sort(shortlist)]
+                all_rows = False
+
+            # The scores of the candidates, in order. Without filters, the vectors aren't copied.
+            scores = vectors @ query if all_rows else vectors[candidates] @ query
+
+            top_k = min(k, len(candidates))
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+
+            with self._lock:
+                if self.generation != generation:
+                    continue
+
+                rows = self._get_rows(candidates[top].tolist(), scores[top].tolist())
+
+            if with_vectors:
+                # The arrays of the generation aren't changed, so the vectors can be read without the lock.
+                return [(*row, vector) for row, vector in zip(rows, vectors[candidates[top]].tolist())]
+            return rows
+
+    def _get_rows(self, positions: list[int], scores: list[float]) -> list[tuple[str, Document, float]]:
+        """Get the `(id, chunk, score)` of the rows, in order. Must be called with `self._lock` held."""
+
+        placeholders = ', '.join('?' * len(positions))
+        rows = {
+            position: (chunk_id, text, metadata)
+            for position, chunk_id, text, metadata in self._conn.execute(
+                f'SELECT position, id, text, metadata FROM chunks WHERE position IN ({placeholders})',
+                positions,
+            )
+        }
+
+        results = []
+        for position, score in zip(positions, scores):
+            chunk_id, text, metadata = rows[position]
+            results.append((chunk_id, Document(page_content=text, metadata=json.loads(metadata)), score))
+        return results
+
+    def iter_chunks(self, batch_size: int = 1_000) -> Iterator[tuple[str, Document]]:
+        """Iterate over the `(id, chunk)` pairs of the collection, in the order they were added."""
+
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT position, id, text, metadata FROM chunks '
+                    'WHERE deleted = 0 AND position > ? ORDER BY position LIMIT ?',
+                    [position, batch_size],
+                ).fetchall()
+
+            for position, chunk_id, text, metadata in rows:
+                yield chunk_id, Document(page_content=text, metadata=json.loads(metadata))
+
+            if len(rows) < batch_size:
+                break
+
+    def compact(self) -> None:
+        """Reclaim the deleted rows, by writing the rows that are left to the vectors file of the next generation.
+
+        Like `build_index`, the rows that are left are copied without the lock, so the collection can be searched
+        and changed in the meantime. Rows added in the meantime are copied at the end, and rows deleted in the
+        meantime are kept, as deleted rows of the next generation. The new vectors file and the renumbered rows
+        are committed together, so an interrupted compaction leaves the collection as it was.
+        """
+
+        with self._compact_lock:
+            with self._lock:
+                generation, count, vectors, alive = self.generation, self.count, self._vectors, self._alive
+
+            positions = np.flatnonzero(alive)
+            if len(positions) == count:
+                return
+
+            next_path = self.path / f'vectors-{generation + 1}.f32'
+            next_index_paths = IVFIndex.get_paths(self.path, generation + 1)
+            next_paths = [next_path, *next_index_paths, *self.get_quantized_paths(generation + 1).values()]
+
+            try:
+                with open(next_path, 'wb') as f:
+                    for i in range(0, len(positions), 10_000):
+                        f.write(np.ascontiguousarray(vectors[positions[i:i + 10_000]]).tobytes())
+                self._write_codes(generation + 1, positions, vectors=vectors)
+            except Exception:
+                for path in next_paths:
+                    path.unlink(missing_ok=True)
+                raise
+
+            with self._lock:
+                added = np.arange(count, self.count)
+                kept = np.concatenate([positions, added])
+                try:
+                    with open(next_path, 'ab') as f:
+                        f.write(np.ascontiguousarray(self._vectors[count:]).tobytes())
+                    self._write_codes(generation + 1, added, append=True)
+
+                    # The rows that are left keep their centroids. The index may have changed in the meantime.
+                    assignments = None
+                    if self._index is not None:
+                        assignments = np.fromfile(self.index_paths[1], dtype=np.int32)[kept]
+                        assignments.tofile(next_index_paths[1])
+                        np.save(next_index_paths[0], self._index.centroids)
+
+                    # Rows only move to lower positions, so renumbering them in order doesn't collide.
+                    self._conn.execute('BEGIN')
+                    try:
+                        self._conn.executemany(
+                            'DELETE FROM chunks WHERE position = ?',
+                            [(int(position),) for position in np.flatnonzero(~alive)],
+                        )
+                        self._conn.executemany(
+                            'UPDATE chunks SET position = ? WHERE position = ?',
+                            [(new, int(old)) for new, old in enumerate(kept) if new != old],
+                        )
+                        self._set_setting('generation', generation + 1)
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                except Exception:
+                    for path in next_paths:
+                        path.unlink(missing_ok=True)
+                    raise
+
+                previous_paths = [self.vectors_path, *self.index_paths, *self.get_quantized_paths(generation).values()]
+                self.generation += 1
+                self.count = len(kept)
+                self._alive = self._alive[kept]
+                self._source_ids = self._source_ids[kept]
+                self._map_vectors()
+                self._map_codes()
+                if self._index is not None:
+                    self._index = IVFIndex(self._index.centroids, assignments, nprobe=self._index.nprobe)
+
+                # Searches that still map the previous file keep it, until they're done (on POSIX).
+                for path in previous_paths:
+                    path.unlink(missing_ok=True)
+
+    def build_index(self, nlist: int = None, iterations: int = 10) -> None:
+        """Build the IVF index of the collection, or rebuild it with new centroids. See `IVFIndex`.
+
+        The centroids are trained and the rows are assigned to them without the lock, so the collection
+        can be searched and changed in the meantime. Rows added in the meantime are assigned at the end.
+
+        :param nlist: The number of centroids. Defaults to `IVFIndex.get_default_nlist` of the rows.
+        :param iterations: The number of k-means iterations.
+        """
+
+        while True:
+            with self._lock:
+                generation, vectors, alive = self.generation, self._vectors, self._alive
+
+            positions = np.flatnonzero(alive)
+            if not len(positions):
+                raise ValueError(f'The collection in {self.path} is empty')
+
+            nlist = nlist or IVFIndex.get_default_nlist(len(positions))
+            centroids = IVFIndex.train(vectors[IVFIndex.get_sample(positions, nlist)], nlist, iterations=iterations)
+            assignments = IVFIndex.assign_to(centroids, vectors)
+
+            with self._lock:
+                if self.generation != generation:
+                    continue
+
+                assignments = np.concatenate([assignments, IVFIndex.assign_to(centroids, self._vectors[len(vectors):])])
+
+                # The centroids are written last, since the index files are used only if they exist (see `_load`).
+                centroids_path, assignments_path = self.index_paths
+                centroids_path.unlink(missing_ok=True)
+                assignments.tofile(assignments_path)
+                np.save(centroids_path, centroids)
+
+                self._index = IVFIndex(centroids, assignments)
+                return
+
+    def drop_index(self) -> None:
+        """Delete the IVF index of the collection, so it's searched exhaustively."""
+
+        with self._lock:
+            self._index = None
+            for path in self.index_paths:
+                path.unlink(missing_ok=True)
+
+    def drop(self) -> None:
+        """Delete the collection and its files."""
+
+        with self._lock:
+            self._conn.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+
+        with LocalCollection._shared_lock:
+            LocalCollection._shared.pop(self.path.resolve(), None)
+
+        with LocalCollection._directory_locks_lock:
+            if lock_file := LocalCollection._directory_locks.pop(self.path.resolve(), None):
+                lock_file.close()
+
+    def get_stats(self) -> dict:
+        """Get statistics about the size of the collection."""
+        return {
+            'rows': self.count,
+            'deleted': self.deleted_count,
+            'dim': self.dim,
+            'generation': self.generation,
+            'index': self._index.get_stats() if self._index else None,
+            'quantization': self.quantizer.name if self.quantizer else None,
+        }
+
+
+class LocalVectorStore(VectorStore):
+    """A LangChain vector store of collections in local files. See `LocalCollection`."""
+
+    def __init__(self, embedding_function: Embeddings, collection_name: str, path: str | Path = None):
+        """Initialize the vector store.
+
+        :param path: The directory of the collections. Defaults to the `LOCAL_VECTOR_DB_PATH` environment variable.
+        """
+
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.path = Path(path or os.environ.get('LOCAL_VECTOR_DB_PATH', 'data/vector-db'))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    @property
+    def collection(self) -> LocalCollection:
+        """The process-wide collection. Created on first use."""
+        return LocalCollection.get_shared(self.path / self.collection_name)
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: list[dict] = None,
+            ids: list[str] = None,
+            **kwargs,
+        ) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if not texts:
+            return []
+
+        vectors = self.embedding_function.embed_documents(texts)
+        self.collection.add(ids, texts, metadatas, vectors)
+        return ids
+
+    def delete(self, ids: list[str] = None, **kwargs) -> bool:
+        self.collection.delete(ids or [])
+        return True
+
+    @staticmethod
+    def _get_search_filters(filter: dict | MetadataFilter | None) -> dict:
+        """Get the filters of `LocalCollection.search` from the `filter` of the similarity searches."""
+
+        if isinstance(filter, MetadataFilter):
+            return {'metadata_filter': filter}
+        if filter:
+            if set(filter) != {'source_id'}:
+                raise ValueError(f'Only `source_id` filters are supported, got: {filter}')
+            source_ids = filter['source_id']
+            return {'source_ids': source_ids if isinstance(source_ids, list) else [source_ids]}
+        return {}
+
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            filter: dict | MetadataFilter = None,
+            nprobe: int = None,
+            oversample: int = None,
+            **kwargs,
+        ) -> list[tuple[Document, float]]:
+        """Find the `k` chunks that are the most similar to the embedding.
+
+        :param filter: `{'source_id': source_id}` or `{'source_id': [source_id, ...]}`, to search only these sources,
+            or the filters of the chunks (see `LocalVectorDB.get_filter_kwargs`).
+        :param nprobe: The number of centroids of the index to search, if the collection has one. Higher values
+            trade speed for recall. See `IVFIndex`.
+        :param oversample: The number of candidates per result, to re-rank by the full-precision vectors, if the
+            collection has quantized codes. See `LocalCollection.search`.
+        :return: The chunks, and their cosine distance from the embedding.
+        """
+
+        results = self.collection.search(
+            embedding,
+            k=k,
+            nprobe=nprobe,
+            oversample=oversample,
+            **self._get_search_filters(filter),
+        )
+        return [(document, 1 - similarity) for _, document, similarity in results]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs) -> list[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k, **kwargs)
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: list[str],
+            embedding: Embeddings,
+            metadatas: list[dict] = None,
+            collection_name: str = 'MyRAGApp',
+            **kwargs,
+        ) -> 'LocalVectorStore':
+        vector_store = cls(embedding_function=embedding, collection_name=collection_name, **kwargs)
+        vector_store.add_texts(texts, metadatas=metadatas)
+        return vector_store
+
+
+class LocalVectorDB(BaseVectorDatabase, LocalVectorStore):
+    """An embedded vector database, for single-node deployments. See `LocalCollection`.
+
+    Everything runs in the server process, without network hops nor extra containers.
+    The collections are stored in the `LOCAL_VECTOR_DB_PATH` directory.
+    """
+
+    @property
+    def compaction_scheduler(self) -> CompactionScheduler:
+        """The process-wide compaction scheduler of the collection."""
+        return CompactionScheduler.get_shared(self.cache_scope, env_prefix='LOCAL_VECTOR_DB_COMPACTION')
+
+    async def compact(self) -> None:
+        """Reclaim the deleted rows of the collection, without blocking the event loop."""
+
+        collection = self.collection
+        await self.run_in_executor(collection.compact)
+        Logger().get_logger().info(f'Compacted the local collection {self.collection_name}')
+
+    def record_deletes(self, deleted_count: int) -> None:
+        """Let the compaction scheduler know about deleted rows. See `CompactionScheduler.record_deletes`."""
+
+        self.on_collection_changed()
+        if deleted_count:
+            self.compaction_scheduler.record_deletes(
+                deleted_count,
+                rows_count=self.collection.count - self.collection.deleted_count,
+                compact=self.compact,
+            )
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        return self.collection.get_existing_ids(ids)
+
+    def iter_documents(self, batch_size: int = 1_000) -> Iterator[tuple[str, Document]]:
+        return self.collection.iter_chunks(batch_size=batch_size)
+
+    def get_filter_kwargs(self, metadata_filter: MetadataFilter) -> dict:
+        return {'filter': metadata_filter}
+
+    def similarity_search_with_vectors(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            filter: dict | MetadataFilter = None,
+            nprobe: int = None,
+            oversample: int = None,
+            **kwargs,
+        ) -> list[tuple[Document, list[float]]]:
+        """See `BaseVectorDatabase.similarity_search_with_vectors`. The vectors are normalized."""
+
+        results = self.collection.search(
+            embedding,
+            k=k,
+            nprobe=nprobe,
+            oversample=oversample,
+            with_vectors=True,
+            **self._get_search_filters(filter),
+        )
+        return [(document, vector) for _, document, _, vector in results]
+
+    async def delete_chunks(self, ids: list) -> None:
+        """Delete the chunks with the given IDs from the collection."""
+
+        self.record_deletes(await self.run_in_executor(self.collection.delete, ids))
+        await self.forget_chunks(ids)
+
+    async def delete_embeddings(self, source_id: str, except_ids: list = None) -> dict:
+        """Delete the embeddings of the source from the collection. See `BaseVectorDatabase.delete_embeddings`."""
+
+        delete_count = await self.run_in_executor(self.collection.delete_sources, [source_id], except_ids=except_ids)
+        self.record_deletes(delete_count)
+        await self.forget_sources([source_id], except_ids=except_ids)
+
+        return {
+            'delete_count': delete_count,
+            'error_count': 0,
+        }
+
+    async def delete_embeddings_many(self, source_ids: list[str], batch_size: int = None) -> dict:
+        """Delete the embeddings of many sources from the collection, in batches of sources.
+
+        See `BaseVectorDatabase.delete_embeddings_many`.
+        """
+
+        batch_size = batch_size or int(os.environ.get('EMBEDDINGS_DELETE_BATCH_SIZE', 1_000))
+
+        delete_count = batches = 0
+        for i in range(0, len(source_ids), batch_size):
+            batch = source_ids[i:i + batch_size]
+            batch_delete_count = await self.run_in_executor(self.collection.delete_sources, batch)
+            self.record_deletes(batch_delete_count)
+            await self.forget_sources(batch)
+
+            delete_count += batch_delete_count
+            batches += 1
+
+        return {
+            'delete_count': delete_count,
+            'error_count': 0,
+            'batches': batches,
+        }
+
+    async def drop_collection(self, collection_name: str, ignore_non_exist: bool = False) -> None:
+        """Drop the collection and delete its files."""
+
+        assert collection_name == self.collection_name, 'Can drop only the current collection.'
+
+        if ignore_non_exist and not (self.path / self.collection_name).exists():
+            return
+
+        await self.run_in_executor(self.collection.drop)
+        self.on_collection_changed()
+        self.compaction_scheduler.reset()
+        await self.forget_collection()
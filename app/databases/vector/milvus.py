@@ -1,12 +1,271 @@
+import json
 import os
+import threading
+import time
+import uuid
 
+from langchain.schema import Document
 from langchain_milvus.vectorstores import Milvus as LangMilvus
+from pymilvus import (
+    Collection,
+    CollectionSchema,
+    DataType,
+    FieldSchema,
+    Function,
+    FunctionType,
+    MilvusException,
+    utility,
+)
+from pymilvus.orm.mutation import MutationResult
+from typing import Callable, Iterable, Iterator
 
 from app.databases.vector.base import BaseVectorDatabase
+from app.databases.vector.compaction import CompactionScheduler
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.sparse import BaseSparseIndex
+from app.indexing.metadata import DocumentMetadata, get_promoted_keys
+from app.utils.logger import Logger
+
+
+def get_filter_expr(metadata_filter: MetadataFilter, json_field: str = None) -> str:
+    """Get the boolean expression of the filters (see `MetadataFilter`), for the searches of Milvus.
+
+    :param json_field: The JSON field of the metadata keys other than `source_id`, if they aren't fields of their
+        own. Keys of JSON fields are compared one value at a time, since not all servers support `in` with them.
+    """
+
+    conditions = []
+    for key, values in metadata_filter.get_values().items():
+        if json_field is None or key == 'source_id':
+            conditions.append(f'{key} in {json.dumps(values)}')
+        else:
+            conditions.append(
+                '(' + ' or '.join(f'{json_field}[{json.dumps(key)}] == {json.dumps(value)}' for value in values) + ')'
+            )
+
+    modified_at = 'modified_at' if json_field is None else f'{json_field}["modified_at"]'
+    modified_after, modified_before = metadata_filter.get_modified_range()
+    if modified_after is not None:
+        conditions.append(f'{modified_at} >= {modified_after}')
+    if modified_before is not None:
+        conditions.append(f'{modified_at} <= {modified_before}')
+
+    return ' and '.join(conditions)
+
+
+class MilvusBM25Index(BaseSparseIndex):
+    """A sparse index of the chunks of a Milvus collection, in a companion collection with native BM25 search.
+
+    Milvus computes the sparse vectors of the chunks from their text, with a BM25 function (Milvus 2.5+).
+    The companion collection is created and filled from the collection on first use, and then kept in sync
+    by all the processes. On older servers, `supported` is set to `False` (see `Milvus.get_sparse_index`).
+
+    The companion collection is filled under a temporary name, and renamed once it's complete, so a partially
+    filled collection (e.g. of a process that stopped while filling it) is never used.
+    """
+
+    # The maximal length of the text, in bytes.
+    MAX_TEXT_LENGTH = 65_535
+
+    # Until this process uses the companion collection, its writes check whether another process created it
+    # at most this often, in seconds, instead of on every write.
+    EXISTS_CHECK_INTERVAL = 60
+
+    # The shared, process-wide indexes, by the collection's scope. See `get_shared`.
+    _shared: dict[str, 'MilvusBM25Index'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, collection_name: str, alias: str):
+        """Initialize the index.
+
+        :param collection_name: The name of the indexed collection.
+        :param alias: The connection alias of the indexed collection.
+        """
+
+        self.collection_name = f'{collection_name}_bm25'
+        self.alias = alias
+        self.supported: bool = None
+        self.col: Collection = None
+        self._lock = threading.Lock()
+        self._checked_at = float('-inf')
+
+    @classmethod
+    def get_shared(cls, scope: str, collection_name: str, alias: str) -> 'MilvusBM25Index':
+        """Get the process-wide index of the collection identified by `scope`."""
+
+        with cls._shared_lock:
+            if scope not in cls._shared:
+                cls._shared[scope] = cls(collection_name, alias)
+
+            return cls._shared[scope]
+
+    def get_collection(self) -> Collection | None:
+        """Get the companion collection, or `None` if it wasn't created yet (e.g. by another process)."""
+
+        if self.col is None and utility.has_collection(self.collection_name, using=self.alias):
+            self.col = Collection(self.collection_name, using=self.alias)
+            self.col.load()
+        self._checked_at = time.monotonic()
+
+        return self.col
+
+    def _get_synced_collection(self) -> Collection | None:
+        """Get the companion collection for the writes, checking whether it exists at most every
+        `EXISTS_CHECK_INTERVAL` seconds until it's found.
+        """
+
+        if self.col is None and time.monotonic() - self._checked_at < self.EXISTS_CHECK_INTERVAL:
+            return None
+        return self.get_collection()
+
+    def create_collection(self, collection_name: str = None) -> Collection:
+        """Create the companion collection, with the BM25 function of the sparse vectors.
+
+        :param collection_name: The name of the created collection. Defaults to the name of the companion collection.
+        """
+
+        schema = CollectionSchema(
+            fields=[
+                FieldSchema('pk', DataType.VARCHAR, max_length=64, is_primary=True),
+                FieldSchema('source_id', DataType.VARCHAR, max_length=self.MAX_TEXT_LENGTH),
+                FieldSchema('text', DataType.VARCHAR, max_length=self.MAX_TEXT_LENGTH, enable_analyzer=True),
+                FieldSchema('metadata', DataType.JSON),
+                FieldSchema('sparse', DataType.SPARSE_FLOAT_VECTOR),
+            ],
+            functions=[
+                Function('bm25', FunctionType.BM25, input_field_names=['text'], output_field_names=['sparse']),
+            ],
+        )
+
+        col = Collection(
+            collection_name or self.collection_name,
+            schema=schema,
+            using=self.alias,
+            consistency_level='Strong',
+        )
+        col.create_index('sparse', {'index_type': 'SPARSE_INVERTED_INDEX', 'metric_type': 'BM25'})
+        col.load()
+        return col
+
+    def load(self, iter_documents: Callable[[], Iterable[tuple[str, Document]]]) -> None:
+        with self._lock:
+            if self.get_collection() is not None:
+                return
+
+            loading_name = f'{self.collection_name}_loading_{uuid.uuid4().hex[:8]}'
+            try:
+                col = self.create_collection(loading_name)
+            except MilvusException as e:
+                self.supported = False
+                Logger().get_logger().warning(f'Milvus has no native BM25 search, using an in-memory index: {e}')
+                raise
+
+            self.supported = True
+            try:
+                batch_ids, batch = [], []
+                for chunk_id, document in iter_documents():
+                    batch_ids.append(chunk_id)
+                    batch.append(document)
+                    if len(batch) == 1_000:
+                        self._upsert(col, batch_ids, batch)
+                        batch_ids, batch = [], []
+                if batch:
+                    self._upsert(col, batch_ids, batch)
+
+                utility.rename_collection(loading_name, self.collection_name, using=self.alias)
+            except Exception:
+                col.drop()
+                # Another process may have completed the companion collection first.
+                if self.get_collection() is None:
+                    raise
+                return
+
+            self.get_collection()
+
+    def _upsert(self, col: Collection, ids: list, documents: list[Document]) -> None:
+        col.upsert([
+            {
+                'pk': str(chunk_id),
+                'source_id': str(document.metadata.get('source_id')),
+                'text': document.page_content.encode('utf-8')[:self.MAX_TEXT_LENGTH].decode('utf-8', 'ignore'),
+                'metadata': document.metadata | {'pk': chunk_id},
+            }
+            for chunk_id, document in zip(ids, documents)
+        ])
+
+    def add(self, ids: list, documents: list[Document]) -> None:
+        if ids and (col := self._get_synced_collection()) is not None:
+            self._upsert(col, ids, documents)
+
+    def delete_chunks(self, ids: list) -> None:
+        if ids and (col := self._get_synced_collection()) is not None:
+            col.delete(f'pk in {json.dumps([str(chunk_id) for chunk_id in ids])}')
+
+    def delete_sources(self, source_ids: list[str], except_ids: list = None) -> None:
+        if (col := self._get_synced_collection()) is not None:
+            expr = f'source_id in {json.dumps([str(source_id) for source_id in source_ids])}'
+            if except_ids:
+                expr += f' and pk not in {json.dumps([str(chunk_id) for chunk_id in except_ids])}'
+            col.delete(expr)
+
+    def clear(self) -> None:
+        with self._lock:
+            if (col := self.get_collection()) is not None:
+                col.drop()
+                self.col = None
+
+    def search_with_ids(
+            self,
+            query: str,
+            k: int = 4,
+            metadata_filter: MetadataFilter = None,
+        ) -> list[tuple[str, Document]]:
+        expr = None
+        if metadata_filter is not None:
+            # The companion collection has the `source_id` field, and the other keys in its JSON `metadata` field.
+            expr = get_filter_expr(metadata_filter, json_field='metadata') or None
+
+        res = self.col.search(
+            data=[query],
+            anns_field='sparse',
+            param={'metric_type': 'BM25'},
+            limit=k,
+            expr=expr,
+            output_fields=['text', 'metadata'],
+        )
+        return [
+            (str(hit.id), Document(page_content=hit.entity.get('text'), metadata=hit.entity.get('metadata')))
+            for hit in res[0]
+        ]
 
 
 class Milvus(BaseVectorDatabase, LangMilvus):
-    """A wrapper for a Milvus database for the project."""
+    """A wrapper for a Milvus database for the project.
+
+    The tenants share the collection, which is partitioned by their `tenant_id` field (a partition key),
+    so the searches of a tenant only scan its partition. See `get_tenant_expr`.
+    """
+
+    # The partition key of the collections. The default tenant is stored as an empty string.
+    TENANT_FIELD = 'tenant_id'
+
+    # The supported index types, and the default params of their searches. See `get_index_params`.
+    INDEX_SEARCH_PARAMS = {
+        'FLAT': {},
+        'HNSW': {'ef': 64},
+        'IVF_FLAT': {'nprobe': 16},
+        'IVF_SQ8': {'nprobe': 16},
+        'IVF_PQ': {'nprobe': 16},
+        'DISKANN': {'search_list': 100},
+        'AUTOINDEX': {},
+    }
+
+    # The data types of the scalar fields that searches are filtered by, which are indexed. See `_create_index`.
+    SCALAR_INDEX_DTYPES = (DataType.VARCHAR, DataType.INT64)
+
+    # The (monotonic) time of the last write of this process to each collection, by the collection's scope.
+    # See `get_read_consistency_level`.
+    _last_write_times: dict[str, float] = {}
 
     @staticmethod
     def get_local_connection_args() -> dict:
@@ -24,25 +283,346 @@ class Milvus(BaseVectorDatabase, LangMilvus):
     def __init__(self, **kwargs):
         """Initialize the Milvus database for the project."""
 
+        index_params = self.get_index_params()
         default_kwargs = {
             'connection_args': self.get_local_connection_args(),
-            'consistency_level': 'Strong',
+            'consistency_level': os.environ.get('MILVUS_CONSISTENCY_LEVEL', 'Strong'),
             'auto_id': True,
+            'partition_key_field': self.TENANT_FIELD,
+            'index_params': index_params,
+            'search_params': self.get_search_params(index_params) if index_params else None,
         }
         super().__init__(**(default_kwargs | kwargs))
+        self.read_consistency_level = os.environ.get('MILVUS_READ_CONSISTENCY_LEVEL', self.consistency_level)
+
+        # The index of an existing collection isn't changed, so search it with the params of its own index type.
+        index = self._get_index()
+        if index is not None and self.index_params is not None:
+            index_type = index['index_param'].get('index_type')
+            if index_type != self.index_params['index_type']:
+                Logger().get_logger().warning(
+                    f'The collection {self.collection_name} has a {index_type} index, not a '
+                    f'{self.index_params["index_type"]} index. Drop and reload the collection to change its index.'
+                )
+                self.index_params = index['index_param']
+                self.search_params = self.get_search_params(index['index_param'])
+
+    @classmethod
+    def get_index_params(cls) -> dict | None:
+        """Get the vector index of new collections, from the `MILVUS_INDEX_*` environment variables.
+
+        :return: The index params, or `None` for the default index of `langchain-milvus` (HNSW, with the L2 metric).
+        """
+
+        index_type = os.environ.get('MILVUS_INDEX_TYPE', '').upper()
+        if not index_type:
+            return None
+        if index_type not in cls.INDEX_SEARCH_PARAMS:
+            raise ValueError(f'Unknown Milvus index type: {index_type}. Supported: {", ".join(cls.INDEX_SEARCH_PARAMS)}')
+
+        return {
+            'index_type': index_type,
+            'metric_type': os.environ.get('MILVUS_METRIC_TYPE', 'L2'),
+            'params': json.loads(os.environ.get('MILVUS_INDEX_PARAMS', '{}')),
+        }
+
+    @classmethod
+    def get_search_params(cls, index_params: dict) -> dict:
+        """Get the default search params of an index, overridden by the `MILVUS_SEARCH_PARAMS` environment variable.
+
+        :param index_params: The params of the index, see `get_index_params`.
+        """
+
+        params = cls.INDEX_SEARCH_PARAMS.get(index_params.get('index_type'), {})
+        return {
+            'metric_type': index_params.get('metric_type', 'L2'),
+            'params': params | json.loads(os.environ.get('MILVUS_SEARCH_PARAMS', '{}')),
+        }
+
+    def record_write(self) -> None:
+        """Record that this process wrote to the collection. See `get_read_consistency_level`."""
+        self._last_write_times[self.cache_scope] = time.monotonic()
+
+    def get_read_consistency_level(self) -> str:
+        """Get the consistency level of the searches, from the `MILVUS_READ_CONSISTENCY_LEVEL` environment variable.
+
+        `Bounded` searches don't wait for the latest writes, so they may miss the writes of the last few seconds.
+        For a process to read its own writes, its searches use the `Session` level, which waits for the writes
+        of this process only, for `MILVUS_BOUNDED_STALENESS` seconds after its last write to the collection.
+        Other processes see the writes once the staleness window of Milvus passed.
+        """
+
+        if self.read_consistency_level == 'Bounded':
+            last_write_time = self._last_write_times.get(self.cache_scope)
+            staleness = float(os.environ.get('MILVUS_BOUNDED_STALENESS', 5))
+            if last_write_time is not None and time.monotonic() - last_write_time < staleness:
+                return 'Session'
+
+        return self.read_consistency_level
+
+    def get_tenant_collection_name(self, collection_name: str) -> str:
+        """The tenants share the collection. See `get_tenant_expr`."""
+        return collection_name
+
+    def get_tenant_expr(self) -> str:
+        """Get the filter of the tenant's entities, for the searches and deletes of the collection.
+
+        Milvus routes the filter by the partition key to the tenant's partition, instead of scanning the
+        collection. Collections created by older versions have no partition key, and serve only the default tenant.
+        """
+
+        if self.TENANT_FIELD in self.fields:
+            return f'{self.TENANT_FIELD} == {json.dumps(self.tenant_id or "")}'
+        if self.tenant_id is not None and self.col is not None:
+            raise ValueError(
+                f'The collection {self.collection_name} has no tenants. Drop and reload the collection to use tenants.'
+            )
+        return ''
 
-    async def delete_embeddings(self, source_id: str, should_compact: bool = False) -> dict:
+    def _with_tenant_expr(self, expr: str = None) -> str:
+        """Restrict the filter to the tenant's entities. See `get_tenant_expr`."""
+
+        tenant_expr = self.get_tenant_expr()
+        if not expr:
+            return tenant_expr
+        return f'({expr}) and {tenant_expr}' if tenant_expr else expr
+
+    def add_texts(self, texts: Iterable[str], metadatas: list[dict] = None, **kwargs) -> list[str]:
+        texts = list(texts)
+        if self.col is None or self.get_tenant_expr():
+            # New collections get the partition key from the metadata of the first entities.
+            metadatas = [
+                (metadata or {}) | {self.TENANT_FIELD: self.tenant_id or ''}
+                for metadata in (metadatas or [{} for _ in texts])
+            ]
+
+        if metadatas and self._is_legacy_modified_at():
+            # Collections created by older versions store `modified_at` as an ISO 8601 string.
+            metadatas = [DocumentMetadata.format_dict(metadata) for metadata in metadatas]
+
+        ids = super().add_texts(texts, metadatas, **kwargs)
+        self.record_write()
+        return ids
+
+    def _parse_document(self, data: dict) -> Document:
+        """Parse a search result or a row of the collection. The partition key isn't part of the chunk's metadata."""
+
+        data.pop(self.TENANT_FIELD, None)
+        return super()._parse_document(data)
+
+    def _is_legacy_modified_at(self) -> bool:
+        """Whether the collection stores `modified_at` as a string, rather than in seconds since the epoch."""
+
+        if self.col is None:
+            return False
+        return any(
+            field.name == 'modified_at' and field.dtype == DataType.VARCHAR
+            for field in self.col.schema.fields
+        )
+
+    def _create_index(self) -> None:
+        """Create the vector index of the collection (see `get_index_params`), and the indexes of its scalar fields.
+
+        The filtered fields (see `get_filter_kwargs`) are indexed, if the collection has them and they aren't
+        indexed yet. Servers that can't index them (e.g. while the collection is loaded) are only warned about,
+        since the filters work without the indexes.
+        """
+
+        super()._create_index()
+        if self.col is None:
+            return
+
+        indexed_fields = {index.field_name for index in self.col.indexes}
+        for field in self.col.schema.fields:
+            if (
+                field.name not in ('source_id', 'source_name', 'modified_at', *get_promoted_keys())
+                or field.name in indexed_fields
+                or field.dtype not in self.SCALAR_INDEX_DTYPES
+            ):
+                continue
+
+            try:
+                self.col.create_index(
+                    field.name,
+                    index_params={'index_type': 'INVERTED'},
+                    index_name=f'{field.name}_index',
+                )
+            except MilvusException as e:
+                Logger().get_logger().warning(f'Failed to index {field.name} of {self.collection_name}: {e}')
+
+    def get_filter_kwargs(self, metadata_filter: MetadataFilter) -> dict:
+        expr = get_filter_expr(metadata_filter)
+        return {'expr': expr} if expr else {}
+
+    def _collection_search(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            param: dict = None,
+            output_fields: list[str] = None,
+            **kwargs,
+        ):
+        """Search the collection, with the default search params and consistency level.
+
+        :param param: The search params. Params without `params` are only the params of the index, e.g.
+            `{'ef': 128}`, and override the default search params (see `get_search_params`).
+        :param output_fields: The fields of the results. Defaults to all the fields, except for the vector.
+        :param kwargs: See `LangMilvus._collection_search`. `consistency_level` defaults to
+            `get_read_consistency_level()`. Only the tenant's entities are searched (see `get_tenant_expr`).
+        """
+
+        if param is not None and 'params' not in param:
+            search_params = self.search_params or {}
+            param = search_params | {'params': search_params.get('params', {}) | param}
+
+        kwargs.setdefault('consistency_level', self.get_read_consistency_level())
+        kwargs['expr'] = self._with_tenant_expr(kwargs.get('expr')) or None
+        if output_fields is None:
+            return super()._collection_search(embedding, k=k, param=param, **kwargs)
+
+        # `LangMilvus._collection_search` has fixed output fields.
+        if self.col is None:
+            return None
+        timeout = self.timeout or kwargs.pop('timeout', None)
+        return self.col.search(
+            data=[embedding],
+            anns_field=self._vector_field,
+            param=param or self.search_params,
+            limit=k,
+            output_fields=output_fields,
+            timeout=timeout,
+            **kwargs,
+        )
+
+    def similarity_search_with_vectors(
+            self,
+            embedding: list[float],
+            k: int = 4,
+            **kwargs,
+        ) -> list[tuple[Document, list[float]]]:
+        """See `BaseVectorDatabase.similarity_search_with_vectors`. The vectors are output fields of the search."""
+
+        output_fields = self.fields[:]
+        res = self._collection_search(embedding, k=k, output_fields=output_fields, **kwargs)
+        if res is None:
+            return []
+
+        results = []
+        for hit in res[0]:
+            data = {field: hit.entity.get(field) for field in output_fields}
+            vector = data.pop(self._vector_field)
+            results.append((self._parse_document(data), vector))
+        return results
+
+    @property
+    def compaction_scheduler(self) -> CompactionScheduler:
+        """The process-wide compaction scheduler of the collection, shared by its tenants."""
+        return CompactionScheduler.get_shared(self.collection_scope)
+
+    async def compact(self) -> None:
+        """Compact the collection and wait for the compaction to complete, without blocking the event loop."""
+
+        col = self.col
+
+        def compact():
+            col.compact()
+            col.wait_for_compaction_completed()
+
+        await self.run_in_executor(compact)
+
+    async def _delete(self, expr: str, should_compact: bool = False) -> MutationResult:
+        """Delete the tenant's entities that match `expr`, and let the compaction scheduler know about it."""
+
+        expr = self._with_tenant_expr(expr)
+
+        def delete() -> tuple[MutationResult, int]:
+            res = self.delete(expr=expr)
+            self.record_write()
+            return res, self.col.num_entities
+
+        res, rows_count = await self.run_in_executor(delete)
+        self.on_collection_changed()
+        self.compaction_scheduler.record_deletes(
+            int(res.delete_count),
+            rows_count=rows_count,
+            compact=self.compact,
+            force=should_compact,
+        )
+
+        return res
+
+    def _get_bm25_index(self) -> MilvusBM25Index:
+        """Get the native BM25 index of the tenant's entities. Each tenant has a companion collection of its own."""
+
+        collection_name = self.collection_name if self.tenant_id is None else f'{self.collection_name}_{self.tenant_id}'
+        return MilvusBM25Index.get_shared(self.cache_scope, collection_name, self.alias)
+
+    def get_sparse_index(self) -> BaseSparseIndex:
+        """Get the native BM25 index of the collection, or the in-memory index if Milvus doesn't support it."""
+
+        sparse_index = self._get_bm25_index()
+        return sparse_index if sparse_index.supported is not False else super().get_sparse_index()
+
+    def load_sparse_index(self) -> BaseSparseIndex:
+        """See `BaseVectorDatabase.load_sparse_index`. Falls back to the in-memory index on older Milvus servers."""
+
+        try:
+            return super().load_sparse_index()
+        except MilvusException:
+            if self._get_bm25_index().supported is not False:
+                raise
+            return super().load_sparse_index()
+
+    def iter_documents(self, batch_size: int = 1_000) -> Iterator[tuple[int, Document]]:
+        """Iterate over the `(id, chunk)` pairs of the tenant, fetching `batch_size` chunks at a time."""
+
+        if self.col is None:
+            return
+
+        iterator = self.col.query_iterator(
+            batch_size=batch_size,
+            expr=self.get_tenant_expr(),
+            output_fields=[field for field in self.fields if field != self._vector_field],
+        )
+        try:
+            while rows := iterator.next():
+                for row in rows:
+                    yield row[self._primary_field], self._parse_document(dict(row))
+        finally:
+            iterator.close()
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        """See `BaseVectorDatabase.get_existing_ids`. The IDs are looked up with the read consistency level."""
+
+        if self.col is None:
+            return set()
+
+        if self.col.schema.primary_field.dtype == DataType.INT64:
+            ids = [int(chunk_id) for chunk_id in ids]
+        rows = self.col.query(
+            expr=f'{self._primary_field} in {json.dumps(ids)}',
+            output_fields=[self._primary_field],
+            consistency_level=self.get_read_consistency_level(),
+        )
+        return {str(row[self._primary_field]) for row in rows}
+
+    async def delete_embeddings(self, source_id: str, should_compact: bool = False, except_ids: list = None) -> dict:
         """Delete the embeddings for the given text from the Milvus database.
         
         :param source_id: The ID of the text to delete.
         :param should_compact: Whether to compact the database after deletion. If not compacted, data
             may still be present in the database, until Milvus decides to compact it.
-            That said, compacting on every deletion may result in slower performance.
+            The compaction is deferred by the compaction scheduler (see `CompactionScheduler`), until
+            the deletes quiet down.
+        :param except_ids: The IDs of chunks of the source to keep. See `BaseVectorDatabase.delete_embeddings`.
         """
         
-        res = self.delete(expr=f'source_id == "{source_id}"')
-        if should_compact:
-            self.col.compact()
+        expr = f'source_id == {json.dumps(source_id)}'
+        if except_ids:
+            expr += f' and {self._primary_field} not in {json.dumps(except_ids)}'
+
+        res = await self._delete(expr, should_compact=should_compact)
+        await self.forget_sources([source_id], except_ids=except_ids)
 
         return {
             'insert_count': int(res.insert_count),
@@ -53,13 +633,91 @@ class Milvus(BaseVectorDatabase, LangMilvus):
             'error_count': int(res.err_count),
             'error_index': str(res.err_index),
         }
-    
+
+    async def delete_embeddings_many(self, source_ids: list[str], batch_size: int = None) -> dict:
+        """Delete the embeddings of many sources from the Milvus database, with one delete per batch of sources.
+
+        See `BaseVectorDatabase.delete_embeddings_many`.
+        """
+
+        batch_size = batch_size or int(os.environ.get('EMBEDDINGS_DELETE_BATCH_SIZE', 1_000))
+
+        delete_count = error_count = batches = 0
+        for i in range(0, len(source_ids), batch_size):
+            batch = source_ids[i:i + batch_size]
+            res = await self._delete(f'source_id in {json.dumps(batch)}')
+            await self.forget_sources(batch)
+
+            delete_count += int(res.delete_count)
+            error_count += int(res.err_count)
+            batches += 1
+
+        return {
+            'delete_count': delete_count,
+            'error_count': error_count,
+            'batches': batches,
+        }
+
+    async def delete_chunks(self, ids: list) -> None:
+        """Delete the chunks with the given IDs from the Milvus database."""
+        await self._delete(f'{self._primary_field} in {json.dumps(ids)}')
+        await self.forget_chunks(ids)
+
+    async def get_tenant_ids(self) -> list[str]:
+        """Get the tenants of the collection, i.e. with entities in the collection or sources in the source manifest.
+
+        The default tenant isn't included.
+        """
+
+        def get_entity_tenant_ids() -> set[str]:
+            if self.col is None or self.TENANT_FIELD not in self.fields:
+                return set()
+
+            tenant_ids = set()
+            iterator = self.col.query_iterator(
+                batch_size=10_000,
+                expr=f'{self.TENANT_FIELD} != ""',
+                output_fields=[self.TENANT_FIELD],
+            )
+            try:
+                while rows := iterator.next():
+                    tenant_ids.update(row[self.TENANT_FIELD] for row in rows)
+            finally:
+                iterator.close()
+            return tenant_ids
+
+        tenant_ids = await self.run_in_executor(get_entity_tenant_ids)
+        scope_prefix = f'{self.collection_scope}/'
+        tenant_ids.update(
+            scope.removeprefix(scope_prefix) for scope in await self.get_source_manifest().get_scopes(scope_prefix)
+        )
+        return sorted(tenant_ids)
+
     async def drop_collection(self, collection_name: str, ignore_non_exist: bool = False) -> None:
-        """Drop the collection from the Milvus database."""
+        """Drop the collection from the Milvus database.
+
+        The tenants share the collection, so the vector databases of tenants (see `with_tenant`) delete only
+        the entities of their tenant, and the vector database of the default tenant drops all the tenants,
+        along with their caches, source manifests, chunk deduplication indexes and BM25 collections.
+        """
 
         assert collection_name == self.collection_name, 'Can drop only the current collection.'
 
         if ignore_non_exist and self.col is None:
             return
 
-        self.col.drop()
+        if self.tenant_id is not None:
+            await self._delete(self.get_tenant_expr())
+            await self.forget_collection()
+            return
+
+        tenant_ids = await self.get_tenant_ids()
+        await self.run_in_executor(self.col.drop)
+        self.on_collection_changed()
+        self.compaction_scheduler.reset()
+        await self.forget_collection()
+
+        for tenant_id in tenant_ids:
+            tenant_db = self.with_tenant(tenant_id)
+            tenant_db.on_collection_changed()
+            await tenant_db.forget_collection()
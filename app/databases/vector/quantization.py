@@ -0,0 +1,111 @@
+import abc
+import numpy as np
+
+
+class BaseQuantizer(abc.ABC):
+    """Compresses normalized vectors into codes, whose (approximate) similarities to queries are cheaper to compute.
+
+    The codes are used to find the candidates of a search, which are then re-ranked by their full-precision
+    vectors (see `LocalCollection.search`). Each row's codes are stored in one or more files, by their suffix.
+    """
+
+    # The name of the quantizer, in the `LOCAL_VECTOR_DB_QUANTIZATION` environment variable.
+    name: str
+
+    # The default number of candidates per result, to re-rank by the full-precision vectors.
+    default_oversample: int
+
+    # The number of rows to score at once. Small batches keep the intermediate arrays in the CPU caches.
+    batch_size = 1_024
+
+    @abc.abstractmethod
+    def get_files(self, dim: int) -> dict[str, tuple[np.dtype, tuple]]:
+        """Get the `(dtype, row shape)` of the files of the codes, by their suffix."""
+        pass
+
+    @abc.abstractmethod
+    def encode(self, vectors: np.ndarray) -> dict[str, np.ndarray]:
+        """Get the codes of the (normalized) vectors, by the suffix of their file."""
+        pass
+
+    @abc.abstractmethod
+    def score(self, codes: dict[str, np.ndarray], query: np.ndarray) -> np.ndarray:
+        """Get the approximate similarities of the rows to the (normalized) query, from their codes."""
+        pass
+
+    def get_bytes_per_row(self, dim: int) -> int:
+        """Get the size of the codes of a row, in bytes."""
+        return sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for dtype, shape in self.get_files(dim).values())
+
+
+class Int8Quantizer(BaseQuantizer):
+    """Scalar quantization, to an `int8` per dimension and a `float32` scale per row (~4x smaller)."""
+
+    name = 'int8'
+    default_oversample = 4
+
+    def get_files(self, dim: int) -> dict[str, tuple[np.dtype, tuple]]:
+        return {
+            'codes.i8': (np.int8, (dim,)),
+            'scales.f32': (np.float32, ()),
+        }
+
+    def encode(self, vectors: np.ndarray) -> dict[str, np.ndarray]:
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        return {
+            'codes.i8': np.round(vectors / scales[:, None]).astype(np.int8),
+            'scales.f32': scales.astype(np.float32),
+        }
+
+    def score(self, codes: dict[str, np.ndarray], query: np.ndarray) -> np.ndarray:
+        int8_codes, scales = codes['codes.i8'], codes['scales.f32']
+        scores = np.empty(len(int8_codes), dtype=np.float32)
+        for i in range(0, len(int8_codes), self.batch_size):
+            scores[i:i + self.batch_size] = int8_codes[i:i + self.batch_size].astype(np.float32) @ query
+        return scores * scales
+
+
+class BinaryQuantizer(BaseQuantizer):
+    """Binary quantization, to the sign bit of each dimension (32x smaller), compared by Hamming distance."""
+
+    name = 'binary'
+    default_oversample = 20
+
+    # The number of set bits of each 16-bit value.
+    POPCOUNT = np.unpackbits(np.arange(2 ** 16, dtype=np.uint16).view(np.uint8)).reshape(-1, 16).sum(axis=1) \
+        .astype(np.uint8)
+
+    def get_files(self, dim: int) -> dict[str, tuple[np.dtype, tuple]]:
+        # Padded to 16-bit words, which are counted at once (see `POPCOUNT`).
+        return {'bits.u8': (np.uint8, ((dim + 15) // 16 * 2,))}
+
+    def encode(self, vectors: np.ndarray) -> dict[str, np.ndarray]:
+        bits = np.packbits(vectors > 0, axis=1)
+        if bits.shape[1] % 2:
+            bits = np.pad(bits, ((0, 0), (0, 1)))
+        return {'bits.u8': bits}
+
+    def score(self, codes: dict[str, np.ndarray], query: np.ndarray) -> np.ndarray:
+        words = np.ascontiguousarray(codes['bits.u8']).view(np.uint16)
+        query_words = self.encode(query[None, :])['bits.u8'].view(np.uint16)[0]
+        scores = np.empty(len(words), dtype=np.float32)
+        for i in range(0, len(words), self.batch_size):
+            distances = self.POPCOUNT[words[i:i + self.batch_size] ^ query_words].sum(axis=1, dtype=np.int32)
+            scores[i:i + self.batch_size] = -distances
+        return scores
+
+
+QUANTIZERS: dict[str, type[BaseQuantizer]] = {
+    quantizer.name: quantizer
+    for quantizer in [Int8Quantizer, BinaryQuantizer]
+}
+
+
+def get_quantizer(name: str | None) -> BaseQuantizer | None:
+    """Get the quantizer by its name, or `None` to store full-precision vectors only."""
+
+    if not name:
+        return None
+    if name not in QUANTIZERS:
+        raise ValueError(f'Unknown quantization: {name}. Supported: {", ".join(QUANTIZERS)}')
+    return QUANTIZERS[name]()
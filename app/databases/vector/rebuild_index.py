@@ -0,0 +1,102 @@
+"""Build (or rebuild) the IVF index of a collection of the local vector database.
+
+Reports the build time, and the recall@k and the latency of the index against the exhaustive search,
+on queries sampled from the collection. Must run while the server is stopped, since a collection must
+be used by a single process at a time (see `LocalCollection`).
+
+Usage:
+```bash
+python -m app.databases.vector.rebuild_index --collection MyRAGApp
+python -m app.databases.vector.rebuild_index --collection MyRAGApp --nlist 4096 --nprobe 8 16 32
+python -m app.databases.vector.rebuild_index --collection MyRAGApp --drop  # Back to exhaustive searches.
+```
+"""
+
+import argparse
+import numpy as np
+import os
+import time
+
+from pathlib import Path
+
+from app.databases.vector.local import LocalCollection
+
+
+def evaluate_index(
+        collection: LocalCollection,
+        queries: np.ndarray,
+        k: int = 8,
+        **search_kwargs,
+    ) -> dict:
+    """Compare the searches of the collection (see `LocalCollection.search`) with exhaustive searches, on the queries.
+
+    :param search_kwargs: The arguments of the searches, e.g. `nprobe` and `oversample`.
+    :return: The mean recall@k, and the mean latencies of both searches, in milliseconds.
+    """
+
+    recalls, exact_latencies, index_latencies = [], [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        expected = {chunk_id for chunk_id, _, _ in collection.search(query, k=k, exact=True)}
+        exact_latencies.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        found = {chunk_id for chunk_id, _, _ in collection.search(query, k=k, **search_kwargs)}
+        index_latencies.append(time.perf_counter() - start_time)
+
+        recalls.append(len(found & expected) / max(len(expected), 1))
+
+    return {
+        'recall': float(np.mean(recalls)),
+        'exact_ms': float(np.mean(exact_latencies)) * 1_000,
+        'index_ms': float(np.mean(index_latencies)) * 1_000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--collection',
+        default=os.environ.get('DEFAULT_VECTOR_DB_COLLECTION_NAME', 'MyRAGApp'),
+        help='The name of the collection.',
+    )
+    parser.add_argument(
+        '--path',
+        type=Path,
+        default=Path(os.environ.get('LOCAL_VECTOR_DB_PATH', 'data/vector-db')),
+        help='The directory of the collections.',
+    )
+    parser.add_argument('--nlist', type=int, help='The number of centroids. Defaults to `4 * sqrt(rows)`.')
+    parser.add_argument('--iterations', type=int, default=10, help='The number of k-means iterations.')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[None], help='The `nprobe` values to evaluate.')
+    parser.add_argument('--queries', type=int, default=100, help='The number of queries to evaluate.')
+    parser.add_argument('--drop', action='store_true', help='Delete the index instead.')
+    args = parser.parse_args()
+
+    collection = LocalCollection(args.path / args.collection)
+    if args.drop:
+        collection.drop_index()
+        print(f'Deleted the index of {args.collection}')
+        return
+
+    start_time = time.perf_counter()
+    collection.build_index(nlist=args.nlist, iterations=args.iterations)
+    print(f'Built the index of {args.collection} in {time.perf_counter() - start_time:.1f}s: {collection.get_stats()}')
+
+    positions = np.flatnonzero(collection._alive)
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(positions, min(args.queries, len(positions)), replace=False))
+    queries = np.asarray(collection._vectors[sample])
+    queries += rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    print(f'{"nprobe":>8}{"recall@8":>10}{"exact ms":>10}{"index ms":>10}')
+    for nprobe in args.nprobe:
+        results = evaluate_index(collection, queries, nprobe=nprobe)
+        print(
+            f'{nprobe or collection._index.nprobe:>8}{results["recall"]:>10.3f}'
+            f'{results["exact_ms"]:>10.2f}{results["index_ms"]:>10.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+import asyncio
+import copy
+import json
+import numpy as np
+import os
+import threading
+import time
+
+from datetime import timedelta
+from langchain.schema import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.vectorstores import VectorStoreRetriever
+from typing import ClassVar, Collection
+
+from app.databases.vector.diversity import maximal_marginal_relevance
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.sparse import reciprocal_rank_fusion, reciprocal_rank_fusion_scores
+from app.utils.cache import LRUCache
+from app.utils.tenants import get_current_tenant
+from app.utils.timing import timed
+
+
+def normalize_query(query: str) -> str:
+    """Normalize the whitespace of the query text, so near-identical queries share cache entries.
+
+    The case is kept, since the embedding models are case-sensitive.
+    """
+    return ' '.join(query.split())
+
+
+class TimedLRUCache(LRUCache):
+    """An `LRUCache` that also tracks how long it takes to compute the missing values.
+
+    This is used to estimate the latency saved by the cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.miss_seconds = 0.0
+        self.computed = 0
+
+    def record_miss_time(self, seconds: float) -> None:
+        """Record the time it took to compute a missing value."""
+        self.miss_seconds += seconds
+        self.computed += 1
+
+    def get_stats(self) -> dict:
+        avg_miss_ms = 1_000 * self.miss_seconds / self.computed if self.computed else 0.0
+        return super().get_stats() | {
+            'avg_miss_ms': avg_miss_ms,
+            'saved_ms': self.hits * avg_miss_ms,
+        }
+
+
+class CollectionGenerations:
+    """Per-process counters of the changes to each collection.
+
+    Caches include the generation of a collection in their keys, so bumping it invalidates
+    the entries of the collection, without having to scan the caches. Changes made by other
+    processes aren't tracked, so caches should also expire their entries after a TTL.
+    """
+
+    _generations: dict[str, int] = {}
+
+    @classmethod
+    def get(cls, scope: str) -> int:
+        """Get the generation of the collection identified by `scope`."""
+        return cls._generations.get(scope, 0)
+
+    @classmethod
+    def bump(cls, scope: str) -> None:
+        """Mark that the collection identified by `scope` has changed."""
+        cls._generations[scope] = cls.get(scope) + 1
+
+
+class RetrieverCache:
+    """A per-process cache for the retrievers, with two tiers:
+
+    - Query embeddings, keyed by the embeddings model and the query text, with collapsed whitespace.
+    - Search results, keyed by the normalized query, the search parameters and the collection.
+
+    The search results key includes the generation of the collection (see `CollectionGenerations`),
+    so changes to a collection invalidate its results. Changes made by other processes are
+    picked up only after the TTL.
+    """
+
+    # The shared, process-wide cache. See `get_shared`.
+    _shared: 'RetrieverCache' = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_size: int = 1_024, ttl: timedelta = timedelta(minutes=5)):
+        self.query_embeddings = TimedLRUCache(max_size=max_size, ttl=ttl)
+        self.search_results = TimedLRUCache(max_size=max_size, ttl=ttl)
+
+    @classmethod
+    def get_shared(cls) -> 'RetrieverCache | None':
+        """Get the process-wide cache, configured by environment variables.
+
+        Returns `None` if the cache is disabled, i.e. `RETRIEVER_CACHE_SIZE` is 0.
+        """
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                max_size = int(os.environ.get('RETRIEVER_CACHE_SIZE', 1_024))
+                if max_size <= 0:
+                    return None
+
+                cls._shared = cls(
+                    max_size=max_size,
+                    ttl=timedelta(seconds=int(os.environ.get('RETRIEVER_CACHE_TTL', 5 * 60))),
+                )
+
+        return cls._shared
+
+    def get_stats(self) -> dict:
+        """Get statistics about the cache usage, including the estimated saved latency."""
+        return {
+            'query_embeddings': self.query_embeddings.get_stats(),
+            'search_results': self.search_results.get_stats(),
+        }
+
+
+class VectorDBRetriever(VectorStoreRetriever):
+    """A vector store retriever with a per-process cache (see `RetrieverCache`), and a `hybrid` search type.
+
+    The `hybrid` search runs the dense (similarity) search and the sparse (BM25) search of the vector
+    database concurrently, and merges them with reciprocal-rank fusion (see `reciprocal_rank_fusion`),
+    so queries with exact identifiers (ticket numbers, SKUs, error codes) match too. Its `search_kwargs`:
+    - `k`: The number of documents to return.
+    - `fetch_k`: The number of documents to fetch from each search. Defaults to `2 * k`.
+    - `rrf_k`: See `reciprocal_rank_fusion`.
+    - Others are passed to the dense search.
+
+    Both search types can be followed by a diversity stage, that selects the `k` documents among the `fetch_k`
+    candidates, so the results aren't near-duplicates of each other, nor all from the same source (see
+    `maximal_marginal_relevance`). It's enabled by either of these `search_kwargs`:
+    - `lambda_mult`: Trades relevance (1) for novelty (0). Defaults to 1, i.e. the source caps only.
+    - `max_per_source`: The maximum number of documents of each source.
+    The candidates of the dense search are fetched with their vectors, so the stage doesn't call the database.
+    The durations of the searches and of the stage are reported as the `retrieval` and `diversity` timings of
+    the request (see `collect_timings`).
+
+    Searches can be pre-filtered by the metadata of the chunks (see `with_filter`), in both search types.
+    They search the vectors of the current tenant, if one is set (see `use_tenant`), so a retriever can be
+    shared by the requests of all the tenants.
+
+    Only the `similarity` and `hybrid` search types are cached. Other search types fall back to
+    the regular `VectorStoreRetriever` behavior.
+
+    Usage:
+    ```python
+    >>> retriever = VectorDB().as_retriever(search_type='hybrid', search_kwargs={'k': 8})
+    >>> await retriever.ainvoke('Why did TKT-1234 fail?')
+    ```
+    """
+
+    allowed_search_types: ClassVar[Collection[str]] = (*VectorStoreRetriever.allowed_search_types, 'hybrid')
+
+    cache: RetrieverCache | None = None
+
+    # The filters of the sparse search. The dense search is filtered by the `search_kwargs`. See `with_filter`.
+    metadata_filter: MetadataFilter | None = None
+
+    def with_filter(self, metadata_filter: MetadataFilter | None) -> 'VectorDBRetriever':
+        """Get a copy of the retriever, whose searches only find the chunks that match the filters."""
+
+        if metadata_filter is None or metadata_filter.is_empty():
+            return self
+
+        return self.copy(update={
+            'metadata_filter': metadata_filter,
+            'search_kwargs': self.search_kwargs | self.vectorstore.get_filter_kwargs(metadata_filter),
+        })
+
+    def for_tenant(self, tenant_id: str | None) -> 'VectorDBRetriever':
+        """Get a copy of the retriever, that searches the vectors of the tenant (see `with_tenant` of the database)."""
+
+        vectorstore = self.vectorstore.with_tenant(tenant_id)
+        if vectorstore is self.vectorstore:
+            return self
+
+        return self.copy(update={'vectorstore': vectorstore})
+
+    def _get_tenant_retriever(self) -> 'VectorDBRetriever':
+        """Get the retriever of the current tenant, or this retriever if no tenant is set."""
+
+        tenant_id = get_current_tenant()
+        return self if tenant_id is None else self.for_tenant(tenant_id)
+
+    def _embeddings_key(self, query: str) -> tuple:
+        """Get the cache key of the query's embedding."""
+
+        embeddings = self.vectorstore.embeddings
+        model_id = getattr(embeddings, 'model_id', None) or getattr(embeddings, 'model', None)
+        return type(embeddings).__name__, model_id, normalize_query(query)
+
+    def _search_key(self, query: str) -> tuple:
+        """Get the cache key of the query's search results."""
+
+        scope = self.vectorstore.cache_scope
+        return (
+            scope,
+            CollectionGenerations.get(scope),
+            self.search_type,
+            normalize_query(query),
+            json.dumps(self.search_kwargs, sort_keys=True, default=str),
+        )
+
+    def _get_hybrid_kwargs(self) -> tuple[int, int, int, dict]:
+        """Get `k`, `fetch_k`, `rrf_k`, and the kwargs of the dense search, of the `hybrid` search.
+
+        Also used by the `similarity` search, when it's followed by the diversity stage.
+        """
+
+        dense_kwargs = dict(self.search_kwargs)
+        k = dense_kwargs.pop('k', 4)
+        fetch_k = dense_kwargs.pop('fetch_k', 2 * k)
+        rrf_k = dense_kwargs.pop('rrf_k', 60)
+        dense_kwargs.pop('lambda_mult', None)
+        dense_kwargs.pop('max_per_source', None)
+        return k, fetch_k, rrf_k, dense_kwargs
+
+    def _has_diversity_stage(self) -> bool:
+        """Whether the search is followed by the diversity stage."""
+        return 'lambda_mult' in self.search_kwargs or 'max_per_source' in self.search_kwargs
+
+    def _has_own_search(self) -> bool:
+        """Whether the search is run by `_search`, rather than by `VectorStoreRetriever`."""
+
+        if self.search_type == 'similarity':
+            return self.cache is not None or self._has_diversity_stage()
+        return self.search_type == 'hybrid'
+
+    def _embed_query(self, query: str) -> list[float]:
+        """Embed the query, using the cache when possible."""
+
+        if self.cache is None:
+            return self.vectorstore.embeddings.embed_query(query)
+
+        embeddings_key = self._embeddings_key(query)
+        embedding = self.cache.query_embeddings.get(embeddings_key)
+        if embedding is None:
+            start_time = time.perf_counter()
+            embedding = self.vectorstore.embeddings.embed_query(query)
+            self.cache.query_embeddings.record_miss_time(time.perf_counter() - start_time)
+            self.cache.query_embeddings.set(embeddings_key, embedding)
+
+        return embedding
+
+    async def _aembed_query(self, query: str) -> list[float]:
+        """Same as `_embed_query`, but async."""
+
+        if self.cache is None:
+            return await self.vectorstore.embeddings.aembed_query(query)
+
+        embeddings_key = self._embeddings_key(query)
+        embedding = self.cache.query_embeddings.get(embeddings_key)
+        if embedding is None:
+            start_time = time.perf_counter()
+            embedding = await self.vectorstore.embeddings.aembed_query(query)
+            self.cache.query_embeddings.record_miss_time(time.perf_counter() - start_time)
+            self.cache.query_embeddings.set(embeddings_key, embedding)
+
+        return embedding
+
+    def _search(self, query: str, embedding: list[float]) -> list[Document]:
+        """Search by the query and its embedding."""
+
+        with timed('retrieval'):
+            if not self._has_diversity_stage():
+                if self.search_type != 'hybrid':
+                    return self.vectorstore.similarity_search_by_vector(embedding, **self.search_kwargs)
+
+                k, fetch_k, rrf_k, dense_kwargs = self._get_hybrid_kwargs()
+                dense_docs = self.vectorstore.similarity_search_by_vector(embedding, k=fetch_k, **dense_kwargs)
+                sparse_docs = self.vectorstore.sparse_search(query, k=fetch_k, metadata_filter=self.metadata_filter)
+                return reciprocal_rank_fusion([dense_docs, sparse_docs], k=rrf_k)[:k]
+
+            _, fetch_k, _, dense_kwargs = self._get_hybrid_kwargs()
+            candidates = self.vectorstore.similarity_search_with_vectors(embedding, k=fetch_k, **dense_kwargs)
+            sparse_docs = None
+            if self.search_type == 'hybrid':
+                sparse_docs = self.vectorstore.sparse_search(query, k=fetch_k, metadata_filter=self.metadata_filter)
+
+        return self._diversify(embedding, candidates, sparse_docs)
+
+    async def _asearch(self, query: str, embedding: list[float]) -> list[Document]:
+        """Same as `_search`, but async, and the searches of the `hybrid` search run concurrently."""
+
+        with timed('retrieval'):
+            if not self._has_diversity_stage():
+                if self.search_type != 'hybrid':
+                    return await self.vectorstore.asimilarity_search_by_vector(embedding, **self.search_kwargs)
+
+                k, fetch_k, rrf_k, dense_kwargs = self._get_hybrid_kwargs()
+                dense_docs, sparse_docs = await asyncio.gather(
+                    self.vectorstore.asimilarity_search_by_vector(embedding, k=fetch_k, **dense_kwargs),
+                    self.vectorstore.asparse_search(query, k=fetch_k, metadata_filter=self.metadata_filter),
+                )
+                return reciprocal_rank_fusion([dense_docs, sparse_docs], k=rrf_k)[:k]
+
+            _, fetch_k, _, dense_kwargs = self._get_hybrid_kwargs()
+            if self.search_type == 'hybrid':
+                candidates, sparse_docs = await asyncio.gather(
+                    self.vectorstore.asimilarity_search_with_vectors(embedding, k=fetch_k, **dense_kwargs),
+                    self.vectorstore.asparse_search(query, k=fetch_k, metadata_filter=self.metadata_filter),
+                )
+            else:
+                candidates = await self.vectorstore.asimilarity_search_with_vectors(
+                    embedding, k=fetch_k, **dense_kwargs,
+                )
+                sparse_docs = None
+
+        return self._diversify(embedding, candidates, sparse_docs)
+
+    def _diversify(
+            self,
+            embedding: list[float],
+            candidates: list[tuple[Document, list[float]]],
+            sparse_docs: list[Document] = None,
+        ) -> list[Document]:
+        """Select the `k` documents of the diversity stage. See `maximal_marginal_relevance`.
+
+        :param candidates: The documents of the dense search, and their vectors.
+        :param sparse_docs: The documents of the sparse search, of the `hybrid` search. Their relevance is their
+            fused score, and the documents that the dense search didn't find are only capped per source, since
+            their vectors are unknown.
+        """
+
+        k, _, rrf_k, _ = self._get_hybrid_kwargs()
+        with timed('diversity'):
+            dimension = len(embedding)
+            if sparse_docs is None:
+                docs = [doc for doc, _ in candidates]
+                vectors = np.asarray([vector for _, vector in candidates], dtype=np.float32).reshape(-1, dimension)
+                query = np.asarray(embedding, dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+                relevance = vectors @ query / np.maximum(norms, 1e-12)
+            else:
+                # The fusion keeps the first occurrence of each chunk, i.e. the document of the dense search.
+                dense_vectors = {id(doc): vector for doc, vector in candidates}
+                fused = reciprocal_rank_fusion_scores([[doc for doc, _ in candidates], sparse_docs], k=rrf_k)
+                docs = [doc for doc, _ in fused]
+                vectors = np.zeros((len(docs), dimension), dtype=np.float32)
+                for i, doc in enumerate(docs):
+                    if id(doc) in dense_vectors:
+                        vectors[i] = dense_vectors[id(doc)]
+                relevance = np.asarray([score for _, score in fused], dtype=np.float32)
+                relevance /= max(float(relevance.max(initial=0.0)), 1e-12)
+
+            selected = maximal_marginal_relevance(
+                relevance,
+                vectors,
+                k=k,
+                lambda_mult=self.search_kwargs.get('lambda_mult', 1.0),
+                sources=[doc.metadata.get('source_id') for doc in docs],
+                max_per_source=self.search_kwargs.get('max_per_source'),
+            )
+            return [docs[i] for i in selected]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        """Get the documents relevant to the query, using the cache when possible."""
+
+        if (retriever := self._get_tenant_retriever()) is not self:
+            return retriever._get_relevant_documents(query, run_manager=run_manager)
+
+        if not self._has_own_search():
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+        if self.cache is None:
+            return self._search(query, self._embed_query(query))
+
+        search_key = self._search_key(query)
+        docs = self.cache.search_results.get(search_key)
+        if docs is None:
+            embedding = self._embed_query(query)
+
+            start_time = time.perf_counter()
+            docs = self._search(query, embedding)
+            self.cache.search_results.record_miss_time(time.perf_counter() - start_time)
+            self.cache.search_results.set(search_key, docs)
+
+        # Copy, so the callers can't modify the cached documents.
+        return copy.deepcopy(docs)
+
+    async def _aget_relevant_documents(
+            self,
+            query: str,
+            *,
+            run_manager: AsyncCallbackManagerForRetrieverRun,
+        ) -> list[Document]:
+        """Get the documents relevant to the query, using the cache when possible."""
+
+        if (retriever := self._get_tenant_retriever()) is not self:
+            return await retriever._aget_relevant_documents(query, run_manager=run_manager)
+
+        if not self._has_own_search():
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        if self.cache is None:
+            return await self._asearch(query, await self._aembed_query(query))
+
+        search_key = self._search_key(query)
+        docs = self.cache.search_results.get(search_key)
+        if docs is None:
+            embedding = await self._aembed_query(query)
+
+            start_time = time.perf_counter()
+            docs = await self._asearch(query, embedding)
+            self.cache.search_results.record_miss_time(time.perf_counter() - start_time)
+            self.cache.search_results.set(search_key, docs)
+
+        # Copy, so the callers can't modify the cached documents.
+        return copy.deepcopy(docs)
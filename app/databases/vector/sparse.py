@@ -0,0 +1,268 @@
+import abc
+import copy
+import heapq
+import math
+import re
+import threading
+
+from collections import Counter
+from datetime import datetime, timezone
+from langchain.schema import Document
+from operator import itemgetter
+from typing import Callable, Iterable
+
+from app.databases.vector.filters import MetadataFilter
+
+
+# Words, and compound identifiers whose parts are joined by punctuation (e.g. `TKT-1234`, `v2.1.0`, `a/b`).
+TOKEN_PATTERN = re.compile(r'\w+(?:[-./:#]\w+)*')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list[str]:
+    """Split the text into lowercase terms.
+
+    Compound identifiers are kept whole and also split into their parts, so an exact identifier
+    matches best, while its parts still match on their own.
+    """
+
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms += WORD_PATTERN.findall(token)
+
+    return terms
+
+
+class BaseSparseIndex(abc.ABC):
+    """A sparse (keyword) index of the chunks of a collection, searched with BM25.
+
+    The index is kept in sync by the vector database (see `BaseVectorDatabase.aadd_documents`
+    and `BaseVectorDatabase.forget_chunks`), once it's loaded. Until then, changes are ignored,
+    since they're picked up by `load`. The index may miss changes (e.g. of other processes), so the
+    vector database drops the results of chunks it no longer has. See `BaseVectorDatabase.sparse_search`.
+    """
+
+    @abc.abstractmethod
+    def load(self, iter_documents: Callable[[], Iterable[tuple[str, Document]]]) -> None:
+        """Load the chunks of the collection into the index, unless it's loaded already.
+
+        :param iter_documents: Iterates over the `(id, chunk)` pairs of the collection.
+        """
+        pass
+
+    @abc.abstractmethod
+    def add(self, ids: list, documents: list[Document]) -> None:
+        """Add the chunks to the index, or replace them if their IDs are indexed already."""
+        pass
+
+    @abc.abstractmethod
+    def delete_chunks(self, ids: list) -> None:
+        """Remove the chunks from the index."""
+        pass
+
+    @abc.abstractmethod
+    def delete_sources(self, source_ids: list[str], except_ids: list = None) -> None:
+        """Remove the chunks of the sources from the index, except for `except_ids`."""
+        pass
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Remove all the chunks from the index."""
+        pass
+
+    @abc.abstractmethod
+    def search_with_ids(
+            self,
+            query: str,
+            k: int = 4,
+            metadata_filter: MetadataFilter = None,
+        ) -> list[tuple[str, Document]]:
+        """Get the `(id, chunk)` pairs of the `k` chunks that best match the keywords of the query, by their BM25 score.
+
+        :param metadata_filter: If set, only the chunks that match it are searched.
+        """
+        pass
+
+    def search(self, query: str, k: int = 4, metadata_filter: MetadataFilter = None) -> list[Document]:
+        """Same as `search_with_ids`, without the IDs."""
+        return [document for _, document in self.search_with_ids(query, k=k, metadata_filter=metadata_filter)]
+
+
+class InMemoryBM25Index(BaseSparseIndex):
+    """A process-wide inverted index of the chunks of a collection.
+
+    The index is loaded from the collection on first use, and then kept in sync with the changes
+    made by this process. Changes made by other processes aren't tracked, so the chunks they add aren't
+    searched, and the chunks they delete are dropped from the results by `BaseVectorDatabase.sparse_search`.
+    """
+
+    # The shared, process-wide indexes, by the collection's scope. See `get_shared`.
+    _shared: dict[str, 'InMemoryBM25Index'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """Initialize the index.
+
+        :param k1: Controls how quickly the score saturates as a term repeats in a chunk.
+        :param b: Controls how much the score is normalized by the length of the chunk.
+        """
+
+        self.k1 = k1
+        self.b = b
+        self.loaded_at: datetime = None
+
+        self._lock = threading.RLock()
+        self._documents: dict[str, Document] = {}
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+        self._postings: dict[str, dict[str, int]] = {}
+        self._sources: dict[str, set[str]] = {}
+
+    @classmethod
+    def get_shared(cls, scope: str) -> 'InMemoryBM25Index':
+        """Get the process-wide index of the collection identified by `scope`."""
+
+        with cls._shared_lock:
+            if scope not in cls._shared:
+                cls._shared[scope] = cls()
+
+            return cls._shared[scope]
+
+    @classmethod
+    def get_all_stats(cls) -> dict:
+        """Get the statistics of all the shared indexes, by scope."""
+        return {scope: index.get_stats() for scope, index in cls._shared.items()}
+
+    def load(self, iter_documents: Callable[[], Iterable[tuple[str, Document]]]) -> None:
+        with self._lock:
+            if self.loaded_at is not None:
+                return
+
+            for chunk_id, document in iter_documents():
+                self._add(str(chunk_id), document)
+            self.loaded_at = datetime.now(timezone.utc)
+
+    def add(self, ids: list, documents: list[Document]) -> None:
+        with self._lock:
+            if self.loaded_at is None:
+                return
+
+            for chunk_id, document in zip(ids, documents):
+                self._add(str(chunk_id), document)
+
+    def delete_chunks(self, ids: list) -> None:
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(str(chunk_id))
+
+    def delete_sources(self, source_ids: list[str], except_ids: list = None) -> None:
+        except_ids = {str(chunk_id) for chunk_id in except_ids or []}
+        with self._lock:
+            for source_id in source_ids:
+                for chunk_id in self._sources.get(source_id, set()) - except_ids:
+                    self._remove(chunk_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents, self._lengths, self._postings, self._sources = {}, {}, {}, {}
+            self._total_length = 0
+            self.loaded_at = None
+
+    def search_with_ids(
+            self,
+            query: str,
+            k: int = 4,
+            metadata_filter: MetadataFilter = None,
+        ) -> list[tuple[str, Document]]:
+        with self._lock:
+            if not self._documents:
+                return []
+
+            avg_length = self._total_length / len(self._documents) or 1
+            scores: dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (len(self._documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0) + idf * count * (self.k1 + 1) / (count + norm)
+
+            if metadata_filter is not None:
+                scores = {
+                    chunk_id: score for chunk_id, score in scores.items()
+                    if metadata_filter.matches(self._documents[chunk_id].metadata)
+                }
+
+            best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+            # Copy, so the callers can't modify the indexed chunks.
+            return [(chunk_id, copy.deepcopy(self._documents[chunk_id])) for chunk_id, _ in best]
+
+    def get_stats(self) -> dict:
+        """Get statistics about the size of the index."""
+
+        with self._lock:
+            return {
+                'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+                'chunks': len(self._documents),
+                'terms': len(self._postings),
+            }
+
+    def _add(self, chunk_id: str, document: Document) -> None:
+        if chunk_id in self._documents:
+            self._remove(chunk_id)
+
+        counts = Counter(tokenize(document.page_content))
+        self._documents[chunk_id] = document
+        self._lengths[chunk_id] = sum(counts.values())
+        self._total_length += self._lengths[chunk_id]
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+        self._sources.setdefault(document.metadata.get('source_id'), set()).add(chunk_id)
+
+    def _remove(self, chunk_id: str) -> None:
+        document = self._documents.pop(chunk_id, None)
+        if document is None:
+            return
+
+        self._total_length -= self._lengths.pop(chunk_id)
+        for term in set(tokenize(document.page_content)):
+            postings = self._postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self._postings[term]
+
+        source_chunks = self._sources[document.metadata.get('source_id')]
+        source_chunks.discard(chunk_id)
+        if not source_chunks:
+            del self._sources[document.metadata.get('source_id')]
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int = 60) -> list[Document]:
+    """Merge rankings of chunks by the sum of their reciprocal ranks, `1 / (k + rank)`.
+
+    Chunks are identified by their source and content, since the rankings may come from different
+    indexes. The first occurrence of each chunk is returned.
+
+    :param k: Dampens the weight of the top ranks, so chunks ranked well by all the rankings come first.
+    """
+    return [document for document, _ in reciprocal_rank_fusion_scores(rankings, k=k)]
+
+
+def reciprocal_rank_fusion_scores(rankings: list[list[Document]], k: int = 60) -> list[tuple[Document, float]]:
+    """Same as `reciprocal_rank_fusion`, with the fused score of each chunk."""
+
+    scores: dict[tuple, float] = {}
+    documents: dict[tuple, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = (str(document.metadata.get('source_id')), document.page_content)
+            scores[key] = scores.get(key, 0) + 1 / (k + rank)
+            documents.setdefault(key, document)
+
+    return [(documents[key], scores[key]) for key in sorted(scores, key=scores.get, reverse=True)]
@@ -0,0 +1,468 @@
+import asyncio
+import hashlib
+import numpy as np
+import os
+import threading
+import weakref
+import zlib
+
+from dataclasses import dataclass, field
+from langchain.schema import Document
+from typing import Any, Awaitable, Callable
+
+from app.databases.postgres import Database
+
+
+class MinHasher:
+    """Computes MinHash signatures of texts, whose similarity estimates the Jaccard similarity of the texts.
+
+    Texts are normalized (lowercased, with collapsed whitespace) and shingled into overlapping word
+    n-grams, so small edits (e.g. a changed date in a templated page) change only a few shingles.
+    The permutations are seeded, so signatures are comparable across processes and can be persisted.
+    """
+
+    # A Mersenne prime larger than the 32-bit shingle hashes, so `a * hash + b` doesn't overflow 64 bits.
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        """Initialize the hasher.
+
+        :param num_perm: The number of hash permutations, i.e. the length of the signatures.
+        :param shingle_size: The number of words in each shingle.
+        """
+
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+
+    def get_shingles(self, text: str) -> set[str]:
+        """Get the word n-grams of the normalized text."""
+
+        words = text.lower().split()
+        if len(words) <= self.shingle_size:
+            return {' '.join(words)}
+        return {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def get_signature(self, text: str) -> np.ndarray:
+        """Get the MinHash signature of the text, as `num_perm` unsigned 64-bit integers."""
+
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in self.get_shingles(text)),
+            dtype=np.uint64,
+        )
+        return ((self._a * hashes + self._b) % np.uint64(self._PRIME)).min(axis=1)
+
+    @staticmethod
+    def get_similarity(signature: np.ndarray, other_signature: np.ndarray) -> float:
+        """Estimate the Jaccard similarity of the texts of the signatures."""
+        return float(np.mean(signature == other_signature))
+
+
+@dataclass
+class SignatureIndexEntry:
+    """A chunk in the `ChunkSignatureIndex`."""
+
+    chunk_id: str
+    source_id: str
+    signature: np.ndarray
+    band_keys: list[int]
+
+
+class ChunkSignatureIndex:
+    """Keeps the MinHash signatures of the stored chunks in the main database, with an LSH index of their bands.
+
+    Each signature is split into bands, and each band is hashed into a bucket key. Chunks that share
+    a bucket key are candidate near-duplicates. See `ChunkDeduplicator`.
+    """
+
+    # The tables are created once per process, on first use. See `setup`.
+    _setup_done = False
+    # The setup locks, by event loop, since a lock can only be used by the event loop it was first used in.
+    _setup_locks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock] = weakref.WeakKeyDictionary()
+    _setup_locks_lock = threading.Lock()
+
+    @classmethod
+    def _get_setup_lock(cls) -> asyncio.Lock:
+        """Get the setup lock of the running event loop."""
+
+        with cls._setup_locks_lock:
+            return cls._setup_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+
+    async def setup(self) -> None:
+        """Create the index tables, if they don't exist."""
+
+        async with self._get_setup_lock():
+            if ChunkSignatureIndex._setup_done:
+                return
+
+            async with Database.connection() as conn:
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chunk_signatures (
+                        scope TEXT NOT NULL,
+                        chunk_id TEXT NOT NULL,
+                        source_id TEXT NOT NULL,
+                        signature BYTEA NOT NULL,
+                        PRIMARY KEY (scope, chunk_id)
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS chunk_signatures_source_idx ON chunk_signatures (scope, source_id)
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chunk_lsh_buckets (
+                        scope TEXT NOT NULL,
+                        band_key BIGINT NOT NULL,
+                        chunk_id TEXT NOT NULL,
+                        PRIMARY KEY (scope, band_key, chunk_id),
+                        FOREIGN KEY (scope, chunk_id) REFERENCES chunk_signatures ON DELETE CASCADE
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chunk_links (
+                        scope TEXT NOT NULL,
+                        chunk_id TEXT NOT NULL,
+                        source_id TEXT NOT NULL,
+                        source_name TEXT NOT NULL,
+                        PRIMARY KEY (scope, chunk_id, source_id),
+                        FOREIGN KEY (scope, chunk_id) REFERENCES chunk_signatures ON DELETE CASCADE
+                    )
+                ''')
+            ChunkSignatureIndex._setup_done = True
+
+    async def find(
+            self,
+            scope: str,
+            band_keys: list[int],
+            exclude_source_ids: list[str] = None,
+        ) -> dict[str, np.ndarray]:
+        """Find the chunks that share any of the bucket keys.
+
+        :param exclude_source_ids: Sources whose chunks aren't candidates.
+        :return: The signatures of the candidate chunks, by their IDs.
+        """
+
+        await self.setup()
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                SELECT DISTINCT s.chunk_id, s.signature
+                FROM chunk_lsh_buckets b JOIN chunk_signatures s USING (scope, chunk_id)
+                WHERE b.scope = %s AND b.band_key = ANY(%s) AND NOT s.source_id = ANY(%s)
+            ''', [scope, band_keys, exclude_source_ids or []])
+            return {
+                row['chunk_id']: np.frombuffer(row['signature'], dtype=np.uint64)
+                for row in await cursor.fetchall()
+            }
+
+    async def add(self, scope: str, entries: list[SignatureIndexEntry]) -> None:
+        """Add the chunks to the index."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany('''
+                    INSERT INTO chunk_signatures (scope, chunk_id, source_id, signature) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (scope, chunk_id) DO NOTHING
+                ''', [[scope, entry.chunk_id, entry.source_id, entry.signature.tobytes()] for entry in entries])
+                await cursor.executemany('''
+                    INSERT INTO chunk_lsh_buckets (scope, band_key, chunk_id) VALUES (%s, %s, %s)
+                    ON CONFLICT DO NOTHING
+                ''', [[scope, band_key, entry.chunk_id] for entry in entries for band_key in entry.band_keys])
+
+    async def add_links(self, scope: str, links: list[tuple[str, str, str]]) -> None:
+        """Record that the sources contain near-duplicates of the chunks.
+
+        :param links: `(chunk_id, source_id, source_name)` tuples.
+        """
+
+        await self.setup()
+        async with Database.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany('''
+                    INSERT INTO chunk_links (scope, chunk_id, source_id, source_name) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT DO NOTHING
+                ''', [[scope, *link] for link in links])
+
+    async def delete_chunks(self, scope: str, chunk_ids: list[str]) -> list[str]:
+        """Remove the chunks from the index.
+
+        :return: The sources that contain near-duplicates of the chunks, i.e. their links.
+        """
+
+        await self.setup()
+        async with Database.connection() as conn:
+            cursor = await conn.execute(
+                'DELETE FROM chunk_links WHERE scope = %s AND chunk_id = ANY(%s) RETURNING source_id',
+                [scope, chunk_ids],
+            )
+            linked_source_ids = {row['source_id'] for row in await cursor.fetchall()}
+            await conn.execute(
+                'DELETE FROM chunk_signatures WHERE scope = %s AND chunk_id = ANY(%s)',
+                [scope, chunk_ids],
+            )
+            return sorted(linked_source_ids)
+
+    async def delete_sources(self, scope: str, source_ids: list[str], except_ids: list[str] = None) -> list[str]:
+        """Remove the chunks of the sources from the index, except for `except_ids`, and their links.
+
+        Unless `except_ids` is given, the sources are also removed from the links of other chunks.
+
+        :return: The other sources that contain near-duplicates of the removed chunks.
+        """
+
+        await self.setup()
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                DELETE FROM chunk_links l USING chunk_signatures s
+                WHERE l.scope = s.scope AND l.chunk_id = s.chunk_id
+                    AND s.scope = %s AND s.source_id = ANY(%s) AND NOT s.chunk_id = ANY(%s)
+                RETURNING l.source_id
+            ''', [scope, source_ids, except_ids or []])
+            linked_source_ids = {row['source_id'] for row in await cursor.fetchall()}
+            await conn.execute('''
+                DELETE FROM chunk_signatures
+                WHERE scope = %s AND source_id = ANY(%s) AND NOT chunk_id = ANY(%s)
+            ''', [scope, source_ids, except_ids or []])
+            if except_ids is None:
+                await conn.execute(
+                    'DELETE FROM chunk_links WHERE scope = %s AND source_id = ANY(%s)',
+                    [scope, source_ids],
+                )
+                linked_source_ids -= set(source_ids)
+
+            return sorted(linked_source_ids)
+
+    async def delete(self, scope: str) -> None:
+        """Remove all the chunks of the collection from the index."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            await conn.execute('DELETE FROM chunk_signatures WHERE scope = %s', [scope])
+
+
+@dataclass
+class DeduplicationPlan:
+    """The near-duplicates among a batch of chunks, found by `ChunkDeduplicator.deduplicate`."""
+
+    signatures: list[np.ndarray]
+    band_keys: list[list[int]]
+    # For each chunk, the ID of the stored chunk it duplicates, or the index of an earlier chunk of the batch.
+    duplicate_of_ids: list[str | None] = field(default_factory=list)
+    duplicate_of_indices: list[int | None] = field(default_factory=list)
+
+    def is_duplicate(self, idx: int) -> bool:
+        return self.duplicate_of_ids[idx] is not None or self.duplicate_of_indices[idx] is not None
+
+
+class ChunkDeduplicator:
+    """Finds near-duplicate chunks before they're embedded, with MinHash signatures and an LSH index.
+
+    Chunks whose estimated Jaccard similarity with a stored chunk (or an earlier chunk of the batch)
+    is at least `threshold` aren't embedded nor stored. The sources of the dropped chunks are recorded
+    as links of the kept chunk (see `ChunkSignatureIndex.add_links`).
+
+    When the kept chunk is deleted, `forget_chunks` and `forget_sources` return the linked sources,
+    so they can be stored again (see `BaseVectorDatabase.invalidate_sources`).
+
+    Usage:
+    ```python
+    >>> deduplicator = ChunkDeduplicator(threshold=0.9)
+    >>> plan = await deduplicator.deduplicate('Milvus:MyRAGApp', chunks, run_in_executor)
+    >>> ids = vector_db.add_documents([chunk for idx, chunk in enumerate(chunks) if not plan.is_duplicate(idx)])
+    >>> await deduplicator.register('Milvus:MyRAGApp', chunks, plan, ids)
+    ```
+    """
+
+    # The shared, process-wide deduplicator. See `get_shared`.
+    _shared: 'ChunkDeduplicator' = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+            self,
+            threshold: float = 0.9,
+            num_perm: int = 128,
+            shingle_size: int = 3,
+            index: ChunkSignatureIndex = None,
+        ):
+        """Initialize the deduplicator.
+
+        :param threshold: The minimal estimated Jaccard similarity for a chunk to be a near-duplicate.
+        :param num_perm: The length of the MinHash signatures.
+        :param shingle_size: The number of words in each shingle. See `MinHasher`.
+        """
+
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self.index = index or ChunkSignatureIndex()
+        self.bands, self.rows = self.get_lsh_params(num_perm, threshold)
+
+        self.chunks_checked = 0
+        self.chunks_saved = 0
+        self.embedding_calls_saved = 0
+
+    @classmethod
+    def get_shared(cls) -> 'ChunkDeduplicator | None':
+        """Get the process-wide deduplicator, configured by environment variables.
+
+        Returns `None` if deduplication is disabled, i.e. `CHUNK_DEDUP_ENABLED` isn't set to `true`.
+        """
+
+        if os.environ.get('CHUNK_DEDUP_ENABLED', 'false').lower() != 'true':
+            return None
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(threshold=float(os.environ.get('CHUNK_DEDUP_THRESHOLD', 0.9)))
+
+        return cls._shared
+
+    @staticmethod
+    def get_lsh_params(num_perm: int, threshold: float, min_recall: float = 0.95) -> tuple[int, int]:
+        """Split the signatures into bands, so chunks above the threshold are very likely to share a band.
+
+        Chunks of similarity `s` share a band with a probability of `1 - (1 - s^rows)^bands`. The most
+        rows per band (i.e. the fewest candidates) are used, for which chunks at the threshold still
+        share a band with a probability of `min_recall`.
+
+        :return: The number of bands and of rows per band.
+        """
+
+        rows = max(
+            (rows for rows in range(1, num_perm + 1)
+             if num_perm % rows == 0 and 1 - (1 - threshold ** rows) ** (num_perm // rows) >= min_recall),
+            default=1,
+        )
+        return num_perm // rows, rows
+
+    def get_band_keys(self, signature: np.ndarray) -> list[int]:
+        """Hash each band of the signature into a (signed, 64-bit) bucket key."""
+
+        return [
+            int.from_bytes(
+                hashlib.blake2b(band.tobytes(), digest_size=8, salt=band_idx.to_bytes(16, 'big')).digest(),
+                'big',
+                signed=True,
+            )
+            for band_idx, band in enumerate(signature.reshape(self.bands, self.rows))
+        ]
+
+    async def deduplicate(
+            self,
+            scope: str,
+            chunks: list[Document],
+            run_in_executor: Callable[..., Awaitable[Any]],
+            exclude_source_ids: list[str] = None,
+        ) -> DeduplicationPlan:
+        """Find the near-duplicates among the chunks, and of the stored chunks of the collection.
+
+        :param scope: Identifies the collection (see `BaseVectorDatabase.cache_scope`).
+        :param run_in_executor: Runs blocking calls off the event loop (see `BaseVectorDatabase.run_in_executor`).
+        :param exclude_source_ids: Sources whose stored chunks aren't compared, e.g. because they're being replaced.
+        """
+
+        def sign() -> tuple[list[np.ndarray], list[list[int]]]:
+            signatures = [self.hasher.get_signature(chunk.page_content) for chunk in chunks]
+            return signatures, [self.get_band_keys(signature) for signature in signatures]
+
+        signatures, band_keys = await run_in_executor(sign)
+        plan = DeduplicationPlan(signatures=signatures, band_keys=band_keys)
+
+        candidates = await self.index.find(
+            scope,
+            list({key for keys in band_keys for key in keys}),
+            exclude_source_ids=exclude_source_ids,
+        )
+
+        # The kept chunks of the batch, by their bucket keys.
+        batch_buckets: dict[int, list[int]] = {}
+        for idx, signature in enumerate(signatures):
+            duplicate_of_id = duplicate_of_idx = None
+
+            for chunk_id, candidate_signature in candidates.items():
+                if self.hasher.get_similarity(signature, candidate_signature) >= self.threshold:
+                    duplicate_of_id = chunk_id
+                    break
+            else:
+                batch_candidates = {other_idx for key in band_keys[idx] for other_idx in batch_buckets.get(key, [])}
+                for other_idx in sorted(batch_candidates):
+                    if self.hasher.get_similarity(signature, signatures[other_idx]) >= self.threshold:
+                        duplicate_of_idx = other_idx
+                        break
+
+            plan.duplicate_of_ids.append(duplicate_of_id)
+            plan.duplicate_of_indices.append(duplicate_of_idx)
+            if duplicate_of_id is None and duplicate_of_idx is None:
+                for key in band_keys[idx]:
+                    batch_buckets.setdefault(key, []).append(idx)
+
+        duplicates_count = sum(plan.is_duplicate(idx) for idx in range(len(chunks)))
+        self.chunks_checked += len(chunks)
+        self.chunks_saved += duplicates_count
+        if chunks and duplicates_count == len(chunks):
+            self.embedding_calls_saved += 1
+
+        return plan
+
+    async def register(self, scope: str, chunks: list[Document], plan: DeduplicationPlan, ids: list) -> None:
+        """Add the kept chunks to the index, after they were stored, and link the sources of the near-duplicates.
+
+        :param ids: The IDs of the kept chunks, in order.
+        """
+
+        kept_ids = iter(ids)
+        chunk_ids: list[str | None] = [
+            None if plan.is_duplicate(idx) else str(next(kept_ids)) for idx in range(len(chunks))
+        ]
+
+        await self.index.add(scope, [
+            SignatureIndexEntry(
+                chunk_id=chunk_id,
+                source_id=chunks[idx].metadata['source_id'],
+                signature=plan.signatures[idx],
+                band_keys=plan.band_keys[idx],
+            )
+            for idx, chunk_id in enumerate(chunk_ids) if chunk_id is not None
+        ])
+
+        # The links are recorded so the near-duplicates can be restored if the kept chunk is deleted.
+        links = [
+            (
+                plan.duplicate_of_ids[idx] or chunk_ids[plan.duplicate_of_indices[idx]],
+                chunk.metadata['source_id'],
+                chunk.metadata['source_name'],
+            )
+            for idx, chunk in enumerate(chunks) if plan.is_duplicate(idx)
+        ]
+        if links:
+            await self.index.add_links(scope, links)
+
+    async def forget_chunks(self, scope: str, chunk_ids: list) -> list[str]:
+        """Remove deleted chunks from the index.
+
+        :return: The sources whose near-duplicates of the chunks were dropped.
+        """
+        return await self.index.delete_chunks(scope, [str(chunk_id) for chunk_id in chunk_ids])
+
+    async def forget_sources(self, scope: str, source_ids: list[str], except_ids: list = None) -> list[str]:
+        """Remove the chunks of deleted sources from the index, except for `except_ids`.
+
+        :return: The other sources whose near-duplicates of the removed chunks were dropped.
+        """
+
+        except_ids = [str(chunk_id) for chunk_id in except_ids] if except_ids is not None else None
+        return await self.index.delete_sources(scope, source_ids, except_ids=except_ids)
+
+    async def forget_collection(self, scope: str) -> None:
+        """Remove all the chunks of a dropped collection from the index."""
+        await self.index.delete(scope)
+
+    def get_stats(self) -> dict:
+        """Get statistics about the saved chunks and embedding calls."""
+        return {
+            'threshold': self.threshold,
+            'chunks_checked': self.chunks_checked,
+            'chunks_saved': self.chunks_saved,
+            'embedding_calls_saved': self.embedding_calls_saved,
+        }
@@ -0,0 +1,392 @@
+import asyncio
+import os
+import time
+import uuid
+
+from dataclasses import dataclass, fields
+from datetime import datetime
+from enum import Enum
+
+from app.databases.postgres import Database
+from app.databases.vector import VectorDB
+from app.indexing.metadata import DocumentMetadata
+from app.utils.logger import Logger
+from app.utils.tenants import get_current_tenant, use_tenant
+
+
+class IngestionJobStatus(Enum):
+    """The statuses of an ingestion job."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+@dataclass
+class IngestionJob:
+    """Represents a request to store a text in the vector database, processed in the background."""
+
+    id: uuid.UUID
+    source_id: str
+    source_name: str
+    modified_at: datetime
+    status: IngestionJobStatus
+    # The number of submissions that were coalesced into this job. Only the last one is stored.
+    submissions: int
+    created_at: datetime
+    text: str = None
+    # The tenant whose vector database the text is stored in. The default tenant is an empty string.
+    tenant_id: str = ''
+    chunks_count: int = None
+    error: str = None
+    started_at: datetime = None
+    finished_at: datetime = None
+
+    @classmethod
+    def from_row(cls, row: dict) -> 'IngestionJob':
+        """Create a job from a row of the `ingestion_jobs` table."""
+
+        names = {f.name for f in fields(cls)}
+        job = cls(**{k: v for k, v in row.items() if k in names})
+        job.status = IngestionJobStatus(job.status)
+        return job
+
+    def get_metadata(self) -> DocumentMetadata:
+        """Get the metadata of the text, to store in the vector database."""
+        return DocumentMetadata(source_id=self.source_id, source_name=self.source_name, modified_at=self.modified_at)
+
+    def to_dict(self) -> dict:
+        """Convert the job to a JSON-compatible dictionary, for the API. The text is omitted."""
+
+        def milliseconds(start: datetime, end: datetime) -> float | None:
+            return (end - start).total_seconds() * 1_000 if start and end else None
+
+        return {
+            'id': str(self.id),
+            'source_id': self.source_id,
+            'source_name': self.source_name,
+            'tenant_id': self.tenant_id or None,
+            'modified_at': self.modified_at.isoformat(),
+            'status': self.status.value,
+            'submissions': self.submissions,
+            'chunks_count': self.chunks_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'queued_ms': milliseconds(self.created_at, self.started_at),
+            'running_ms': milliseconds(self.started_at, self.finished_at),
+        }
+
+
+class IngestionJobStore:
+    """Persists the ingestion jobs in the main database, so they survive restarts and can be polled.
+
+    Jobs of the same `source_id` (of the same tenant) are coalesced - while a job is queued, new submissions
+    for its source replace its text, so only the last write is stored. Jobs of the same source never run
+    concurrently, so they're applied in the order of submission.
+    """
+
+    async def setup(self) -> None:
+        """Create the jobs table, if it doesn't exist."""
+
+        async with Database.connection() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    id UUID PRIMARY KEY,
+                    source_id TEXT NOT NULL,
+                    source_name TEXT NOT NULL,
+                    tenant_id TEXT NOT NULL DEFAULT '',
+                    modified_at TIMESTAMP NOT NULL,
+                    text TEXT,
+                    status TEXT NOT NULL,
+                    submissions INTEGER NOT NULL DEFAULT 1,
+                    chunks_count INTEGER,
+                    error TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    started_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ
+                )
+            ''')
+            # Tables created by older versions have no tenants.
+            await conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS tenant_id TEXT NOT NULL DEFAULT ''")
+            # At most one queued job per source of a tenant - that's where new submissions are coalesced into.
+            await conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS ingestion_jobs_queued_tenant_source_id
+                ON ingestion_jobs (tenant_id, source_id) WHERE status = 'queued'
+            ''')
+            await conn.execute('DROP INDEX IF EXISTS ingestion_jobs_queued_source_id')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS ingestion_jobs_status_created_at ON ingestion_jobs (status, created_at)
+            ''')
+
+    async def submit(self, text: str, metadata: DocumentMetadata, tenant_id: str = None) -> IngestionJob:
+        """Queue a job to store the text, or coalesce it into the queued job of the same source.
+
+        :param tenant_id: The tenant whose vector database the text is stored in, or `None` for the default tenant.
+        """
+
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                INSERT INTO ingestion_jobs (id, source_id, source_name, tenant_id, modified_at, text, status)
+                VALUES (%(id)s, %(source_id)s, %(source_name)s, %(tenant_id)s, %(modified_at)s, %(text)s, 'queued')
+                ON CONFLICT (tenant_id, source_id) WHERE status = 'queued' DO UPDATE SET
+                    source_name = EXCLUDED.source_name,
+                    modified_at = EXCLUDED.modified_at,
+                    text = EXCLUDED.text,
+                    submissions = ingestion_jobs.submissions + 1
+                RETURNING *
+            ''', {
+                'id': uuid.uuid4(),
+                'source_id': metadata.source_id,
+                'source_name': metadata.source_name,
+                'tenant_id': tenant_id or '',
+                'modified_at': metadata.modified_at,
+                'text': text,
+            })
+            return IngestionJob.from_row(await cursor.fetchone())
+
+    async def claim(self) -> IngestionJob | None:
+        """Mark the oldest queued job as running and return it, or `None` if there are no jobs to run.
+
+        Jobs whose source has a running job are skipped, until that job finishes.
+        """
+
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                UPDATE ingestion_jobs SET status = 'running', started_at = now(), heartbeat_at = now()
+                WHERE id = (
+                    SELECT id FROM ingestion_jobs queued
+                    WHERE status = 'queued' AND NOT EXISTS (
+                        SELECT 1 FROM ingestion_jobs running
+                        WHERE running.tenant_id = queued.tenant_id AND running.source_id = queued.source_id
+                            AND running.status = 'running'
+                    )
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+            ''')
+            row = await cursor.fetchone()
+            return IngestionJob.from_row(row) if row else None
+
+    async def heartbeat(self, job_id: uuid.UUID) -> None:
+        """Mark that the running job is still alive. See `requeue_stale`."""
+
+        async with Database.connection() as conn:
+            await conn.execute('UPDATE ingestion_jobs SET heartbeat_at = now() WHERE id = %s', [job_id])
+
+    async def finish(self, job_id: uuid.UUID, chunks_count: int = None, error: str = None) -> None:
+        """Mark the job as done, or as failed if `error` is set. The text is dropped, as it's no longer needed."""
+
+        async with Database.connection() as conn:
+            await conn.execute('''
+                UPDATE ingestion_jobs
+                SET status = %(status)s, chunks_count = %(chunks_count)s, error = %(error)s,
+                    finished_at = now(), text = NULL
+                WHERE id = %(id)s
+            ''', {
+                'id': job_id,
+                'status': (IngestionJobStatus.FAILED if error is not None else IngestionJobStatus.DONE).value,
+                'chunks_count': chunks_count,
+                'error': error,
+            })
+
+    async def requeue_stale(self, stale_after: float) -> int:
+        """Queue the running jobs again, if they weren't alive for `stale_after` seconds (e.g. the server restarted).
+
+        If a newer job of the same source is already queued, the stale job fails instead, as it's superseded.
+
+        :return: The number of requeued or failed jobs.
+        """
+
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                UPDATE ingestion_jobs stale SET
+                    status = CASE WHEN queued.id IS NULL THEN 'queued' ELSE 'failed' END,
+                    error = CASE WHEN queued.id IS NULL THEN NULL ELSE 'Interrupted, and superseded by a newer job' END,
+                    text = CASE WHEN queued.id IS NULL THEN stale.text ELSE NULL END,
+                    finished_at = CASE WHEN queued.id IS NULL THEN NULL ELSE now() END,
+                    started_at = NULL
+                FROM ingestion_jobs running
+                LEFT JOIN ingestion_jobs queued ON queued.tenant_id = running.tenant_id
+                    AND queued.source_id = running.source_id AND queued.status = 'queued'
+                WHERE stale.id = running.id
+                    AND running.status = 'running'
+                    AND running.heartbeat_at < now() - make_interval(secs => %s)
+            ''', [stale_after])
+            return cursor.rowcount
+
+    async def get(self, job_id: uuid.UUID) -> IngestionJob | None:
+        """Get the job, or `None` if it doesn't exist."""
+
+        async with Database.connection() as conn:
+            cursor = await conn.execute('SELECT * FROM ingestion_jobs WHERE id = %s', [job_id])
+            row = await cursor.fetchone()
+            return IngestionJob.from_row(row) if row else None
+
+
+class IngestionJobQueue:
+    """Processes the ingestion jobs in the background, with a fixed number of concurrent workers.
+
+    Each job replaces the embeddings of its source with its text (see `BaseVectorDatabase.upsert_text`),
+    in the vector database of the tenant that submitted it (see `use_tenant`).
+
+    Jobs are shared by all the server processes through `IngestionJobStore`. Jobs of a process that
+    stopped while running them are picked up again by the other processes (or after a restart),
+    once their heartbeats stop.
+
+    Example usage:
+    >>> queue = IngestionJobQueue(concurrency=2)
+    >>> await queue.open()
+    >>> job = await queue.submit('Some text', metadata)
+    >>> await queue.get(job.id)
+        IngestionJob(id=..., status=IngestionJobStatus.QUEUED, ...)
+    >>> await queue.close()
+    """
+
+    # Running jobs update their heartbeat every `HEARTBEAT_INTERVAL` seconds,
+    # and are considered stale if they didn't for `STALE_AFTER` seconds.
+    HEARTBEAT_INTERVAL = 10
+    STALE_AFTER = 60
+
+    def __init__(self, concurrency: int = None, poll_interval: float = None, store: IngestionJobStore = None):
+        """Initialize the queue. The workers are started only when calling `open`.
+
+        :param concurrency: The number of jobs to run concurrently. Defaults to `INGESTION_JOBS_CONCURRENCY`.
+        :param poll_interval: The number of seconds between checks for new jobs (e.g. submitted by other
+            processes), when idle. Defaults to `INGESTION_JOBS_POLL_INTERVAL`.
+        :param store: The store of the jobs. Defaults to `IngestionJobStore`.
+        """
+
+        self.concurrency = concurrency or int(os.environ.get('INGESTION_JOBS_CONCURRENCY', 2))
+        self.poll_interval = poll_interval or float(os.environ.get('INGESTION_JOBS_POLL_INTERVAL', 1))
+        self.store = store or IngestionJobStore()
+
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._closing = True
+        self._requeued_at = float('-inf')
+        self._running_count = 0
+        self._done_count = 0
+        self._failed_count = 0
+
+    async def open(self) -> None:
+        """Create the jobs table if needed, and start the workers."""
+
+        await self.store.setup()
+        self._closing = False
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        Logger().get_logger().info(f'Ingestion job queue is running with {self.concurrency} workers')
+
+    async def close(self, timeout: float = 30) -> None:
+        """Stop the workers.
+
+        Waits up to `timeout` seconds for the running jobs to finish. Jobs that are still running after that
+        are cancelled, and will be picked up again once they're stale.
+        """
+
+        self._closing = True
+        self._wakeup.set()
+
+        workers, self._workers = self._workers, []
+        if not workers:
+            return
+
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            Logger().get_logger().warning(f'Cancelling {len(pending)} running ingestion jobs')
+            for worker in pending:
+                worker.cancel()
+            await asyncio.wait(pending)
+
+    async def submit(self, text: str, metadata: DocumentMetadata) -> IngestionJob:
+        """Submit a job to store the text, for the current tenant. See `IngestionJobStore.submit`."""
+
+        job = await self.store.submit(text, metadata, tenant_id=get_current_tenant())
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: uuid.UUID) -> IngestionJob | None:
+        """Get the job, or `None` if it doesn't exist."""
+        return await self.store.get(job_id)
+
+    def get_stats(self) -> dict:
+        """Get statistics about the jobs of this process, for monitoring."""
+        return {
+            'concurrency': self.concurrency,
+            'running': self._running_count,
+            'done': self._done_count,
+            'failed': self._failed_count,
+        }
+
+    async def _work(self) -> None:
+        """Claim and run jobs, until the queue is closed."""
+
+        while not self._closing:
+            try:
+                await self._requeue_stale()
+                job = await self.store.claim()
+            except Exception:
+                Logger().get_logger().exception('Failed to claim an ingestion job')
+                job = None
+
+            if job is not None:
+                # The job stays running until it's requeued as stale (see `_requeue_stale`).
+                try:
+                    await self._run(job)
+                except Exception:
+                    Logger().get_logger().exception(f'Failed to record the results of ingestion job {job.id}')
+                continue
+
+            # Wait for a job to be submitted by this process, or poll for jobs of other processes.
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._closing:
+                self._wakeup.clear()
+
+    async def _requeue_stale(self) -> None:
+        """Requeue the stale jobs (see `IngestionJobStore.requeue_stale`), at most once per heartbeat interval."""
+
+        now = time.monotonic()
+        if now - self._requeued_at < self.HEARTBEAT_INTERVAL:
+            return
+
+        self._requeued_at = now
+        count = await self.store.requeue_stale(self.STALE_AFTER)
+        if count:
+            Logger().get_logger().info(f'Requeued {count} stale ingestion jobs')
+
+    async def _run(self, job: IngestionJob) -> None:
+        """Run the job, and record its results."""
+
+        self._running_count += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            with use_tenant(job.tenant_id):
+                res = await VectorDB().upsert_text(job.text, job.get_metadata())
+        except Exception as e:
+            Logger().get_logger().exception(f'Ingestion job {job.id} failed')
+            await self.store.finish(job.id, error=str(e) or type(e).__name__)
+            self._failed_count += 1
+        else:
+            await self.store.finish(job.id, chunks_count=len(res['ids']))
+            self._done_count += 1
+        finally:
+            heartbeat.cancel()
+            self._running_count -= 1
+
+    async def _heartbeat(self, job_id: uuid.UUID) -> None:
+        """Update the heartbeat of the running job, until cancelled."""
+
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                await self.store.heartbeat(job_id)
+            except Exception:
+                Logger().get_logger().exception(f'Failed to update the heartbeat of ingestion job {job_id}')
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import threading
+import weakref
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from psycopg.types.json import Jsonb
+
+from app.databases.postgres import Database
+
+
+def to_naive_utc(timestamp: datetime) -> datetime:
+    """Convert timezone-aware timestamps to naive UTC timestamps, as stored in the manifest.
+
+    Naive timestamps are assumed to be in UTC already.
+    """
+
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@dataclass
+class SourceManifestEntry:
+    """What is stored in a vector database collection for a source."""
+
+    # Identifies the collection (see `BaseVectorDatabase.cache_scope`).
+    scope: str
+    source_id: str
+    # The hash of the source's content and of how it was split (see `BaseVectorDatabase.get_content_hash`).
+    content_hash: str
+    # In naive UTC (see `to_naive_utc`).
+    modified_at: datetime
+    chunk_ids: list
+    # The hashes of the chunks, in the order of `chunk_ids` (see `BaseVectorDatabase.get_chunk_hash`).
+    chunk_hashes: list = field(default_factory=list)
+
+
+class SourceManifest:
+    """Keeps a per-source manifest of the vector database collections in the main database.
+
+    The manifest is used by `BaseVectorDatabase.upsert_text` to skip sources that didn't change,
+    and is cleaned up when sources are deleted from the collections.
+    """
+
+    # The table is created once per process, on first use. See `setup`.
+    _setup_done = False
+    # The setup locks, by event loop, since a lock can only be used by the event loop it was first used in.
+    _setup_locks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock] = weakref.WeakKeyDictionary()
+    _setup_locks_lock = threading.Lock()
+
+    @classmethod
+    def _get_setup_lock(cls) -> asyncio.Lock:
+        """Get the setup lock of the running event loop."""
+
+        with cls._setup_locks_lock:
+            return cls._setup_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+
+    async def setup(self) -> None:
+        """Create the manifest table, if it doesn't exist."""
+
+        async with self._get_setup_lock():
+            if SourceManifest._setup_done:
+                return
+
+            async with Database.connection() as conn:
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS source_manifests (
+                        scope TEXT NOT NULL,
+                        source_id TEXT NOT NULL,
+                        content_hash TEXT NOT NULL,
+                        modified_at TIMESTAMP NOT NULL,
+                        chunk_ids JSONB NOT NULL,
+                        chunk_hashes JSONB NOT NULL DEFAULT '[]',
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        PRIMARY KEY (scope, source_id)
+                    )
+                ''')
+                # Added after the table was introduced.
+                await conn.execute('''
+                    ALTER TABLE source_manifests ADD COLUMN IF NOT EXISTS chunk_hashes JSONB NOT NULL DEFAULT '[]'
+                ''')
+            SourceManifest._setup_done = True
+
+    async def get(self, scope: str, source_id: str) -> SourceManifestEntry | None:
+        """Get the manifest entry of the source, or `None` if the source isn't in the manifest."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            cursor = await conn.execute('''
+                SELECT scope, source_id, content_hash, modified_at, chunk_ids, chunk_hashes
+                FROM source_manifests WHERE scope = %s AND source_id = %s
+            ''', [scope, source_id])
+            row = await cursor.fetchone()
+            return SourceManifestEntry(**row) if row else None
+
+    async def set(self, entry: SourceManifestEntry) -> None:
+        """Create or replace the manifest entry of the source."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            await conn.execute('''
+                INSERT INTO source_manifests (scope, source_id, content_hash, modified_at, chunk_ids, chunk_hashes)
+                VALUES (
+                    %(scope)s, %(source_id)s, %(content_hash)s, %(modified_at)s, %(chunk_ids)s, %(chunk_hashes)s
+                )
+                ON CONFLICT (scope, source_id) DO UPDATE SET
+                    content_hash = EXCLUDED.content_hash,
+                    modified_at = EXCLUDED.modified_at,
+                    chunk_ids = EXCLUDED.chunk_ids,
+                    chunk_hashes = EXCLUDED.chunk_hashes,
+                    updated_at = now()
+            ''', {
+                'scope': entry.scope,
+                'source_id': entry.source_id,
+                'content_hash': entry.content_hash,
+                'modified_at': to_naive_utc(entry.modified_at),
+                'chunk_ids': Jsonb(entry.chunk_ids, dumps=lambda ids: json.dumps(ids, default=str)),
+                'chunk_hashes': Jsonb(entry.chunk_hashes),
+            })
+
+    async def get_scopes(self, prefix: str) -> list[str]:
+        """Get the scopes that start with the prefix and have sources in the manifest."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            cursor = await conn.execute(
+                'SELECT DISTINCT scope FROM source_manifests WHERE starts_with(scope, %s)',
+                [prefix],
+            )
+            return [row['scope'] for row in await cursor.fetchall()]
+
+    async def delete(self, scope: str, source_id: str = None) -> None:
+        """Delete the manifest entry of the source, or of all the sources of the collection if `source_id` is `None`."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            if source_id is None:
+                await conn.execute('DELETE FROM source_manifests WHERE scope = %s', [scope])
+            else:
+                await conn.execute(
+                    'DELETE FROM source_manifests WHERE scope = %s AND source_id = %s',
+                    [scope, source_id],
+                )
+
+    async def delete_many(self, scope: str, source_ids: list[str]) -> None:
+        """Delete the manifest entries of the sources."""
+
+        await self.setup()
+        async with Database.connection() as conn:
+            await conn.execute(
+                'DELETE FROM source_manifests WHERE scope = %s AND source_id = ANY(%s)',
+                [scope, source_ids],
+            )
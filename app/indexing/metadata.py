@@ -1,5 +1,39 @@
+import json
+import os
+import re
+
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+# The stored metadata fields of the chunks, which payload keys can't be promoted to.
+RESERVED_KEYS = ('source_id', 'source_name', 'modified_at', 'payload', 'pk', 'text', 'vector', 'tenant_id')
+
+# The promoted keys are used as field names, and in the filters of the searches.
+KEY_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def get_promoted_keys() -> list[str]:
+    """Get the payload keys that are stored as metadata fields of their own, so searches can be filtered by them.
+
+    The keys are set by the comma-separated `METADATA_PROMOTED_KEYS` environment variable. Their values are
+    stored as strings, and as an empty string when the payload doesn't have them.
+    """
+
+    keys = [key.strip() for key in os.environ.get('METADATA_PROMOTED_KEYS', '').split(',') if key.strip()]
+    invalid = [key for key in keys if key in RESERVED_KEYS or not KEY_PATTERN.fullmatch(key)]
+    if invalid:
+        raise ValueError(f'Invalid promoted payload keys (reserved, or not identifiers): {", ".join(invalid)}')
+
+    return keys
+
+
+def to_epoch(timestamp: datetime) -> int:
+    """Convert the timestamp to seconds since the epoch. Naive timestamps are assumed to be in UTC."""
+
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp())
 
 
 @dataclass
@@ -12,10 +46,42 @@ class DocumentMetadata:
     payload: dict = field(default_factory=dict)
 
     def to_dict(self) -> dict:
-        """Converts the metadata to a vector-database compatible dictionary."""
+        """Converts the metadata to a vector-database compatible dictionary.
+
+        `modified_at` is stored in seconds since the epoch, so searches can be filtered by date ranges, and the
+        promoted payload keys (see `get_promoted_keys`) are stored next to the payload.
+        """
         return {
             'source_id': self.source_id,
             'source_name': self.source_name,
-            'modified_at': self.modified_at.isoformat(),
+            'modified_at': to_epoch(self.modified_at),
+            **{key: str(self.payload.get(key, '')) for key in get_promoted_keys()},
             'payload': self.payload,
         }
+
+    @staticmethod
+    def format_dict(metadata: dict) -> dict:
+        """Convert the stored metadata of a chunk (see `to_dict`) for the users and the LLM.
+
+        `modified_at` is converted to an ISO 8601 timestamp (chunks stored by older versions have one
+        already), and a payload stored as JSON (e.g. by Chroma) is parsed.
+        """
+
+        metadata = dict(metadata)
+        if 'modified_at' in metadata:
+            metadata['modified_at'] = DocumentMetadata.format_modified_at(metadata['modified_at'])
+        if isinstance(metadata.get('payload'), str):
+            try:
+                metadata['payload'] = json.loads(metadata['payload'])
+            except json.JSONDecodeError:
+                pass
+
+        return metadata
+
+    @staticmethod
+    def format_modified_at(modified_at: int | float | str) -> str:
+        """Convert the stored `modified_at` of a chunk to an ISO 8601 timestamp. See `format_dict`."""
+
+        if isinstance(modified_at, (int, float)):
+            return datetime.fromtimestamp(modified_at, timezone.utc).isoformat()
+        return modified_at
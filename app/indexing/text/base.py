@@ -1,8 +1,9 @@
 from langchain.schema import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import Iterable
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+from typing import Any, Awaitable, Callable, Iterable, Iterator, TextIO
 
 from app.indexing.metadata import DocumentMetadata
+from app.indexing.text.streaming import StreamingTextSplitter
 
 
 def enhance_metadata(doc: Document, metadata_dict: dict) -> Document:
@@ -21,10 +22,17 @@ def enhance_metadata(doc: Document, metadata_dict: dict) -> Document:
 class BaseTextIndexing:
     """Implements the base strategy for text splitting and indexing."""
 
+    # The number of texts that `asplit_many` should be given at once, to process them concurrently.
+    max_concurrency = 1
+
     def __init__(self, chunk_size: int = 1_000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
+    def get_fingerprint(self) -> str:
+        """Identifies the strategy and its parameters. Strategies with the same fingerprint split texts the same way."""
+        return f'{type(self).__name__}:{self.chunk_size}:{self.chunk_overlap}'
+
     def split(self, text: str | Iterable[Document], metadata: DocumentMetadata) -> Iterable[Document]:
         """Split the text into chunks and return `Document` objects."""
 
@@ -34,10 +42,60 @@ class BaseTextIndexing:
         # Replace the original metadata with `metadata` and add the original metadata to the new metadata payload.
         docs = (enhance_metadata(doc, metadata_dict) for doc in docs)
 
-        text_splitter = RecursiveCharacterTextSplitter(
+        splits = self.get_text_splitter().split_documents(docs)
+
+        return splits
+
+    def get_text_splitter(self) -> TextSplitter:
+        """Get the splitter of the texts into chunks."""
+        return RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
         )
-        splits = text_splitter.split_documents(docs)
 
-        return splits
+    def get_stream_splitter(self, metadata: DocumentMetadata) -> StreamingTextSplitter:
+        """Get a splitter of a text that is fed in parts. See `split_stream`."""
+        return StreamingTextSplitter(self.get_text_splitter(), metadata, window_size=16 * self.chunk_size)
+
+    def split_stream(
+            self,
+            text: Iterable[str] | TextIO,
+            metadata: DocumentMetadata,
+            read_size: int = 1 << 16,
+        ) -> Iterator[Document]:
+        """Split a text that is read incrementally, and yield the chunks lazily.
+
+        Unlike `split`, the whole text is never in memory, so it's suitable for very large documents.
+
+        :param text: The parts of the text, or a file-like object to read it from.
+        :param read_size: The number of characters to read from a file-like object at once.
+        """
+
+        splitter = self.get_stream_splitter(metadata)
+        parts = iter(lambda: text.read(read_size), '') if hasattr(text, 'read') else text
+
+        for part in parts:
+            yield from splitter.feed(part)
+        yield from splitter.flush()
+
+    async def asplit_many(
+            self,
+            documents: list[tuple[str | Iterable[Document], DocumentMetadata]],
+            run_in_executor: Callable[..., Awaitable[Any]],
+        ) -> list[list[Document] | Exception]:
+        """Split many texts into chunks, without blocking the event loop.
+
+        :param documents: The `(text, metadata)` pairs to split.
+        :param run_in_executor: Runs blocking calls off the event loop (see `BaseVectorDatabase.run_in_executor`).
+
+        :return: The chunks of each text, in the order of `documents`, or the exception that failed it.
+        """
+
+        results = []
+        for text, metadata in documents:
+            try:
+                results.append(await run_in_executor(lambda: list(self.split(text, metadata))))
+            except Exception as e:
+                results.append(e)
+
+        return results
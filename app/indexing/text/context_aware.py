@@ -1,9 +1,20 @@
+import asyncio
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
 from itertools import chain
 from langchain.schema import Document
 from langchain_core.language_models import BaseChatModel
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from typing import Any, Awaitable, Callable, Iterable, Iterator
 
+from app.indexing.metadata import DocumentMetadata
 from app.indexing.text.base import BaseTextIndexing
+from app.indexing.text.streaming import StreamingTextSplitter
 from app.models import ChatModel
+from app.utils.logger import Logger
 
 
 def add_context_to_split(split: Document, context: str) -> Document:
@@ -12,6 +23,40 @@ def add_context_to_split(split: Document, context: str) -> Document:
     return split
 
 
+class ContextAwareStreamingSplitter(StreamingTextSplitter):
+    """Splits a text that is fed in parts, and adds the summary of the document to the chunks, as context.
+
+    The chunks are held back until there's enough content to summarize the document
+    (see `ContextAwareIndexing.document_content_cutoff`), or until the text ends.
+    """
+
+    def __init__(self, *args, indexing: 'ContextAwareIndexing', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.indexing = indexing
+        self.summary: str = None
+        self._pending: list[Document] = []
+        self._pending_length = 0
+
+    def _add_context(self, splits: list[Document], is_last: bool) -> list[Document]:
+        if self.summary is None:
+            self._pending += splits
+            self._pending_length += sum(len(split.page_content) for split in splits)
+            if not self._pending or (self._pending_length < self.indexing.document_content_cutoff and not is_last):
+                return []
+
+            document_content, _ = self.indexing.take_document_content(iter(self._pending))
+            self.summary = self.indexing.summarize(document_content)
+            splits, self._pending = self._pending, []
+
+        return [add_context_to_split(split, context=self.summary) for split in splits]
+
+    def feed(self, text: str) -> list[Document]:
+        return self._add_context(super().feed(text), is_last=False)
+
+    def flush(self) -> list[Document]:
+        return self._add_context(super().flush(), is_last=True)
+
+
 class ContextAwareIndexing(BaseTextIndexing):
     """Implements the context-aware text indexing strategy."""
 
@@ -19,6 +64,11 @@ class ContextAwareIndexing(BaseTextIndexing):
 The summary should be concise and contain the main points of the document.
 This is the document: """
 
+    # The process-wide summaries, by `get_summary_key`, so re-indexed documents aren't summarized again.
+    SUMMARY_CACHE_MAX_ENTRIES = 10_000
+    _summaries: OrderedDict[str, str] = OrderedDict()
+    _summaries_lock = threading.Lock()
+
     def __init__(
             self,
             *args,
@@ -26,8 +76,18 @@ This is the document: """
             max_summary_tokens: int = 500,
             document_content_cutoff: int =  5_000,
             chat_model: BaseChatModel = None,
+            max_concurrency: int = None,
+            requests_per_second: float = None,
             **kwargs,
         ):
+        """Initialize the strategy.
+
+        :param max_concurrency: The number of documents to summarize concurrently by `asplit_many`.
+            Defaults to the `CONTEXT_AWARE_SUMMARIZE_CONCURRENCY` environment variable.
+        :param requests_per_second: Limits the rate of the summarization requests by `asplit_many`.
+            Defaults to the `CONTEXT_AWARE_SUMMARIZE_REQUESTS_PER_SECOND` environment variable. Unlimited if not set.
+        """
+
         super().__init__(*args, **kwargs)
         self.llm = chat_model or ChatModel(model_kwargs={
             'temperature': 0,
@@ -36,16 +96,55 @@ This is the document: """
         self.summarize_prompt = summarize_prompt or self.BASE_SUMMARIZE_PROMPT
         self.document_content_cutoff = document_content_cutoff
 
-    def split(self, *args, **kwargs):
-        """Split the text into chunks and return `Document` objects.
-        
-        This method also summarizes the document and adds the summary to the 
-        beginning of each chunk, as context.
-        """
+        self.max_concurrency = max_concurrency or int(os.environ.get('CONTEXT_AWARE_SUMMARIZE_CONCURRENCY', 4))
+        requests_per_second = requests_per_second \
+            or float(os.environ.get('CONTEXT_AWARE_SUMMARIZE_REQUESTS_PER_SECOND', 0))
+        self.rate_limiter = InMemoryRateLimiter(
+            requests_per_second=requests_per_second,
+            check_every_n_seconds=min(0.1, 1 / requests_per_second),
+            max_bucket_size=self.max_concurrency,
+        ) if requests_per_second else None
 
-        splits = iter(super().split(*args, **kwargs))
+    def get_model_id(self) -> str | None:
+        """The ID of the summarization model."""
+        return getattr(self.llm, 'model_id', None) or getattr(self.llm, 'model_name', None) \
+            or getattr(self.llm, 'model', None)
+
+    def get_fingerprint(self) -> str:
+        """Identifies the strategy and its parameters, including the summarization model and prompt."""
+
+        prompt_hash = hashlib.sha256(self.summarize_prompt.encode('utf-8')).hexdigest()[:16]
+        return f'{super().get_fingerprint()}:{self.get_model_id()}:{prompt_hash}:{self.document_content_cutoff}'
+
+    def get_summary_key(self, document_content: str) -> str:
+        """Identifies the summary of the (truncated) document content, by the model and the prompt."""
+
+        key = f'{self.get_model_id()}\n{self.summarize_prompt}{document_content}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get_cached_summary(self, document_content: str) -> str | None:
+        """Get the memoized summary of the document content, if any."""
+
+        key = self.get_summary_key(document_content)
+        with self._summaries_lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+            return self._summaries.get(key)
+
+    def cache_summary(self, document_content: str, summary: str) -> None:
+        """Memoize the summary of the document content. The least recently used summaries are evicted first."""
+
+        with self._summaries_lock:
+            self._summaries[self.get_summary_key(document_content)] = summary
+            while len(self._summaries) > self.SUMMARY_CACHE_MAX_ENTRIES:
+                self._summaries.popitem(last=False)
+
+    def take_document_content(self, splits: Iterator[Document]) -> tuple[str, list[Document]]:
+        """Take splits until there's enough content to summarize the document.
+
+        :return: The content to summarize, truncated to `document_content_cutoff`, and the splits that were taken.
+        """
 
-        # Summarize the document.
         document_content = ''
         splits_used = []
         while len(document_content) < self.document_content_cutoff:
@@ -55,9 +154,39 @@ This is the document: """
             except StopIteration:
                 break
 
-        document_content = document_content[:self.document_content_cutoff]
-        res = self.llm.invoke(self.summarize_prompt + document_content)
-        doc_summary = res.content
+        return document_content[:self.document_content_cutoff], splits_used
+
+    def summarize(self, document_content: str) -> str:
+        """Summarize the (truncated) document content, or reuse its memoized summary."""
+
+        summary = self.get_cached_summary(document_content)
+        if summary is None:
+            summary = self.llm.invoke(self.summarize_prompt + document_content).content
+            self.cache_summary(document_content, summary)
+
+        return summary
+
+    def get_stream_splitter(self, metadata: DocumentMetadata) -> StreamingTextSplitter:
+        """Get a splitter of a text that is fed in parts, which adds the summary to the chunks."""
+        return ContextAwareStreamingSplitter(
+            self.get_text_splitter(),
+            metadata,
+            window_size=16 * self.chunk_size,
+            indexing=self,
+        )
+
+    def split(self, *args, **kwargs):
+        """Split the text into chunks and return `Document` objects.
+
+        This method also summarizes the document and adds the summary to the
+        beginning of each chunk, as context.
+        """
+
+        splits = iter(super().split(*args, **kwargs))
+
+        # Summarize the document.
+        document_content, splits_used = self.take_document_content(splits)
+        doc_summary = self.summarize(document_content)
 
         # Add the context to each split.
         splits = (
@@ -66,3 +195,77 @@ This is the document: """
         )
 
         return splits
+
+    async def asummarize_many(self, documents_content: list[str]) -> list[str | Exception]:
+        """Summarize the documents concurrently, up to `max_concurrency` at once and at the rate limit.
+
+        Memoized summaries are reused, and identical documents are summarized once.
+
+        :return: The summary of each document, in order, or the exception that failed it.
+        """
+
+        summaries: dict[str, str | Exception] = {}
+        to_summarize = []
+        for document_content in documents_content:
+            summary = self.get_cached_summary(document_content)
+            if summary is not None:
+                summaries[document_content] = summary
+            elif document_content not in summaries:
+                summaries[document_content] = None
+                to_summarize.append(document_content)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def summarize(document_content: str) -> str:
+            async with semaphore:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.aacquire()
+                res = await self.llm.ainvoke(self.summarize_prompt + document_content)
+
+            self.cache_summary(document_content, res.content)
+            return res.content
+
+        results = await asyncio.gather(*map(summarize, to_summarize), return_exceptions=True)
+        summaries.update(zip(to_summarize, results))
+
+        return [summaries[document_content] for document_content in documents_content]
+
+    async def asplit_many(
+            self,
+            documents: list[tuple[str | Iterable[Document], DocumentMetadata]],
+            run_in_executor: Callable[..., Awaitable[Any]],
+        ) -> list[list[Document] | Exception]:
+        """Split many texts into chunks, and summarize the documents concurrently.
+
+        Documents whose summarization failed are split without context, instead of failing.
+        See `BaseTextIndexing.asplit_many`.
+        """
+
+        results = []
+        for text, metadata in documents:
+            try:
+                results.append(await run_in_executor(lambda: list(BaseTextIndexing.split(self, text, metadata))))
+            except Exception as e:
+                results.append(e)
+
+        documents_content = [
+            self.take_document_content(iter(splits))[0]
+            for splits in results if not isinstance(splits, Exception)
+        ]
+        summaries = iter(await self.asummarize_many(documents_content))
+
+        for (_, metadata), splits in zip(documents, results):
+            if isinstance(splits, Exception):
+                continue
+
+            summary = next(summaries)
+            if isinstance(summary, Exception):
+                Logger().get_logger().warning(
+                    f'Failed to summarize source {metadata.source_id}, storing it without context: {summary}'
+                )
+                continue
+
+            for split in splits:
+                add_context_to_split(split, context=summary)
+
+        return results
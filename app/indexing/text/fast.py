@@ -0,0 +1,176 @@
+import functools
+
+from itertools import accumulate, count, islice
+from operator import add, sub
+from langchain_text_splitters import TextSplitter
+from typing import Callable
+
+from app.indexing.text.base import BaseTextIndexing
+
+
+class FastRecursiveTextSplitter(TextSplitter):
+    """A faster drop-in replacement of `RecursiveCharacterTextSplitter`, with the same chunk boundaries.
+
+    `RecursiveCharacterTextSplitter` splits the text into pieces with `re.split`, and re-joins the
+    pieces into chunks, at every level of the separators. Here, the text is never copied until the
+    chunks are returned:
+    - The pieces of a range of the text are found by their offsets, with a single pass over the range
+      per level of the separators.
+    - Pieces are `(start, end)` offsets. Since the separators are kept in the pieces, the pieces of
+      a chunk are contiguous, and a chunk is a single slice of the text.
+    - With the default `len` length function, lengths are computed from the offsets. Other length
+      functions (e.g. token counters) are cached, since the same pieces (words, mostly) repeat a lot.
+
+    Only literal separators are supported, which are kept at the start of the pieces (the defaults
+    of `RecursiveCharacterTextSplitter`).
+
+    Usage:
+    ```python
+    >>> splitter = FastRecursiveTextSplitter(chunk_size=1_000, chunk_overlap=200)
+    >>> splitter.split_text(text)
+        ['First chunk...', ...]
+    >>> FastRecursiveTextSplitter.from_tiktoken_encoder(encoding_name='cl100k_base', chunk_size=256)
+    ```
+    """
+
+    def __init__(self, separators: list[str] = None, length_cache_size: int = 100_000, **kwargs):
+        """Initialize the splitter.
+
+        :param separators: The separators to split by, from the coarsest to the finest.
+            Defaults to the separators of `RecursiveCharacterTextSplitter`.
+        :param length_cache_size: The number of pieces whose length is cached, for length functions other than `len`.
+        """
+
+        super().__init__(keep_separator=True, **kwargs)
+        self._separators = separators or ['\n\n', '\n', ' ', '']
+        if self._length_function is not len:
+            self._length_function = functools.lru_cache(maxsize=length_cache_size)(self._length_function)
+
+    def split_text(self, text: str) -> list[str]:
+        """Split the text into chunks."""
+        return _SplitRun(self, text).split(0, len(text), 0)
+
+
+class _SplitRun:
+    """Splits a single text with a `FastRecursiveTextSplitter`."""
+
+    def __init__(self, splitter: FastRecursiveTextSplitter, text: str):
+        self.text = text
+        self.separators = splitter._separators
+        self.chunk_size = splitter._chunk_size
+        self.chunk_overlap = splitter._chunk_overlap
+        self.strip_whitespace = splitter._strip_whitespace
+        self.length_function = splitter._length_function
+
+    def split(self, start: int, end: int, level: int) -> list[str]:
+        """Split `text[start:end]` by `separators[level:]`, like `RecursiveCharacterTextSplitter._split_text`."""
+
+        segment = self.text[start:end]
+
+        # Find the coarsest separator in the range.
+        separator_level = len(self.separators) - 1
+        for i in range(level, len(self.separators)):
+            if self.separators[i] == '' or self.separators[i] in segment:
+                separator_level = i
+                break
+        separator = self.separators[separator_level]
+        is_last_level = separator_level == len(self.separators) - 1 or separator == ''
+
+        # The pieces of the range, each starting with the separator. The k-th piece is `boundaries[k:k + 2]`.
+        # The offset of the i-th separator is the length of the i first parts, and of the i-1 separators before.
+        if separator == '':
+            boundaries = list(range(start, end + 1))
+        else:
+            parts_ends = accumulate(map(len, segment.split(separator)), initial=start)
+            boundaries = list(map(add, parts_ends, count(-len(separator), len(separator))))
+            boundaries[0] = start
+            boundaries[-1] = end
+            if len(boundaries) > 2 and boundaries[1] == start:
+                del boundaries[0]
+
+        if self.length_function is len:
+            lengths = list(map(sub, islice(boundaries, 1, None), boundaries))
+        else:
+            lengths = [self.length_function(self.text[a:b]) for a, b in zip(boundaries, islice(boundaries, 1, None))]
+
+        # Pieces that are too long are split by the next separators, and the pieces between them are merged.
+        chunks = []
+        good_start = 0
+        for k in [k for k, length in enumerate(lengths) if length >= self.chunk_size]:
+            if good_start < k:
+                self.merge(boundaries, lengths, good_start, k, chunks)
+            good_start = k + 1
+
+            if is_last_level:
+                chunks.append(self.text[boundaries[k]:boundaries[k + 1]])
+            else:
+                chunks.extend(self.split(boundaries[k], boundaries[k + 1], separator_level + 1))
+
+        if good_start < len(lengths):
+            self.merge(boundaries, lengths, good_start, len(lengths), chunks)
+
+        return chunks
+
+    def merge(self, boundaries: list[int], lengths: list[int], first: int, last: int, chunks: list[str]) -> None:
+        """Merge the contiguous pieces `first` to `last` (excluded) into chunks, like `TextSplitter._merge_splits`."""
+
+        chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+
+        # The current chunk is made of the pieces `first` to `k` (excluded), of `total` length.
+        total = 0
+        for k in range(first, last):
+            length = lengths[k]
+            if total + length > chunk_size and k > first:
+                self.add_chunk(boundaries[first], boundaries[k], chunks)
+
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    total -= lengths[first]
+                    first += 1
+
+            total += length
+
+        if first < last:
+            self.add_chunk(boundaries[first], boundaries[last], chunks)
+
+    def add_chunk(self, start: int, end: int, chunks: list[str]) -> None:
+        """Add `text[start:end]` to the chunks, unless it's blank."""
+
+        chunk = self.text[start:end]
+        if self.strip_whitespace:
+            chunk = chunk.strip()
+        if chunk:
+            chunks.append(chunk)
+
+
+class FastTextIndexing(BaseTextIndexing):
+    """Implements the base text indexing strategy, with `FastRecursiveTextSplitter`.
+
+    Splits texts into the same chunks as `BaseTextIndexing`, only faster.
+    """
+
+    def __init__(self, *args, length_function: Callable[[str], int] = None, **kwargs):
+        """Initialize the strategy.
+
+        :param length_function: Measures the length of the chunks, e.g. in tokens. Defaults to `len`.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.length_function = length_function or len
+
+    def get_fingerprint(self) -> str:
+        """Identifies the strategy and its parameters, including the length function."""
+
+        # Chunks of the default length function are identical to those of `BaseTextIndexing`.
+        if self.length_function is len:
+            return BaseTextIndexing(self.chunk_size, self.chunk_overlap).get_fingerprint()
+
+        length_function_name = getattr(self.length_function, '__qualname__', type(self.length_function).__name__)
+        return f'{super().get_fingerprint()}:{length_function_name}'
+
+    def get_text_splitter(self) -> FastRecursiveTextSplitter:
+        """Get the splitter of the texts into chunks."""
+        return FastRecursiveTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=self.length_function,
+        )
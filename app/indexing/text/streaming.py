@@ -0,0 +1,71 @@
+import copy
+
+from langchain.schema import Document
+from langchain_text_splitters import TextSplitter
+
+from app.indexing.metadata import DocumentMetadata
+
+
+class StreamingTextSplitter:
+    """Splits a text that is fed in parts, so the whole text never has to be in memory.
+
+    The parts are buffered until the buffer reaches `window_size` characters. The buffer is then
+    split with `text_splitter`, and all the chunks but the last one are returned. The last chunk
+    may continue in the next parts, so the buffer is kept from its start, and the overlap between
+    consecutive chunks is kept too.
+
+    The chunks are mostly identical to splitting the whole text at once. They can differ only around the
+    windows' boundaries, but they always respect `chunk_size` and `chunk_overlap`.
+
+    Usage:
+    ```python
+    >>> splitter = StreamingTextSplitter(RecursiveCharacterTextSplitter(chunk_size=1_000), metadata, 16_000)
+    >>> for part in parts:
+    ...     store(splitter.feed(part))
+    >>> store(splitter.flush())
+    ```
+    """
+
+    def __init__(self, text_splitter: TextSplitter, metadata: DocumentMetadata, window_size: int):
+        """Initialize the splitter.
+
+        :param text_splitter: Splits the buffered text into chunks.
+        :param metadata: The metadata of the chunks.
+        :param window_size: The number of characters to buffer before splitting. Should be several chunks long.
+            The memory usage depends on it, and not on the size of the text.
+        """
+
+        self.text_splitter = text_splitter
+        self.window_size = window_size
+        self.metadata_dict = metadata.to_dict()
+        self._buffer = ''
+
+    def _to_documents(self, chunks: list[str]) -> list[Document]:
+        return [Document(page_content=chunk, metadata=copy.deepcopy(self.metadata_dict)) for chunk in chunks]
+
+    def feed(self, text: str) -> list[Document]:
+        """Add the next part of the text.
+
+        :return: The chunks that are complete, in order. Possibly none.
+        """
+
+        self._buffer += text
+        if len(self._buffer) < self.window_size:
+            return []
+
+        *chunks, last_chunk = self.text_splitter.split_text(self._buffer)
+        if not chunks:
+            return []
+
+        self._buffer = self._buffer[max(self._buffer.rfind(last_chunk), 0):]
+        return self._to_documents(chunks)
+
+    def flush(self) -> list[Document]:
+        """Split the rest of the text, after its last part was fed.
+
+        :return: The remaining chunks, in order.
+        """
+
+        chunks = self.text_splitter.split_text(self._buffer) if self._buffer else []
+        self._buffer = ''
+        return self._to_documents(chunks)
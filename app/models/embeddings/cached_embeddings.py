@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from array import array
+from langchain_core.embeddings import Embeddings
+from pathlib import Path
+
+from app.utils.cache import LRUCache
+from app.utils.logger import Logger
+
+
+class EmbeddingsCache:
+    """A persistent, content-addressed cache of embedding vectors.
+
+    The cache has two tiers:
+    - An in-memory LRU cache, for the hot entries.
+    - A local SQLite database, which survives restarts and is shared by the processes of the server.
+      When it grows beyond `max_entries`, the least recently used entries are evicted.
+
+    Entries are keyed by a namespace (the model and its configuration) and the SHA-256 of the text.
+    Vectors are stored as float32.
+    """
+
+    # The shared, process-wide cache. See `get_shared`.
+    _shared: 'EmbeddingsCache' = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str | Path, max_entries: int = 1_000_000, memory_size: int = 10_000):
+        """Initialize the cache.
+
+        :param path: The path of the SQLite database file. Created if it doesn't exist.
+        :param max_entries: The maximal number of entries in the SQLite database.
+        :param memory_size: The maximal number of entries in the in-memory cache.
+        """
+
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.memory_cache: LRUCache[tuple[str, str], list[float]] = LRUCache(max_size=memory_size)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                namespace TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, text_hash)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+
+        # An estimate of the number of entries, kept up to date by this process, to avoid counting on every write.
+        self._entries_count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @classmethod
+    def get_shared(cls) -> 'EmbeddingsCache | None':
+        """Get the process-wide cache, configured by environment variables.
+
+        Returns `None` if the cache is disabled, i.e. `EMBEDDINGS_CACHE_PATH` is not set.
+        """
+
+        path = os.environ.get('EMBEDDINGS_CACHE_PATH')
+        if not path:
+            return None
+
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared.path != Path(path):
+                cls._shared = cls(
+                    path,
+                    max_entries=int(os.environ.get('EMBEDDINGS_CACHE_MAX_ENTRIES', 1_000_000)),
+                    memory_size=int(os.environ.get('EMBEDDINGS_CACHE_MEMORY_SIZE', 10_000)),
+                )
+
+        return cls._shared
+
+    def get_many(self, namespace: str, text_hashes: list[str]) -> dict[str, list[float]]:
+        """Get the cached vectors of `text_hashes`. Hashes that aren't cached are missing from the result."""
+
+        found = {}
+        missing = []
+        for text_hash in text_hashes:
+            vector = self.memory_cache.get((namespace, text_hash))
+            if vector is None:
+                missing.append(text_hash)
+            else:
+                found[text_hash] = vector
+        self.memory_hits += len(found)
+
+        if missing:
+            placeholders = ', '.join('?' * len(missing))
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE namespace = ? AND text_hash IN ({placeholders})',
+                    [namespace, *missing],
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        f'UPDATE embeddings SET last_used = ? WHERE namespace = ? AND text_hash IN ({placeholders})',
+                        [time.time(), namespace, *missing],
+                    )
+
+            for text_hash, blob in rows:
+                vector = array('f', blob).tolist()
+                self.memory_cache.set((namespace, text_hash), vector)
+                found[text_hash] = vector
+
+            self.disk_hits += len(rows)
+            self.misses += len(missing) - len(rows)
+
+        return found
+
+    def set_many(self, namespace: str, vectors: dict[str, list[float]]) -> None:
+        """Store the vectors, keyed by the hashes of their texts."""
+
+        for text_hash, vector in vectors.items():
+            self.memory_cache.set((namespace, text_hash), vector)
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (namespace, text_hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                [(namespace, text_hash, array('f', vector).tobytes(), now) for text_hash, vector in vectors.items()],
+            )
+            self._entries_count += len(vectors)
+
+            if self._entries_count > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Evict the least recently used entries, leaving 10% of free space to avoid evicting on every write.
+
+        Must be called with `self._lock` held.
+        """
+
+        self._entries_count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        to_evict = self._entries_count - int(self.max_entries * 0.9)
+        if to_evict <= 0:
+            return
+
+        self._conn.execute(
+            'DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+            [to_evict],
+        )
+        self._entries_count -= to_evict
+        self.evictions += to_evict
+        Logger().get_logger().info(f'Evicted {to_evict} entries from the embeddings cache')
+
+    def get_stats(self) -> dict:
+        """Get statistics about the cache usage."""
+
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'entries': self._entries_count,
+            'max_entries': self.max_entries,
+            'memory_entries': len(self.memory_cache),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an `Embeddings` model and caches its results in an `EmbeddingsCache`.
+
+    Only texts that aren't in the cache are sent to the model, so re-embedding known texts
+    (e.g. when re-indexing a document, or boilerplate that repeats across documents) is free.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingsCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+        model_id = getattr(embeddings, 'model_id', None) or getattr(embeddings, 'model', None)
+        dimensions = getattr(embeddings, 'dimensions', None) \
+            or (getattr(embeddings, 'model_kwargs', None) or {}).get('dimensions')
+        self.namespace = f'{type(embeddings).__name__}:{model_id}:{dimensions}'
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Get the content address of `text`."""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _lookup(self, texts: list[str], kind: str) -> tuple[list[str], dict[str, list[float]], dict[str, str]]:
+        """Look up the texts in the cache.
+
+        :return: A 3-tuple of:
+            - The hashes of `texts`.
+            - The cached vectors, by hash.
+            - The texts that are missing from the cache, by hash (deduplicated).
+        """
+
+        hashes = [self.hash_text(text) for text in texts]
+        cached = self.cache.get_many(f'{self.namespace}:{kind}', list(set(hashes)))
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in cached}
+        return hashes, cached, missing
+
+    def _store(self, kind: str, missing: dict[str, str], vectors: list[list[float]]) -> dict[str, list[float]]:
+        """Store the vectors of the missing texts and return them, by hash."""
+
+        new_vectors = dict(zip(missing.keys(), vectors))
+        if new_vectors:
+            self.cache.set_many(f'{self.namespace}:{kind}', new_vectors)
+        return new_vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed the texts, using the cache for texts that were already embedded."""
+
+        hashes, cached, missing = self._lookup(texts, 'document')
+        if missing:
+            cached |= self._store('document', missing, self.embeddings.embed_documents(list(missing.values())))
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed the query text, using the cache if it was already embedded."""
+
+        hashes, cached, missing = self._lookup([text], 'query')
+        if missing:
+            cached |= self._store('query', missing, [self.embeddings.embed_query(text)])
+
+        return cached[hashes[0]]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Asynchronously embed the texts, using the cache for texts that were already embedded."""
+
+        hashes, cached, missing = await asyncio.to_thread(self._lookup, texts, 'document')
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            cached |= await asyncio.to_thread(self._store, 'document', missing, vectors)
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """Asynchronously embed the query text, using the cache if it was already embedded."""
+
+        hashes, cached, missing = await asyncio.to_thread(self._lookup, [text], 'query')
+        if missing:
+            vectors = [await self.embeddings.aembed_query(text)]
+            cached |= await asyncio.to_thread(self._store, 'query', missing, vectors)
+
+        return cached[hashes[0]]
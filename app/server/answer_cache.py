@@ -0,0 +1,162 @@
+import numpy as np
+import os
+import threading
+import time
+
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+
+
+@dataclass
+class CachedAnswer:
+    """An answer to a question, as stored in the `SemanticAnswerCache`."""
+
+    question: str
+    messages: list[Any]
+    scope: str
+    generation: int
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    """A per-process cache of answers, looked up by the semantic similarity of the questions.
+
+    Questions are compared by the cosine similarity of their embeddings. An entry is returned
+    only if its question is similar enough (see `threshold`) to the new question, and if the
+    corpus it was answered from didn't change since (tracked by the `scope` and `generation`
+    of the collection, see `CollectionGenerations`).
+
+    Usage:
+    ```python
+    >>> cache = SemanticAnswerCache(threshold=0.95)
+    >>> cache.store('What is RAG?', embedding, messages, scope='Milvus:MyRAGApp', generation=3)
+    >>> cache.lookup(other_embedding, scope='Milvus:MyRAGApp', generation=3)
+        CachedAnswer(question='What is RAG?', messages=[...], ...)
+    ```
+    """
+
+    # The shared, process-wide cache. See `get_shared`.
+    _shared: 'SemanticAnswerCache' = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, threshold: float = 0.95, ttl: timedelta = timedelta(hours=1), max_entries: int = 1_000):
+        """Initialize the cache.
+
+        :param threshold: The minimal cosine similarity between questions, for the answer to be reused.
+        :param ttl: Entries expire after this amount of time.
+        :param max_entries: The maximal number of entries. The oldest entries are evicted first.
+        """
+
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._answers: list[CachedAnswer] = []
+        # The normalized embeddings of the questions, one row per answer.
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_shared(cls) -> 'SemanticAnswerCache | None':
+        """Get the process-wide cache, configured by environment variables.
+
+        Returns `None` if the cache is disabled, i.e. `SEMANTIC_ANSWER_CACHE_ENABLED` isn't set to `true`.
+        """
+
+        if os.environ.get('SEMANTIC_ANSWER_CACHE_ENABLED', 'false').lower() != 'true':
+            return None
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(
+                    threshold=float(os.environ.get('SEMANTIC_ANSWER_CACHE_THRESHOLD', 0.95)),
+                    ttl=timedelta(seconds=int(os.environ.get('SEMANTIC_ANSWER_CACHE_TTL', 60 * 60))),
+                    max_entries=int(os.environ.get('SEMANTIC_ANSWER_CACHE_MAX_ENTRIES', 1_000)),
+                )
+
+        return cls._shared
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        """Normalize the embedding, so the dot product of two embeddings is their cosine similarity."""
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: list[float], scope: str, generation: int) -> CachedAnswer | None:
+        """Find the answer to the most similar question, if it's above the similarity threshold.
+
+        :param embedding: The embedding of the new question.
+        :param scope: Identifies the corpus that the question is answered from.
+        :param generation: The current generation of the corpus. Answers from older generations are ignored.
+        """
+
+        with self._lock:
+            self._remove_stale(scope, generation)
+
+            if self._answers:
+                similarities = self._embeddings @ self._normalize(embedding)
+                similarities[[answer.scope != scope for answer in self._answers]] = -np.inf
+
+                best_idx = int(np.argmax(similarities))
+                if similarities[best_idx] >= self.threshold:
+                    self.hits += 1
+                    return self._answers[best_idx]
+
+            self.misses += 1
+            return None
+
+    def store(self, question: str, embedding: list[float], messages: list[Any], scope: str, generation: int) -> None:
+        """Store the answer to the question. See `lookup` for the description of the parameters."""
+
+        answer = CachedAnswer(
+            question=question,
+            messages=messages,
+            scope=scope,
+            generation=generation,
+            expires_at=time.monotonic() + self.ttl.total_seconds(),
+        )
+        vector = self._normalize(embedding)[np.newaxis, :]
+
+        with self._lock:
+            self._answers.append(answer)
+            self._embeddings = np.vstack([self._embeddings, vector]) if len(self._embeddings) else vector
+
+            if len(self._answers) > self.max_entries:
+                self._keep([False] + [True] * (len(self._answers) - 1))
+
+    def _remove_stale(self, scope: str, generation: int) -> None:
+        """Remove the expired answers, and the answers from older generations of `scope`.
+
+        Must be called with `self._lock` held.
+        """
+
+        now = time.monotonic()
+        keep = [
+            answer.expires_at >= now and (answer.scope != scope or answer.generation == generation)
+            for answer in self._answers
+        ]
+        if not all(keep):
+            self._keep(keep)
+
+    def _keep(self, mask: list[bool]) -> None:
+        """Keep only the answers where `mask` is `True`. Must be called with `self._lock` held."""
+
+        self._answers = [answer for answer, keep in zip(self._answers, mask) if keep]
+        self._embeddings = self._embeddings[np.asarray(mask, dtype=bool)]
+
+    def get_stats(self) -> dict:
+        """Get statistics about the cache usage."""
+
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._answers),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
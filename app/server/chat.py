@@ -1,12 +1,15 @@
 import json
 import uuid
 
-from fastapi import APIRouter, Request
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
-from app.server.llm import LLMAgent, LLMEventType
+from app.server.llm import LLMAgentPool, LLMAgentPoolTimeout, LLMEventType
 from app.utils.config import Config
+from app.utils.tenants import get_current_tenant
 
 
 chat_router = APIRouter()
@@ -17,8 +20,18 @@ class ChatRequest(BaseModel):
 
 
 def get_user_chat_config(session_id: str) -> dict:
-    """Get the user chat configuration in a format that's compatible with our chat agent."""
-    return {'configurable': {'thread_id': session_id}}
+    """Get the user chat configuration in a format that's compatible with our chat agent.
+
+    The chat threads of tenants are kept apart, even if a session switches tenants.
+    """
+
+    tenant_id = get_current_tenant()
+    return {'configurable': {'thread_id': session_id if tenant_id is None else f'{tenant_id}/{session_id}'}}
+
+
+def get_llm_agent_pool(request: Request) -> LLMAgentPool:
+    """Get the process-wide pool of LLM agents, created in the app's `lifespan`."""
+    return request.app.state.llm_agent_pool
 
 
 @chat_router.post("/new")
@@ -43,8 +56,11 @@ async def chat_history(request: Request):
         chat_history = []
     else:
         # Get the chat history from the agent and convert it to a format that can be sent to the client.
-        async with LLMAgent() as llm_agent:
-            chat_history = await llm_agent.aget_history(user_config)
+        try:
+            async with get_llm_agent_pool(request).lease() as llm_agent:
+                chat_history = await llm_agent.aget_history(user_config)
+        except LLMAgentPoolTimeout:
+            raise HTTPException(status_code=503, detail='The server is busy, please try again later.')
             
     return {'messages': chat_history}
 
@@ -67,13 +83,21 @@ async def chat(
         await new_chat(request)
     session_id = request.session['chat_session_id']
 
-    # Get the user chat configuration and the LLM agent.
+    # Get the user chat configuration and the LLM agents pool.
     user_config = get_user_chat_config(session_id)
+    llm_agent_pool = get_llm_agent_pool(request)
+
+    # The agent is leased before the response starts, so a busy pool fails the request with a 503 status.
+    lease = AsyncExitStack()
+    try:
+        llm_agent = await lease.enter_async_context(llm_agent_pool.lease())
+    except LLMAgentPoolTimeout:
+        raise HTTPException(status_code=503, detail='The server is busy, please try again later.')
 
     async def stream_agent_response():
-        """Stream the agent's response to the client."""
+        """Stream the agent's response to the client, and return the agent to the pool when it's done."""
 
-        async with LLMAgent() as llm_agent:
+        async with lease:
 
             # Send the user's message to the agent and yield the agent's response.
             async for chat_msg in llm_agent.astream_events(chat_request.message, user_config):
@@ -84,5 +108,11 @@ async def chat(
                 else:
                     yield json.dumps(chat_msg.to_dict()) + '\n'
 
+    async def release_agent():
+        """Return the agent to the pool if the stream was interrupted, or didn't start (e.g. the client left)."""
+        await response_stream.aclose()
+        await lease.aclose()
+
     # Return the agent's response as a stream of JSON objects.
-    return StreamingResponse(stream_agent_response(), media_type='application/json')
+    response_stream = stream_agent_response()
+    return StreamingResponse(response_stream, media_type='application/json', background=BackgroundTask(release_agent))
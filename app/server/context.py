@@ -0,0 +1,175 @@
+import math
+import os
+
+from langchain.schema import Document
+from langchain_core.messages import BaseMessage
+from typing import Callable
+
+
+# The average number of characters per token of the LLMs, to estimate the number of tokens of texts.
+CHARS_PER_TOKEN = 4
+
+# The share of the budget that the documents get anyway, so long conversations can't crowd them out.
+MIN_DOCUMENTS_SHARE = 0.25
+
+# Truncated documents keep at least this number of characters of their content, or are left out.
+MIN_TRUNCATED_CHARS = 200
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens of the text, for the LLM. See `CHARS_PER_TOKEN`."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def get_context_token_budget() -> int | None:
+    """Get the budget of the LLM's input tokens, from the `LLM_CONTEXT_TOKEN_BUDGET` environment variable.
+
+    The budget covers the system prompt, the conversation and the retrieved documents. `None` if it's 0.
+    """
+
+    max_tokens = int(os.environ.get('LLM_CONTEXT_TOKEN_BUDGET', 16_000))
+    return max_tokens if max_tokens > 0 else None
+
+
+def get_documents_token_budget(max_tokens: int, system_prompt: str = '', messages: list[BaseMessage] = None) -> int:
+    """Get the tokens that are left for the retrieved documents, out of the budget of the LLM's input.
+
+    :param max_tokens: The budget of the LLM's input. See `get_context_token_budget`.
+    :param system_prompt: The system prompt of the LLM.
+    :param messages: The messages of the conversation so far, including the previous tool results.
+    """
+
+    used_tokens = count_tokens(system_prompt)
+    for message in messages or []:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        used_tokens += count_tokens(content)
+
+    return max(max_tokens - used_tokens, int(max_tokens * MIN_DOCUMENTS_SHARE))
+
+
+def _get_overlap(first: str, second: str, min_overlap: int) -> int:
+    """Get the length of the longest suffix of `first` that is a prefix of `second`, if it's at least `min_overlap`."""
+
+    head = second[:min_overlap]
+    if len(head) < min_overlap:
+        return 0
+
+    start = first.find(head, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(head, start + 1)
+
+    return 0
+
+
+def _stitch(first: str, second: str, min_overlap: int) -> str | None:
+    """Stitch two overlapping texts into one, without repeating the overlap. `None` if they don't overlap."""
+
+    if second in first:
+        return first
+    if first in second:
+        return second
+    if overlap := _get_overlap(first, second, min_overlap):
+        return first + second[overlap:]
+    if overlap := _get_overlap(second, first, min_overlap):
+        return second + first[overlap:]
+
+    return None
+
+
+def merge_overlapping_chunks(docs: list[Document], min_overlap: int = 20) -> list[Document]:
+    """Stitch the chunks of each source that overlap (see `BaseTextIndexing.chunk_overlap`) into passages.
+
+    Neighboring chunks repeat up to `chunk_overlap` characters of each other, which would be sent to the LLM
+    twice. The overlaps are found by the texts of the chunks, since the chunks don't record their offsets.
+    Each passage takes the place, and the metadata, of its best-ranked chunk.
+
+    :param docs: The chunks, the most relevant first.
+    :param min_overlap: The minimal number of characters of an overlap, so common phrases don't stitch chunks.
+    """
+
+    passages: list[Document | None] = []
+    # The indexes of the passages of each source.
+    source_passages: dict[str, list[int]] = {}
+
+    for doc in docs:
+        indexes = source_passages.setdefault(str(doc.metadata.get('source_id')), [])
+        passage, position = doc, len(passages)
+
+        # The chunk may bridge several passages of its source, so it's stitched with all of them.
+        for i in list(indexes):
+            text = _stitch(passages[i].page_content, passage.page_content, min_overlap)
+            if text is None:
+                continue
+
+            metadata = passages[i].metadata if i < position else passage.metadata
+            passage, position = Document(page_content=text, metadata=metadata), min(position, i)
+            passages[i] = None
+            indexes.remove(i)
+
+        if position == len(passages):
+            passages.append(passage)
+        else:
+            passages[position] = passage
+        indexes.append(position)
+
+    return [passage for passage in passages if passage is not None]
+
+
+def fit_token_budget(
+        docs: list[Document],
+        max_tokens: int,
+        format_document: Callable[[Document], str],
+        document_separator: str = '\n',
+    ) -> list[str]:
+    """Format the documents, in order, until the formatted documents reach the token budget.
+
+    The document that reaches the budget is truncated to the tokens that are left, at a word boundary,
+    and the documents after it are left out.
+
+    :return: The formatted documents.
+    """
+
+    results = []
+    tokens_left = max_tokens
+    for doc in docs:
+        separator_tokens = count_tokens(document_separator) if results else 0
+        text = format_document(doc)
+        tokens = separator_tokens + count_tokens(text)
+        if tokens <= tokens_left:
+            results.append(text)
+            tokens_left -= tokens
+            continue
+
+        empty_doc = Document(page_content='', metadata=doc.metadata)
+        chars_left = (tokens_left - separator_tokens - count_tokens(format_document(empty_doc))) * CHARS_PER_TOKEN
+        if chars_left >= MIN_TRUNCATED_CHARS:
+            content = doc.page_content[:chars_left - 4].rsplit(' ', 1)[0]
+            results.append(format_document(Document(page_content=f'{content} ...', metadata=doc.metadata)))
+        break
+
+    return results
+
+
+def assemble_context(
+        docs: list[Document],
+        format_document: Callable[[Document], str],
+        document_separator: str = '\n',
+        max_tokens: int = None,
+    ) -> str:
+    """Assemble the retrieved documents into the context of the LLM.
+
+    The overlapping chunks of each source are merged into passages (see `merge_overlapping_chunks`), and the
+    passages are formatted up to the token budget (see `fit_token_budget`).
+
+    :param docs: The retrieved documents, the most relevant first.
+    :param format_document: Formats a document for the LLM.
+    :param max_tokens: The token budget of the documents. See `get_documents_token_budget`.
+    """
+
+    passages = merge_overlapping_chunks(docs)
+    if max_tokens is None:
+        return document_separator.join(format_document(passage) for passage in passages)
+
+    return document_separator.join(fit_token_budget(passages, max_tokens, format_document, document_separator))
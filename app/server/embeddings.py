@@ -1,8 +1,21 @@
+import codecs
+import json
+import os
+import uuid
+
 from datetime import datetime
-from fastapi import APIRouter, Request
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from langchain.schema import Document
+from pydantic import BaseModel, ValidationError
+from starlette.types import Receive, Scope, Send
+from typing import AsyncGenerator
 
 from app.databases.vector import VectorDB
+from app.databases.vector.filters import MetadataFilter
+from app.indexing.jobs import IngestionJobQueue
+from app.indexing.metadata import DocumentMetadata
+from app.utils.tenants import get_current_tenant
 
 
 embeddings_router = APIRouter()
@@ -16,12 +29,54 @@ class StoreTextRequest(BaseModel):
     source_id: str
     modified_at: datetime
 
+    def to_metadata(self) -> DocumentMetadata:
+        """Get the metadata of the text, to store in the vector database."""
+        return DocumentMetadata(
+            source_id=self.source_id,
+            source_name=self.source_name,
+            modified_at=self.modified_at,
+        )
+
 
 class DeleteTextRequest(BaseModel):
     """The request to delete the embeddings for the given text from the vector database."""
     source_id: str
 
 
+class DeleteTextsRequest(BaseModel):
+    """The request to delete the embeddings of many texts from the vector database."""
+    source_ids: list[str]
+
+
+class SearchRequest(BaseModel):
+    """The request to search the chunks of the vector database, pre-filtered by their metadata."""
+
+    query: str
+    k: int = 8
+    search_type: str | None = None
+    source_ids: list[str] | None = None
+    source_names: list[str] | None = None
+    modified_after: datetime | None = None
+    modified_before: datetime | None = None
+    # The allowed values of promoted payload keys (see `METADATA_PROMOTED_KEYS`), by key.
+    payload: dict[str, list[str]] = {}
+
+    def to_filter(self) -> MetadataFilter:
+        """Get the filters of the search."""
+        return MetadataFilter(
+            source_ids=self.source_ids,
+            source_names=self.source_names,
+            modified_after=self.modified_after,
+            modified_before=self.modified_before,
+            payload=self.payload,
+        )
+
+
+def get_ingestion_jobs(request: Request) -> IngestionJobQueue:
+    """Get the process-wide queue of ingestion jobs, created in the app's `lifespan`."""
+    return request.app.state.ingestion_jobs
+
+
 @embeddings_router.delete('/text/delete')
 async def delete_text(
     request: Request,
@@ -36,19 +91,243 @@ async def delete_text(
     }
 
 
+@embeddings_router.delete('/text/delete/bulk')
+async def delete_texts(
+    request: Request,
+    delete_texts_request: DeleteTextsRequest,
+) -> dict:
+    """Delete the embeddings of many texts from the vector database, in batches.
+
+    Prefer this endpoint to many calls of `/text/delete`, since each batch is deleted at once.
+    """
+
+    res = await VectorDB().delete_embeddings_many(delete_texts_request.source_ids)
+    return {
+        'status': 'success' if res['error_count'] == 0 else 'error',
+        'details': res,
+    }
+
+
+@embeddings_router.post('/search')
+async def search(
+    request: Request,
+    search_request: SearchRequest,
+) -> dict:
+    """Search the chunks that are the most relevant to the query, among the chunks that match the filters.
+
+    The filters are pushed down into the search of the vector database, so up to `k` matching chunks are
+    returned, however few of the chunks match. The search type defaults to `RETRIEVER_SEARCH_TYPE`.
+    """
+
+    try:
+        retriever = VectorDB().as_retriever(
+            search_type=search_request.search_type or os.environ.get('RETRIEVER_SEARCH_TYPE', 'similarity'),
+            search_kwargs={'k': search_request.k},
+            metadata_filter=search_request.to_filter(),
+        )
+    except ValueError as e:
+        # Unknown search types, or filters by payload keys that aren't promoted.
+        raise HTTPException(status_code=400, detail=str(e))
+
+    docs = await retriever.ainvoke(search_request.query)
+    return {
+        'results': [
+            {'content': doc.page_content, 'metadata': DocumentMetadata.format_dict(doc.metadata)}
+            for doc in docs
+        ],
+    }
+
+
 @embeddings_router.post('/text/store')
 async def store_text(
     request: Request,
     store_text_request: StoreTextRequest,
+    upsert: bool = False,
 ) -> dict:
-    """Store the embeddings for the given text in the vector database."""
+    """Store the embeddings for the given text in the vector database.
+
+    :param upsert: If `true`, the text replaces the stored chunks of the source, and is skipped if it's
+        unchanged or older than the stored text. The response includes the `status` of the upsert.
+        Otherwise, the chunks are added to the stored chunks of the source.
+    """
     
+    if upsert:
+        return await VectorDB().upsert_text(store_text_request.text, metadata=store_text_request.to_metadata())
+
     ids = await VectorDB().split_and_store_text(
         store_text_request.text,
-        metadata={
-            'source_name': store_text_request.source_name,
-            'source_id': store_text_request.source_id,
-            'modified_at': store_text_request.modified_at.isoformat(),
-        }
+        metadata=store_text_request.to_metadata(),
     )
     return {'ids': ids}
+
+
+@embeddings_router.post('/text/store/stream')
+async def store_text_stream(
+    request: Request,
+    source_id: str,
+    source_name: str,
+    modified_at: datetime,
+) -> dict:
+    """Store the embeddings for a very large text, which is read from the request body as it streams in.
+
+    The request body is the UTF-8 text itself, and the metadata is given in the query parameters.
+    Unlike `/text/store`, the text doesn't have to fit in memory - its chunks are embedded and inserted
+    in batches of `EMBEDDINGS_BATCH_SIZE`, while the rest of the body is read.
+    """
+
+    async def read_text() -> AsyncGenerator[str, None]:
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        async for chunk in request.stream():
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    metadata = DocumentMetadata(source_id=source_id, source_name=source_name, modified_at=modified_at)
+    try:
+        ids = await VectorDB().split_and_store_text_stream(read_text(), metadata=metadata)
+    except UnicodeDecodeError as e:
+        # The chunks before the invalid bytes may have been stored already.
+        raise HTTPException(status_code=400, detail=f'The text is not valid UTF-8: {e}')
+
+    return {'ids': ids}
+
+
+class FullDuplexStreamingResponse(StreamingResponse):
+    """A `StreamingResponse` that can be streamed while the request body is still being read.
+
+    `StreamingResponse` watches for the client's disconnection by reading the incoming messages,
+    which would swallow the chunks of the request body. Here, a disconnection is detected by
+    the reads of the request body (`ClientDisconnect`) or the writes of the response instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+
+async def read_ndjson_lines(
+    request: Request,
+    max_line_size: int = None,
+) -> AsyncGenerator[tuple[int, bytes | None], None]:
+    """Read the non-empty lines of an NDJSON request body as it streams in.
+
+    Each chunk of the body is split on its own, and the parts of the unfinished line are kept until its end is read,
+    so long lines are read in linear time. The parts of lines longer than `max_line_size` bytes aren't kept.
+
+    :param max_line_size: The maximal size of a line, in bytes. Defaults to the `EMBEDDINGS_BULK_MAX_LINE_SIZE`
+        environment variable.
+
+    :return: An async generator of `(line number, line)` pairs. Line numbers start at 1.
+        The lines longer than `max_line_size` are `None`.
+    """
+
+    max_line_size = max_line_size or int(os.environ.get('EMBEDDINGS_BULK_MAX_LINE_SIZE', 10_000_000))
+
+    # The parts of the unfinished line, and its size so far.
+    parts: list[bytes] = []
+    size = 0
+    line_number = 0
+
+    def pop_line() -> bytes | None:
+        nonlocal parts, size
+        line = b''.join(parts) if size <= max_line_size else None
+        parts, size = [], 0
+        return line
+
+    async for chunk in request.stream():
+        *line_ends, rest = chunk.split(b'\n')
+        for line_end in line_ends:
+            parts.append(line_end)
+            size += len(line_end)
+            line_number += 1
+            line = pop_line()
+            if line is None or line.strip():
+                yield line_number, line
+
+        parts.append(rest)
+        size += len(rest)
+        if size > max_line_size:
+            # Only the size of a line that is too long is kept.
+            parts = []
+
+    if size:
+        line = pop_line()
+        if line is None or line.strip():
+            yield line_number + 1, line
+
+
+@embeddings_router.post('/text/bulk')
+async def store_text_bulk(request: Request) -> FullDuplexStreamingResponse:
+    """Store the embeddings for many texts in the vector database.
+
+    The request body is NDJSON - one `StoreTextRequest` JSON object per line. The chunks of
+    consecutive texts are embedded and inserted together, in batches of `EMBEDDINGS_BATCH_SIZE`.
+
+    The response is streamed as NDJSON as well, with one result per line:
+    `{"line": 1, "source_id": "...", "ids": [...]}`, or `{"line": 2, "source_id": "...", "error": "..."}`.
+    Results of the valid lines are in the order of the request. Invalid lines are reported as soon as they're read.
+    Lines longer than `EMBEDDINGS_BULK_MAX_LINE_SIZE` bytes are invalid.
+    """
+
+    vector_db = VectorDB()
+
+    # Line numbers of the valid lines, whose results weren't returned yet, and errors of the invalid lines.
+    pending_lines: list[int] = []
+    invalid_lines: list[dict] = []
+
+    async def documents() -> AsyncGenerator[tuple[str | list[Document], DocumentMetadata], None]:
+        async for line_number, line in read_ndjson_lines(request):
+            if line is None:
+                invalid_lines.append({'line': line_number, 'error': 'The line is too long.'})
+                continue
+
+            try:
+                store_text_request = StoreTextRequest.model_validate_json(line)
+            except ValidationError as e:
+                invalid_lines.append({'line': line_number, 'error': str(e)})
+                continue
+
+            pending_lines.append(line_number)
+            yield store_text_request.text, store_text_request.to_metadata()
+
+    def to_ndjson(result: dict) -> str:
+        return json.dumps(result) + '\n'
+
+    async def results() -> AsyncGenerator[str, None]:
+        async for result in vector_db.split_and_store_many(documents()):
+            while invalid_lines:
+                yield to_ndjson(invalid_lines.pop(0))
+            yield to_ndjson({'line': pending_lines.pop(0)} | result)
+
+        while invalid_lines:
+            yield to_ndjson(invalid_lines.pop(0))
+
+    return FullDuplexStreamingResponse(results(), media_type='application/x-ndjson')
+
+
+@embeddings_router.post('/jobs', status_code=202)
+async def submit_store_text_job(
+    request: Request,
+    store_text_request: StoreTextRequest,
+) -> dict:
+    """Submit a background job that replaces the embeddings of the source with the given text.
+
+    Returns immediately. Poll `/embeddings/jobs/{job_id}` for the status of the job.
+    Submissions for a source whose job is still queued are coalesced into that job, so the last one wins.
+    """
+
+    job = await get_ingestion_jobs(request).submit(store_text_request.text, store_text_request.to_metadata())
+    return {'job_id': str(job.id), 'status': job.status.value}
+
+
+@embeddings_router.get('/jobs/{job_id}')
+async def get_job(request: Request, job_id: uuid.UUID) -> dict:
+    """Get the status of an ingestion job."""
+
+    job = await get_ingestion_jobs(request).get(job_id)
+    # The jobs of other tenants are hidden.
+    if job is None or job.tenant_id != (get_current_tenant() or ''):
+        raise HTTPException(status_code=404, detail='Job not found.')
+
+    return job.to_dict()
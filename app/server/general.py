@@ -1,5 +1,14 @@
 from fastapi import APIRouter, Request
 
+from app.databases.postgres import Database
+from app.databases.vector.compaction import CompactionScheduler
+from app.databases.vector.local import LocalCollection
+from app.databases.vector.retriever import RetrieverCache
+from app.databases.vector.sparse import InMemoryBM25Index
+from app.indexing.dedup import ChunkDeduplicator
+from app.models.embeddings.cached_embeddings import EmbeddingsCache
+from app.server.answer_cache import SemanticAnswerCache
+
 
 general_router = APIRouter()
 
@@ -8,3 +17,26 @@ general_router = APIRouter()
 async def hello_world(request: Request):
     """Return a simple hello world message."""
     return {'message': 'Hello, world!'}
+
+
+@general_router.get("/stats")
+async def stats(request: Request):
+    """Return statistics about the shared resources of the server process, for monitoring."""
+
+    embeddings_cache = EmbeddingsCache.get_shared()
+    retriever_cache = RetrieverCache.get_shared()
+    answer_cache = SemanticAnswerCache.get_shared()
+    chunk_deduplicator = ChunkDeduplicator.get_shared()
+
+    return {
+        'database_pool': Database.get_pool_stats(),
+        'llm_agent_pool': request.app.state.llm_agent_pool.get_stats(),
+        'ingestion_jobs': request.app.state.ingestion_jobs.get_stats(),
+        'embeddings_cache': embeddings_cache.get_stats() if embeddings_cache else None,
+        'retriever_cache': retriever_cache.get_stats() if retriever_cache else None,
+        'semantic_answer_cache': answer_cache.get_stats() if answer_cache else None,
+        'vector_db_compaction': CompactionScheduler.get_all_stats(),
+        'sparse_indexes': InMemoryBM25Index.get_all_stats(),
+        'local_vector_db': LocalCollection.get_all_stats(),
+        'chunk_dedup': chunk_deduplicator.get_stats() if chunk_deduplicator else None,
+    }
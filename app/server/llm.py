@@ -1,16 +1,26 @@
+import asyncio
+import copy
+import os
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from enum import Enum
 from typing import AsyncGenerator
 
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.prebuilt import create_react_agent
-from langchain.tools.retriever import create_retriever_tool
 from langchain_core.messages import HumanMessage, BaseMessage, SystemMessage, ToolMessage, AIMessage, AIMessageChunk
-from langchain_core.prompts.prompt import PromptTemplate
 
 from app.databases.vector import VectorDB
+from app.databases.vector.retriever import CollectionGenerations
 from app.databases.postgres import Database
+from app.indexing.metadata import DocumentMetadata
 from app.models import ChatModel
+from app.server.answer_cache import SemanticAnswerCache
+from app.server.context import get_context_token_budget
+from app.server.retriever_tool import JSONDocumentFormatter, create_filtered_retriever_tool
 from app.utils.logger import Logger
+from app.utils.tenants import get_current_tenant, use_tenant
+from app.utils.timing import collect_timings
 
 
 PROMPT_MESSAGE = """When answering the user question using data from the tools, be sure to:
@@ -23,6 +33,29 @@ PROMPT_MESSAGE = """When answering the user question using data from the tools,
 If you don't know the answer, answer that you don't know based on the information you have.
 If you're not sure, state that you're not sure."""
 
+# Controls how the documents returned by the retriever tool will look when passed to the LLM: a JSON object per
+# document. Compiled once, and shared by the agents. To see the available metadata keys, check
+# `retriever.invoke('some query')[0].metadata.keys()`.
+DOCUMENT_FORMATTER = JSONDocumentFormatter({
+    'source_name': 'source_name',  # E.g. filename, article title, etc.
+    'source_id': 'source_id',      # E.g. URL, document ID, etc.
+    'modified': 'modified_at',
+    'content': 'page_content',
+})
+
+
+def get_retriever_search_kwargs() -> dict:
+    """Get the `search_kwargs` of the agent's retriever, with the optional diversity stage (see `VectorDBRetriever`)."""
+
+    search_kwargs = {'k': 8}
+    if fetch_k := os.environ.get('RETRIEVER_FETCH_K'):
+        search_kwargs['fetch_k'] = int(fetch_k)
+    if lambda_mult := os.environ.get('RETRIEVER_MMR_LAMBDA'):
+        search_kwargs['lambda_mult'] = float(lambda_mult)
+    if max_per_source := os.environ.get('RETRIEVER_MAX_PER_SOURCE'):
+        search_kwargs['max_per_source'] = int(max_per_source)
+    return search_kwargs
+
 
 class LLMEventType(Enum):
     """Event types for the LLM agent."""
@@ -106,7 +139,7 @@ class ChatMessage:
                     payload={'retrieved_data': [{
                         'source_name': document.metadata['source_name'],
                         'source_id': document.metadata['source_id'],
-                        'modified': document.metadata['modified_at'],
+                        'modified': DocumentMetadata.format_dict(document.metadata)['modified_at'],
                         'content': document.page_content,
                     } for document in event['data']['output']]},
                 )
@@ -156,7 +189,6 @@ class ChatMessage:
         }
 
 
-# TODO: Consider using a pool of agents for better performance, or some other caching mechanism.
 class LLMAgent:
     """A wrapper for the LangChain agent.
     
@@ -171,49 +203,53 @@ class LLMAgent:
     def __init__(self):
         self._agent = None
         self._llm = None
+        self._retriever = None
         self.retriever_tool_name = 'Internal_Company_Info_Retriever'
         self._checkpointer_ctx = None
+        self._checkpointer = None
+        self.created_at: datetime = None
 
     async def __aenter__(self) -> 'LLMAgent':
         """Initialize the LLM agent."""
 
-        # The Retriever in the RAG model.
-        retriever = VectorDB().as_retriever(search_kwargs={'k': 8})
+        self.created_at = datetime.now()
+
+        # The Retriever in the RAG model. The pooled agents serve all the tenants, so it's created for the default
+        # tenant, even if the agent is recycled by a tenant's request, and searches the tenant of each request.
+        with use_tenant(None):
+            self._retriever = retriever = VectorDB().as_retriever(
+                search_type=os.environ.get('RETRIEVER_SEARCH_TYPE', 'similarity'),
+                search_kwargs=get_retriever_search_kwargs(),
+            )
 
         # The ChatBot LLM
         self._llm = ChatModel()
 
-        # Retriever tool, for the R in RAG.
-        tool = create_retriever_tool(
+        # Retriever tool, for the R in RAG. The LLM can narrow its searches down by the metadata of the documents.
+        tool = create_filtered_retriever_tool(
             retriever,
             self.retriever_tool_name,
             'Searches and retrieves data from the corpus of documents that the company has',
 
-            # Controls how the returned results will look when passed to the LLM.
-            # To see available `variables`, check the `retriever.invoke('some query')[0].metadata.keys()`
-            document_prompt=PromptTemplate(
-                template_format='jinja2',
-                input_variables=['source_id', 'source_name', 'modified_at', 'page_content'],
-                template='{'
-                    '"source_name": "{{source_name}}", '  # E.g. filename, article title, etc.
-                    '"source_id": "{{source_id}}", '      # E.g. URL, document ID, etc.
-                    '"modified": "{{modified_at}}", '
-                    '"content": "{{page_content|replace(\'"\', \'""\')}}"'
-                '}',
-            ),
+            document_formatter=DOCUMENT_FORMATTER,
             document_separator='\n',
+
+            # Overlapping chunks are merged, and the documents are trimmed to what the system prompt and the
+            # conversation leave of the token budget.
+            max_tokens=get_context_token_budget(),
+            system_prompt=PROMPT_MESSAGE,
         )
         tools = [tool]
 
-        # Checkpointer for the agent.
-        self._checkpointer_ctx = AsyncPostgresSaver.from_conn_string(Database().get_connection_string())
-        checkpointer = await self._checkpointer_ctx.__aenter__()
+        # Checkpointer for the agent. It borrows connections from the shared pool, when it's open.
+        self._checkpointer_ctx = Database.checkpointer()
+        self._checkpointer = await self._checkpointer_ctx.__aenter__()
 
         # Create the agent itself.
         self._agent = create_react_agent(
             self._llm,
             tools,
-            checkpointer=checkpointer,
+            checkpointer=self._checkpointer,
             state_modifier=SystemMessage(PROMPT_MESSAGE),
         )
 
@@ -224,7 +260,22 @@ class LLMAgent:
         await self._checkpointer_ctx.__aexit__(exc_type, exc_val, exc_tb) 
         self._llm = None
         self._agent = None
+        self._retriever = None
         self._checkpointer_ctx = None
+        self._checkpointer = None
+
+    def is_healthy(self, max_age: timedelta) -> bool:
+        """Check whether the agent can be reused for another request.
+
+        An agent is considered unhealthy if it was closed, if it's older than `max_age`
+        (so it picks up configuration and vector DB changes), or if the connection of its
+        checkpointer was closed.
+        """
+
+        if self._agent is None or self.created_at + max_age < datetime.now():
+            return False
+
+        return not getattr(self._checkpointer.conn, 'closed', False)
 
     async def astream_events(self, message: str, chat_session: dict) -> AsyncGenerator[ChatMessage, None]:
         """Stream the events from the LLM agent.
@@ -237,22 +288,266 @@ class LLMAgent:
             - The event data.
         """
 
-        # Send the message to the agent and yield the events.
-        async for event in self._agent.astream_events(
-            {"messages": [HumanMessage(content=message)]},
-            config=chat_session,
-            version='v2',
-        ):
-            # Process the event and if relevant, yield a message to the user.
-            message = ChatMessage.from_event(event)
-            if message:
-                yield message
+        # The semantic answer cache is used only for the first message of a session, as later
+        # answers depend on the conversation.
+        answer_cache = SemanticAnswerCache.get_shared()
+        if answer_cache is not None and await self._is_first_turn(chat_session):
+            chat_messages = self._astream_cached_events(answer_cache, message, chat_session)
+        else:
+            chat_messages = self._astream_agent_events(message, chat_session)
+
+        async for chat_msg in chat_messages:
+            yield chat_msg
 
         # Let the client know that the conversation is done.
         yield ChatMessage.from_event({'event': 'done'})
 
+    async def _astream_agent_events(self, message: str, chat_session: dict) -> AsyncGenerator[ChatMessage, None]:
+        """Send the message to the agent and yield the relevant events as `ChatMessage` objects.
+
+        The retrievals run while the response is streamed, after its `Server-Timing` header was sent, so the
+        durations of their stages (see `timed`) are added to the `timings` of the retriever's end events instead.
+        """
+
+        with collect_timings() as timings:
+            async for event in self._agent.astream_events(
+                {"messages": [HumanMessage(content=message)]},
+                config=chat_session,
+                version='v2',
+            ):
+                # Process the event and if relevant, yield a message to the user.
+                chat_msg = ChatMessage.from_event(event)
+                if chat_msg and chat_msg.type == LLMEventType.RETRIEVER_END:
+                    chat_msg.payload['timings'] = {stage: round(duration, 1) for stage, duration in timings.items()}
+                    Logger().get_logger().debug(f'Retrieval timings: {chat_msg.payload["timings"]}')
+                    timings.clear()
+                if chat_msg:
+                    yield chat_msg
+
+    async def _astream_cached_events(
+            self,
+            answer_cache: SemanticAnswerCache,
+            message: str,
+            chat_session: dict,
+        ) -> AsyncGenerator[ChatMessage, None]:
+        """Replay the answer to a similar question from the cache, or ask the agent and cache its answer."""
+
+        # The answers are cached per tenant, since each tenant has a corpus of its own.
+        vector_db = self._retriever.for_tenant(get_current_tenant()).vectorstore
+        scope = vector_db.cache_scope
+        generation = CollectionGenerations.get(scope)
+        embedding = await vector_db.embeddings.aembed_query(message)
+
+        cached_answer = answer_cache.lookup(embedding, scope, generation)
+        if cached_answer is not None:
+            Logger().get_logger().debug(f'Answering from the cache, the question: {cached_answer.question}')
+
+            # Record the exchange in the session's history, as if the agent answered it.
+            answer = ''.join(msg.content for msg in cached_answer.messages if msg.type == LLMEventType.CHAT_CHUNK)
+            await self._agent.aupdate_state(
+                chat_session,
+                {'messages': [HumanMessage(content=message), AIMessage(content=answer)]},
+                as_node='agent',
+            )
+
+            for chat_msg in cached_answer.messages:
+                yield copy.deepcopy(chat_msg)
+            return
+
+        chat_messages = []
+        async for chat_msg in self._astream_agent_events(message, chat_session):
+            chat_messages.append(chat_msg)
+            yield chat_msg
+
+        # Cache only complete answers.
+        answer_cache.store(message, embedding, chat_messages, scope, generation)
+
+    async def _is_first_turn(self, chat_session: dict) -> bool:
+        """Check whether the chat session has no messages yet."""
+
+        state = await self._agent.aget_state(chat_session)
+        return not state.values.get('messages')
+
     async def aget_history(self, chat_session: dict) -> list[dict]:
         """Get the chat history for the given chat session."""
         
         state = await self._agent.aget_state(chat_session)
         return [ChatMessage.from_base_message(message).to_dict() for message in state.values['messages']]
+
+
+class LLMAgentPoolTimeout(TimeoutError):
+    """Raised when no agent could be leased from the pool in time."""
+
+
+class LLMAgentPool:
+    """A process-wide pool of pre-built `LLMAgent` objects.
+
+    Building an agent (retriever, chat model, tools, checkpointer and the compiled graph) costs
+    more than handling a typical request, so the agents are built once, when the server starts,
+    and leased to the requests.
+
+    Agents that failed during a lease or that are no longer healthy (see `LLMAgent.is_healthy`)
+    are recycled, i.e. closed and replaced by a new agent, when they are returned to the pool.
+
+    Example usage:
+    >>> pool = LLMAgentPool(size=4)
+    >>> await pool.open()
+    >>> async with pool.lease() as llm_agent:
+    ...     async for msg in llm_agent.astream_events('Hello', chat_session):
+    ...         print(msg)
+    >>> await pool.close()
+    """
+
+    def __init__(self, size: int = None, lease_timeout: float = None, max_agent_age: timedelta = None):
+        """Initialize the pool. Agents are created only when calling `open`.
+
+        :param size: The number of agents in the pool. Defaults to `LLM_AGENT_POOL_SIZE`.
+        :param lease_timeout: The default number of seconds to wait for an agent to become available.
+            Defaults to `LLM_AGENT_POOL_LEASE_TIMEOUT`.
+        :param max_agent_age: Agents older than that are recycled. Defaults to `LLM_AGENT_POOL_MAX_AGE`
+            (in seconds).
+        """
+
+        self.size = size or int(os.environ.get('LLM_AGENT_POOL_SIZE', 4))
+        self.lease_timeout = (
+            lease_timeout if lease_timeout is not None else float(os.environ.get('LLM_AGENT_POOL_LEASE_TIMEOUT', 30))
+        )
+        self.max_agent_age = max_agent_age or timedelta(seconds=int(os.environ.get('LLM_AGENT_POOL_MAX_AGE', 60 * 60)))
+
+        self._idle_agents: asyncio.Queue[LLMAgent] = None
+        self._agents_count = 0
+        self._leased_count = 0
+        self._all_returned = asyncio.Event()
+        self._closed = True
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def open(self) -> None:
+        """Create the agents of the pool."""
+
+        self._idle_agents = asyncio.Queue()
+        self._all_returned.set()
+        self._closed = False
+
+        agents = await asyncio.gather(*(self._create_agent() for _ in range(self.size)))
+        for agent in agents:
+            self._idle_agents.put_nowait(agent)
+
+        Logger().get_logger().info(f'LLM agent pool is ready with {self.size} agents')
+
+    async def close(self, timeout: float = None) -> None:
+        """Close all the agents of the pool.
+
+        Waits up to `timeout` seconds (defaults to the lease timeout) for leased agents to be returned.
+        Agents that are returned after that are closed on return.
+        """
+
+        self._closed = True
+        if self._idle_agents is None:
+            # The pool was never opened.
+            return
+
+        try:
+            await asyncio.wait_for(
+                self._all_returned.wait(),
+                timeout if timeout is not None else self.lease_timeout,
+            )
+        except asyncio.TimeoutError:
+            Logger().get_logger().warning(f'Closing the LLM agent pool with {self._leased_count} agents still leased')
+
+        while not self._idle_agents.empty():
+            await self._destroy_agent(self._idle_agents.get_nowait())
+
+    @asynccontextmanager
+    async def lease(self, timeout: float = None) -> AsyncGenerator[LLMAgent, None]:
+        """Lease an agent from the pool for the duration of the context.
+
+        :param timeout: The number of seconds to wait for an agent. Defaults to `self.lease_timeout`.
+
+        :raise LLMAgentPoolTimeout: If no agent became available in time.
+        """
+
+        if self._closed:
+            raise RuntimeError('The LLM agent pool is closed.')
+
+        agent = await self._acquire(timeout if timeout is not None else self.lease_timeout)
+
+        healthy = False
+        try:
+            yield agent
+            healthy = True
+        finally:
+            await self._release(agent, healthy=healthy)
+
+    def get_stats(self) -> dict:
+        """Get statistics about the pool, for monitoring."""
+        return {
+            'size': self.size,
+            'agents': self._agents_count,
+            'idle': self._idle_agents.qsize() if self._idle_agents else 0,
+            'leased': self._leased_count,
+            'closed': self._closed,
+        }
+
+    async def _acquire(self, timeout: float) -> LLMAgent:
+        """Get an idle agent, creating one if the pool lost agents that failed to be recreated."""
+
+        if not self._idle_agents.empty():
+            # Doesn't wait, so a zero timeout doesn't fail while agents are idle.
+            agent = self._idle_agents.get_nowait()
+        elif self._agents_count < self.size:
+            agent = await self._create_agent()
+        else:
+            try:
+                agent = await asyncio.wait_for(self._idle_agents.get(), timeout)
+            except asyncio.TimeoutError:
+                raise LLMAgentPoolTimeout(f'No LLM agent became available within {timeout} seconds.')
+
+        self._leased_count += 1
+        self._all_returned.clear()
+        return agent
+
+    async def _release(self, agent: LLMAgent, healthy: bool) -> None:
+        """Return the agent to the pool, recycling it if needed."""
+
+        self._leased_count -= 1
+        try:
+            if self._closed:
+                await self._destroy_agent(agent)
+            elif healthy and agent.is_healthy(self.max_agent_age):
+                self._idle_agents.put_nowait(agent)
+            else:
+                Logger().get_logger().info('Recycling an LLM agent')
+                await self._destroy_agent(agent)
+                self._idle_agents.put_nowait(await self._create_agent())
+        except Exception:
+            # The pool shrinks for now, and will create the missing agent on the next lease.
+            Logger().get_logger().exception('Failed to recycle an LLM agent')
+        finally:
+            if self._leased_count == 0:
+                self._all_returned.set()
+
+    async def _create_agent(self) -> LLMAgent:
+        """Create and initialize a new agent."""
+
+        # Count the agent up-front, so concurrent leases don't create more agents than `size`.
+        self._agents_count += 1
+        try:
+            agent = LLMAgent()
+            await agent.__aenter__()
+        except Exception:
+            self._agents_count -= 1
+            raise
+
+        return agent
+
+    async def _destroy_agent(self, agent: LLMAgent) -> None:
+        """Close the agent. Errors are logged, as there's nothing else to do with a broken agent."""
+
+        self._agents_count -= 1
+        try:
+            await agent.__aexit__(None, None, None)
+        except Exception:
+            Logger().get_logger().exception('Failed to close an LLM agent')
@@ -8,24 +8,98 @@ from starlette.middleware.sessions import SessionMiddleware
 from app.server.general import general_router
 from app.server.chat import chat_router
 from app.server.embeddings import embeddings_router
+from app.server.llm import LLMAgentPool
 from app.databases.postgres import Database
+from app.indexing.jobs import IngestionJobQueue
 from app.utils.config import Config
 from app.utils.logger import Logger
+from app.utils.tenants import get_tenant_tokens, use_tenant, validate_tenant_id
+from app.utils.timing import collect_timings, to_server_timing
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Run the database setup and teardown."""
+    """Run the database setup and teardown, and manage the process-wide resources."""
     
+    await Database.open_pool()
     await Database.setup()
     Logger().get_logger().info('Database setup complete')
 
+    # The LLM agents are expensive to build, so they're built once and shared by the requests.
+    app.state.llm_agent_pool = LLMAgentPool()
+    await app.state.llm_agent_pool.open()
+
+    # Long ingestions run in the background, instead of inside the HTTP requests.
+    app.state.ingestion_jobs = IngestionJobQueue()
+    await app.state.ingestion_jobs.open()
+
     yield
-    # Optionally add teardown code here
+
+    await app.state.ingestion_jobs.close()
+    await app.state.llm_agent_pool.close()
+    await Database.close_pool()
 
 
 app = FastAPI(lifespan=lifespan)
 
+
+def get_request_tenant(request: Request) -> str | None:
+    """Get the tenant of the request, or `None` for the default tenant.
+
+    Requests with the access token of a tenant (see `get_tenant_tokens`) belong to that tenant. Other requests
+    (with the shared access token, e.g. of trusted backends) name their tenant by the `x-tenant-id` header,
+    which is kept in the session, so the following requests of a chat session stay with the tenant.
+
+    :raises PermissionError: If the `x-tenant-id` header names another tenant than the access token.
+    :raises ValueError: If the tenant ID is invalid.
+    """
+
+    tenant_id = request.headers.get('x-tenant-id')
+    token = request.headers.get('x-access-token')
+    tenant_tokens = get_tenant_tokens()
+    if token in tenant_tokens:
+        if tenant_id is not None and validate_tenant_id(tenant_id) != tenant_tokens[token]:
+            raise PermissionError(f'The access token is not of the tenant {tenant_id}')
+        return tenant_tokens[token]
+
+    if tenant_id is not None:
+        request.session['tenant_id'] = validate_tenant_id(tenant_id)
+    return request.session.get('tenant_id')
+
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Report the durations of the stages of the request (see `timed`) in the `Server-Timing` header.
+
+    The responses are sent as soon as their body starts, so streamed responses report only the stages that
+    ran before. The chat answers retrieve their documents while they're streamed, so they report the timings
+    of the retrievals in their events instead (see `LLMAgent.astream_events`).
+    """
+
+    with collect_timings() as timings:
+        response = await call_next(request)
+
+    if timings:
+        response.headers['Server-Timing'] = to_server_timing(timings)
+    return response
+
+
+# Added before the session middleware, so it runs inside it and can use the session.
+@app.middleware("http")
+async def tenant_middleware(request: Request, call_next):
+    """Scope the vector databases of the request to its tenant. See `get_request_tenant`."""
+
+    try:
+        tenant_id = get_request_tenant(request)
+    except PermissionError as e:
+        return JSONResponse(status_code=403, content={'reason': str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={'reason': str(e)})
+
+    with use_tenant(tenant_id):
+        return await call_next(request)
+
+
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.environ['SECRET_KEY'],
@@ -34,9 +108,13 @@ app.add_middleware(
 
 @app.middleware("http")
 async def check_token_middleware(request: Request, call_next):
-    """Allow only requests with the correct token."""
+    """Allow only requests with the correct token, or with the token of a tenant (see `get_request_tenant`)."""
     token = request.headers.get("x-access-token")
-    if (Config.get_deploy_env() != 'LOCAL') and (token != os.environ['FAST_API_ACCESS_SECRET_TOKEN']):
+    if (
+        Config.get_deploy_env() != 'LOCAL'
+        and token != os.environ['FAST_API_ACCESS_SECRET_TOKEN']
+        and token not in get_tenant_tokens()
+    ):
         return JSONResponse(status_code=403, content={'reason': 'Invalid or missing token'})
     
     response = await call_next(request)
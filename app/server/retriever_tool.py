@@ -0,0 +1,199 @@
+from datetime import datetime
+from functools import partial
+from json.encoder import encode_basestring
+from langchain.schema import Document
+from langchain_core.callbacks import Callbacks
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import BasePromptTemplate, format_document
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.tools import StructuredTool
+from langgraph.prebuilt import InjectedState
+from typing import Annotated, Callable, Optional
+
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.retriever import VectorDBRetriever
+from app.indexing.metadata import DocumentMetadata, get_promoted_keys
+from app.server.context import assemble_context, get_documents_token_budget
+
+
+class FilteredRetrieverInput(BaseModel):
+    """The input of the retriever tool: the query, and optional filters of the documents."""
+
+    query: str = Field(description='query to look up in retriever')
+    source_names: Optional[list[str]] = Field(None, description='Only search the documents with these names.')
+    modified_after: Optional[datetime] = Field(
+        None,
+        description='Only search the documents modified at or after this ISO 8601 timestamp.',
+    )
+    modified_before: Optional[datetime] = Field(
+        None,
+        description='Only search the documents modified at or before this ISO 8601 timestamp.',
+    )
+    payload: Optional[dict[str, list[str]]] = Field(
+        None,
+        description='Only search the documents whose fields have one of the values, by field.',
+    )
+
+    # The conversation so far, injected by the agent (not by the LLM), for the token budget of the documents.
+    messages: Annotated[Optional[list], InjectedState('messages')] = None
+
+
+class JSONDocumentFormatter:
+    """Formats documents for the LLM as JSON objects, one per document, with some of their metadata.
+
+    Unlike a prompt template, the formatter is compiled once: the JSON of the keys is precomputed into a format
+    string, so formatting a document is only the (C-accelerated) escaping of its values, with no intermediate
+    documents nor metadata dicts. The metadata is shown in a readable form, like `DocumentMetadata.format_dict`.
+
+    Usage:
+    ```python
+    >>> formatter = JSONDocumentFormatter({'source_id': 'source_id', 'content': 'page_content'})
+    >>> formatter(Document(page_content='Say "hi"', metadata={'source_id': 42}))
+        '{"source_id": "42", "content": "Say \\"hi\\""}'
+    ```
+    """
+
+    def __init__(self, fields: dict[str, str]):
+        """Compile the formatter.
+
+        :param fields: The metadata key of each field, by its JSON key. `page_content` is the content of the document.
+        """
+
+        self.fields = dict(fields)
+        self._keys = tuple(fields.values())
+        self._template = '{' + ', '.join(f'{encode_basestring(key).replace("%", "%%")}: %s' for key in fields) + '}'
+
+    def __call__(self, doc: Document) -> str:
+        metadata = doc.metadata
+        return self._template % tuple(
+            encode_basestring(doc.page_content if key == 'page_content' else self._format_value(key, metadata.get(key)))
+            for key in self._keys
+        )
+
+    @staticmethod
+    def _format_value(key: str, value) -> str:
+        """Format a metadata value as a string. Missing values are empty."""
+
+        if value is None:
+            return ''
+        if key == 'modified_at':
+            value = DocumentMetadata.format_modified_at(value)
+        return value if isinstance(value, str) else str(value)
+
+
+def _format_with_prompt(doc: Document, document_prompt: BasePromptTemplate) -> str:
+    """Format the document with the prompt, with its metadata in a readable form. See `DocumentMetadata.format_dict`."""
+    return format_document(
+        Document(page_content=doc.page_content, metadata=DocumentMetadata.format_dict(doc.metadata)),
+        document_prompt,
+    )
+
+
+def _format_documents(
+        docs: list[Document],
+        document_formatter: Callable[[Document], str],
+        document_separator: str,
+        max_tokens: int = None,
+        system_prompt: str = '',
+        messages: list[BaseMessage] = None,
+    ) -> str:
+    """Format the documents for the LLM.
+
+    The overlapping chunks are merged, and the documents are trimmed to the tokens that the system prompt and the
+    conversation leave of the budget, if there's one (see `assemble_context`).
+    """
+
+    if max_tokens is not None:
+        max_tokens = get_documents_token_budget(max_tokens, system_prompt=system_prompt, messages=messages)
+    return assemble_context(docs, document_formatter, document_separator, max_tokens=max_tokens)
+
+
+def _get_filtered_documents(
+        query: str,
+        retriever: VectorDBRetriever,
+        document_formatter: Callable[[Document], str],
+        document_separator: str,
+        max_tokens: int = None,
+        system_prompt: str = '',
+        messages: list[BaseMessage] = None,
+        callbacks: Callbacks = None,
+        **filters,
+    ) -> str:
+    """Search the documents, pre-filtered by their metadata. Invalid filters are reported back to the LLM."""
+
+    try:
+        metadata_filter = MetadataFilter(**(filters | {'payload': filters.get('payload') or {}}))
+    except ValueError as e:
+        return f'Invalid filters: {e}'
+
+    docs = retriever.with_filter(metadata_filter).invoke(query, config={'callbacks': callbacks})
+    return _format_documents(docs, document_formatter, document_separator, max_tokens, system_prompt, messages)
+
+
+async def _aget_filtered_documents(
+        query: str,
+        retriever: VectorDBRetriever,
+        document_formatter: Callable[[Document], str],
+        document_separator: str,
+        max_tokens: int = None,
+        system_prompt: str = '',
+        messages: list[BaseMessage] = None,
+        callbacks: Callbacks = None,
+        **filters,
+    ) -> str:
+    """Same as `_get_filtered_documents`, but async."""
+
+    try:
+        metadata_filter = MetadataFilter(**(filters | {'payload': filters.get('payload') or {}}))
+    except ValueError as e:
+        return f'Invalid filters: {e}'
+
+    docs = await retriever.with_filter(metadata_filter).ainvoke(query, config={'callbacks': callbacks})
+    return _format_documents(docs, document_formatter, document_separator, max_tokens, system_prompt, messages)
+
+
+def create_filtered_retriever_tool(
+        retriever: VectorDBRetriever,
+        name: str,
+        description: str,
+        *,
+        document_prompt: BasePromptTemplate = None,
+        document_formatter: Callable[[Document], str] = None,
+        document_separator: str = '\n\n',
+        max_tokens: int = None,
+        system_prompt: str = '',
+    ) -> StructuredTool:
+    """Create a retriever tool, like `create_retriever_tool`, whose searches the LLM can pre-filter by metadata.
+
+    The filters are pushed down into the searches of the vector database (see `VectorDBRetriever.with_filter`),
+    and the payload keys that can be filtered by (see `get_promoted_keys`) are listed in the description.
+
+    :param document_prompt: Formats each document for the LLM, with its metadata in a readable form.
+    :param document_formatter: Formats each document for the LLM, instead of `document_prompt`, e.g. a
+        `JSONDocumentFormatter`.
+    :param max_tokens: The token budget of the LLM's input (see `get_context_token_budget`). The documents get what
+        the system prompt and the conversation (injected by the agent) leave of it. `None` for no budget.
+    :param system_prompt: The system prompt of the agent, for the token budget.
+    """
+
+    assert (document_prompt is None) != (document_formatter is None), 'Set either a prompt or a formatter.'
+
+    promoted_keys = get_promoted_keys()
+    description += (
+        f'. The `payload` filters can use the fields: {", ".join(promoted_keys)}.'
+        if promoted_keys else '. Don\'t use the `payload` filters.'
+    )
+    kwargs = {
+        'retriever': retriever,
+        'document_formatter': document_formatter or partial(_format_with_prompt, document_prompt=document_prompt),
+        'document_separator': document_separator,
+        'max_tokens': max_tokens,
+        'system_prompt': system_prompt,
+    }
+    return StructuredTool(
+        name=name,
+        description=description,
+        func=partial(_get_filtered_documents, **kwargs),
+        coroutine=partial(_aget_filtered_documents, **kwargs),
+        args_schema=FilteredRetrieverInput,
+    )
@@ -0,0 +1,181 @@
+import pytest
+
+from contextlib import asynccontextmanager
+from typing import Generator
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.databases.postgres import Database
+from app.utils.singleton import Singleton
+
+
+class TestDatabase:
+    """Tests for the connection pool of the `Database` class."""
+
+    @pytest.fixture(autouse=True)
+    def pool_class(self) -> Generator[MagicMock, None, None]:
+        """Replace `AsyncConnectionPool` with a mock, and start every test with no open pool.
+
+        The database is configured by the environment variables of the test, and restored afterwards.
+        """
+
+        env = {
+            'POSTGRES_PASSWORD': 'secret',
+            'POSTGRES_HOSTNAME': 'db',
+            'POSTGRES_POOL_MIN_SIZE': '1',
+            'POSTGRES_POOL_MAX_SIZE': '5',
+        }
+        with (
+            patch.dict('os.environ', env),
+            patch.dict(Singleton._instances),
+            patch.dict(Singleton._creation_time),
+            patch.object(Database, '_pool', None),
+            patch('app.databases.postgres.AsyncConnectionPool') as AsyncConnectionPoolMock,
+        ):
+            Database(force_recreate=True)
+
+            pool = AsyncConnectionPoolMock.return_value
+            pool.open = AsyncMock()
+            pool.close = AsyncMock()
+            yield AsyncConnectionPoolMock
+
+    async def test_open_pool(self, pool_class: MagicMock):
+        """The pool is configured by environment variables, opened once, and shared."""
+
+        # Run
+        pool = await Database.open_pool()
+        same_pool = await Database.open_pool()
+
+        # Validate
+        assert pool is same_pool is Database.get_pool() is pool_class.return_value
+        pool_class.assert_called_once()
+        assert pool_class.call_args.kwargs | {'check': None} == {
+            'conninfo': 'postgres://postgres:secret@db:5432/chat_db',
+            'kwargs': Database.CONNECTION_KWARGS,
+            'min_size': 1,
+            'max_size': 5,
+            'max_idle': 600.0,
+            'max_lifetime': 3_600.0,
+            'timeout': 30.0,
+            'check': None,
+            'name': 'rag-app',
+            'open': False,
+        }
+        pool.open.assert_awaited_once_with(wait=True)
+
+    async def test_close_pool(self, pool_class: MagicMock):
+        """Closing the pool closes it once, and the database falls back to dedicated connections."""
+
+        # Setup
+        pool = await Database.open_pool()
+
+        # Run
+        await Database.close_pool()
+        await Database.close_pool()
+
+        # Validate
+        pool.close.assert_awaited_once()
+        assert Database.get_pool() is None
+
+    async def test_get_pool_stats(self, pool_class: MagicMock):
+        """The statistics of the pool are renamed for monitoring, with 0 for the counters the pool didn't report."""
+
+        # Setup
+        pool_class.return_value.get_stats.return_value = {
+            'pool_min': 1,
+            'pool_max': 5,
+            'pool_size': 3,
+            'pool_available': 1,
+            'requests_waiting': 2,
+            'requests_num': 40,
+        }
+
+        # Run
+        closed_stats = Database.get_pool_stats()
+        await Database.open_pool()
+        stats = Database.get_pool_stats()
+
+        # Validate
+        assert closed_stats == {'open': False}
+        assert stats == {
+            'open': True,
+            'min_size': 1,
+            'max_size': 5,
+            'size': 3,
+            'in_use': 2,
+            'available': 1,
+            'waiting': 2,
+            'requests': 40,
+            'requests_queued': 0,
+            'requests_wait_ms': 0,
+            'requests_errors': 0,
+            'connections_lost': 0,
+        }
+
+    async def test_connection_from_pool(self, pool_class: MagicMock):
+        """The connections are borrowed from the pool when it's open."""
+
+        # Setup
+        conn = MagicMock()
+
+        @asynccontextmanager
+        async def pool_connection():
+            yield conn
+
+        pool_class.return_value.connection = pool_connection
+        await Database.open_pool()
+
+        # Run
+        with patch('app.databases.postgres.AsyncConnection.connect') as connect_mock:
+            async with Database.connection() as pool_conn:
+                pass
+
+        # Validate
+        assert pool_conn is conn
+        connect_mock.assert_not_called()
+
+    async def test_connection_without_pool(self):
+        """A dedicated connection is opened when the pool isn't open."""
+
+        # Setup
+        conn = MagicMock()
+        conn.__aenter__ = AsyncMock(return_value=conn)
+        conn.__aexit__ = AsyncMock(return_value=None)
+
+        # Run
+        with patch('app.databases.postgres.AsyncConnection.connect', AsyncMock(return_value=conn)) as connect_mock:
+            async with Database.connection() as dedicated_conn:
+                pass
+
+        # Validate
+        assert dedicated_conn is conn
+        connect_mock.assert_awaited_once_with(
+            'postgres://postgres:secret@db:5432/chat_db',
+            **Database.CONNECTION_KWARGS,
+        )
+        conn.__aexit__.assert_awaited_once()
+
+    async def test_checkpointer(self, pool_class: MagicMock):
+        """The checkpointers share the pool when it's open, and have a dedicated connection otherwise."""
+
+        # Setup
+        saver = MagicMock()
+
+        @asynccontextmanager
+        async def from_conn_string(conn_string: str):
+            yield saver
+
+        with patch('app.databases.postgres.AsyncPostgresSaver') as AsyncPostgresSaverMock:
+            AsyncPostgresSaverMock.from_conn_string = MagicMock(side_effect=from_conn_string)
+
+            # Run
+            async with Database.checkpointer() as dedicated_checkpointer:
+                pass
+            pool = await Database.open_pool()
+            async with Database.checkpointer() as pool_checkpointer:
+                pass
+
+        # Validate
+        assert dedicated_checkpointer is saver
+        AsyncPostgresSaverMock.from_conn_string.assert_called_once_with('postgres://postgres:secret@db:5432/chat_db')
+        assert pool_checkpointer is AsyncPostgresSaverMock.return_value
+        AsyncPostgresSaverMock.assert_called_once_with(pool)
@@ -1,5 +1,7 @@
 import json
 
+from unittest.mock import patch
+
 from app.databases.vector.chroma import Chroma
 from app.tests.databases.vector.vector_db_tests_base import AllDocuments, BaseVectorDBTests
 
@@ -19,3 +21,14 @@ class TestChromaDB(BaseVectorDBTests):
             } for m in res['metadatas']],
             texts=res['documents'],
         )
+
+    async def test_hnsw_params(self):
+        """New collections are created with the HNSW parameters of the environment variables."""
+
+        # Run
+        with patch.dict('os.environ', {'CHROMA_HNSW_M': '32', 'CHROMA_HNSW_SEARCH_EF': '100'}):
+            vector_db = self.VECTOR_DB_CLS(collection_name='hnsw-params')
+
+        # Validate
+        assert vector_db._collection.metadata == {'hnsw:M': 32, 'hnsw:search_ef': 100}
+        await vector_db.drop_collection('hnsw-params')
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+
+from app.databases.vector.compaction import CompactionScheduler
+
+
+class FakeCompaction:
+    """Replaces the compaction of a collection in the tests, and counts the compactions."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+
+    async def __call__(self) -> None:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+
+
+class TestCompactionScheduler:
+    """Tests for the `CompactionScheduler` class."""
+
+    @pytest.fixture
+    def scheduler(self) -> CompactionScheduler:
+        return CompactionScheduler(min_deleted_ratio=0.1, min_deleted_count=100, quiet_period=0.05)
+
+    async def wait_for_idle(self, scheduler: CompactionScheduler) -> None:
+        """Wait until the scheduled compaction completed."""
+
+        async def wait():
+            while scheduler.state != 'idle':
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(wait(), timeout=1)
+
+    @pytest.mark.parametrize('deleted_count,rows_count,expected_compactions', [
+        # Below both thresholds.
+        (5, 1_000, 0),
+
+        # Enough deleted rows, relative to the collection.
+        (50, 200, 1),
+
+        # Enough deleted rows, regardless of the collection.
+        (100, 1_000_000, 1),
+    ])
+    async def test_thresholds(
+        self,
+        scheduler: CompactionScheduler,
+        deleted_count: int,
+        rows_count: int,
+        expected_compactions: int,
+    ):
+        """A compaction is scheduled only once the deleted rows reach a threshold."""
+
+        # Setup
+        compact = FakeCompaction()
+
+        # Run
+        scheduler.record_deletes(deleted_count, rows_count=rows_count, compact=compact)
+        await asyncio.sleep(0.1)
+
+        # Validate
+        assert compact.calls == expected_compactions
+        assert scheduler.get_stats()['compactions'] == expected_compactions
+        assert scheduler.get_stats()['deleted_since_compaction'] == (0 if expected_compactions else deleted_count)
+
+    async def test_deletes_are_compacted_once(self, scheduler: CompactionScheduler):
+        """Deletes during the quiet period restart it, so a burst of deletes is compacted once."""
+
+        # Setup
+        compact = FakeCompaction()
+
+        # Run
+        for _ in range(5):
+            scheduler.record_deletes(50, rows_count=100, compact=compact)
+            await asyncio.sleep(0.02)
+
+        # Validate - The quiet period didn't pass yet.
+        assert compact.calls == 0
+        assert scheduler.get_stats()['state'] == 'scheduled'
+
+        # Validate
+        await self.wait_for_idle(scheduler)
+        assert compact.calls == 1
+        assert scheduler.get_stats()['deleted_since_compaction'] == 0
+        assert scheduler.get_stats()['last_compaction_at'] is not None
+
+    async def test_forced_compaction(self, scheduler: CompactionScheduler):
+        """Forced compactions run after the quiet period, even below the thresholds."""
+
+        # Setup
+        compact = FakeCompaction()
+
+        # Run
+        scheduler.record_deletes(1, rows_count=1_000, compact=compact, force=True)
+        await self.wait_for_idle(scheduler)
+
+        # Validate
+        assert compact.calls == 1
+
+    async def test_failed_compaction(self, scheduler: CompactionScheduler):
+        """Failed compactions keep the deleted rows, so they're retried with the next deletes."""
+
+        # Setup
+        compact = FakeCompaction(error=RuntimeError('Compaction failed'))
+
+        # Run
+        scheduler.record_deletes(100, rows_count=1_000, compact=compact)
+        await self.wait_for_idle(scheduler)
+        await asyncio.sleep(0.1)
+
+        # Validate - Not retried until the next deletes.
+        stats = scheduler.get_stats()
+        assert compact.calls == 1
+        assert stats['failures'] == 1
+        assert stats['last_error'] == 'Compaction failed'
+        assert stats['deleted_since_compaction'] == 100
+
+        # Run
+        compact.error = None
+        scheduler.record_deletes(1, rows_count=1_000, compact=compact)
+        await self.wait_for_idle(scheduler)
+
+        # Validate
+        stats = scheduler.get_stats()
+        assert compact.calls == 2
+        assert stats['compactions'] == 1
+        assert stats['last_error'] is None
+
+    async def test_reset(self, scheduler: CompactionScheduler):
+        """Resetting the scheduler cancels the scheduled compaction."""
+
+        # Setup
+        compact = FakeCompaction()
+        scheduler.record_deletes(100, rows_count=1_000, compact=compact)
+
+        # Run
+        scheduler.reset()
+        await asyncio.sleep(0.1)
+
+        # Validate
+        assert compact.calls == 0
+        assert scheduler.get_stats()['state'] == 'idle'
+        assert scheduler.get_stats()['deleted_since_compaction'] == 0
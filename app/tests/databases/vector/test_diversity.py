@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from app.databases.vector.diversity import maximal_marginal_relevance
+
+
+# Candidates 0 and 1 are near-duplicates, 2 is different, and 3 is orthogonal to all of them.
+VECTORS = np.array([
+    [1.0, 0.0, 0.0],
+    [0.99, 0.1, 0.0],
+    [0.6, 0.8, 0.0],
+    [0.0, 0.0, 1.0],
+])
+RELEVANCE = np.array([0.9, 0.88, 0.7, 0.2])
+
+
+class TestMaximalMarginalRelevance:
+    """Tests for the `maximal_marginal_relevance` function."""
+
+    def test_relevance_only(self):
+        """With `lambda_mult=1`, the candidates are selected by relevance."""
+        assert maximal_marginal_relevance(RELEVANCE, VECTORS, k=3, lambda_mult=1) == [0, 1, 2]
+
+    def test_novelty(self):
+        """Near-duplicates of the selected candidates are passed over, for less relevant but novel candidates."""
+        assert maximal_marginal_relevance(RELEVANCE, VECTORS, k=3, lambda_mult=0.5) == [0, 3, 2]
+
+    def test_max_per_source(self):
+        """At most `max_per_source` candidates of each source are selected, and fewer than `k` if needed."""
+
+        # Setup
+        sources = ['a', 'a', 'a', 'b']
+
+        # Run + Validate
+        assert maximal_marginal_relevance(
+            RELEVANCE, VECTORS, k=3, lambda_mult=1, sources=sources, max_per_source=2,
+        ) == [0, 1, 3]
+        assert maximal_marginal_relevance(
+            RELEVANCE, VECTORS, k=3, lambda_mult=1, sources=sources, max_per_source=1,
+        ) == [0, 3]
+
+    def test_zero_vectors(self):
+        """Candidates without vectors aren't similar to any candidate."""
+
+        # Setup
+        vectors = VECTORS.copy()
+        vectors[1] = 0
+
+        # Run + Validate
+        assert maximal_marginal_relevance(RELEVANCE, vectors, k=2, lambda_mult=0.5) == [0, 1]
+
+    @pytest.mark.parametrize('k', [0, 10])
+    def test_k(self, k: int):
+        """Up to `k` candidates are selected, each once."""
+
+        # Run
+        selected = maximal_marginal_relevance(RELEVANCE, VECTORS, k=k)
+
+        # Validate
+        assert sorted(selected) == list(range(min(k, len(RELEVANCE))))
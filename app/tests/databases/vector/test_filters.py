@@ -0,0 +1,53 @@
+import pytest
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from app.databases.vector.filters import MetadataFilter
+
+
+METADATA = {
+    'source_id': '1',
+    'source_name': 'Handbook',
+    'modified_at': 1_700_000_000,  # 2023-11-14T22:13:20Z
+    'team': 'data',
+    'payload': {'team': 'data'},
+}
+
+
+class TestMetadataFilter:
+
+    @pytest.mark.parametrize('metadata_filter,expected', [
+        (MetadataFilter(), True),
+        (MetadataFilter(source_ids=['1', '2']), True),
+        (MetadataFilter(source_ids=['2']), False),
+        (MetadataFilter(source_names=['Handbook'], modified_after=datetime(2023, 11, 14, 22, 13, 20)), True),
+        (MetadataFilter(modified_after=datetime(2023, 11, 15)), False),
+        (MetadataFilter(modified_before=datetime(2023, 11, 15, 0, 13, 20, tzinfo=timezone.utc)), True),
+        (MetadataFilter(modified_before=datetime(2023, 11, 14)), False),
+    ])
+    def test_matches(self, metadata_filter: MetadataFilter, expected: bool):
+        assert metadata_filter.matches(METADATA) == expected
+
+    def test_matches_legacy_modified_at(self):
+        """Chunks stored by older versions have an ISO 8601 `modified_at`, and don't match date ranges."""
+
+        metadata = METADATA | {'modified_at': '2023-11-14T22:13:20'}
+        assert MetadataFilter(source_ids=['1']).matches(metadata)
+        assert not MetadataFilter(modified_after=datetime(2020, 1, 1)).matches(metadata)
+
+    def test_payload(self):
+        """Only promoted payload keys can be filtered by."""
+
+        # Run + Validate
+        with patch.dict('os.environ', {'METADATA_PROMOTED_KEYS': 'team'}):
+            assert MetadataFilter(payload={'team': ['data', 'ml']}).matches(METADATA)
+            assert not MetadataFilter(payload={'team': ['ml']}).matches(METADATA)
+
+            with pytest.raises(ValueError):
+                MetadataFilter(payload={'author': ['someone']})
+
+    def test_is_empty(self):
+        assert MetadataFilter().is_empty()
+        assert not MetadataFilter(source_names=[]).is_empty()
+        assert not MetadataFilter(modified_before=datetime(2023, 1, 1)).is_empty()
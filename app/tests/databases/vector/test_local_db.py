@@ -0,0 +1,391 @@
+import fcntl
+import numpy as np
+import pytest
+import threading
+
+from langchain.schema import Document
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+from app.databases.vector.base import BaseVectorDatabase
+from app.databases.vector.local import LocalCollection, LocalVectorDB
+from app.tests.databases.vector.vector_db_tests_base import (
+    AllDocuments,
+    BaseVectorDBTests,
+    InsertTestParameters,
+)
+
+
+class TestLocalVectorDB(BaseVectorDBTests):
+    """Test the local vector database."""
+    VECTOR_DB_CLS = LocalVectorDB
+
+    @pytest.fixture(autouse=True, scope='class')
+    def local_vector_db_path(self, tmp_path_factory: pytest.TempPathFactory) -> Path:
+        """Store the collections of the tests in a temporary directory."""
+
+        path = tmp_path_factory.mktemp('vector-db')
+        with patch.dict('os.environ', {'LOCAL_VECTOR_DB_PATH': str(path)}):
+            yield path
+
+    def get_all_documents(self) -> AllDocuments:
+        chunks = list(self.VECTOR_DB_CLS().iter_documents())
+        documents = [document for _, document in chunks]
+        return AllDocuments(
+            ids=[chunk_id for chunk_id, _ in chunks],
+            metadatas=[document.metadata for document in documents],
+            texts=[document.page_content for document in documents],
+        )
+
+    async def create_collection_if_not_exists(
+        self,
+        vector_db: BaseVectorDatabase,
+        entry: InsertTestParameters,
+    ) -> None:
+        """The collections are created on first use."""
+        pass
+
+    async def test_search_by_source_id(self, entries: list[InsertTestParameters]):
+        """Searches can be filtered by the sources of the chunks."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        for entry in entries:
+            await vector_db.split_and_store_text(entry.text, entry.metadata)
+        source_ids = [entries[1].metadata.source_id, entries[3].metadata.source_id]
+
+        # Run
+        docs = vector_db.similarity_search(entries[0].text, k=10, filter={'source_id': source_ids})
+
+        # Validate
+        assert sorted(doc.page_content for doc in docs) == sorted([entries[1].text, entries[3].text])
+        assert vector_db.similarity_search(entries[0].text, k=10, filter={'source_id': 'non-existent'}) == []
+
+
+def change_while_compacting(collection: LocalCollection, change: Callable[[], None]) -> None:
+    """Compact the collection, and make the change from another thread while the rows are copied.
+
+    The change fails the test if it waits for the compaction, i.e. if the copy holds the lock of the collection.
+    """
+
+    write_codes = collection._write_codes
+    thread = threading.Thread(target=change)
+
+    def write_codes_and_change(*args, **kwargs):
+        if not thread.ident:
+            thread.start()
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+        return write_codes(*args, **kwargs)
+
+    with patch.object(collection, '_write_codes', side_effect=write_codes_and_change):
+        collection.compact()
+
+
+class TestLocalCollection:
+
+    @pytest.fixture
+    def collection(self, tmp_path: Path) -> LocalCollection:
+        return LocalCollection(tmp_path / 'collection')
+
+    @staticmethod
+    def add(collection: LocalCollection, vectors: dict[str, list[float]], source_id: str = 'source') -> None:
+        collection.add(
+            ids=list(vectors),
+            texts=[f'text {chunk_id}' for chunk_id in vectors],
+            metadatas=[{'source_id': source_id} for _ in vectors],
+            vectors=list(vectors.values()),
+        )
+
+    def test_search(self, collection: LocalCollection):
+        """The most similar chunks are found by cosine similarity, the most similar first."""
+
+        # Setup
+        self.add(collection, {'a': [1, 0, 0], 'b': [1, 1, 0], 'c': [0, 0, 2], 'd': [-1, 0, 0]})
+
+        # Run
+        results = collection.search([2, 0.1, 0], k=2)
+
+        # Validate
+        assert [chunk_id for chunk_id, _, _ in results] == ['a', 'b']
+        assert results[0][1] == Document(page_content='text a', metadata={'source_id': 'source'})
+        assert results[0][2] == pytest.approx(0.9988, abs=1e-4)
+        assert [chunk_id for chunk_id, _, _ in collection.search([2, 0.1, 0], k=10)] == ['a', 'b', 'c', 'd']
+
+    def test_persistence(self, collection: LocalCollection):
+        """Reopening the collection maps the same vectors, without the deleted chunks."""
+
+        # Setup
+        self.add(collection, {'a': [1, 0], 'b': [0, 1]})
+        self.add(collection, {'c': [1, 1]}, source_id='other')
+        collection.delete(['a'])
+
+        # Run
+        reopened = LocalCollection(collection.path)
+
+        # Validate
+        assert isinstance(reopened._vectors, np.memmap)
+        assert reopened.get_stats() == {'rows': 3, 'deleted': 1, 'dim': 2, 'generation': 0, 'index': None, 'quantization': None}
+        assert [chunk_id for chunk_id, _ in reopened.iter_chunks()] == ['b', 'c']
+        assert [chunk_id for chunk_id, _, _ in reopened.search([1, 0], k=1, source_ids=['other'])] == ['c']
+
+    def test_compact(self, collection: LocalCollection):
+        """Compacting reclaims the deleted rows, and keeps the other rows and their vectors."""
+
+        # Setup
+        self.add(collection, {str(i): [np.cos(i), np.sin(i)] for i in range(10)})
+        collection.delete_sources(['source'], except_ids=['2', '5', '7'])
+
+        # Run
+        collection.compact()
+
+        # Validate
+        assert collection.get_stats() == {'rows': 3, 'deleted': 0, 'dim': 2, 'generation': 1, 'index': None, 'quantization': None}
+        assert [path.name for path in collection.path.glob('*.f32')] == ['vectors-1.f32']
+        for i in [2, 5, 7]:
+            assert collection.search([np.cos(i), np.sin(i)], k=1)[0][0] == str(i)
+
+        self.add(collection, {'new': [0, -1]})
+        assert [chunk_id for chunk_id, _ in LocalCollection(collection.path).iter_chunks()] == ['2', '5', '7', 'new']
+
+    def test_recover_interrupted_insert(self, collection: LocalCollection):
+        """Vectors that were appended without their rows are discarded."""
+
+        # Setup
+        self.add(collection, {'a': [1, 0]})
+        with open(collection.vectors_path, 'ab') as f:
+            f.write(np.array([[0, 1]], dtype=np.float32).tobytes())
+
+        # Run
+        reopened = LocalCollection(collection.path)
+        self.add(reopened, {'b': [0, 1]})
+
+        # Validate
+        assert [chunk_id for chunk_id, _, _ in reopened.search([0, 1], k=2)] == ['b', 'a']
+        assert reopened.vectors_path.stat().st_size == 2 * 2 * 4
+
+    def test_used_by_another_process(self, tmp_path: Path):
+        """A collection can't be opened while another process holds the lock of its directory."""
+
+        # Setup
+        path = tmp_path / 'collection'
+        path.mkdir()
+
+        # Run + Validate
+        # Locks of other open files conflict with each other, as if they were held by another process.
+        with open(path / 'collection.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            with pytest.raises(RuntimeError):
+                LocalCollection(path)
+
+        collection = LocalCollection(path)
+        with open(path / 'collection.lock', 'a') as lock_file, pytest.raises(BlockingIOError):
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        collection.drop()
+        LocalCollection(path).drop()
+
+    def test_dimensions_mismatch(self, collection: LocalCollection):
+        self.add(collection, {'a': [1, 0]})
+        with pytest.raises(ValueError):
+            self.add(collection, {'b': [1, 0, 0]})
+
+
+class TestLocalCollectionIndex:
+
+    @pytest.fixture
+    def vectors(self) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 8))
+        return centers[rng.integers(20, size=2_000)] + rng.normal(scale=0.2, size=(2_000, 8))
+
+    @pytest.fixture
+    def collection(self, tmp_path: Path, vectors: np.ndarray) -> LocalCollection:
+        collection = LocalCollection(tmp_path / 'collection')
+        ids = [str(i) for i in range(len(vectors))]
+        collection.add(ids, ids, [{'source_id': str(i % 10)} for i in range(len(vectors))], vectors)
+        collection.build_index(nlist=20)
+        return collection
+
+    @staticmethod
+    def search_ids(collection: LocalCollection, vector: np.ndarray, **kwargs) -> list[str]:
+        return [chunk_id for chunk_id, _, _ in collection.search(vector, **kwargs)]
+
+    def test_search(self, collection: LocalCollection, vectors: np.ndarray):
+        """The index finds the nearest chunks, and probing all the centroids is exhaustive."""
+
+        # Setup
+        index = collection._index
+
+        # Run
+        results = [self.search_ids(collection, vector, k=8, nprobe=4) for vector in vectors[:50]]
+
+        # Validate
+        collection._index = None
+        expected = [self.search_ids(collection, vector, k=8) for vector in vectors[:50]]
+        collection._index = index
+
+        recall = np.mean([len(set(found) & set(exact)) / 8 for found, exact in zip(results, expected)])
+        assert recall > 0.9
+        assert [self.search_ids(collection, vector, k=8, nprobe=20) for vector in vectors[:50]] == expected
+        assert collection.get_stats()['index'] | {'max_list_size': None} == {
+            'type': 'ivf', 'nlist': 20, 'nprobe': 16, 'max_list_size': None,
+        }
+
+    def test_changes(self, collection: LocalCollection, vectors: np.ndarray):
+        """Added chunks are indexed, deleted chunks aren't found, and the index is persisted."""
+
+        # Run
+        collection.add(['new'], ['new'], [{'source_id': 'new'}], [vectors[0] + 0.01])
+        collection.delete(['0'])
+
+        # Validate
+        assert self.search_ids(collection, vectors[0], k=1, nprobe=1) == ['new']
+        assert self.search_ids(collection, vectors[3], k=1, nprobe=1, source_ids=['3']) == ['3']
+
+        reopened = LocalCollection(collection.path)
+        assert reopened.get_stats()['index']['nlist'] == 20
+        assert self.search_ids(reopened, vectors[0], k=2, nprobe=1)[0] == 'new'
+
+    def test_compact(self, collection: LocalCollection, vectors: np.ndarray):
+        """Compacting keeps the index, with the centroids of the rows that are left."""
+
+        # Setup
+        collection.delete_sources([str(i) for i in range(1, 10)])
+
+        # Run
+        collection.compact()
+
+        # Validate
+        assert [path.name for path in sorted(collection.path.glob('ivf-*'))] == [
+            'ivf-1.assignments.i32', 'ivf-1.centroids.npy',
+        ]
+        for i in range(0, 100, 10):
+            assert self.search_ids(collection, vectors[i], k=1, nprobe=1) == [str(i)]
+        assert self.search_ids(LocalCollection(collection.path), vectors[10], k=1, nprobe=1) == ['10']
+
+    def test_compact_concurrent_changes(self, collection: LocalCollection, vectors: np.ndarray):
+        """The rows added and deleted while the collection is compacted are kept, with their centroids."""
+
+        # Setup
+        collection.delete_sources([str(i) for i in range(1, 10)])
+
+        def change():
+            collection.add(['new'], ['new'], [{'source_id': 'new'}], [vectors[0] + 0.01])
+            collection.delete(['10'])
+            assert self.search_ids(collection, vectors[20], k=1, nprobe=1) == ['20']
+
+        # Run
+        change_while_compacting(collection, change)
+
+        # Validate
+        assert collection.get_stats() | {'index': None} == {
+            'rows': 201, 'deleted': 1, 'dim': 8, 'generation': 1, 'index': None, 'quantization': None,
+        }
+        for collection in [collection, LocalCollection(collection.path)]:
+            assert self.search_ids(collection, vectors[0], k=2, nprobe=1) == ['0', 'new']
+            assert self.search_ids(collection, vectors[10], k=1, nprobe=20) != ['10']
+            assert self.search_ids(collection, vectors[30], k=1, nprobe=1) == ['30']
+
+    def test_drop_index(self, collection: LocalCollection, vectors: np.ndarray):
+        """Without the index, the searches are exhaustive, and leftovers of interrupted builds are removed."""
+
+        # Setup
+        assignments_path = collection.index_paths[1]
+
+        # Run
+        collection.drop_index()
+
+        # Validate
+        assert collection.get_stats()['index'] is None
+        assert list(collection.path.glob('ivf-*')) == []
+
+        assignments_path.write_bytes(b'\0' * 8)
+        assert LocalCollection(collection.path).get_stats()['index'] is None
+        assert not assignments_path.exists()
+
+    def test_build_empty(self, tmp_path: Path):
+        with pytest.raises(ValueError):
+            LocalCollection(tmp_path / 'collection').build_index()
+
+
+@pytest.mark.parametrize('quantization', ['int8', 'binary'])
+class TestLocalCollectionQuantization:
+
+    @pytest.fixture
+    def vectors(self) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 32))
+        return centers[rng.integers(20, size=1_000)] + rng.normal(scale=0.5, size=(1_000, 32))
+
+    @pytest.fixture
+    def collection(self, tmp_path: Path, vectors: np.ndarray, quantization: str) -> LocalCollection:
+        collection = LocalCollection(tmp_path / 'collection', quantization=quantization)
+        ids = [str(i) for i in range(len(vectors))]
+        collection.add(ids, ids, [{'source_id': str(i % 10)} for i in range(len(vectors))], vectors)
+        return collection
+
+    @staticmethod
+    def search_ids(collection: LocalCollection, vector: np.ndarray, **kwargs) -> list[str]:
+        return [chunk_id for chunk_id, _, _ in collection.search(vector, **kwargs)]
+
+    def test_search(self, collection: LocalCollection, vectors: np.ndarray):
+        """The candidates found by the codes are re-ranked by the full-precision vectors."""
+
+        # Run
+        results = [collection.search(vector, k=8) for vector in vectors[:50]]
+
+        # Validate
+        expected = [collection.search(vector, k=8, exact=True) for vector in vectors[:50]]
+        recall = np.mean([
+            len({chunk_id for chunk_id, _, _ in found} & {chunk_id for chunk_id, _, _ in exact}) / 8
+            for found, exact in zip(results, expected)
+        ])
+        assert recall > 0.9
+
+        # The similarities are of the full-precision vectors.
+        assert results[0][0][0] == '0'
+        assert results[0][0][2] == pytest.approx(1, abs=1e-5)
+
+    def test_compact_concurrent_changes(self, collection: LocalCollection, vectors: np.ndarray, quantization: str):
+        """The codes of the rows added while the collection is compacted are kept."""
+
+        # Setup
+        collection.delete_sources([str(i) for i in range(1, 10)])
+
+        # Run
+        change_while_compacting(
+            collection,
+            lambda: collection.add(['new'], ['new'], [{'source_id': 'new'}], [vectors[0] + 0.01]),
+        )
+
+        # Validate
+        assert collection.get_stats()['rows'] == 101
+        for collection in [collection, LocalCollection(collection.path, quantization=quantization)]:
+            assert self.search_ids(collection, vectors[0], k=2, oversample=1) == ['0', 'new']
+
+    def test_persistence(self, collection: LocalCollection, vectors: np.ndarray, quantization: str):
+        """The codes are appended and compacted with the vectors, and recomputed when the quantization changes."""
+
+        # Setup
+        collection.add(['new'], ['new'], [{'source_id': 'new'}], [vectors[0] + 0.01])
+        collection.delete_sources([str(i) for i in range(1, 10)])
+
+        # Run
+        collection.compact()
+
+        # Validate
+        assert {path.name.split('.', 1)[0] for path in collection.path.glob('quantized-*')} == {'quantized-1'}
+        assert collection.get_stats()['quantization'] == quantization
+        assert self.search_ids(LocalCollection(collection.path, quantization=quantization), vectors[0], k=2) == [
+            '0', 'new',
+        ]
+
+        other_quantization = 'binary' if quantization == 'int8' else 'int8'
+        reopened = LocalCollection(collection.path, quantization=other_quantization)
+        assert self.search_ids(reopened, vectors[10], k=1) == ['10']
+
+        reopened = LocalCollection(collection.path, quantization='')
+        assert reopened.get_stats()['quantization'] is None
+        assert list(collection.path.glob('quantized-*')) == []
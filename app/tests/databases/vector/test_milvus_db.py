@@ -1,9 +1,14 @@
 import pytest
 
 from langchain.schema import Document
+from langchain_milvus.vectorstores import Milvus as LangMilvus
+from pymilvus import DataType, MilvusException, utility
+from unittest.mock import patch
 
 from app.databases.vector.base import BaseVectorDatabase
-from app.databases.vector.milvus import Milvus
+from app.databases.vector.milvus import Milvus, MilvusBM25Index
+from app.databases.vector.retriever import CollectionGenerations
+from app.databases.vector.sparse import InMemoryBM25Index
 from app.tests.databases.vector.vector_db_tests_base import (
     AllDocuments,
     BaseVectorDBTests,
@@ -55,3 +60,238 @@ class TestMilvusDB(BaseVectorDBTests):
             await vector_db.drop_collection(collection_name + '111')
 
         assert str(exc_ctx.value) == 'Can drop only the current collection.'
+
+    async def test_native_sparse_index(self, entries: list[InsertTestParameters], collection_name: str):
+        """The sparse index is a companion collection with native BM25 search, dropped with the collection."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Run
+        docs = await vector_db.asparse_search('fox', k=1)
+
+        # Validate
+        sparse_index = vector_db.get_sparse_index()
+        assert isinstance(sparse_index, MilvusBM25Index)
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+        assert utility.has_collection(sparse_index.collection_name, using=vector_db.alias)
+
+        # Run & Validate - the companion collection is dropped with the collection.
+        await vector_db.drop_collection(collection_name)
+        assert not utility.has_collection(sparse_index.collection_name, using=vector_db.alias)
+
+    async def test_native_sparse_index_failed_load(self, entries: list[InsertTestParameters]):
+        """A companion collection whose filling failed isn't used, and is filled again by the next search."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+        sparse_index = vector_db.get_sparse_index()
+
+        # Run
+        with patch.object(MilvusBM25Index, '_upsert', side_effect=MilvusException(message='Connection lost')):
+            with pytest.raises(MilvusException):
+                await vector_db.asparse_search('fox', k=1)
+
+        # Validate
+        assert not [
+            name for name in utility.list_collections(using=vector_db.alias)
+            if name.startswith(sparse_index.collection_name)
+        ]
+
+        # Run & Validate - the next search fills the companion collection.
+        docs = await vector_db.asparse_search('fox', k=1)
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+
+    async def test_native_sparse_index_not_loaded(self, entries: list[InsertTestParameters]):
+        """Until the companion collection exists, the writes don't check whether it exists on every write."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+
+        # Run
+        with patch('app.databases.vector.milvus.utility.has_collection', wraps=utility.has_collection) as has_mock:
+            for entry in entries[:3]:
+                await vector_db.split_and_store_text(entry.text, entry.metadata)
+
+        # Validate
+        assert [call.args[0] for call in has_mock.call_args_list].count(
+            vector_db.get_sparse_index().collection_name
+        ) == 1
+
+    async def test_sparse_index_fallback(self, entries: list[InsertTestParameters]):
+        """Milvus servers without native BM25 search fall back to the in-memory index."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Run
+        with patch.object(MilvusBM25Index, 'create_collection', side_effect=MilvusException(message='Unsupported')):
+            docs = await vector_db.asparse_search('fox', k=1)
+
+        # Validate
+        assert isinstance(vector_db.get_sparse_index(), InMemoryBM25Index)
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+
+    async def test_index_params(self, entries: list[InsertTestParameters]):
+        """New collections are indexed and searched with the configured index and search params."""
+
+        # Setup
+        env = {
+            'MILVUS_INDEX_TYPE': 'ivf_flat',
+            'MILVUS_INDEX_PARAMS': '{"nlist": 8}',
+            'MILVUS_SEARCH_PARAMS': '{"nprobe": 4}',
+        }
+        with patch.dict('os.environ', env):
+            vector_db = self.VECTOR_DB_CLS()
+
+        # Run
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+        docs = vector_db.search(entries[1].text, 'similarity', k=1, param={'nprobe': 8})
+
+        # Validate
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+        assert vector_db._get_index()['index_param'] == {
+            'index_type': 'IVF_FLAT',
+            'metric_type': 'L2',
+            'params': {'nlist': 8},
+        }
+        assert vector_db.search_params == {'metric_type': 'L2', 'params': {'nprobe': 4}}
+
+    async def test_existing_index_is_kept(self, entries: list[InsertTestParameters]):
+        """Existing collections are searched with the params of their own index, when another index is configured."""
+
+        # Setup
+        await self.VECTOR_DB_CLS().split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Run
+        with patch.dict('os.environ', {'MILVUS_INDEX_TYPE': 'IVF_FLAT'}):
+            vector_db = self.VECTOR_DB_CLS()
+
+        # Validate
+        assert vector_db.index_params['index_type'] == 'HNSW'
+        assert vector_db.search_params == {'metric_type': 'L2', 'params': {'ef': 64}}
+        docs = vector_db.search(entries[1].text, 'similarity', k=1, param={'ef': 16})
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+
+    def test_unknown_index_type(self):
+        """Unknown index types are rejected."""
+
+        # Run + Validate
+        with patch.dict('os.environ', {'MILVUS_INDEX_TYPE': 'NOPE'}), pytest.raises(ValueError):
+            self.VECTOR_DB_CLS()
+
+    async def test_read_your_writes(self, entries: list[InsertTestParameters]):
+        """With Bounded reads, the searches of a process wait for its own writes, for the staleness window."""
+
+        # Setup
+        with patch.dict('os.environ', {'MILVUS_READ_CONSISTENCY_LEVEL': 'Bounded'}):
+            vector_db = self.VECTOR_DB_CLS()
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Run
+        with patch.object(vector_db.col, 'search', wraps=vector_db.col.search) as search:
+            docs = vector_db.search(entries[1].text, 'similarity', k=1)
+
+        # Validate
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+        assert search.call_args.kwargs['consistency_level'] == 'Session'
+
+        # Run + Validate - once the staleness window passed, the searches don't wait anymore.
+        with patch.dict('os.environ', {'MILVUS_BOUNDED_STALENESS': '0'}):
+            assert vector_db.get_read_consistency_level() == 'Bounded'
+
+    async def test_scalar_indexes(self, entries: list[InsertTestParameters]):
+        """The fields that searches are filtered by are indexed, including the promoted payload keys."""
+
+        # Setup
+        metadata = entries[1].metadata
+        metadata.payload = {'team': 'data'}
+
+        # Run
+        with patch.dict('os.environ', {'METADATA_PROMOTED_KEYS': 'team'}):
+            vector_db = self.VECTOR_DB_CLS()
+            await vector_db.split_and_store_text(entries[1].text, metadata)
+
+        # Validate
+        fields = {field.name: field.dtype for field in vector_db.col.schema.fields}
+        assert fields['modified_at'] == DataType.INT64
+        assert fields['team'] == DataType.VARCHAR
+        assert {index.field_name for index in vector_db.col.indexes} >= {
+            'source_id', 'source_name', 'modified_at', 'team',
+        }
+
+    async def test_legacy_modified_at(self, entries: list[InsertTestParameters]):
+        """Collections created by older versions, with an ISO 8601 `modified_at`, can still be written to."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        legacy_metadata = entries[0].metadata.to_dict() | {'modified_at': '2021-01-01T00:00:00'}
+        vector_db.add_texts([entries[0].text], [legacy_metadata])
+
+        # Run
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Validate
+        docs = self.get_all_documents()
+        assert docs.texts == [entries[0].text, entries[1].text]
+        assert docs.metadatas[1]['modified_at'] == '2021-02-02T00:00:00+00:00'
+
+    async def test_tenant_partitions(self, entries: list[InsertTestParameters]):
+        """The tenants share the collection, partitioned by the tenant, and their searches filter by the tenant."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        await vector_db.split_and_store_text(entries[0].text, entries[0].metadata)
+        tenant_db = vector_db.with_tenant('acme')
+
+        # Run
+        with patch.object(tenant_db.col, 'search', wraps=tenant_db.col.search) as search_mock:
+            tenant_db.similarity_search('This is a test.', k=2, expr='source_id == "1"')
+
+        # Validate
+        partition_key, = [field for field in vector_db.col.schema.fields if field.is_partition_key]
+        assert partition_key.name == 'tenant_id'
+        assert tenant_db.collection_name == vector_db.collection_name
+        assert vector_db.with_tenant('acme') is tenant_db
+        assert search_mock.call_args.kwargs['expr'] == '(source_id == "1") and tenant_id == "acme"'
+
+    async def test_tenant_drop_collection(self, entries: list[InsertTestParameters], source_manifest):
+        """Dropping the collection of the default tenant also forgets the manifests and BM25 collections of tenants."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        tenant_db = vector_db.with_tenant('acme')
+        await vector_db.upsert_text(entries[0].text, entries[0].metadata)
+        await tenant_db.upsert_text(entries[1].text, entries[1].metadata)
+        await tenant_db.asparse_search('quick fox')
+        tenant_bm25_collection = tenant_db._get_bm25_index().collection_name
+        generation = CollectionGenerations.get(tenant_db.cache_scope)
+        assert await vector_db.get_tenant_ids() == ['acme']
+
+        # Run
+        await vector_db.drop_collection(vector_db.collection_name)
+
+        # Validate
+        assert source_manifest.entries == {}
+        assert not utility.has_collection(tenant_bm25_collection, using=vector_db.alias)
+        assert CollectionGenerations.get(tenant_db.cache_scope) > generation
+
+    async def test_tenant_legacy_collection(self, entries: list[InsertTestParameters]):
+        """Collections created by older versions, without a partition key, serve only the default tenant."""
+
+        # Setup - older versions didn't add the tenant to the metadata.
+        legacy_db = self.VECTOR_DB_CLS(partition_key_field=None)
+        LangMilvus.add_texts(legacy_db, [entries[0].text], [entries[0].metadata.to_dict()])
+
+        # Run
+        vector_db = self.VECTOR_DB_CLS()
+        tenant_db = vector_db.with_tenant('acme')
+        await vector_db.split_and_store_text(entries[1].text, entries[1].metadata)
+
+        # Validate
+        assert self.get_all_documents().texts == [entries[0].text, entries[1].text]
+        with pytest.raises(ValueError, match='has no tenants'):
+            tenant_db.similarity_search('This is a test.')
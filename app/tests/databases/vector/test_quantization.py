@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.databases.vector.quantization import BinaryQuantizer, Int8Quantizer, get_quantizer
+
+
+def make_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestQuantizers:
+
+    def test_int8(self):
+        """The int8 scores approximate the cosine similarities closely."""
+
+        # Setup
+        quantizer = Int8Quantizer()
+        vectors, query = make_vectors(100, 64), make_vectors(1, 64, seed=1)[0]
+
+        # Run
+        codes = quantizer.encode(vectors)
+        scores = quantizer.score(codes, query)
+
+        # Validate
+        assert codes['codes.i8'].dtype == np.int8
+        assert np.abs(scores - vectors @ query).max() < 0.01
+        assert quantizer.get_bytes_per_row(1024) == 1024 + 4
+
+    @pytest.mark.parametrize('dim', [64, 100])
+    def test_binary(self, dim: int):
+        """The binary scores rank the vectors by the Hamming distance of their signs."""
+
+        # Setup
+        quantizer = BinaryQuantizer()
+        vectors, query = make_vectors(100, dim), make_vectors(1, dim, seed=1)[0]
+
+        # Run
+        codes = quantizer.encode(vectors)
+        scores = quantizer.score(codes, query)
+
+        # Validate
+        assert codes['bits.u8'].shape == (100, (dim + 15) // 16 * 2)
+        assert (scores == -((vectors > 0) != (query > 0)).sum(axis=1)).all()
+        assert np.corrcoef(scores, vectors @ query)[0, 1] > 0.5
+        assert quantizer.get_bytes_per_row(1024) == 128
+
+    def test_get_quantizer(self):
+        assert get_quantizer('') is None
+        assert isinstance(get_quantizer('binary'), BinaryQuantizer)
+        with pytest.raises(ValueError):
+            get_quantizer('int4')
@@ -0,0 +1,329 @@
+import pytest
+
+from langchain.schema import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.retriever import (
+    CollectionGenerations,
+    RetrieverCache,
+    VectorDBRetriever,
+    normalize_query,
+)
+from app.databases.vector.sparse import InMemoryBM25Index
+from app.utils.timing import collect_timings
+
+
+class CountingVectorStore(InMemoryVectorStore):
+    """An in-memory vector store that counts the searches, in place of a real vector DB."""
+
+    cache_scope = 'CountingVectorStore:test'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.searches = 0
+
+    def similarity_search(self, *args, **kwargs) -> list[Document]:
+        self.searches += 1
+        return super().similarity_search(*args, **kwargs)
+
+    def similarity_search_by_vector(self, *args, **kwargs) -> list[Document]:
+        self.searches += 1
+        return super().similarity_search_by_vector(*args, **kwargs)
+
+    def similarity_search_with_vectors(self, embedding: list[float], k: int = 4, **kwargs) -> list[tuple]:
+        self.searches += 1
+        results = self._similarity_search_with_score_by_vector(embedding, k, **kwargs)
+        return [(doc, vector) for doc, _, vector in results]
+
+    async def asimilarity_search_with_vectors(self, embedding: list[float], k: int = 4, **kwargs) -> list[tuple]:
+        return self.similarity_search_with_vectors(embedding, k=k, **kwargs)
+
+
+class HybridVectorStore(CountingVectorStore):
+    """Also searches the texts with BM25, like `BaseVectorDatabase.sparse_search`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse_index = InMemoryBM25Index()
+        self.sparse_index.load(lambda: [])
+        self.sparse_searches = 0
+
+    def add_texts(self, texts: list[str], metadatas: list[dict] = None, **kwargs) -> list[str]:
+        ids = super().add_texts(texts, metadatas=metadatas, **kwargs)
+        metadatas = metadatas or [{} for _ in texts]
+        self.sparse_index.add(ids, [Document(page_content=text, metadata=m) for text, m in zip(texts, metadatas)])
+        return ids
+
+    def sparse_search(self, query: str, k: int = 4, metadata_filter: MetadataFilter = None) -> list[Document]:
+        self.sparse_searches += 1
+        return self.sparse_index.search(query, k=k, metadata_filter=metadata_filter)
+
+    async def asparse_search(self, query: str, k: int = 4, metadata_filter: MetadataFilter = None) -> list[Document]:
+        return self.sparse_search(query, k=k, metadata_filter=metadata_filter)
+
+    def get_filter_kwargs(self, metadata_filter: MetadataFilter) -> dict:
+        return {'filter': lambda doc: metadata_filter.matches(doc.metadata)}
+
+
+class TestVectorDBRetriever:
+    """Tests for the `VectorDBRetriever` class and its cache."""
+
+    @pytest.fixture
+    def vector_store(self) -> CountingVectorStore:
+        vector_store = CountingVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(['apples', 'bananas', 'cherries'], metadatas=[{'i': 0}, {'i': 1}, {'i': 2}])
+        return vector_store
+
+    @pytest.fixture
+    def cache(self) -> RetrieverCache:
+        return RetrieverCache(max_size=10)
+
+    @pytest.mark.parametrize('query,expected', [
+        ('Hello World', 'Hello World'),
+        ('  Hello \n\t World  ', 'Hello World'),
+        ('hello world', 'hello world'),
+    ])
+    def test_normalize_query(self, query: str, expected: str):
+        assert normalize_query(query) == expected
+
+    def test_cache_hit(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Repeated and near-identical queries are served from the cache."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 2}, cache=cache)
+
+        # Run
+        docs_1 = retriever.invoke('Which fruits?')
+        docs_2 = retriever.invoke('  Which   fruits? ')
+
+        # Validate
+        assert docs_1 == docs_2
+        assert len(docs_1) == 2
+        assert vector_store.searches == 1
+        assert cache.get_stats()['search_results']['hits'] == 1
+        assert cache.get_stats()['query_embeddings']['misses'] == 1
+
+    def test_case_sensitive(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Queries that differ only in case have their own embeddings and search results."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 2}, cache=cache)
+
+        # Run
+        retriever.invoke('Apple')
+        retriever.invoke('apple')
+        retriever.invoke(' apple ')
+
+        # Validate
+        assert vector_store.searches == 2
+        assert cache.get_stats()['search_results']['hits'] == 1
+        assert cache.get_stats()['search_results']['misses'] == 2
+        assert cache.get_stats()['query_embeddings']['misses'] == 2
+        assert retriever._search_key('Apple') != retriever._search_key('apple')
+
+    async def test_cache_hit_async(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Same as `test_cache_hit`, but async."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 2}, cache=cache)
+
+        # Run
+        docs_1 = await retriever.ainvoke('Which fruits?')
+        docs_2 = await retriever.ainvoke(' Which fruits? ')
+
+        # Validate
+        assert docs_1 == docs_2
+        assert vector_store.searches == 1
+
+    def test_search_kwargs_in_key(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Different search parameters are cached separately, but share the query embedding."""
+
+        # Run
+        VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 1}, cache=cache).invoke('fruits')
+        docs = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 3}, cache=cache).invoke('fruits')
+
+        # Validate
+        assert len(docs) == 3
+        assert vector_store.searches == 2
+        assert cache.get_stats()['query_embeddings']['hits'] == 1
+
+    def test_invalidate_on_change(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Bumping the generation of the collection invalidates its search results."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 10}, cache=cache)
+        retriever.invoke('fruits')
+
+        # Run
+        vector_store.add_texts(['dates'])
+        CollectionGenerations.bump(vector_store.cache_scope)
+        docs = retriever.invoke('fruits')
+
+        # Validate
+        assert len(docs) == 4
+        assert vector_store.searches == 2
+
+    def test_cached_documents_are_copies(self, vector_store: CountingVectorStore, cache: RetrieverCache):
+        """Changing the returned documents doesn't change the cached ones."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 1}, cache=cache)
+
+        # Run
+        doc, = retriever.invoke('fruits')
+        doc.metadata['i'] = 'changed'
+        doc, = retriever.invoke('fruits')
+
+        # Validate
+        assert doc.metadata['i'] != 'changed'
+
+    def test_no_cache(self, vector_store: CountingVectorStore):
+        """Without a cache, every query is searched."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 1})
+
+        # Run
+        retriever.invoke('fruits')
+        retriever.invoke('fruits')
+
+        # Validate
+        assert vector_store.searches == 2
+
+
+class TestHybridRetriever:
+    """Tests for the `hybrid` search type of `VectorDBRetriever`."""
+
+    @pytest.fixture
+    def vector_store(self) -> HybridVectorStore:
+        vector_store = HybridVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(
+            [f'Ticket TKT-{i}: the page {i} is slow.' for i in range(1_000, 1_020)],
+            metadatas=[{'source_id': f'ticket-{i}'} for i in range(20)],
+        )
+        return vector_store
+
+    @pytest.mark.parametrize('use_cache', [True, False])
+    async def test_exact_identifier(self, vector_store: HybridVectorStore, use_cache: bool):
+        """The chunk with the exact identifier is retrieved, even if the dense search misses it."""
+
+        # Setup
+        cache = RetrieverCache(max_size=10) if use_cache else None
+        retriever = VectorDBRetriever(
+            vectorstore=vector_store,
+            search_type='hybrid',
+            search_kwargs={'k': 3, 'fetch_k': 3},
+            cache=cache,
+        )
+
+        # Run
+        docs = await retriever.ainvoke('Why is TKT-1017 slow?')
+        sync_docs = retriever.invoke('Why is TKT-1017 slow?')
+
+        # Validate
+        assert len(docs) == 3
+        assert 'TKT-1017' in docs[0].page_content or 'TKT-1017' in docs[1].page_content
+        assert sync_docs == docs
+        assert vector_store.sparse_searches == (1 if use_cache else 2)
+
+    def test_cached_separately(self, vector_store: HybridVectorStore):
+        """The `hybrid` and `similarity` search results are cached separately."""
+
+        # Setup
+        cache = RetrieverCache(max_size=10)
+
+        # Run
+        VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 2}, cache=cache).invoke('slow')
+        VectorDBRetriever(
+            vectorstore=vector_store, search_type='hybrid', search_kwargs={'k': 2}, cache=cache,
+        ).invoke('slow')
+
+        # Validate
+        assert vector_store.sparse_searches == 1
+        assert cache.get_stats()['search_results']['misses'] == 2
+
+    @pytest.mark.parametrize('search_type', ['similarity', 'hybrid'])
+    async def test_filtered(self, vector_store: HybridVectorStore, search_type: str):
+        """Both searches are pre-filtered, so all the results match the filters, and they're cached separately."""
+
+        # Setup
+        cache = RetrieverCache(max_size=10)
+        retriever = VectorDBRetriever(
+            vectorstore=vector_store,
+            search_type=search_type,
+            search_kwargs={'k': 3, 'fetch_k': 3} if search_type == 'hybrid' else {'k': 3},
+            cache=cache,
+        )
+        metadata_filter = MetadataFilter(source_ids=['ticket-2', 'ticket-17'])
+
+        # Run
+        docs = await retriever.ainvoke('Why is TKT-1017 slow?')
+        filtered_docs = await retriever.with_filter(metadata_filter).ainvoke('Why is TKT-1017 slow?')
+
+        # Validate
+        assert len(docs) == 3
+        assert sorted(doc.metadata['source_id'] for doc in filtered_docs) == ['ticket-17', 'ticket-2']
+        assert retriever.metadata_filter is None
+        assert cache.get_stats()['search_results']['misses'] == 2
+
+
+class TestDiverseRetriever:
+    """Tests for the diversity stage of `VectorDBRetriever`."""
+
+    @pytest.fixture
+    def vector_store(self) -> HybridVectorStore:
+        vector_store = HybridVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(
+            [f'Ticket TKT-{i}: the page {i} is slow.' for i in range(1_000, 1_012)],
+            metadatas=[{'source_id': f'ticket-{i % 3}'} for i in range(12)],
+        )
+        return vector_store
+
+    @pytest.mark.parametrize('search_type', ['similarity', 'hybrid'])
+    @pytest.mark.parametrize('use_cache', [True, False])
+    async def test_max_per_source(self, vector_store: HybridVectorStore, search_type: str, use_cache: bool):
+        """The documents are selected among the candidates, with at most `max_per_source` of each source."""
+
+        # Setup
+        retriever = VectorDBRetriever(
+            vectorstore=vector_store,
+            search_type=search_type,
+            search_kwargs={'k': 4, 'fetch_k': 12, 'max_per_source': 1},
+            cache=RetrieverCache(max_size=10) if use_cache else None,
+        )
+
+        # Run
+        docs = await retriever.ainvoke('Why is TKT-1007 slow?')
+        sync_docs = retriever.invoke('Why is TKT-1007 slow?')
+
+        # Validate
+        assert sorted(doc.metadata['source_id'] for doc in docs) == ['ticket-0', 'ticket-1', 'ticket-2']
+        assert sync_docs == docs
+
+    def test_relevance_order(self, vector_store: HybridVectorStore):
+        """With `lambda_mult=1`, the stage keeps the order of the similarity search."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 4})
+
+        # Run
+        docs = retriever.invoke('slow')
+        diverse_docs = retriever.copy(update={'search_kwargs': {'k': 4, 'lambda_mult': 1.0}}).invoke('slow')
+
+        # Validate
+        assert diverse_docs == docs
+
+    def test_timings(self, vector_store: HybridVectorStore):
+        """The durations of the searches and of the stage are reported."""
+
+        # Setup
+        retriever = VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 4, 'lambda_mult': 0.5})
+
+        # Run
+        with collect_timings() as timings:
+            retriever.invoke('slow')
+
+        # Validate
+        assert set(timings) == {'retrieval', 'diversity'}
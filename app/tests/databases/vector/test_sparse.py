@@ -0,0 +1,146 @@
+import pytest
+
+from langchain.schema import Document
+
+from app.databases.vector.filters import MetadataFilter
+from app.databases.vector.sparse import (
+    InMemoryBM25Index,
+    reciprocal_rank_fusion,
+    reciprocal_rank_fusion_scores,
+    tokenize,
+)
+
+
+def make_chunk(text: str, source_id: str = 'source-1') -> Document:
+    return Document(page_content=text, metadata={'source_id': source_id})
+
+
+CHUNKS = {
+    '1': make_chunk('The deployment failed with error E-4012 on the staging cluster.', 'runbook'),
+    '2': make_chunk('Ticket TKT-1234: the login page is slow for some users.', 'tickets'),
+    '3': make_chunk('Ticket TKT-5678: the export button is missing.', 'tickets'),
+    '4': make_chunk('How to restart the staging cluster after a failed deployment.', 'runbook'),
+}
+
+
+class TestTokenize:
+
+    @pytest.mark.parametrize('text,expected', [
+        ('Hello, World!', ['hello', 'world']),
+        ('Error TKT-1234', ['error', 'tkt-1234', 'tkt', '1234']),
+        ('Upgrade to v2.1.0.', ['upgrade', 'to', 'v2.1.0', 'v2', '1', '0']),
+        ('', []),
+    ])
+    def test_tokenize(self, text: str, expected: list[str]):
+        assert tokenize(text) == expected
+
+
+class TestInMemoryBM25Index:
+
+    @pytest.fixture
+    def index(self) -> InMemoryBM25Index:
+        index = InMemoryBM25Index()
+        index.load(lambda: CHUNKS.items())
+        return index
+
+    @pytest.mark.parametrize('query,expected_id', [
+        ('TKT-1234', '2'),
+        ('what is E-4012?', '1'),
+        ('restart the cluster', '4'),
+    ])
+    def test_search(self, index: InMemoryBM25Index, query: str, expected_id: str):
+        """The chunks with the rarest terms of the query rank first."""
+
+        # Run
+        docs = index.search(query, k=2)
+
+        # Validate
+        assert docs[0] == CHUNKS[expected_id]
+
+    def test_search_no_match(self, index: InMemoryBM25Index):
+        assert index.search('nothing relevant here', k=2) == []
+
+    def test_search_filtered(self, index: InMemoryBM25Index):
+        """Only the chunks that match the filters are ranked, so the best of them are returned."""
+
+        # Run
+        docs = index.search('staging cluster', k=2, metadata_filter=MetadataFilter(source_ids=['tickets']))
+
+        # Validate
+        assert docs == []
+        assert index.search('ticket', k=1, metadata_filter=MetadataFilter(source_ids=['tickets']))[0] in (
+            CHUNKS['2'], CHUNKS['3'],
+        )
+
+    def test_changes_before_load_are_ignored(self):
+        """Until it's loaded, the index ignores changes, which are picked up by `load`."""
+
+        # Setup
+        index = InMemoryBM25Index()
+
+        # Run
+        index.add(['1'], [CHUNKS['1']])
+
+        # Validate
+        assert index.get_stats()['chunks'] == 0
+        index.load(lambda: CHUNKS.items())
+        assert index.get_stats()['chunks'] == 4
+
+    def test_add_and_delete(self, index: InMemoryBM25Index):
+        """Added chunks are searchable, replace chunks of the same ID, and deleted chunks aren't."""
+
+        # Run & Validate - add.
+        index.add(['5'], [make_chunk('Ticket TKT-9999: a new ticket.', 'tickets')])
+        assert index.search('TKT-9999', k=1)[0].page_content == 'Ticket TKT-9999: a new ticket.'
+
+        # Run & Validate - replace.
+        index.add(['5'], [make_chunk('Ticket TKT-8888: an edited ticket.', 'tickets')])
+        assert index.search('TKT-9999 edited', k=1)[0].page_content == 'Ticket TKT-8888: an edited ticket.'
+        assert index.search('new', k=1) == []
+        assert index.get_stats()['chunks'] == 5
+
+        # Run & Validate - delete chunks.
+        index.delete_chunks(['5', 'non-existent'])
+        assert index.search('edited', k=1) == []
+
+        # Run & Validate - delete sources, except for some of their chunks.
+        index.delete_sources(['tickets'], except_ids=['3'])
+        assert index.search('ticket', k=4) == [CHUNKS['3']]
+
+        index.delete_sources(['runbook', 'tickets'])
+        assert index.get_stats() | {'loaded_at': None} == {'loaded_at': None, 'chunks': 0, 'terms': 0}
+
+    def test_search_returns_copies(self, index: InMemoryBM25Index):
+        """The callers can't modify the indexed chunks."""
+
+        # Run
+        index.search('TKT-1234', k=1)[0].metadata['source_id'] = 'modified'
+
+        # Validate
+        assert index.search('TKT-1234', k=1)[0].metadata['source_id'] == 'tickets'
+
+
+def test_reciprocal_rank_fusion():
+    """Chunks ranked well by both rankings come first, and each chunk is returned once."""
+
+    # Setup
+    a, b, c, d = (make_chunk(text) for text in 'abcd')
+
+    # Run
+    docs = reciprocal_rank_fusion([[a, b, c], [make_chunk('c'), d, b]])
+
+    # Validate
+    assert docs == [c, b, a, d]
+
+
+def test_reciprocal_rank_fusion_scores():
+    """The fused score of each chunk is the sum of its reciprocal ranks."""
+
+    # Setup
+    a, b = make_chunk('a'), make_chunk('b')
+
+    # Run
+    results = reciprocal_rank_fusion_scores([[a, b], [make_chunk('b')]], k=1)
+
+    # Validate
+    assert results == [(b, 1 / 3 + 1 / 2), (a, 1 / 2)]
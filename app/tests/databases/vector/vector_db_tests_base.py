@@ -1,5 +1,8 @@
 import abc
+import asyncio
+import numpy as np
 import pytest
+import time
 import uuid
 
 from collections import namedtuple
@@ -9,9 +12,13 @@ from typing import AsyncGenerator, Type
 from unittest.mock import patch
 
 from app.databases.vector.base import BaseVectorDatabase
+from app.databases.vector.filters import MetadataFilter
+from app.indexing.dedup import ChunkDeduplicator, SignatureIndexEntry
+from app.indexing.manifest import SourceManifestEntry
 from app.indexing.metadata import DocumentMetadata
 from app.indexing.text.base import BaseTextIndexing
 from app.tests.test_utils.string_utils import regularize_spaces
+from app.utils.tenants import use_tenant
 
 
 InsertTestParameters = namedtuple('InsertTestParameters', ['text', 'metadata', 'expected_entries'])
@@ -24,6 +31,83 @@ class AllDocuments:
     texts: list[str]
 
 
+class FakeSourceManifest:
+    """Replaces `SourceManifest` in the tests, so no database is needed."""
+
+    def __init__(self):
+        self.entries: dict[tuple[str, str], SourceManifestEntry] = {}
+
+    async def get(self, scope: str, source_id: str) -> SourceManifestEntry | None:
+        return self.entries.get((scope, source_id))
+
+    async def set(self, entry: SourceManifestEntry) -> None:
+        self.entries[(entry.scope, entry.source_id)] = entry
+
+    async def get_scopes(self, prefix: str) -> list[str]:
+        return sorted({scope for scope, _ in self.entries if scope.startswith(prefix)})
+
+    async def delete(self, scope: str, source_id: str = None) -> None:
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if key[0] != scope or (source_id is not None and key[1] != source_id)
+        }
+
+    async def delete_many(self, scope: str, source_ids: list[str]) -> None:
+        self.entries = {
+            key: entry for key, entry in self.entries.items() if key[0] != scope or key[1] not in source_ids
+        }
+
+
+class FakeChunkSignatureIndex:
+    """Replaces `ChunkSignatureIndex` in the tests, so no database is needed."""
+
+    def __init__(self):
+        self.entries: dict[tuple[str, str], SignatureIndexEntry] = {}
+        self.links: dict[tuple[str, str], list[dict]] = {}
+
+    async def find(
+            self,
+            scope: str,
+            band_keys: list[int],
+            exclude_source_ids: list[str] = None,
+        ) -> dict[str, np.ndarray]:
+        return {
+            chunk_id: entry.signature for (entry_scope, chunk_id), entry in self.entries.items()
+            if entry_scope == scope and set(entry.band_keys) & set(band_keys)
+            and entry.source_id not in (exclude_source_ids or [])
+        }
+
+    async def add(self, scope: str, entries: list[SignatureIndexEntry]) -> None:
+        self.entries.update({(scope, entry.chunk_id): entry for entry in entries})
+
+    async def add_links(self, scope: str, links: list[tuple[str, str, str]]) -> None:
+        for chunk_id, source_id, source_name in links:
+            self.links.setdefault((scope, chunk_id), []).append({'source_id': source_id, 'source_name': source_name})
+
+    async def delete_chunks(self, scope: str, chunk_ids: list[str]) -> list[str]:
+        linked_source_ids = set()
+        for chunk_id in chunk_ids:
+            self.entries.pop((scope, chunk_id), None)
+            linked_source_ids.update(link['source_id'] for link in self.links.pop((scope, chunk_id), []))
+        return sorted(linked_source_ids)
+
+    async def delete_sources(self, scope: str, source_ids: list[str], except_ids: list[str] = None) -> list[str]:
+        linked_source_ids = set(await self.delete_chunks(scope, [
+            chunk_id for (entry_scope, chunk_id), entry in self.entries.items()
+            if entry_scope == scope and entry.source_id in source_ids and chunk_id not in (except_ids or [])
+        ]))
+        if except_ids is None:
+            self.links = {
+                key: [link for link in links if key[0] != scope or link['source_id'] not in source_ids]
+                for key, links in self.links.items()
+            }
+            linked_source_ids -= set(source_ids)
+        return sorted(linked_source_ids)
+
+    async def delete(self, scope: str) -> None:
+        await self.delete_chunks(scope, [chunk_id for entry_scope, chunk_id in self.entries if entry_scope == scope])
+
+
 class BaseVectorDBTests(abc.ABC):
     """Base class for testing vector databases.
     
@@ -70,7 +154,15 @@ class BaseVectorDBTests(abc.ABC):
         ]
 
     @pytest.fixture(autouse=True)
-    async def collection_name(self) -> AsyncGenerator[str, None]:
+    def source_manifest(self) -> FakeSourceManifest:
+        """Replace the source manifest of the vector databases with an in-memory fake."""
+
+        source_manifest = FakeSourceManifest()
+        with patch.object(BaseVectorDatabase, 'get_source_manifest', return_value=source_manifest):
+            yield source_manifest
+
+    @pytest.fixture(autouse=True)
+    async def collection_name(self, source_manifest: FakeSourceManifest) -> AsyncGenerator[str, None]:
         """Return the collection name for the test."""
 
         # Setup
@@ -173,6 +265,37 @@ class BaseVectorDBTests(abc.ABC):
         assert entry_to_delete.metadata not in db_content.metadatas
         assert db_content.ids == ids[:delete_idx] + ids[delete_idx + 1:]
 
+    @pytest.mark.parametrize('batch_size', [1, 1_000])
+    async def test_vector_db_delete_many(
+        self,
+        entries: list[InsertTestParameters],
+        source_manifest: FakeSourceManifest,
+        batch_size: int,
+    ):
+        """Deleting many sources deletes all their entries, in batches, and removes them from the manifest."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        await self.create_collection_if_not_exists(vector_db, entries[0])
+
+        ids = []
+        for entry in entries:
+            res = await vector_db.upsert_text(entry.text, entry.metadata)
+            ids += res['ids']
+
+        # Run - Deleting a non-existent source is a no-op.
+        source_ids = [entries[1].metadata.source_id, entries[3].metadata.source_id, 'non-existent']
+        res = await vector_db.delete_embeddings_many(source_ids, batch_size=batch_size)
+
+        # Validate
+        assert res['error_count'] == 0
+        assert res['batches'] == (3 if batch_size == 1 else 1)
+        assert self.get_all_documents().ids == [ids[0], ids[2]]
+        assert {source_id for _, source_id in source_manifest.entries} == {
+            entries[0].metadata.source_id,
+            entries[2].metadata.source_id,
+        }
+
     async def test_vector_db_drop_collection(self, entries: list[InsertTestParameters], collection_name: str):
         """Test the dropping of a collection from the vector database."""
         
@@ -189,6 +312,556 @@ class BaseVectorDBTests(abc.ABC):
         # Validate - The collection is empty.
         assert self.get_all_documents().ids == []
     
+    @pytest.mark.parametrize('batch_size,expected_batches', [
+        # All the chunks fit in a single batch.
+        (10, 1),
+
+        # Chunks of consecutive documents are packed together.
+        (3, 2),
+
+        # A batch per chunk.
+        (1, 4),
+    ])
+    async def test_vector_db_store_many(
+        self,
+        entries: list[InsertTestParameters],
+        batch_size: int,
+        expected_batches: int,
+    ):
+        """`split_and_store_many` stores the documents in full batches and returns a result per document."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+
+        async def documents():
+            for entry in entries:
+                yield entry.text, entry.metadata
+
+        # Run
+        with patch.object(vector_db, 'add_documents', wraps=vector_db.add_documents) as add_documents_mock:
+            results = [result async for result in vector_db.split_and_store_many(documents(), batch_size=batch_size)]
+
+        # Validate - the documents were inserted in full batches.
+        assert add_documents_mock.call_count == expected_batches
+
+        # Validate - a result per document, in order.
+        assert [result['source_id'] for result in results] == [entry.metadata.source_id for entry in entries]
+        assert all(len(result['ids']) == 1 for result in results)
+
+        # Validate - all the documents were stored.
+        db_content = self.get_all_documents()
+        assert db_content.ids == [result['ids'][0] for result in results]
+        assert db_content.metadatas == [entry.metadata.to_dict() for entry in entries]
+
+    async def test_vector_db_store_many_failed_batch(self, entries: list[InsertTestParameters]):
+        """When a batch fails, only the documents with chunks in that batch are reported as failed."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        org_add_documents = vector_db.add_documents
+        calls = 0
+
+        def add_documents(*args, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise ValueError('Insert failed')
+            return org_add_documents(*args, **kwargs)
+
+        async def documents():
+            for entry in entries:
+                yield entry.text, entry.metadata
+
+        # Run
+        with patch.object(vector_db, 'add_documents', side_effect=add_documents):
+            results = [result async for result in vector_db.split_and_store_many(documents(), batch_size=2)]
+
+        # Validate
+        assert 'ids' in results[0] and 'ids' in results[1]
+        assert results[2] == {'source_id': entries[2].metadata.source_id, 'error': 'Insert failed'}
+        assert results[3] == {'source_id': entries[3].metadata.source_id, 'error': 'Insert failed'}
+
+    @pytest.mark.parametrize('delete_fails', [False, True])
+    async def test_vector_db_store_many_failed_document(self, entries: list[InsertTestParameters], delete_fails: bool):
+        """When a later batch of a document fails, the chunks of the document that earlier batches stored are deleted.
+
+        If they can't be deleted, their IDs are reported along with the error.
+        """
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS(split_strategy=BaseTextIndexing(chunk_size=60, chunk_overlap=0))
+        paragraphs = [
+            'The first paragraph talks about the weather today.',
+            'The second paragraph talks about the traffic today.',
+            'The third paragraph talks about the news of today.',
+        ]
+        org_add_documents = vector_db.add_documents
+        calls = 0
+
+        def add_documents(*args, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise ValueError('Insert failed')
+            return org_add_documents(*args, **kwargs)
+
+        async def documents():
+            yield '\n\n'.join(paragraphs), entries[0].metadata
+            yield entries[1].text, entries[1].metadata
+
+        # Run - the first batch stores 2 chunks of the first document, and the second batch fails.
+        with (
+            patch.object(vector_db, 'add_documents', side_effect=add_documents),
+            patch.object(
+                vector_db,
+                'delete_chunks',
+                wraps=vector_db.delete_chunks,
+                side_effect=ValueError('Delete failed') if delete_fails else None,
+            ),
+        ):
+            results = [result async for result in vector_db.split_and_store_many(documents(), batch_size=2)]
+
+        # Validate
+        db_content = self.get_all_documents()
+        assert results[1] == {'source_id': entries[1].metadata.source_id, 'error': 'Insert failed'}
+        if delete_fails:
+            assert results[0]['error'] == 'Insert failed'
+            assert sorted(results[0]['ids']) == sorted(db_content.ids)
+            assert sorted(db_content.texts) == paragraphs[:2]
+        else:
+            assert results[0] == {'source_id': entries[0].metadata.source_id, 'error': 'Insert failed'}
+            assert db_content.ids == []
+
+    async def test_vector_db_store_does_not_block_event_loop(self, entries: list[InsertTestParameters]):
+        """Ingestion runs off the event loop, so concurrent responses (e.g. chat tokens) keep streaming."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        org_add_documents = vector_db.add_documents
+        blocking_seconds = 0.5
+        max_token_latency = 0.2
+
+        def slow_add_documents(*args, **kwargs):
+            """Simulates a slow, blocking call to the embeddings model."""
+            time.sleep(blocking_seconds)
+            return org_add_documents(*args, **kwargs)
+
+        async def stream_tokens(ingestion: asyncio.Task) -> list[float]:
+            """Simulates a chat response that streams a token every 10ms, and returns the latency of each token."""
+            latencies = []
+            while not ingestion.done():
+                start_time = time.perf_counter()
+                await asyncio.sleep(0.01)
+                latencies.append(time.perf_counter() - start_time)
+            return latencies
+
+        # Run
+        with patch.object(vector_db, 'add_documents', side_effect=slow_add_documents):
+            ingestion = asyncio.create_task(vector_db.split_and_store_text(entries[0].text, entries[0].metadata))
+            latencies = await stream_tokens(ingestion)
+            ids = await ingestion
+
+        # Validate - the text was stored, while the tokens kept streaming.
+        assert len(ids) == 1
+        assert len(latencies) > 1
+        assert max(latencies) < max_token_latency
+
+    async def test_vector_db_store_text_stream(self, entries: list[InsertTestParameters]):
+        """A text that is read incrementally is stored in batches, and stored like a text that is stored at once."""
+
+        # Setup
+        entry = entries[0]
+        text = '\n\n'.join(f'Paragraph {i}: {entry.text}' for i in range(20))
+        vector_db = self.VECTOR_DB_CLS(split_strategy=BaseTextIndexing(chunk_size=100, chunk_overlap=0))
+        await self.create_collection_if_not_exists(vector_db, entry)
+
+        async def read_text():
+            for i in range(0, len(text), 64):
+                yield text[i:i + 64]
+
+        # Run
+        with patch.object(vector_db, 'aadd_documents', wraps=vector_db.aadd_documents) as aadd_documents_mock:
+            ids = await vector_db.split_and_store_text_stream(read_text(), entry.metadata, batch_size=3)
+
+        # Validate
+        expected_chunks = vector_db.split_strategy.split(text, entry.metadata)
+        assert len(ids) == len(expected_chunks)
+        assert all(len(call.args[0]) <= 3 for call in aadd_documents_mock.call_args_list)
+        assert sorted(self.get_all_documents().texts) == sorted(chunk.page_content for chunk in expected_chunks)
+
+    async def test_vector_db_upsert(self, entries: list[InsertTestParameters], source_manifest: FakeSourceManifest):
+        """`upsert_text` replaces the chunks of the source, and skips unchanged or stale texts."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        entry, other_entry = entries[:2]
+        metadata = entry.metadata
+        newer_metadata = DocumentMetadata(metadata.source_id, metadata.source_name, datetime(2022, 1, 1))
+        await vector_db.split_and_store_text(other_entry.text, other_entry.metadata)
+
+        # Run & Validate - the source is created.
+        res = await vector_db.upsert_text(entry.text, metadata)
+        assert res['status'] == 'created'
+        created_ids = res['ids']
+
+        # Run & Validate - the same text isn't stored again, even if it's newer.
+        with patch.object(vector_db, 'add_documents') as add_documents_mock:
+            res = await vector_db.upsert_text(entry.text, newer_metadata)
+        add_documents_mock.assert_not_called()
+        assert res == {'status': 'unchanged', 'ids': created_ids}
+        assert source_manifest.entries[(vector_db.cache_scope, metadata.source_id)].modified_at == datetime(2022, 1, 1)
+
+        # Run & Validate - older texts are skipped.
+        res = await vector_db.upsert_text('An older text.', metadata)
+        assert res == {'status': 'stale', 'ids': created_ids}
+
+        # Run & Validate - a changed text replaces the chunks of the source.
+        res = await vector_db.upsert_text('A new text.', newer_metadata)
+        assert res['status'] == 'updated'
+
+        db_content = self.get_all_documents()
+        assert sorted(db_content.texts) == sorted([other_entry.text, 'A new text.'])
+        assert res['ids'][0] in db_content.ids
+        assert created_ids[0] not in db_content.ids
+
+        # Run & Validate - deleting the source removes it from the manifest.
+        await vector_db.delete_embeddings(metadata.source_id)
+        assert (vector_db.cache_scope, metadata.source_id) not in source_manifest.entries
+        assert self.get_all_documents().texts == [other_entry.text]
+
+    async def test_vector_db_upsert_failed_delete(
+            self,
+            entries: list[InsertTestParameters],
+            source_manifest: FakeSourceManifest,
+        ):
+        """If the replaced chunks can't be deleted, the manifest isn't updated, so the next upsert deletes them."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        entry = entries[0]
+        await vector_db.split_and_store_text(entry.text, entry.metadata)
+
+        # Run
+        with patch.object(vector_db, 'delete_embeddings', side_effect=RuntimeError('The delete failed')):
+            with pytest.raises(RuntimeError):
+                await vector_db.upsert_text(entry.text, entry.metadata)
+        no_entry = (vector_db.cache_scope, entry.metadata.source_id) not in source_manifest.entries
+        res = await vector_db.upsert_text(entry.text, entry.metadata)
+
+        # Validate
+        assert no_entry
+        assert res['status'] == 'created'
+        assert self.get_all_documents().texts == [entry.text]
+
+    async def test_vector_db_upsert_changed_chunks(self, entries: list[InsertTestParameters]):
+        """`upsert_text` embeds only the new chunks of an edited source, and deletes only the vanished chunks."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS(split_strategy=BaseTextIndexing(chunk_size=60, chunk_overlap=0))
+        paragraphs = [
+            'The first paragraph talks about the weather today.',
+            'The second paragraph talks about the traffic today.',
+            'The third paragraph talks about the news of today.',
+        ]
+        metadata = entries[0].metadata
+        newer_metadata = DocumentMetadata(metadata.source_id, metadata.source_name, datetime(2022, 1, 1))
+        res = await vector_db.upsert_text('\n\n'.join(paragraphs), metadata)
+        assert res['added'] == 3
+        first_ids = res['ids']
+
+        # Run - edit the second paragraph.
+        paragraphs[1] = 'The second paragraph talks about sports, instead.'
+        with patch.object(vector_db, 'add_documents', wraps=vector_db.add_documents) as add_documents_mock:
+            res = await vector_db.upsert_text('\n\n'.join(paragraphs), newer_metadata)
+
+        # Validate - only the edited chunk was embedded and replaced.
+        assert res['status'] == 'updated'
+        assert (res['added'], res['deleted']) == (1, 1)
+        assert [doc.page_content for doc in add_documents_mock.call_args.args[0]] == [paragraphs[1]]
+        assert res['ids'][0] == first_ids[0] and res['ids'][2] == first_ids[2]
+        assert res['ids'][1] != first_ids[1]
+
+        db_content = self.get_all_documents()
+        assert sorted(db_content.ids) == sorted(res['ids'])
+        assert sorted(db_content.texts) == sorted(paragraphs)
+
+    async def test_vector_db_upsert_changed_chunks_failed_delete(self, entries: list[InsertTestParameters]):
+        """If the vanished chunks can't be deleted, the next upsert keeps the new chunks, and deletes the others."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS(split_strategy=BaseTextIndexing(chunk_size=60, chunk_overlap=0))
+        paragraphs = [
+            'The first paragraph talks about the weather today.',
+            'The second paragraph talks about the traffic today.',
+        ]
+        metadata = entries[0].metadata
+        await vector_db.upsert_text('\n\n'.join(paragraphs), metadata)
+        paragraphs[1] = 'The second paragraph talks about sports, instead.'
+
+        # Run
+        with patch.object(vector_db, 'delete_chunks', side_effect=RuntimeError('The delete failed')):
+            with pytest.raises(RuntimeError):
+                await vector_db.upsert_text('\n\n'.join(paragraphs), metadata)
+        with patch.object(vector_db, 'add_documents', wraps=vector_db.add_documents) as add_documents_mock:
+            res = await vector_db.upsert_text('\n\n'.join(paragraphs), metadata)
+
+        # Validate
+        assert res['status'] == 'updated'
+        assert (res['added'], res['deleted']) == (0, 1)
+        add_documents_mock.assert_not_called()
+        db_content = self.get_all_documents()
+        assert sorted(db_content.ids) == sorted(res['ids'])
+        assert sorted(db_content.texts) == sorted(paragraphs)
+
+    async def test_vector_db_upsert_replaces_appended_chunks(self, entries: list[InsertTestParameters]):
+        """`upsert_text` also replaces the chunks of the source that were stored without it."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        entry = entries[0]
+        await vector_db.split_and_store_text(entry.text, entry.metadata)
+        await vector_db.split_and_store_text(entry.text, entry.metadata)
+
+        # Run
+        res = await vector_db.upsert_text(entry.text, entry.metadata)
+
+        # Validate
+        assert res['status'] == 'created'
+        db_content = self.get_all_documents()
+        assert db_content.ids == res['ids']
+        assert db_content.texts == [entry.text]
+
+    async def test_vector_db_chunk_dedup(self, entries: list[InsertTestParameters]):
+        """With deduplication enabled, near-duplicates of stored chunks are neither embedded nor stored."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        index = FakeChunkSignatureIndex()
+        deduplicator = ChunkDeduplicator(threshold=0.8, index=index)
+        text = (
+            'The weekly report: sales grew by 5% this week, driven by the new subscription plans. The support team '
+            'closed most of the open tickets, and the new office opens in March, as planned by the board. The '
+            'hiring of the data team continues, with three new engineers starting next month. Thanks, everyone.'
+        )
+        near_duplicate = text.replace('5%', '6%')
+        metadatas = [
+            DocumentMetadata(source_id=f'email-{i}', source_name=f'Email {i}', modified_at=datetime(2021, 1, 1))
+            for i in range(3)
+        ]
+
+        with patch.object(vector_db, 'get_chunk_deduplicator', return_value=deduplicator):
+            res = await vector_db.upsert_text(text, metadatas[0])
+            kept_id = str(res['ids'][0])  # The index keeps the IDs of all the vector databases as text.
+
+            # Run
+            with patch.object(vector_db, 'add_documents', wraps=vector_db.add_documents) as add_documents_mock:
+                res = await vector_db.upsert_text(near_duplicate, metadatas[1])
+                ids = await vector_db.split_and_store_text(entries[1].text, metadatas[2])
+
+            # Validate - the near-duplicate wasn't embedded, and is linked to the kept chunk.
+            assert res == {'status': 'created', 'ids': [], 'added': 0, 'deleted': 0, 'duplicates': 1}
+            assert add_documents_mock.call_count == 1
+            assert len(ids) == 1
+            assert sorted(self.get_all_documents().texts) == sorted([text, entries[1].text])
+            assert index.links[(vector_db.cache_scope, kept_id)] == [{'source_id': 'email-1', 'source_name': 'Email 1'}]
+            assert deduplicator.get_stats()['chunks_saved'] == 1
+
+            # Validate - deleted sources are removed from the index.
+            await vector_db.delete_embeddings(metadatas[0].source_id)
+            assert (vector_db.cache_scope, kept_id) not in index.entries
+
+    async def test_vector_db_chunk_dedup_kept_chunk_deleted(self):
+        """When the kept chunk is deleted, the sources of its near-duplicates are stored again by their next upsert."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        deduplicator = ChunkDeduplicator(threshold=0.8, index=FakeChunkSignatureIndex())
+        text = (
+            'The weekly report: sales grew by 5% this week, driven by the new subscription plans. The support team '
+            'closed most of the open tickets, and the new office opens in March, as planned by the board. The '
+            'hiring of the data team continues, with three new engineers starting next month. Thanks, everyone.'
+        )
+        near_duplicate = text.replace('5%', '6%')
+        metadatas = [
+            DocumentMetadata(source_id=f'email-{i}', source_name=f'Email {i}', modified_at=datetime(2021, 1, 1))
+            for i in range(2)
+        ]
+
+        with patch.object(vector_db, 'get_chunk_deduplicator', return_value=deduplicator):
+            await vector_db.upsert_text(text, metadatas[0])
+            res = await vector_db.upsert_text(near_duplicate, metadatas[1])
+            assert res['duplicates'] == 1
+
+            # Run
+            await vector_db.delete_embeddings(metadatas[0].source_id)
+            res = await vector_db.upsert_text(near_duplicate, metadatas[1])
+
+        # Validate
+        assert res['status'] == 'updated'
+        assert res['added'] == 1
+        assert self.get_all_documents().texts == [near_duplicate]
+
+    async def test_vector_db_chunk_dedup_edited_source(self):
+        """The chunks of an edited source aren't dropped as near-duplicates of its own replaced chunks."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        deduplicator = ChunkDeduplicator(threshold=0.8, index=FakeChunkSignatureIndex())
+        text = (
+            'The weekly report: sales grew by 5% this week, driven by the new subscription plans. The support team '
+            'closed most of the open tickets, and the new office opens in March, as planned by the board. The '
+            'hiring of the data team continues, with three new engineers starting next month. Thanks, everyone.'
+        )
+        metadata = DocumentMetadata(source_id='email', source_name='Email', modified_at=datetime(2021, 1, 1))
+
+        with patch.object(vector_db, 'get_chunk_deduplicator', return_value=deduplicator):
+            await vector_db.upsert_text(text, metadata)
+
+            # Run
+            res = await vector_db.upsert_text(text.replace('5%', '6%'), metadata)
+
+        # Validate
+        assert (res['added'], res['deleted'], res['duplicates']) == (1, 1, 0)
+        assert self.get_all_documents().texts == [text.replace('5%', '6%')]
+
+    async def test_vector_db_hybrid_search(self, entries: list[InsertTestParameters]):
+        """The sparse index is loaded from the collection, and kept in sync with the stored and deleted chunks."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        ticket_metadata = DocumentMetadata(source_id='ticket', source_name='Ticket', modified_at=datetime(2021, 1, 1))
+        for entry in entries[:2]:
+            await vector_db.split_and_store_text(entry.text, entry.metadata)
+
+        # Run & Validate - the stored chunks are loaded on the first search.
+        docs = await vector_db.asparse_search('quick fox', k=2)
+        assert [doc.page_content for doc in docs] == [entries[1].text]
+
+        # Run & Validate - new chunks are searchable.
+        await vector_db.upsert_text('The deployment failed with error E-4012.', ticket_metadata)
+        docs = await vector_db.as_retriever(search_type='hybrid', search_kwargs={'k': 2}).ainvoke('E-4012')
+        ticket_doc, = [doc for doc in docs if doc.page_content == 'The deployment failed with error E-4012.']
+        assert ticket_doc.metadata['source_id'] == 'ticket'
+
+        # Run & Validate - deleted chunks aren't.
+        await vector_db.upsert_text(
+            'The deployment succeeded.',
+            DocumentMetadata(source_id='ticket', source_name='Ticket', modified_at=datetime(2022, 1, 1)),
+        )
+        assert await vector_db.asparse_search('E-4012', k=2) == []
+
+        await vector_db.delete_embeddings(entries[1].metadata.source_id)
+        assert await vector_db.asparse_search('quick fox', k=2) == []
+
+    async def test_vector_db_hybrid_search_missed_deletes(self, entries: list[InsertTestParameters]):
+        """The chunks that were deleted without the sparse index (e.g. by another process) aren't searchable."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        for entry in entries[:2]:
+            await vector_db.split_and_store_text(entry.text, entry.metadata)
+        sparse_index = vector_db.load_sparse_index()
+
+        with (
+            patch.object(sparse_index, 'delete_sources'),
+            patch.object(sparse_index, 'delete_chunks'),
+        ):
+            await vector_db.delete_embeddings(entries[1].metadata.source_id)
+
+        # Run
+        docs = await vector_db.asparse_search('quick fox', k=2)
+        hybrid_docs = await vector_db.as_retriever(search_type='hybrid', search_kwargs={'k': 2}).ainvoke('quick fox')
+
+        # Validate
+        assert len(sparse_index.search('quick fox', k=2)) == 1
+        assert docs == []
+        assert entries[1].text not in [doc.page_content for doc in hybrid_docs]
+
+    @pytest.mark.parametrize('search_type', ['similarity', 'hybrid'])
+    async def test_vector_db_filtered_search(self, entries: list[InsertTestParameters], search_type: str):
+        """Searches are pre-filtered by the metadata, so they return the best matching chunks, however few match."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        for entry in entries:
+            await vector_db.split_and_store_text(entry.text, entry.metadata)
+
+        def search(**filters) -> list[str]:
+            retriever = vector_db.as_retriever(
+                search_type=search_type,
+                search_kwargs={'k': 2},
+                metadata_filter=MetadataFilter(**filters),
+            )
+            return sorted(doc.metadata['source_name'] for doc in retriever.invoke('This is a test.'))
+
+        # Run + Validate
+        assert search(source_names=['test2', 'test3']) == ['test2', 'test3']
+        assert search(source_ids=['987654']) == ['test4']
+        assert search(modified_after=datetime(2021, 3, 3)) == ['test3', 'test4']
+        assert search(modified_after=datetime(2021, 2, 1), modified_before=datetime(2021, 3, 1)) == ['test2']
+        assert search(source_names=['test1'], modified_after=datetime(2021, 2, 1)) == []
+
+    @pytest.mark.parametrize('search_type', ['similarity', 'hybrid'])
+    async def test_vector_db_diverse_search(self, entries: list[InsertTestParameters], search_type: str):
+        """The candidates are fetched with their vectors, and the diversity stage caps the chunks of each source."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        digest_metadata = DocumentMetadata(source_id='digest', source_name='Digest', modified_at=datetime(2021, 5, 5))
+        for entry in entries:
+            await vector_db.split_and_store_text(entry.text, entry.metadata)
+            await vector_db.split_and_store_text(f'Digest: {entry.text}', digest_metadata)
+        embedding = vector_db.embeddings.embed_query('This is a test.')
+
+        # Run
+        candidates = await vector_db.asimilarity_search_with_vectors(
+            embedding,
+            k=2,
+            **vector_db.get_filter_kwargs(MetadataFilter(source_ids=['digest'])),
+        )
+        docs = await vector_db.as_retriever(
+            search_type=search_type,
+            search_kwargs={'k': 4, 'fetch_k': 8, 'max_per_source': 1},
+        ).ainvoke('This is a test.')
+
+        # Validate
+        assert [doc.metadata['source_id'] for doc, _ in candidates] == ['digest', 'digest']
+        assert all(len(vector) == len(embedding) for _, vector in candidates)
+        assert len(docs) == 4
+        assert len({doc.metadata['source_id'] for doc in docs}) == 4
+
+    @pytest.mark.parametrize('search_type', ['similarity', 'hybrid'])
+    async def test_vector_db_tenants(self, entries: list[InsertTestParameters], search_type: str):
+        """Each tenant stores and searches only its own chunks, also with a retriever that is shared by the tenants."""
+
+        # Setup
+        vector_db = self.VECTOR_DB_CLS()
+        with use_tenant('acme'):
+            tenant_db = self.VECTOR_DB_CLS()
+
+        def search() -> set[str]:
+            retriever = vector_db.as_retriever(search_type=search_type, search_kwargs={'k': 4})
+            return {doc.metadata['source_name'] for doc in retriever.invoke('This is a test.')}
+
+        try:
+            await vector_db.split_and_store_text(entries[0].text, entries[0].metadata)
+            for entry in entries[:3]:
+                await tenant_db.split_and_store_text(entry.text, entry.metadata)
+
+            # Run + Validate - the searches of the shared retriever are scoped to the current tenant.
+            assert tenant_db.tenant_id == 'acme'
+            assert search() == {entries[0].metadata.source_name}
+            with use_tenant('acme'):
+                assert search() == {entry.metadata.source_name for entry in entries[:3]}
+
+            # Run + Validate - the deletes of a tenant don't affect the other tenants.
+            await tenant_db.delete_embeddings(entries[0].metadata.source_id)
+            assert search() == {entries[0].metadata.source_name}
+            with use_tenant('acme'):
+                assert search() == {entry.metadata.source_name for entry in entries[1:3]}
+        finally:
+            await tenant_db.drop_collection(tenant_db.collection_name, ignore_non_exist=True)
+
     async def test_embedding_function(self):
         """`get_embedding_function` returns an instance of `EmbeddingsModel`."""
         
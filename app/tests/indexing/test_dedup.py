@@ -0,0 +1,211 @@
+import asyncio
+import pytest
+
+from contextlib import asynccontextmanager
+from langchain.schema import Document
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.indexing.dedup import ChunkDeduplicator, ChunkSignatureIndex, MinHasher
+from app.tests.databases.vector.vector_db_tests_base import FakeChunkSignatureIndex
+
+
+TEXT = (
+    'The quarterly review covers the revenue of the new products, the hiring plans of the engineering team, '
+    'the migration of the billing system to the new provider, and the schedule of the next product launch. '
+    'Questions about the review can be sent to the finance team before the end of the month.'
+)
+
+
+async def run_in_executor(func, *args):
+    return func(*args)
+
+
+def make_chunk(text: str, source_id: str = 'source-1') -> Document:
+    return Document(page_content=text, metadata={'source_id': source_id, 'source_name': f'Source {source_id}'})
+
+
+class TestMinHasher:
+
+    def test_similarity(self):
+        """The similarity of the signatures estimates the Jaccard similarity of the shingles."""
+
+        # Setup
+        hasher = MinHasher()
+        edited_text = TEXT.replace('quarterly', 'yearly')
+        shingles, edited_shingles = hasher.get_shingles(TEXT), hasher.get_shingles(edited_text)
+        jaccard_similarity = len(shingles & edited_shingles) / len(shingles | edited_shingles)
+
+        # Run
+        signature = hasher.get_signature(TEXT)
+
+        # Validate
+        assert hasher.get_similarity(signature, hasher.get_signature(TEXT.upper())) == 1
+        assert hasher.get_similarity(signature, hasher.get_signature(edited_text)) == pytest.approx(
+            jaccard_similarity, abs=0.1,
+        )
+        assert hasher.get_similarity(signature, hasher.get_signature('An unrelated, short text.')) < 0.1
+
+    def test_signatures_are_stable(self):
+        """Signatures of separate hashers are comparable, so they can be persisted."""
+        assert (MinHasher().get_signature(TEXT) == MinHasher().get_signature(TEXT)).all()
+
+
+class TestChunkDeduplicator:
+
+    @pytest.mark.parametrize('threshold', [0.5, 0.8, 0.9, 0.95])
+    def test_lsh_params(self, threshold: float):
+        """The bands split the signatures, and chunks at the threshold are likely to share one."""
+
+        # Run
+        bands, rows = ChunkDeduplicator.get_lsh_params(128, threshold)
+
+        # Validate
+        assert bands * rows == 128
+        assert 1 - (1 - threshold ** rows) ** bands >= 0.95
+        assert rows == 128 or 1 - (1 - threshold ** (rows * 2)) ** (bands // 2) < 0.95
+
+    async def test_deduplicate(self):
+        """Near-duplicates of stored chunks and of earlier chunks of the batch are found."""
+
+        # Setup
+        deduplicator = ChunkDeduplicator(threshold=0.8, index=FakeChunkSignatureIndex())
+        stored_chunks = [make_chunk(TEXT)]
+        plan = await deduplicator.deduplicate('scope', stored_chunks, run_in_executor)
+        await deduplicator.register('scope', stored_chunks, plan, ['id-1'])
+
+        other_text = (
+            'A different text, about the weather of the week, the traffic in the city center, the opening hours '
+            'of the museums and the parks, and the events of the weekend, from the concerts to the markets.'
+        )
+        chunks = [
+            make_chunk(TEXT.replace('quarterly', 'yearly'), 'source-2'),
+            make_chunk(other_text, 'source-2'),
+            make_chunk(other_text.replace('museums', 'libraries'), 'source-2'),
+        ]
+
+        # Run
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor)
+
+        # Validate
+        assert plan.duplicate_of_ids == ['id-1', None, None]
+        assert plan.duplicate_of_indices == [None, None, 1]
+        assert deduplicator.get_stats() == {
+            'threshold': 0.8,
+            'chunks_checked': 4,
+            'chunks_saved': 2,
+            'embedding_calls_saved': 0,
+        }
+
+    async def test_deduplicate_by_scope(self):
+        """Chunks of other collections aren't near-duplicates."""
+
+        # Setup
+        deduplicator = ChunkDeduplicator(index=FakeChunkSignatureIndex())
+        chunks = [make_chunk(TEXT)]
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor)
+        await deduplicator.register('scope', chunks, plan, ['id-1'])
+
+        # Run
+        plan = await deduplicator.deduplicate('other-scope', chunks, run_in_executor)
+
+        # Validate
+        assert not plan.is_duplicate(0)
+
+    async def test_links(self):
+        """The sources of the near-duplicates are linked to the kept chunks."""
+
+        # Setup
+        index = FakeChunkSignatureIndex()
+        deduplicator = ChunkDeduplicator(index=index)
+        chunks = [make_chunk(TEXT, 'source-1'), make_chunk(TEXT, 'source-2'), make_chunk(TEXT, 'source-3')]
+
+        # Run
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor)
+        await deduplicator.register('scope', chunks, plan, ['id-1'])
+
+        # Validate
+        assert index.links[('scope', 'id-1')] == [
+            {'source_id': 'source-2', 'source_name': 'Source source-2'},
+            {'source_id': 'source-3', 'source_name': 'Source source-3'},
+        ]
+
+        # Run & Validate - the links of deleted sources are removed.
+        await deduplicator.forget_sources('scope', ['source-2'])
+        assert index.links[('scope', 'id-1')] == [{'source_id': 'source-3', 'source_name': 'Source source-3'}]
+
+    async def test_forget_kept_chunk(self):
+        """Forgetting a kept chunk returns the sources of its near-duplicates."""
+
+        # Setup
+        deduplicator = ChunkDeduplicator(index=FakeChunkSignatureIndex())
+        chunks = [make_chunk(TEXT, 'source-1'), make_chunk(TEXT, 'source-2')]
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor)
+        await deduplicator.register('scope', chunks, plan, ['id-1'])
+
+        # Run
+        linked_source_ids = await deduplicator.forget_chunks('scope', ['id-1'])
+        plan = await deduplicator.deduplicate('scope', chunks[1:], run_in_executor)
+
+        # Validate - the near-duplicate isn't dropped anymore.
+        assert linked_source_ids == ['source-2']
+        assert not plan.is_duplicate(0)
+
+    async def test_exclude_sources(self):
+        """The stored chunks of excluded sources aren't compared, since they're being replaced."""
+
+        # Setup
+        deduplicator = ChunkDeduplicator(index=FakeChunkSignatureIndex())
+        chunks = [make_chunk(TEXT, 'source-1')]
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor)
+        await deduplicator.register('scope', chunks, plan, ['id-1'])
+
+        # Run
+        plan = await deduplicator.deduplicate('scope', chunks, run_in_executor, exclude_source_ids=['source-1'])
+
+        # Validate
+        assert not plan.is_duplicate(0)
+
+    def test_get_shared(self):
+        """The shared deduplicator is configured by environment variables, and disabled by default."""
+
+        with patch.object(ChunkDeduplicator, '_shared', None):
+            with patch.dict('os.environ', {}, clear=True):
+                assert ChunkDeduplicator.get_shared() is None
+
+            with patch.dict('os.environ', {'CHUNK_DEDUP_ENABLED': 'true', 'CHUNK_DEDUP_THRESHOLD': '0.8'}):
+                deduplicator = ChunkDeduplicator.get_shared()
+                assert deduplicator.threshold == 0.8
+                assert ChunkDeduplicator.get_shared() is deduplicator
+
+
+class TestChunkSignatureIndex:
+
+    def test_setup_event_loops(self):
+        """The tables are created once per process, and the setup can run in several event loops."""
+
+        # Setup
+        conn = MagicMock()
+        conn.execute = AsyncMock()
+
+        @asynccontextmanager
+        async def connection():
+            await asyncio.sleep(0.01)
+            yield conn
+
+        async def setup_concurrently():
+            index = ChunkSignatureIndex()
+            await asyncio.gather(index.setup(), index.setup())
+
+        # Run
+        with (
+            patch.object(ChunkSignatureIndex, '_setup_done', False),
+            patch('app.indexing.dedup.Database.connection', connection),
+        ):
+            asyncio.run(setup_concurrently())
+            execute_count = conn.execute.await_count
+            ChunkSignatureIndex._setup_done = False
+            asyncio.run(setup_concurrently())
+
+        # Validate
+        assert execute_count == 4
+        assert conn.execute.await_count == 8
@@ -0,0 +1,239 @@
+import asyncio
+import pytest
+import uuid
+
+from datetime import datetime, timezone
+from typing import AsyncGenerator
+from unittest.mock import AsyncMock, patch
+
+from app.indexing.jobs import IngestionJob, IngestionJobQueue, IngestionJobStatus
+from app.indexing.metadata import DocumentMetadata
+from app.utils.tenants import get_current_tenant, use_tenant
+
+
+class FakeIngestionJobStore:
+    """Replaces `IngestionJobStore` in the tests, so no database is needed.
+
+    Coalesces the submissions of a queued source like the real store, but doesn't handle stale jobs.
+    """
+
+    def __init__(self):
+        self.jobs: dict[uuid.UUID, IngestionJob] = {}
+
+    async def setup(self) -> None:
+        pass
+
+    async def submit(self, text: str, metadata: DocumentMetadata, tenant_id: str = None) -> IngestionJob:
+        for job in self.jobs.values():
+            if (
+                job.tenant_id == (tenant_id or '')
+                and job.source_id == metadata.source_id
+                and job.status == IngestionJobStatus.QUEUED
+            ):
+                job.text = text
+                job.submissions += 1
+                return job
+
+        job = IngestionJob(
+            id=uuid.uuid4(),
+            source_id=metadata.source_id,
+            source_name=metadata.source_name,
+            modified_at=metadata.modified_at,
+            status=IngestionJobStatus.QUEUED,
+            submissions=1,
+            created_at=datetime.now(timezone.utc),
+            text=text,
+            tenant_id=tenant_id or '',
+        )
+        self.jobs[job.id] = job
+        return job
+
+    async def claim(self) -> IngestionJob | None:
+        for job in self.jobs.values():
+            if job.status == IngestionJobStatus.QUEUED:
+                job.status = IngestionJobStatus.RUNNING
+                job.started_at = datetime.now(timezone.utc)
+                return job
+        return None
+
+    async def heartbeat(self, job_id: uuid.UUID) -> None:
+        pass
+
+    async def finish(self, job_id: uuid.UUID, chunks_count: int = None, error: str = None) -> None:
+        job = self.jobs[job_id]
+        job.status = IngestionJobStatus.FAILED if error is not None else IngestionJobStatus.DONE
+        job.chunks_count = chunks_count
+        job.error = error
+        job.finished_at = datetime.now(timezone.utc)
+
+    async def requeue_stale(self, stale_after: float) -> int:
+        return 0
+
+    async def get(self, job_id: uuid.UUID) -> IngestionJob | None:
+        return self.jobs.get(job_id)
+
+
+# The workers run in the event loop of the `queue` fixture, so the tests must share it.
+@pytest.mark.asyncio(loop_scope='module')
+class TestIngestionJobQueue:
+    """Tests for the `IngestionJobQueue` class."""
+
+    @pytest.fixture
+    def metadata(self) -> DocumentMetadata:
+        return DocumentMetadata(source_id='1001', source_name='test', modified_at=datetime(2024, 1, 1))
+
+    @pytest.fixture
+    def vector_db(self) -> AsyncGenerator[AsyncMock, None]:
+        """Replace the vector database of the jobs with a mock that stores every text as 2 chunks."""
+
+        with patch('app.indexing.jobs.VectorDB') as VectorDBClassMock:
+            vector_db = VectorDBClassMock.return_value
+            vector_db.upsert_text = AsyncMock(return_value={'status': 'created', 'ids': [1, 2]})
+            yield vector_db
+
+    @pytest.fixture
+    async def queue(self, vector_db: AsyncMock) -> AsyncGenerator[IngestionJobQueue, None]:
+        """Return an open queue with 2 workers and a fake store."""
+
+        queue = IngestionJobQueue(concurrency=2, poll_interval=0.01, store=FakeIngestionJobStore())
+        await queue.open()
+
+        yield queue
+
+        await queue.close()
+
+    async def wait_for_jobs(self, queue: IngestionJobQueue, *jobs: IngestionJob) -> None:
+        """Wait until all the jobs finished."""
+
+        async def wait():
+            while any(job.status in (IngestionJobStatus.QUEUED, IngestionJobStatus.RUNNING) for job in jobs):
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(wait(), timeout=1)
+
+    async def test_job_upserts_source(
+        self,
+        queue: IngestionJobQueue,
+        vector_db: AsyncMock,
+        metadata: DocumentMetadata,
+    ):
+        """A job replaces the embeddings of the source with the new text."""
+
+        # Run
+        job = await queue.submit('Some text', metadata)
+        await self.wait_for_jobs(queue, job)
+
+        # Validate
+        vector_db.upsert_text.assert_awaited_once_with('Some text', metadata)
+        assert job.status == IngestionJobStatus.DONE
+        assert job.chunks_count == 2
+        assert queue.get_stats() == {'concurrency': 2, 'running': 0, 'done': 1, 'failed': 0}
+
+    async def test_failed_job(self, queue: IngestionJobQueue, vector_db: AsyncMock, metadata: DocumentMetadata):
+        """Errors fail the job, and the queue keeps processing the following jobs."""
+
+        # Setup
+        vector_db.upsert_text.side_effect = [ValueError('Embedding failed'), {'status': 'created', 'ids': [1]}]
+
+        # Run
+        failed_job = await queue.submit('Some text', metadata)
+        await self.wait_for_jobs(queue, failed_job)
+        job = await queue.submit('Other text', metadata)
+        await self.wait_for_jobs(queue, job)
+
+        # Validate
+        assert failed_job.status == IngestionJobStatus.FAILED
+        assert failed_job.error == 'Embedding failed'
+        assert job.status == IngestionJobStatus.DONE
+        assert queue.get_stats()['failed'] == 1
+
+    async def test_failed_finish(self, vector_db: AsyncMock, metadata: DocumentMetadata):
+        """Errors recording the results of a job don't stop the worker."""
+
+        # Setup - the queue isn't open, so jobs stay queued.
+        store = FakeIngestionJobStore()
+        queue = IngestionJobQueue(concurrency=1, poll_interval=0.01, store=store)
+        failed_job = await queue.submit('Some text', metadata)
+        job = await queue.submit('Other text', DocumentMetadata(
+            source_id='1002', source_name='other', modified_at=datetime(2024, 1, 1),
+        ))
+
+        finish = store.finish
+
+        async def flaky_finish(job_id: uuid.UUID, **kwargs):
+            if job_id == failed_job.id:
+                raise ConnectionError('Connection lost')
+            await finish(job_id, **kwargs)
+
+        # Run
+        with patch.object(store, 'finish', side_effect=flaky_finish):
+            await queue.open()
+            await self.wait_for_jobs(queue, job)
+            await queue.close()
+
+        # Validate - the job is requeued once it's stale.
+        assert failed_job.status == IngestionJobStatus.RUNNING
+        assert job.status == IngestionJobStatus.DONE
+
+    async def test_submissions_are_coalesced(self, vector_db: AsyncMock, metadata: DocumentMetadata):
+        """Submissions for a source whose job is still queued are coalesced, so only the last one is stored."""
+
+        # Setup - the queue isn't open, so jobs stay queued.
+        queue = IngestionJobQueue(concurrency=1, poll_interval=0.01, store=FakeIngestionJobStore())
+
+        # Run
+        jobs = [await queue.submit(f'Version {i}', metadata) for i in range(3)]
+        await queue.open()
+        await self.wait_for_jobs(queue, *jobs)
+        await queue.close()
+
+        # Validate
+        assert jobs[0] is jobs[1] is jobs[2]
+        assert jobs[0].submissions == 3
+        vector_db.upsert_text.assert_awaited_once_with('Version 2', metadata)
+
+    async def test_job_runs_for_its_tenant(self, vector_db: AsyncMock, metadata: DocumentMetadata):
+        """Jobs store the text for the tenant that submitted them, and aren't coalesced across tenants."""
+
+        # Setup - the queue isn't open, so jobs stay queued.
+        queue = IngestionJobQueue(concurrency=1, poll_interval=0.01, store=FakeIngestionJobStore())
+        tenants = []
+        vector_db.upsert_text.side_effect = lambda *args: tenants.append(get_current_tenant()) or {'ids': [1]}
+
+        # Run
+        with use_tenant('acme'):
+            tenant_job = await queue.submit('Tenant text', metadata)
+        job = await queue.submit('Default text', metadata)
+        await queue.open()
+        await self.wait_for_jobs(queue, tenant_job, job)
+        await queue.close()
+
+        # Validate
+        assert tenant_job is not job
+        assert tenant_job.to_dict()['tenant_id'] == 'acme'
+        assert job.to_dict()['tenant_id'] is None
+        assert tenants == ['acme', None]
+
+    async def test_close_waits_for_running_jobs(self, vector_db: AsyncMock, metadata: DocumentMetadata):
+        """Closing the queue lets the running jobs finish, and stops claiming new jobs."""
+
+        # Setup
+        async def slow_store(*args, **kwargs):
+            await asyncio.sleep(0.1)
+            return {'status': 'created', 'ids': [1]}
+
+        vector_db.upsert_text.side_effect = slow_store
+        queue = IngestionJobQueue(concurrency=1, poll_interval=0.01, store=FakeIngestionJobStore())
+        await queue.open()
+
+        running_job = await queue.submit('Some text', metadata)
+        while running_job.status == IngestionJobStatus.QUEUED:
+            await asyncio.sleep(0.01)
+
+        # Run
+        queued_job = await queue.submit('Other text', DocumentMetadata('1002', 'test', datetime(2024, 1, 1)))
+        await queue.close()
+
+        # Validate
+        assert running_job.status == IngestionJobStatus.DONE
+        assert queued_job.status == IngestionJobStatus.QUEUED
@@ -1,7 +1,9 @@
 import pytest
 
-from datetime import datetime
-from app.indexing.metadata import DocumentMetadata
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.indexing.metadata import DocumentMetadata, get_promoted_keys
 
 
 class TestDocumentMetadata:
@@ -60,6 +62,52 @@ class TestDocumentMetadata:
         assert metadata.to_dict() == {
             'source_id': '1',
             'source_name': 'test',
-            'modified_at': '2021-01-21T19:30:00',
+            'modified_at': 1611257400,
             'payload': {'key': 'value34'},
         }
+
+    def test_to_dict_promoted_keys(self):
+        """Promoted payload keys are stored as strings next to the payload, and missing ones as empty strings."""
+
+        # Setup
+        metadata = DocumentMetadata(
+            source_id='1',
+            source_name='test',
+            modified_at=datetime(2021, 1, 21, 21, 30, 0, tzinfo=timezone(timedelta(hours=2))),
+            payload={'team': 'data', 'year': 2021},
+        )
+
+        # Run
+        with patch.dict('os.environ', {'METADATA_PROMOTED_KEYS': 'team, year,author'}):
+            metadata_dict = metadata.to_dict()
+
+        # Validate
+        assert metadata_dict == {
+            'source_id': '1',
+            'source_name': 'test',
+            'modified_at': 1611257400,
+            'team': 'data',
+            'year': '2021',
+            'author': '',
+            'payload': {'team': 'data', 'year': 2021},
+        }
+
+    @pytest.mark.parametrize('promoted_keys', ['source_name', 'team,payload', 'team-name', '1st'])
+    def test_invalid_promoted_keys(self, promoted_keys: str):
+        with patch.dict('os.environ', {'METADATA_PROMOTED_KEYS': promoted_keys}), pytest.raises(ValueError):
+            get_promoted_keys()
+
+    @pytest.mark.parametrize('stored,expected', [
+        # Stored by `to_dict`.
+        (
+            {'modified_at': 1611257400, 'payload': {'key': 'value'}},
+            {'modified_at': '2021-01-21T19:30:00+00:00', 'payload': {'key': 'value'}},
+        ),
+        # Stored by older versions, and by Chroma.
+        (
+            {'modified_at': '2021-01-21T19:30:00', 'payload': '{"key": "value"}'},
+            {'modified_at': '2021-01-21T19:30:00', 'payload': {'key': 'value'}},
+        ),
+    ])
+    def test_format_dict(self, stored: dict, expected: dict):
+        assert DocumentMetadata.format_dict(stored) == expected
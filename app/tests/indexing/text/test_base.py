@@ -1,3 +1,4 @@
+import io
 import pytest
 
 from langchain.schema import Document
@@ -55,3 +56,44 @@ class TestBaseTextIndexing(IndexingBase):
 
         # Validate
         assert [s.metadata for s in splits] == [expected_metadata] * len(splits)
+
+    @pytest.mark.parametrize('part_size', [1, 7, 100, 10_000])
+    def test_split_stream(self, text: str, metadata: DocumentMetadata, part_size: int):
+        """Splitting a text in parts respects the chunks size and overlap, and covers the whole text."""
+
+        # Setup
+        text = '\n\n'.join([text] * 20)
+        parts = [text[i:i + part_size] for i in range(0, len(text), part_size)]
+        indexing = BaseTextIndexing(chunk_size=200, chunk_overlap=50)
+
+        # Run
+        splits = indexing.split_stream(parts, metadata)
+
+        # Validate - splits is an iterator, not a list
+        assert not isinstance(splits, list)
+
+        # Validate
+        splits = list(splits)
+        assert all(0 < len(s.page_content) <= 200 for s in splits)
+        assert [s.metadata for s in splits] == [metadata.to_dict()] * len(splits)
+
+        # Validate - the chunks are in order, and consecutive chunks overlap or are separated by whitespace.
+        end = 0
+        for split in splits:
+            start = text.find(split.page_content, max(end - 200, 0))
+            assert start >= 0
+            assert text[end:start].strip() == ''
+            end = start + len(split.page_content)
+        assert end == len(text.rstrip())
+
+    def test_split_stream_matches_split(self, text: str, metadata: DocumentMetadata):
+        """Texts that fit in a single window are split like `split` does."""
+
+        # Setup
+        indexing = BaseTextIndexing(chunk_size=200, chunk_overlap=50)
+
+        # Run
+        splits = list(indexing.split_stream(io.StringIO(text), metadata, read_size=64))
+
+        # Validate
+        assert splits == indexing.split(text, metadata)
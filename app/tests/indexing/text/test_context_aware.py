@@ -1,15 +1,30 @@
+import asyncio
 import pytest
 
-from typing import Iterable
-from unittest.mock import MagicMock, patch
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Iterable
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from app.indexing.metadata import DocumentMetadata
 from app.indexing.text.context_aware import ContextAwareIndexing
 from app.tests.indexing.text.base import IndexingBase
     
 
+async def run_in_executor(func: Callable, *args, **kwargs):
+    """Replaces `BaseVectorDatabase.run_in_executor` in the tests, by running `func` in the event loop."""
+    return func(*args, **kwargs)
+
+
 class TestContextAwareIndexing(IndexingBase):
 
+    @pytest.fixture(autouse=True)
+    def summaries(self) -> OrderedDict:
+        """Start every test with an empty summaries cache."""
+
+        with patch.object(ContextAwareIndexing, '_summaries', OrderedDict()) as summaries:
+            yield summaries
+
     @staticmethod
     def split_context_content(text: str) -> tuple[str, str]:
         """Split the text into context and content."""
@@ -129,3 +144,116 @@ class TestContextAwareIndexing(IndexingBase):
         # Validate
         chat_model.invoke.assert_called_once_with(indexer.BASE_SUMMARIZE_PROMPT + text)
 
+
+    def test_summary_is_cached(self, text: str, metadata: DocumentMetadata):
+        """Re-indexing a document reuses its summary, unless the prompt changed."""
+
+        # Setup
+        chat_model = MagicMock()
+        chat_model.invoke.return_value.content = 'summary'
+        indexer = ContextAwareIndexing(chat_model=chat_model)
+
+        # Run
+        first_splits = list(indexer.split(text, metadata))
+        second_splits = list(indexer.split(text, metadata))
+
+        # Validate
+        chat_model.invoke.assert_called_once()
+        assert [s.page_content for s in first_splits] == [s.page_content for s in second_splits]
+
+        # Run + Validate - Other prompts have their own summaries.
+        indexer.summarize_prompt = 'Summarize: '
+        list(indexer.split(text, metadata))
+        assert chat_model.invoke.call_count == 2
+
+    async def test_asplit_many_summarizes_concurrently(self, text: str):
+        """Documents are summarized concurrently, up to `max_concurrency` at once."""
+
+        # Setup
+        running = max_running = 0
+
+        async def summarize(prompt: str) -> MagicMock:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return MagicMock(content=f'Summary of {prompt[-3:]}')
+
+        chat_model = MagicMock()
+        chat_model.ainvoke = AsyncMock(side_effect=summarize)
+        indexer = ContextAwareIndexing(chat_model=chat_model, max_concurrency=2, chunk_size=200, chunk_overlap=50)
+        documents = [
+            (f'{text} {i:03}', DocumentMetadata(str(i), 'source_name', datetime(2021, 10, 20)))
+            for i in range(5)
+        ]
+
+        # Run
+        results = await indexer.asplit_many(documents, run_in_executor=run_in_executor)
+
+        # Validate
+        assert chat_model.ainvoke.await_count == 5
+        assert max_running == 2
+        for i, splits in enumerate(results):
+            assert len(splits) > 1
+            assert all(self.extract_context(s.page_content) == f'Summary of {i:03}' for s in splits)
+
+    async def test_asplit_many_reuses_summaries(self, text: str, metadata: DocumentMetadata):
+        """Identical documents are summarized once, and summaries are reused by later calls."""
+
+        # Setup
+        chat_model = MagicMock()
+        chat_model.ainvoke = AsyncMock(return_value=MagicMock(content='summary'))
+        indexer = ContextAwareIndexing(chat_model=chat_model)
+
+        # Run
+        await indexer.asplit_many([(text, metadata), (text, metadata)], run_in_executor=run_in_executor)
+        results = await indexer.asplit_many([(text, metadata)], run_in_executor=run_in_executor)
+
+        # Validate
+        chat_model.ainvoke.assert_awaited_once_with(indexer.BASE_SUMMARIZE_PROMPT + text)
+        assert self.extract_context(results[0][0].page_content) == 'summary'
+
+    async def test_asplit_many_failed_summary(self, text: str):
+        """Documents whose summarization failed are split without context, and don't fail the other documents."""
+
+        # Setup
+        chat_model = MagicMock()
+        chat_model.ainvoke = AsyncMock(side_effect=[MagicMock(content='summary'), ValueError('Throttled')])
+        indexer = ContextAwareIndexing(chat_model=chat_model, max_concurrency=1)
+        documents = [
+            (f'{text} {i}', DocumentMetadata(str(i), 'source_name', datetime(2021, 10, 20)))
+            for i in range(2)
+        ]
+
+        # Run
+        results = await indexer.asplit_many(documents, run_in_executor=run_in_executor)
+
+        # Validate
+        assert self.extract_context(results[0][0].page_content) == 'summary'
+        assert results[1][0].page_content == f'{text} 1'
+
+    @pytest.mark.parametrize('cutoff', [
+        # The summary is computed once the first chunks are split.
+        500,
+
+        # The document is shorter than the cutoff, so the summary is computed at the end.
+        100_000,
+    ])
+    def test_split_stream(self, text: str, metadata: DocumentMetadata, cutoff: int):
+        """Splitting a text in parts adds the summary to each chunk, and summarizes the document once."""
+
+        # Setup
+        chat_model = MagicMock()
+        chat_model.invoke.return_value.content = 'summary'
+        indexer = ContextAwareIndexing(chat_model=chat_model, document_content_cutoff=cutoff, chunk_size=200)
+        text = '\n\n'.join([text] * 10)
+
+        # Run
+        splits = list(indexer.split_stream((text[i:i + 100] for i in range(0, len(text), 100)), metadata))
+
+        # Validate
+        chat_model.invoke.assert_called_once()
+        assert len(splits) > 10
+        assert all(self.extract_context(s.page_content) == 'summary' for s in splits)
+        assert all(self.extract_content(s.page_content) in text for s in splits)
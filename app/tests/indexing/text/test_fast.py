@@ -0,0 +1,94 @@
+import pytest
+import random
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from unittest.mock import MagicMock
+
+from app.indexing.metadata import DocumentMetadata
+from app.indexing.text.base import BaseTextIndexing
+from app.indexing.text.fast import FastRecursiveTextSplitter, FastTextIndexing
+from app.tests.indexing.text.base import IndexingBase
+
+
+class TestFastRecursiveTextSplitter(IndexingBase):
+
+    @pytest.fixture
+    def random_texts(self) -> list[str]:
+        """Texts with runs of separators, long words and whitespace, where the splitters' edge cases are."""
+
+        rnd = random.Random(0)
+        pieces = ['a', 'word', 'longerword', ' ', '  ', '\n', '\n\n', '\n\n\n', ' \n ', '\t', 'x' * 50]
+        return [''.join(rnd.choices(pieces, k=rnd.randint(0, 300))) for _ in range(200)]
+
+    @pytest.mark.parametrize('chunk_size,chunk_overlap', [
+        (1_000, 200),
+        (200, 50),
+        (50, 0),
+        (10, 10),
+        (1, 0),
+    ])
+    def test_same_chunks(self, text: str, random_texts: list[str], chunk_size: int, chunk_overlap: int):
+        """The chunks are identical to the chunks of `RecursiveCharacterTextSplitter`."""
+
+        # Setup
+        recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        fast_splitter = FastRecursiveTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+        for text in [text, '', '\n\n', *random_texts]:
+            # Run + Validate
+            assert fast_splitter.split_text(text) == recursive_splitter.split_text(text)
+
+    def test_same_chunks_custom_separators(self, random_texts: list[str]):
+        """Overlapping occurrences of multi-character separators are found like `re.split` does."""
+
+        # Setup
+        separators = ['\n\n', '  ', ' \n', ' ', '']
+        recursive_splitter = RecursiveCharacterTextSplitter(separators=separators, chunk_size=20, chunk_overlap=5)
+        fast_splitter = FastRecursiveTextSplitter(separators=separators, chunk_size=20, chunk_overlap=5)
+
+        for text in random_texts:
+            # Run + Validate
+            assert fast_splitter.split_text(text) == recursive_splitter.split_text(text)
+
+    def test_length_function_is_cached(self, text: str):
+        """Token-based lengths give the same chunks, and each distinct piece is measured once."""
+
+        # Setup
+        count_words = MagicMock(side_effect=lambda piece: len(piece.split()))
+        recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=8, chunk_overlap=2, length_function=count_words)
+        fast_splitter = FastRecursiveTextSplitter(chunk_size=8, chunk_overlap=2, length_function=count_words)
+
+        # Run
+        expected_chunks = recursive_splitter.split_text(text)
+        count_words.reset_mock()
+        chunks = fast_splitter.split_text(text)
+
+        # Validate
+        assert chunks == expected_chunks
+        measured_pieces = [call.args[0] for call in count_words.call_args_list]
+        assert len(measured_pieces) == len(set(measured_pieces))
+
+
+class TestFastTextIndexing(IndexingBase):
+
+    def test_split(self, text: str, metadata: DocumentMetadata):
+        """Texts are split like `BaseTextIndexing` does, so the stored chunks don't change."""
+
+        # Setup
+        indexing = FastTextIndexing(chunk_size=200, chunk_overlap=50)
+        base_indexing = BaseTextIndexing(chunk_size=200, chunk_overlap=50)
+
+        # Run + Validate
+        assert indexing.split(text, metadata) == base_indexing.split(text, metadata)
+        assert indexing.get_fingerprint() == base_indexing.get_fingerprint()
+
+    def test_length_function_fingerprint(self):
+        """Chunks of other length functions differ, and so does the fingerprint."""
+
+        # Setup
+        def count_tokens(text: str) -> int:
+            return len(text.split())
+
+        # Run + Validate
+        assert FastTextIndexing(length_function=count_tokens).get_fingerprint() \
+            != BaseTextIndexing().get_fingerprint()
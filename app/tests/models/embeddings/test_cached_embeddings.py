@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from pathlib import Path
+from unittest.mock import patch
+
+from app.models.embeddings.cached_embeddings import CachedEmbeddings, EmbeddingsCache
+
+
+class CountingEmbeddings(Embeddings):
+    """A fake embeddings model that records the texts it embedded."""
+
+    def __init__(self, size: int = 8):
+        self.model = f'counting-{size}'
+        self.fake = DeterministicFakeEmbedding(size=size)
+        self.embedded = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.append(texts)
+        return self.fake.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        self.embedded.append([text])
+        return [0.5] * self.fake.size
+
+
+class TestCachedEmbeddings:
+    """Tests for the `CachedEmbeddings` and `EmbeddingsCache` classes."""
+
+    @pytest.fixture
+    def cache_path(self, tmp_path: Path) -> Path:
+        return tmp_path / 'embeddings-cache.sqlite'
+
+    @pytest.fixture
+    def model(self) -> CountingEmbeddings:
+        return CountingEmbeddings()
+
+    def test_embed_documents(self, cache_path: Path, model: CountingEmbeddings):
+        """Only texts that weren't embedded before are sent to the model."""
+
+        # Setup
+        embeddings = CachedEmbeddings(model, EmbeddingsCache(cache_path))
+        expected_vectors = model.fake.embed_documents(['a', 'b', 'c'])
+
+        # Run
+        vectors_1 = embeddings.embed_documents(['a', 'b', 'a'])
+        vectors_2 = embeddings.embed_documents(['c', 'b', 'a'])
+
+        # Validate - the vectors are the same as the model's (up to float32 precision).
+        assert np.allclose(vectors_1, [expected_vectors[0], expected_vectors[1], expected_vectors[0]])
+        assert np.allclose(vectors_2, expected_vectors[::-1])
+
+        # Validate - each text was embedded once.
+        assert model.embedded == [['a', 'b'], ['c']]
+        assert embeddings.cache.get_stats()['misses'] == 3
+
+    async def test_aembed_documents(self, cache_path: Path, model: CountingEmbeddings):
+        """Same as `embed_documents`, but async."""
+
+        # Setup
+        embeddings = CachedEmbeddings(model, EmbeddingsCache(cache_path))
+
+        # Run
+        await embeddings.aembed_documents(['a', 'b'])
+        vectors = await embeddings.aembed_documents(['b', 'c'])
+
+        # Validate
+        assert np.allclose(vectors, model.fake.embed_documents(['b', 'c']))
+        assert model.embedded == [['a', 'b'], ['c']]
+
+    def test_persistence(self, cache_path: Path, model: CountingEmbeddings):
+        """The vectors are read from disk by a new cache (e.g. after a restart)."""
+
+        # Setup
+        CachedEmbeddings(model, EmbeddingsCache(cache_path)).embed_documents(['a', 'b'])
+        cache = EmbeddingsCache(cache_path)
+
+        # Run
+        vectors = CachedEmbeddings(model, cache).embed_documents(['a', 'b'])
+
+        # Validate
+        assert model.embedded == [['a', 'b']]
+        assert np.allclose(vectors, model.fake.embed_documents(['a', 'b']))
+        assert cache.get_stats()['disk_hits'] == 2
+
+    def test_queries_and_models_dont_collide(self, cache_path: Path, model: CountingEmbeddings):
+        """Queries and documents, and different models, are cached separately."""
+
+        # Setup
+        cache = EmbeddingsCache(cache_path)
+        other_model = CountingEmbeddings(size=4)
+
+        # Run
+        document_vector, = CachedEmbeddings(model, cache).embed_documents(['a'])
+        query_vector = CachedEmbeddings(model, cache).embed_query('a')
+        other_vector, = CachedEmbeddings(other_model, cache).embed_documents(['a'])
+
+        # Validate
+        assert query_vector == [0.5] * 8
+        assert document_vector != query_vector
+        assert len(other_vector) == 4
+
+    def test_eviction(self, cache_path: Path, model: CountingEmbeddings):
+        """The least recently used entries are evicted from the disk when the cache is full."""
+
+        # Setup
+        cache = EmbeddingsCache(cache_path, max_entries=10, memory_size=1)
+        embeddings = CachedEmbeddings(model, cache)
+
+        # Run
+        for i in range(11):
+            embeddings.embed_documents([f'text {i}'])
+
+        # Validate - evicted down to 90% of `max_entries`.
+        assert cache.get_stats()['entries'] == 9
+        assert cache.get_stats()['evictions'] == 2
+        assert cache.get_many(f'{embeddings.namespace}:document', [embeddings.hash_text('text 0')]) == {}
+
+    def test_get_shared(self, cache_path: Path):
+        """The shared cache is enabled only when `EMBEDDINGS_CACHE_PATH` is set."""
+
+        # Run + Validate
+        with patch.dict('os.environ', {'EMBEDDINGS_CACHE_PATH': ''}):
+            assert EmbeddingsCache.get_shared() is None
+
+        with patch.dict('os.environ', {'EMBEDDINGS_CACHE_PATH': str(cache_path)}):
+            assert EmbeddingsCache.get_shared() is EmbeddingsCache.get_shared()
+            assert EmbeddingsCache.get_shared().path == cache_path
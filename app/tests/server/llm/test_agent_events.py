@@ -0,0 +1,36 @@
+import asyncio
+
+from datetime import datetime
+from langchain.schema import Document
+from unittest.mock import MagicMock
+
+from app.server.llm import LLMAgent, LLMEventType
+from app.utils.timing import timed
+
+
+class TestLLMAgentEvents:
+    """Tests for the events that `LLMAgent` streams to the client."""
+
+    async def test_retriever_timings(self):
+        """The durations of the retrieval stages are reported in the retriever's end event."""
+
+        # Setup
+        async def astream_events(*args, **kwargs):
+            yield {'event': 'on_retriever_start', 'data': {'input': {'query': 'What is RAG?'}}}
+            with timed('retrieval'):
+                await asyncio.sleep(0.01)
+            yield {'event': 'on_retriever_end', 'data': {'output': [Document(
+                page_content='RAG is retrieval-augmented generation.',
+                metadata={'source_id': '1', 'source_name': 'RAG', 'modified_at': datetime(2024, 1, 1).isoformat()},
+            )]}}
+
+        agent = LLMAgent()
+        agent._agent = MagicMock(astream_events=astream_events)
+
+        # Run
+        events = [event async for event in agent._astream_agent_events('What is RAG?', {})]
+
+        # Validate
+        retriever_end, = [event for event in events if event.type == LLMEventType.RETRIEVER_END]
+        assert list(retriever_end.payload['timings']) == ['retrieval']
+        assert retriever_end.payload['timings']['retrieval'] >= 10
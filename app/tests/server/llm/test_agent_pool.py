@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+
+from datetime import timedelta
+from typing import AsyncGenerator
+from unittest.mock import patch
+
+from app.server.llm import LLMAgentPool, LLMAgentPoolTimeout
+
+
+class FakeLLMAgent:
+    """Replaces `LLMAgent` in the tests, so no models or databases are needed."""
+
+    def __init__(self):
+        self.entered = False
+        self.exited = False
+        self.healthy = True
+
+    async def __aenter__(self) -> 'FakeLLMAgent':
+        self.entered = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.exited = True
+
+    def is_healthy(self, max_age: timedelta) -> bool:
+        return self.healthy
+
+
+class TestLLMAgentPool:
+    """Tests for the `LLMAgentPool` class."""
+
+    @pytest.fixture
+    async def pool(self) -> AsyncGenerator[LLMAgentPool, None]:
+        """Return an open pool of 2 fake agents."""
+
+        with patch('app.server.llm.LLMAgent', FakeLLMAgent):
+            pool = LLMAgentPool(size=2, lease_timeout=0.1)
+            await pool.open()
+
+            yield pool
+
+            await pool.close()
+
+    async def test_open(self, pool: LLMAgentPool):
+        """All the agents are created and initialized when the pool opens."""
+
+        # Validate
+        assert pool.get_stats() | {'closed': None} == {
+            'size': 2,
+            'agents': 2,
+            'idle': 2,
+            'leased': 0,
+            'closed': None,
+        }
+        assert all(agent.entered for agent in pool._idle_agents._queue)
+
+    async def test_lease_reuses_agents(self, pool: LLMAgentPool):
+        """Agents are returned to the pool and reused by the following leases."""
+
+        # Run
+        async with pool.lease() as agent_1:
+            assert pool.get_stats()['leased'] == 1
+        async with pool.lease() as agent_2:
+            pass
+        async with pool.lease() as agent_3:
+            pass
+
+        # Validate - the pool works as a FIFO queue.
+        assert agent_1 is agent_3
+        assert agent_1 is not agent_2
+        assert not agent_1.exited
+        assert pool.get_stats()['leased'] == 0
+
+    async def test_lease_timeout(self, pool: LLMAgentPool):
+        """Leasing fails when all the agents are leased for longer than the timeout."""
+
+        # Setup
+        async with pool.lease(), pool.lease():
+
+            # Run + Validate
+            with pytest.raises(LLMAgentPoolTimeout):
+                async with pool.lease():
+                    pass
+
+    async def test_lease_waits_for_agent(self, pool: LLMAgentPool):
+        """A lease waits for an agent to be returned to the pool."""
+
+        # Setup
+        async def hold_agent():
+            async with pool.lease():
+                await asyncio.sleep(0.05)
+
+        async def lease_agent():
+            async with pool.lease(timeout=1) as agent:
+                return agent
+
+        # Run
+        async with pool.lease():
+            _, agent = await asyncio.gather(hold_agent(), lease_agent())
+
+        # Validate
+        assert isinstance(agent, FakeLLMAgent)
+
+    @pytest.mark.parametrize('fail_lease,healthy', [
+        # The lease raised an exception.
+        (True, True),
+
+        # The agent failed the health check.
+        (False, False),
+    ])
+    async def test_recycle(self, pool: LLMAgentPool, fail_lease: bool, healthy: bool):
+        """Agents are closed and replaced if the lease failed or if they are not healthy."""
+
+        # Run
+        try:
+            async with pool.lease() as agent:
+                agent.healthy = healthy
+                if fail_lease:
+                    raise ValueError('Something went wrong')
+        except ValueError:
+            pass
+
+        # Validate
+        assert agent.exited
+        assert agent not in pool._idle_agents._queue
+        assert pool.get_stats()['agents'] == pool.get_stats()['idle'] == 2
+
+    async def test_lease_zero_timeout(self, pool: LLMAgentPool):
+        """A zero timeout doesn't fall back to the default lease timeout."""
+
+        # Run
+        with patch.object(pool, '_acquire', wraps=pool._acquire) as acquire_mock:
+            async with pool.lease(timeout=0):
+                pass
+
+        # Validate
+        acquire_mock.assert_awaited_once_with(0)
+
+    async def test_close_unopened(self):
+        """Closing a pool that was never opened doesn't fail."""
+
+        # Setup
+        pool = LLMAgentPool(size=2, lease_timeout=0.1)
+
+        # Run
+        await pool.close()
+
+        # Validate
+        assert pool.closed
+
+    async def test_close(self, pool: LLMAgentPool):
+        """Closing the pool closes all the agents, including the ones that are returned later."""
+
+        # Setup
+        idle_agents = list(pool._idle_agents._queue)
+
+        async with pool.lease() as leased_agent:
+            # Run
+            await pool.close(timeout=0.01)
+
+        # Validate
+        assert all(agent.exited for agent in idle_agents)
+        assert pool.get_stats()['agents'] == 0
+
+        with pytest.raises(RuntimeError):
+            async with pool.lease():
+                pass
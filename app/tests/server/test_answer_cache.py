@@ -0,0 +1,99 @@
+import pytest
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from app.server.answer_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache:
+    """Tests for the `SemanticAnswerCache` class."""
+
+    SCOPE = 'VectorDB:collection'
+
+    @pytest.fixture
+    def cache(self) -> SemanticAnswerCache:
+        cache = SemanticAnswerCache(threshold=0.9)
+        cache.store('What is RAG?', [1.0, 0.0, 0.0], ['rag answer'], scope=self.SCOPE, generation=1)
+        cache.store('Who are we?', [0.0, 1.0, 0.0], ['about us'], scope=self.SCOPE, generation=1)
+        return cache
+
+    @pytest.mark.parametrize('embedding,expected_messages', [
+        # Same question.
+        ([1.0, 0.0, 0.0], ['rag answer']),
+
+        # Similar question, and the embedding doesn't have to be normalized.
+        ([2.0, 0.1, 0.1], ['rag answer']),
+        ([0.1, 3.0, 0.0], ['about us']),
+
+        # Not similar enough.
+        ([1.0, 1.0, 0.0], None),
+        ([0.0, 0.0, 1.0], None),
+    ])
+    def test_lookup(self, cache: SemanticAnswerCache, embedding: list[float], expected_messages: list[str]):
+        """Answers are returned for questions above the similarity threshold."""
+
+        # Run
+        answer = cache.lookup(embedding, scope=self.SCOPE, generation=1)
+
+        # Validate
+        assert (answer and answer.messages) == expected_messages
+
+    def test_lookup_other_scope(self, cache: SemanticAnswerCache):
+        """Answers from other collections are never returned."""
+
+        # Run + Validate
+        assert cache.lookup([1.0, 0.0, 0.0], scope='VectorDB:other', generation=1) is None
+        assert cache.get_stats()['entries'] == 2
+
+    def test_lookup_corpus_changed(self, cache: SemanticAnswerCache):
+        """Answers from older generations of the collection are removed."""
+
+        # Run + Validate
+        assert cache.lookup([1.0, 0.0, 0.0], scope=self.SCOPE, generation=2) is None
+        assert cache.get_stats()['entries'] == 0
+
+    def test_ttl(self):
+        """Answers expire after the TTL."""
+
+        # Setup
+        cache = SemanticAnswerCache(ttl=timedelta(seconds=60))
+        with patch('app.server.answer_cache.time.monotonic', return_value=1_000):
+            cache.store('What is RAG?', [1.0, 0.0], ['rag answer'], scope=self.SCOPE, generation=1)
+
+        # Run
+        with patch('app.server.answer_cache.time.monotonic', return_value=1_061):
+            answer = cache.lookup([1.0, 0.0], scope=self.SCOPE, generation=1)
+
+        # Validate
+        assert answer is None
+        assert cache.get_stats() | {'hit_rate': None} == {'entries': 0, 'hits': 0, 'misses': 1, 'hit_rate': None}
+
+    def test_max_entries(self, cache: SemanticAnswerCache):
+        """The oldest answers are evicted when the cache is full."""
+
+        # Setup
+        cache.max_entries = 2
+
+        # Run
+        cache.store('Something else?', [0.0, 0.0, 1.0], ['else'], scope=self.SCOPE, generation=1)
+
+        # Validate
+        assert cache.lookup([1.0, 0.0, 0.0], scope=self.SCOPE, generation=1) is None
+        assert cache.lookup([0.0, 0.0, 1.0], scope=self.SCOPE, generation=1).messages == ['else']
+
+    @pytest.mark.parametrize('enabled,expected_enabled', [
+        ('true', True),
+        ('TRUE', True),
+        ('false', False),
+        ('', False),
+    ])
+    def test_get_shared(self, enabled: str, expected_enabled: bool):
+        """The shared cache is opt-in."""
+
+        # Run
+        with patch.dict('os.environ', {'SEMANTIC_ANSWER_CACHE_ENABLED': enabled}):
+            cache = SemanticAnswerCache.get_shared()
+
+        # Validate
+        assert (cache is not None) == expected_enabled
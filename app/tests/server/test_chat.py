@@ -0,0 +1,81 @@
+import json
+import pytest
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from typing import AsyncGenerator
+from unittest.mock import MagicMock, patch
+
+from app.server.chat import ChatRequest, chat
+from app.server.llm import ChatMessage, LLMAgentPool, LLMEventType
+from app.tests.server.llm.test_agent_pool import FakeLLMAgent
+
+
+class FakeChatAgent(FakeLLMAgent):
+    """A fake agent that answers every message with a single event."""
+
+    async def astream_events(self, message: str, config: dict) -> AsyncGenerator[ChatMessage, None]:
+        yield ChatMessage(LLMEventType.DONE, sender=ChatMessage.Sender.AI, content=f'Echo: {message}')
+
+
+class TestChat:
+    """Tests for the `/chat/ask` endpoint."""
+
+    @pytest.fixture
+    async def pool(self) -> AsyncGenerator[LLMAgentPool, None]:
+        """Return an open pool of a single fake agent."""
+
+        with patch('app.server.llm.LLMAgent', FakeChatAgent):
+            pool = LLMAgentPool(size=1, lease_timeout=0.01)
+            await pool.open()
+
+            yield pool
+
+            await pool.close()
+
+    def make_request(self, pool: LLMAgentPool) -> Request:
+        app = MagicMock()
+        app.state.llm_agent_pool = pool
+        return Request({'type': 'http', 'session': {'chat_session_id': 'user_1'}, 'app': app})
+
+    async def test_chat(self, pool: LLMAgentPool):
+        """The agent's response is streamed, and the agent is returned to the pool when the stream ends."""
+
+        # Run
+        res = await chat(self.make_request(pool), ChatRequest(message='Hello'))
+        leased_count = pool.get_stats()['leased']
+        chunks = [chunk async for chunk in res.body_iterator]
+        await res.background()
+
+        # Validate
+        assert leased_count == 1
+        assert [json.loads(chunk)['content'] for chunk in chunks] == ['Echo: Hello']
+        assert pool.get_stats() | {'closed': None} == {
+            'size': 1,
+            'agents': 1,
+            'idle': 1,
+            'leased': 0,
+            'closed': None,
+        }
+
+    async def test_chat_not_streamed(self, pool: LLMAgentPool):
+        """The agent is returned to the pool if the response isn't streamed, e.g. the client disconnected."""
+
+        # Run
+        res = await chat(self.make_request(pool), ChatRequest(message='Hello'))
+        await res.background()
+
+        # Validate
+        assert pool.get_stats()['leased'] == 0
+
+    async def test_chat_busy(self, pool: LLMAgentPool):
+        """The request fails with a 503 status before the response starts, if no agent is available."""
+
+        # Setup
+        async with pool.lease():
+
+            # Run + Validate
+            with pytest.raises(HTTPException) as exc_info:
+                await chat(self.make_request(pool), ChatRequest(message='Hello'))
+
+        assert exc_info.value.status_code == 503
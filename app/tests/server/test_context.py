@@ -0,0 +1,118 @@
+import pytest
+
+from langchain.schema import Document
+from langchain_core.messages import HumanMessage
+
+from app.server.context import (
+    assemble_context,
+    count_tokens,
+    fit_token_budget,
+    get_documents_token_budget,
+    merge_overlapping_chunks,
+)
+
+
+TEXT = ' '.join(f'Sentence number {i} of the handbook.' for i in range(40))
+
+
+def make_chunk(start: int, end: int, source_id: str = 'handbook') -> Document:
+    return Document(page_content=TEXT[start:end], metadata={'source_id': source_id, 'start': start})
+
+
+def format_doc(doc: Document) -> str:
+    return f'[{doc.metadata["source_id"]}] {doc.page_content}'
+
+
+class TestMergeOverlappingChunks:
+    """Tests for the `merge_overlapping_chunks` function."""
+
+    def test_merge(self):
+        """Overlapping chunks of a source are stitched in text order, in place of the best-ranked one."""
+
+        # Setup
+        docs = [make_chunk(300, 600), make_chunk(0, 100, 'other'), make_chunk(0, 350)]
+
+        # Run
+        passages = merge_overlapping_chunks(docs)
+
+        # Validate
+        assert passages == [
+            Document(page_content=TEXT[0:600], metadata={'source_id': 'handbook', 'start': 300}),
+            docs[1],
+        ]
+
+    def test_bridge(self):
+        """A chunk that overlaps two passages of its source merges them into one."""
+
+        # Setup
+        docs = [make_chunk(0, 200), make_chunk(400, 600), make_chunk(150, 450)]
+
+        # Run
+        passages = merge_overlapping_chunks(docs)
+
+        # Validate
+        assert [passage.page_content for passage in passages] == [TEXT[0:600]]
+        assert passages[0].metadata['start'] == 0
+
+    @pytest.mark.parametrize('docs', [
+        # Neighbors without overlap.
+        [make_chunk(0, 200), make_chunk(200, 400)],
+        # Overlapping texts of different sources.
+        [make_chunk(0, 200), make_chunk(100, 300, 'copy')],
+        # Overlaps shorter than `min_overlap`.
+        [make_chunk(0, 200), make_chunk(190, 400)],
+    ])
+    def test_no_merge(self, docs: list[Document]):
+        """Chunks that don't overlap enough, or that are of different sources, are kept as is."""
+        assert merge_overlapping_chunks(docs) == docs
+
+    def test_contained(self):
+        """Chunks that are contained in a passage are dropped."""
+        assert merge_overlapping_chunks([make_chunk(0, 300), make_chunk(100, 200)]) == [make_chunk(0, 300)]
+
+
+class TestTokenBudget:
+    """Tests for the token budget of the retrieved documents."""
+
+    def test_fit_token_budget(self):
+        """The documents are kept in order until the budget, and the document that reaches it is truncated."""
+
+        # Setup
+        docs = [make_chunk(0, 400), make_chunk(400, 800), make_chunk(800, 1_200)]
+        max_tokens = count_tokens(format_doc(docs[0])) + 100
+
+        # Run
+        results = fit_token_budget(docs, max_tokens, format_doc)
+
+        # Validate
+        assert len(results) == 2
+        assert results[0] == format_doc(docs[0])
+        assert results[1].startswith(format_doc(docs[1])[:100])
+        assert results[1].endswith(' ...')
+        assert sum(count_tokens(result) for result in results) + 1 <= max_tokens
+
+    def test_fit_token_budget_no_room(self):
+        """Documents that can't keep enough of their content are left out."""
+        assert fit_token_budget([make_chunk(0, 400)], 20, format_doc) == []
+
+    def test_documents_token_budget(self):
+        """The documents get what the system prompt and the conversation leave, but at least a share of the budget."""
+
+        # Setup
+        messages = [HumanMessage('a' * 400)]
+
+        # Run + Validate
+        assert get_documents_token_budget(1_000, system_prompt='a' * 400, messages=messages) == 800
+        assert get_documents_token_budget(1_000, messages=[HumanMessage('a' * 10_000)]) == 250
+
+    def test_assemble_context(self):
+        """The chunks are merged before they're formatted, so the overlaps don't count against the budget."""
+
+        # Setup
+        docs = [make_chunk(0, 400), make_chunk(300, 700)]
+
+        # Run
+        context = assemble_context(docs, format_doc, max_tokens=count_tokens(format_doc(make_chunk(0, 700))))
+
+        # Validate
+        assert context == format_doc(make_chunk(0, 700))
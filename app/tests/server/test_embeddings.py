@@ -0,0 +1,45 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+from app.server.embeddings import read_ndjson_lines
+
+
+class TestReadNDJSONLines:
+    """Tests for `read_ndjson_lines`, which reads the lines of the `/embeddings/text/bulk` request body."""
+
+    @staticmethod
+    def make_request(chunks: list[bytes]) -> MagicMock:
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        request = MagicMock()
+        request.stream = stream
+        return request
+
+    @pytest.mark.parametrize('chunks', [
+        [b'{"a": 1}\n\n{"b": 2}\n{"c": 3}'],
+        [b'{"a"', b': 1}\n', b'\n{"b": 2}', b'\n{"c": 3}\n'],
+        [b'{', b'"a": 1}', b'\n\n{"b":', b' 2}\n{"c": 3}', b''],
+    ])
+    async def test_lines(self, chunks: list[bytes]):
+        """The lines are put together from the chunks of the body, and the empty lines are skipped."""
+
+        # Run
+        lines = [line async for line in read_ndjson_lines(self.make_request(chunks))]
+
+        # Validate
+        assert lines == [(1, b'{"a": 1}'), (3, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+    async def test_long_lines(self):
+        """The lines longer than the maximal size are `None`, whether they end in the body or not."""
+
+        # Setup
+        chunks = [b'{"a": 1}\n', b'x' * 8, b'x' * 8, b'\n{"b": 2}\n', b'y' * 20]
+
+        # Run
+        lines = [line async for line in read_ndjson_lines(self.make_request(chunks), max_line_size=10)]
+
+        # Validate
+        assert lines == [(1, b'{"a": 1}'), (2, None), (3, b'{"b": 2}'), (4, None)]
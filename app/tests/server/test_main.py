@@ -0,0 +1,64 @@
+import json
+import pytest
+
+from starlette.requests import Request
+from unittest.mock import patch
+
+from app.server.main import get_request_tenant
+
+
+class TestRequestTenant:
+    """Tests for the tenant of the requests."""
+
+    @pytest.fixture(autouse=True)
+    def tenant_tokens(self):
+        with patch.dict('os.environ', {'TENANT_ACCESS_TOKENS': json.dumps({'acme-token': 'acme'})}):
+            yield
+
+    def make_request(self, session: dict, **headers) -> Request:
+        return Request({
+            'type': 'http',
+            'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()],
+            'session': session,
+        })
+
+    def test_tenant_token(self):
+        """Requests with the access token of a tenant belong to the tenant, whatever the session says."""
+
+        # Setup
+        request = self.make_request({'tenant_id': 'globex'}, x_access_token='acme-token')
+
+        # Run + Validate
+        assert get_request_tenant(request) == 'acme'
+
+    def test_tenant_token_other_tenant(self):
+        """The access token of a tenant can't access other tenants."""
+
+        # Setup
+        request = self.make_request({}, x_access_token='acme-token', x_tenant_id='globex')
+
+        # Run + Validate
+        with pytest.raises(PermissionError):
+            get_request_tenant(request)
+
+    def test_tenant_header(self):
+        """Other requests name their tenant by a header, which is kept in the session."""
+
+        # Setup
+        session = {}
+
+        # Run
+        tenant_id = get_request_tenant(self.make_request(session, x_access_token='secret', x_tenant_id='globex'))
+        session_tenant_id = get_request_tenant(self.make_request(session, x_access_token='secret'))
+
+        # Validate
+        assert tenant_id == session_tenant_id == 'globex'
+
+    def test_default_tenant(self):
+        """Requests without a tenant belong to the default tenant."""
+        assert get_request_tenant(self.make_request({})) is None
+
+    def test_invalid_tenant(self):
+        """Invalid tenant IDs are rejected."""
+        with pytest.raises(ValueError):
+            get_request_tenant(self.make_request({}, x_tenant_id='acme corp'))
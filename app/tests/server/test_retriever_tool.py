@@ -0,0 +1,151 @@
+import json
+import pytest
+
+from langchain.schema import Document
+from langchain_core.messages import HumanMessage
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.prompts.prompt import PromptTemplate
+from unittest.mock import patch
+
+from app.databases.vector.retriever import VectorDBRetriever
+from app.server.retriever_tool import JSONDocumentFormatter, create_filtered_retriever_tool
+from app.tests.databases.vector.test_retriever import HybridVectorStore
+
+
+class TestFilteredRetrieverTool:
+    """Tests for the retriever tool of the agents, with filters."""
+
+    @pytest.fixture
+    def tool(self):
+        vector_store = HybridVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(
+            ['The page is slow.', 'The page is down.', 'The page is fine.'],
+            metadatas=[
+                {'source_id': '1', 'source_name': 'Tickets', 'modified_at': 1_600_000_000, 'team': 'web'},
+                {'source_id': '2', 'source_name': 'Tickets', 'modified_at': 1_700_000_000, 'team': 'web'},
+                {'source_id': '3', 'source_name': 'Status', 'modified_at': 1_700_000_000, 'team': 'ops'},
+            ],
+        )
+
+        with patch.dict('os.environ', {'METADATA_PROMOTED_KEYS': 'team'}):
+            yield create_filtered_retriever_tool(
+                VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 3}),
+                'retriever',
+                'Searches the documents',
+                document_prompt=PromptTemplate.from_template('{source_id} {modified_at}'),
+            )
+
+    @pytest.mark.parametrize('tool_input,expected', [
+        ({'query': 'page'}, None),
+        ({'query': 'page', 'source_names': ['Tickets']}, ['1', '2']),
+        ({'query': 'page', 'modified_after': '2021-01-01T00:00:00Z'}, ['2', '3']),
+        ({'query': 'page', 'source_names': ['Tickets'], 'payload': {'team': ['ops']}}, []),
+    ])
+    async def test_filters(self, tool, tool_input: dict, expected: list[str]):
+        """The searches are filtered, and the documents show their `modified_at` as ISO 8601 timestamps."""
+
+        # Run
+        res = await tool.ainvoke(tool_input)
+
+        # Validate
+        lines = res.split('\n\n') if res else []
+        assert sorted(line.split()[0] for line in lines) == (expected if expected is not None else ['1', '2', '3'])
+        assert all(line.endswith('+00:00') for line in lines)
+
+    async def test_invalid_filters(self, tool):
+        """Invalid filters are reported back to the LLM."""
+
+        # Run
+        res = await tool.ainvoke({'query': 'page', 'payload': {'author': ['someone']}})
+
+        # Validate
+        assert res.startswith('Invalid filters:')
+        assert 'team' in tool.description
+
+    def test_sync(self, tool):
+        assert tool.invoke({'query': 'page', 'source_names': ['Status']}).split()[0] == '3'
+
+    async def test_token_budget(self):
+        """The documents are trimmed to what the system prompt and the conversation leave of the token budget."""
+
+        # Setup
+        vector_store = HybridVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(
+            [f'Page {i} is slow. ' * 40 for i in range(3)],
+            metadatas=[{'source_id': str(i), 'source_name': 'Tickets', 'modified_at': 1_600_000_000} for i in range(3)],
+        )
+        tool = create_filtered_retriever_tool(
+            VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 3}),
+            'retriever',
+            'Searches the documents',
+            document_prompt=PromptTemplate.from_template('{page_content}'),
+            max_tokens=1_000,
+            system_prompt='a' * 1_200,
+        )
+
+        # Run
+        res = await tool.ainvoke({'query': 'page'})
+        trimmed_res = await tool.ainvoke({'query': 'page', 'messages': [HumanMessage('a' * 1_600)]})
+
+        # Validate
+        assert len(res.split('\n\n')) == 3
+        assert len(trimmed_res.split('\n\n')) == 2
+        assert trimmed_res.endswith(' ...')
+
+
+class TestJSONDocumentFormatter:
+    """Tests for the `JSONDocumentFormatter` class."""
+
+    def test_format(self):
+        """Each document is a valid JSON object, with its content and its metadata in a readable form."""
+
+        # Setup
+        formatter = JSONDocumentFormatter({
+            'source_id': 'source_id',
+            'modified': 'modified_at',
+            'team%': 'team',
+            'content': 'page_content',
+        })
+        doc = Document(
+            page_content='Say "hi"\n\tto C:\\Users, café 100%',
+            metadata={'source_id': 42, 'modified_at': 1_600_000_000},
+        )
+
+        # Run
+        res = formatter(doc)
+
+        # Validate
+        assert json.loads(res) == {
+            'source_id': '42',
+            'modified': '2020-09-13T12:26:40+00:00',
+            'team%': '',
+            'content': 'Say "hi"\n\tto C:\\Users, café 100%',
+        }
+        assert '\n' not in res
+        assert list(json.loads(res)) == ['source_id', 'modified', 'team%', 'content']
+
+    async def test_tool(self):
+        """The retriever tool formats the documents with the formatter, one per line."""
+
+        # Setup
+        vector_store = HybridVectorStore(DeterministicFakeEmbedding(size=8))
+        vector_store.add_texts(
+            ['The "page" is slow.', 'The page is down.'],
+            metadatas=[{'source_id': '1'}, {'source_id': '2'}],
+        )
+        tool = create_filtered_retriever_tool(
+            VectorDBRetriever(vectorstore=vector_store, search_kwargs={'k': 2}),
+            'retriever',
+            'Searches the documents',
+            document_formatter=JSONDocumentFormatter({'source_id': 'source_id', 'content': 'page_content'}),
+            document_separator='\n',
+        )
+
+        # Run
+        res = await tool.ainvoke({'query': 'page'})
+
+        # Validate
+        assert sorted(json.loads(line)['content'] for line in res.split('\n')) == [
+            'The "page" is slow.',
+            'The page is down.',
+        ]
@@ -0,0 +1,90 @@
+import pytest
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from app.utils.cache import LRUCache
+
+
+class TestLRUCache:
+    """Tests for the `LRUCache` class."""
+
+    def test_get_set(self):
+        """Values that were set are returned, and missing keys return the default."""
+
+        # Setup
+        cache = LRUCache()
+
+        # Run
+        cache.set('a', 1)
+        cache.set(('b', 2), [1, 2, 3])
+
+        # Validate
+        assert cache.get('a') == 1
+        assert cache.get(('b', 2)) == [1, 2, 3]
+        assert cache.get('c') is None
+        assert cache.get('c', 'default') == 'default'
+        assert cache.get_stats() | {'hit_rate': None} == {
+            'size': 2,
+            'max_size': 1_024,
+            'hits': 2,
+            'misses': 2,
+            'hit_rate': None,
+            'evictions': 0,
+        }
+
+    def test_lru_eviction(self):
+        """The least recently used entries are evicted when the cache is full."""
+
+        # Setup
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Run - `a` is used, so `b` is the least recently used.
+        cache.get('a')
+        cache.set('c', 3)
+
+        # Validate
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+        assert cache.get_stats()['evictions'] == 1
+
+    @pytest.mark.parametrize('seconds_passed,expected_value', [
+        # Before the TTL.
+        (59, 1),
+
+        # After the TTL.
+        (61, None),
+    ])
+    def test_ttl(self, seconds_passed: int, expected_value: int):
+        """Entries expire after the TTL."""
+
+        # Setup
+        cache = LRUCache(ttl=timedelta(seconds=60))
+        with patch('app.utils.cache.time.monotonic', return_value=1_000):
+            cache.set('a', 1)
+
+        # Run
+        with patch('app.utils.cache.time.monotonic', return_value=1_000 + seconds_passed):
+            value = cache.get('a')
+
+        # Validate
+        assert value == expected_value
+
+    def test_pop_and_clear(self):
+        """Entries can be removed one by one, or all at once."""
+
+        # Setup
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Run + Validate
+        assert cache.pop('a') == 1
+        assert cache.pop('a', 'default') == 'default'
+        assert len(cache) == 1
+
+        cache.clear()
+        assert len(cache) == 0
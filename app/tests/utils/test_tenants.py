@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import pytest
+
+from unittest.mock import patch
+
+from app.utils.tenants import get_current_tenant, get_tenant_tokens, use_tenant, validate_tenant_id
+
+
+class TestTenants:
+    """Tests for the tenant of the current request or job."""
+
+    @pytest.mark.parametrize('tenant_id,expected', [
+        ('acme', 'acme'),
+        ('Acme_Corp_2', 'Acme_Corp_2'),
+        ('', None),
+        (None, None),
+    ])
+    def test_validate_tenant_id(self, tenant_id: str, expected: str):
+        """Valid tenant IDs are returned as is, and empty ones are the default tenant."""
+        assert validate_tenant_id(tenant_id) == expected
+
+    @pytest.mark.parametrize('tenant_id', ['acme-corp', '_acme', 'acme_', 'a' * 49, 'acme") or (1 == 1'])
+    def test_validate_tenant_id_invalid(self, tenant_id: str):
+        """Tenant IDs must be usable in collection names and filters."""
+        with pytest.raises(ValueError, match='Invalid tenant ID'):
+            validate_tenant_id(tenant_id)
+
+    def test_use_tenant(self):
+        """The tenant is set in the block only, and blocks can be nested."""
+
+        # Run + Validate
+        assert get_current_tenant() is None
+        with use_tenant('acme'):
+            assert get_current_tenant() == 'acme'
+            with use_tenant(None):
+                assert get_current_tenant() is None
+            assert get_current_tenant() == 'acme'
+        assert get_current_tenant() is None
+
+    async def test_use_tenant_tasks(self):
+        """Tasks created in the block run for its tenant, and concurrent blocks don't mix."""
+
+        async def get_task_tenant() -> str:
+            await asyncio.sleep(0.01)
+            return get_current_tenant()
+
+        async def get_tenant(tenant_id: str) -> str:
+            with use_tenant(tenant_id):
+                task_tenant = await asyncio.create_task(get_task_tenant())
+                return task_tenant + ':' + get_current_tenant()
+
+        # Run
+        results = await asyncio.gather(get_tenant('acme'), get_tenant('globex'))
+
+        # Validate
+        assert results == ['acme:acme', 'globex:globex']
+
+    def test_get_tenant_tokens(self):
+        """The tenants of the access tokens are read from `TENANT_ACCESS_TOKENS`, and validated."""
+
+        # Setup
+        tokens = {'token-1': 'acme', 'token-2': 'globex'}
+
+        with patch.dict(os.environ, {'TENANT_ACCESS_TOKENS': json.dumps(tokens)}):
+            # Run + Validate
+            assert get_tenant_tokens() == tokens
+
+        with patch.dict(os.environ, {'TENANT_ACCESS_TOKENS': json.dumps({'token-1': 'acme corp'})}):
+            with pytest.raises(ValueError):
+                get_tenant_tokens()
+
+        with patch.dict(os.environ, clear=True):
+            assert get_tenant_tokens() == {}
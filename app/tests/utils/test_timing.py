@@ -0,0 +1,39 @@
+import asyncio
+
+from app.utils.timing import collect_timings, timed, to_server_timing
+
+
+class TestTiming:
+    """Tests for the timings of the stages of the requests."""
+
+    async def test_collect_timings(self):
+        """The durations of the stages that run in the block, and in its tasks, are added up by stage."""
+
+        async def retrieve():
+            with timed('retrieval'):
+                await asyncio.sleep(0.01)
+
+        # Run
+        with collect_timings() as timings:
+            await asyncio.gather(retrieve(), asyncio.create_task(retrieve()))
+            with timed('diversity'):
+                pass
+
+        # Validate
+        assert list(timings) == ['retrieval', 'diversity']
+        assert timings['retrieval'] >= 20
+        assert timings['diversity'] < timings['retrieval']
+
+    def test_not_collected(self):
+        """Stages outside of `collect_timings` run as usual."""
+
+        # Run
+        with timed('retrieval'):
+            result = 1 + 1
+
+        # Validate
+        assert result == 2
+
+    def test_to_server_timing(self):
+        """The timings are formatted as a `Server-Timing` header."""
+        assert to_server_timing({'retrieval': 35.24, 'diversity': 0.4}) == 'retrieval;dur=35.2, diversity;dur=0.4'
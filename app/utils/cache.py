@@ -0,0 +1,104 @@
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Generic, Hashable, TypeVar
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """A thread-safe, in-memory cache with LRU eviction and an optional TTL.
+
+    Usage:
+    ```python
+    >>> cache = LRUCache(max_size=2, ttl=timedelta(minutes=5))
+    >>> cache.set('a', 1)
+    >>> cache.get('a')
+        1
+    >>> cache.get('b', 'default')
+        'default'
+    ```
+    """
+
+    def __init__(self, max_size: int = 1_024, ttl: timedelta = None):
+        """Initialize the cache.
+
+        :param max_size: The maximal number of entries. The least recently used entries are evicted first.
+        :param ttl: If set, entries expire after this amount of time.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # Maps key -> (expiration time, value). Ordered from the least to the most recently used.
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K, default: Any = None) -> V:
+        """Get the value of `key`, or `default` if it's not in the cache (or expired)."""
+
+        with self._lock:
+            try:
+                expires_at, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        """Set the value of `key`, evicting the least recently used entries if the cache is full."""
+
+        expires_at = time.monotonic() + self.ttl.total_seconds() if self.ttl else float('inf')
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: K, default: Any = None) -> V:
+        """Remove `key` from the cache and return its value, or `default` if it's not in the cache."""
+
+        with self._lock:
+            _, value = self._entries.pop(key, (None, default))
+            return value
+
+    def clear(self) -> None:
+        """Remove all the entries from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> dict:
+        """Get statistics about the cache usage."""
+
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
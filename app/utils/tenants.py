@@ -0,0 +1,65 @@
+import contextlib
+import contextvars
+import json
+import os
+import re
+
+from typing import Iterator
+
+
+# Tenant IDs are part of collection names, so they're limited to the characters that all the vector databases allow.
+TENANT_ID_PATTERN = re.compile(r'[A-Za-z0-9](?:[A-Za-z0-9_]{0,46}[A-Za-z0-9])?')
+
+# The tenant of the current request or job, or `None` for the default tenant. See `use_tenant`.
+_current_tenant: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_tenant', default=None)
+
+
+def validate_tenant_id(tenant_id: str | None) -> str | None:
+    """Check that the tenant ID can be used in collection names and filters, and return it.
+
+    An empty tenant ID is the default tenant (`None`).
+    """
+
+    if not tenant_id:
+        return None
+    if not TENANT_ID_PATTERN.fullmatch(tenant_id):
+        raise ValueError(
+            f'Invalid tenant ID: {tenant_id!r}. Expected up to 48 letters, digits or `_`, '
+            f'starting and ending with a letter or a digit.'
+        )
+
+    return tenant_id
+
+
+def get_current_tenant() -> str | None:
+    """Get the tenant of the current request or job, or `None` for the default tenant."""
+    return _current_tenant.get()
+
+
+@contextlib.contextmanager
+def use_tenant(tenant_id: str | None) -> Iterator[None]:
+    """Scope the vector databases created and searched in the block (and in the tasks it creates) to the tenant.
+
+    Usage:
+    ```python
+    >>> with use_tenant('acme'):
+    ...     await VectorDB().split_and_store_text(text, metadata)
+    ```
+    """
+
+    token = _current_tenant.set(validate_tenant_id(tenant_id))
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def get_tenant_tokens() -> dict[str, str]:
+    """Get the tenants of the access tokens, from the `TENANT_ACCESS_TOKENS` environment variable.
+
+    The variable is a JSON object of tenant IDs by access token. Requests with one of these tokens can
+    access only their tenant.
+    """
+
+    tokens = json.loads(os.environ.get('TENANT_ACCESS_TOKENS', '{}'))
+    return {token: validate_tenant_id(tenant_id) for token, tenant_id in tokens.items()}
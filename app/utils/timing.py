@@ -0,0 +1,54 @@
+import contextlib
+import contextvars
+import time
+
+from typing import Iterator
+
+
+# The durations of the stages of the current request, in milliseconds, by stage. See `collect_timings`.
+_timings: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar('timings', default=None)
+
+
+@contextlib.contextmanager
+def collect_timings() -> Iterator[dict[str, float]]:
+    """Collect the durations of the stages (see `timed`) that run in the block, and in the tasks it creates.
+
+    Usage:
+    ```python
+    >>> with collect_timings() as timings:
+    ...     await retriever.ainvoke('What is RAG?')
+    >>> timings
+        {'retrieval': 35.2, 'diversity': 0.4}
+    ```
+    """
+
+    timings = {}
+    # Restored by value, not by token, since async generators (e.g. of streamed responses) may be closed
+    # in another context.
+    previous_timings = _timings.get()
+    _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.set(previous_timings)
+
+
+@contextlib.contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Add the duration of the block to the stage's timing, if the timings are collected (see `collect_timings`)."""
+
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start_time) * 1_000
+
+
+def to_server_timing(timings: dict[str, float]) -> str:
+    """Format the timings as the value of a `Server-Timing` HTTP header."""
+    return ', '.join(f'{stage};dur={duration:.1f}' for stage, duration in timings.items())